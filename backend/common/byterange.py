@@ -36,13 +36,56 @@ def parse_byteranges(byterange_header, file_size=None):
         raise InvalidByteRangeException
 
     arr = mo.groups()[0].split(",")
-    regexp = re.compile(r"^([^-]*)-([^-]*)$")
 
     if len(arr) > 1:
         # We don't support very fancy byte ranges yet
         raise UnsatisfyableByteRangeException
 
-    mo = regexp.match(arr[0])
+    byteranges = _parse_byterange(arr[0], file_size)
+
+    log_debug(4, "Request byterange", byteranges)
+    return byteranges
+
+
+def parse_multiple_byteranges(byterange_header, file_size):
+    """ Like parse_byteranges, for a header that may list several ranges.
+        Returns a sorted list of (start, end) tuples, overlapping or
+        adjacent ranges merged. Raises UnsatisfyableByteRangeException only
+        if none of the ranges can be satisfied.
+    """
+    log_debug(4, "Parsing byte ranges", byterange_header)
+    regexp = re.compile(r"^bytes\s*=\s*(.*)$")
+    mo = regexp.match(byterange_header)
+    if not mo:
+        raise InvalidByteRangeException
+
+    byteranges = []
+    for spec in mo.groups()[0].split(","):
+        if not spec.strip():
+            continue
+        try:
+            byteranges.append(_parse_byterange(spec, file_size))
+        except UnsatisfyableByteRangeException:
+            pass
+    if not byteranges:
+        raise UnsatisfyableByteRangeException
+
+    byteranges.sort()
+    merged = [byteranges[0]]
+    for start, end in byteranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+
+    log_debug(4, "Request byteranges", merged)
+    return merged
+
+
+def _parse_byterange(spec, file_size):
+    regexp = re.compile(r"^([^-]*)-([^-]*)$")
+    mo = regexp.match(spec.strip())
     if not mo:
         # Invalid byterange
         raise InvalidByteRangeException
@@ -63,6 +106,8 @@ def parse_byteranges(byterange_header, file_size=None):
                 # Invalid
                 raise InvalidByteRangeException
             end = end + 1
+            if file_size is not None and end > file_size:
+                end = file_size
         else:
             if file_size:
                 end = file_size
@@ -83,10 +128,7 @@ def parse_byteranges(byterange_header, file_size=None):
             start = -end
             end = None
 
-    byteranges = (start, end)
-
-    log_debug(4, "Request byterange", byteranges)
-    return byteranges
+    return (start, end)
 
 
 def _str2int(val):
@@ -105,6 +147,61 @@ def get_content_range(start, end, total_length=None):
     return content_range
 
 
+def multipart_byteranges(byteranges, file_size, content_type, boundary):
+    """ Lay out a multipart/byteranges body (RFC 7233, appendix A).
+        Returns the list of (part header, start, end) and the length of
+        the whole body, trailer included.
+    """
+    parts = []
+    length = 0
+    for start, end in byteranges:
+        header = ("\r\n--%s\r\nContent-Type: %s\r\nContent-Range: %s\r\n\r\n" % (
+            boundary, content_type, get_content_range(start, end, file_size))).encode()
+        parts.append((header, start, end))
+        length += len(header) + end - start
+    length += len(multipart_trailer(boundary))
+    return parts, length
+
+
+def multipart_trailer(boundary):
+    return ("\r\n--%s--\r\n" % boundary).encode()
+
+
+class FileRange:
+
+    """ File-like view of length bytes of file_obj, starting at offset.
+
+        The file position is moved to offset and fileno() is exposed, so
+        a WSGI server with a file_wrapper can sendfile() the range: it
+        sends Content-Length bytes from the current position. Servers
+        without one read() just the range.
+
+        owner is kept referenced as long as the range, for file objects
+        closed when their owner is collected (e.g. by transports.File).
+    """
+
+    def __init__(self, file_obj, offset, length, owner=None):
+        self.file_obj = file_obj
+        self.owner = owner
+        self.remaining = length
+        file_obj.seek(offset)
+
+    def fileno(self):
+        return self.file_obj.fileno()
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        if size <= 0:
+            return b''
+        data = self.file_obj.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file_obj.close()
+
+
 class InvalidByteRangeException(rhnException):
     pass
 
@@ -26,18 +26,47 @@ except ImportError:
     import pickle as cPickle
 import fcntl
 import sys
-from stat import ST_MTIME
-from errno import EEXIST
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from stat import ST_MTIME, ST_SIZE, ST_ATIME
+from errno import EEXIST, ENOENT
 
 from uyuni.common.rhnLib import timestamp
 
 from uyuni.common.usix import raise_with_tb
 from uyuni.common.fileutils import makedirs, setPermsPath
+from spacewalk.common.rhnConfig import CFG
+from spacewalk.common.rhnLog import log_error
 
 # this is a constant I'm not too happy about but one way or another we have
 # to reserve our own shared memory space.
 CACHEDIR = "/var/cache/rhn"
 
+# Name of the lock file serializing evictions, inside CACHEDIR
+EVICTION_LOCK = ".eviction.lock"
+# Prefix of the files listing the entries written through Cache.set, one per
+# user, inside CACHEDIR. Only those entries are evicted: the rest of CACHEDIR
+# (served repodata, reposync and cdnsync data...) belongs to other tools.
+EVICTION_INDEX = ".eviction.index"
+# Run an eviction pass after this many bytes were written by the process...
+EVICTION_CHECK_BYTES = 16 * 1024 * 1024
+# ... or this many seconds after the previous one
+EVICTION_CHECK_INTERVAL = 300
+# An eviction pass shrinks the cache to this fraction of cache_max_size
+EVICTION_LOW_WATERMARK = 0.9
+# Number of independently locked parts of the memory tier
+MEMORY_SHARDS = 16
+# Seconds between two updates of the access time of an entry served from the
+# memory tier, which keep it from being evicted first
+MEMORY_TOUCH_INTERVAL = 60
+# Suffix of the lock files serializing the build of an entry
+BUILD_LOCK_SUFFIX = ".build-lock"
+# Seconds to wait for another process building an entry before building it
+# anyway
+BUILD_LOCK_TIMEOUT = 600
+
 
 def cleanupPath(path):
     """take ~taw/../some/path/$MOUNT_POINT/blah and make it sensible."""
@@ -64,6 +93,368 @@ def _unlock(fd):
         # its usually more forgiving.
         fcntl.flock(fd, fcntl.LOCK_UN)
 
+
+class _Settings:
+
+    """
+    Limits of the cache, read from the configuration once it is available:
+
+    cache_max_size     byte budget of CACHEDIR, 0 for no limit
+    cache_ttl          seconds an entry may stay unused, 0 for no limit
+    cache_memory_size  byte budget of the per-process memory tier,
+                       0 to disable it
+    """
+
+    def __init__(self):
+        self.max_size = 0
+        self.ttl = 0
+        self.memory_size = 0
+        self.loaded = False
+
+    def load(self):
+        if self.loaded or not CFG.is_initialized():
+            return
+        self.loaded = True
+        self.max_size = int(CFG.get('cache_max_size') or 0)
+        self.ttl = int(CFG.get('cache_ttl') or 0)
+        self.memory_size = int(CFG.get('cache_memory_size') or 0)
+
+    def eviction_enabled(self):
+        return self.max_size > 0 or self.ttl > 0
+
+
+_settings = _Settings()
+
+_stats_lock = threading.Lock()
+_stats = {
+    'memory_hits': 0,
+    'disk_hits': 0,
+    'misses': 0,
+    'evictions': 0,
+}
+
+
+def _count(counter, value=1):
+    with _stats_lock:
+        _stats[counter] += value
+
+
+def get_stats():
+    """ Return a copy of the hit/miss/eviction counters of this process. """
+    with _stats_lock:
+        return dict(_stats)
+
+
+def configure(max_size=None, ttl=None, memory_size=None):
+    """
+    Override the cache limits from the configuration file. Arguments left
+    as None keep their current value.
+    """
+    _settings.load()
+    _settings.loaded = True
+    if max_size is not None:
+        _settings.max_size = max_size
+    if ttl is not None:
+        _settings.ttl = ttl
+    if memory_size is not None:
+        _settings.memory_size = memory_size
+    _memory.clear()
+
+
+class _MemoryTier:
+
+    """
+    Per-process LRU of raw cache entries, keyed by file name.
+
+    Entries are validated against the modified stamp of the caller, or
+    against the mtime of the cache file when no stamp is given. The tier is
+    split in MEMORY_SHARDS parts with their own lock and share of the byte
+    budget, so that threads rarely wait for each other.
+
+    Hits do not read the cache file, so while eviction is enabled they
+    refresh its access time every MEMORY_TOUCH_INTERVAL seconds.
+    """
+
+    def __init__(self, shards=MEMORY_SHARDS):
+        self.shards = [(threading.Lock(), OrderedDict()) for _i in range(shards)]
+        self.sizes = [0] * shards
+
+    def _shard(self, fname):
+        return hash(fname) % len(self.shards)
+
+    def get(self, fname, modified=None):
+        if _settings.memory_size <= 0:
+            return None
+        index = self._shard(fname)
+        lock, entries = self.shards[index]
+        with lock:
+            entry = entries.get(fname)
+            if entry is None:
+                return None
+            mtime, data, stored, touched = entry
+            now = time.time()
+            if _settings.ttl and stored + _settings.ttl < now:
+                self._remove(index, fname)
+                return None
+            entries.move_to_end(fname)
+            touch = _settings.eviction_enabled() and touched + MEMORY_TOUCH_INTERVAL <= now
+            if touch:
+                entries[fname] = (mtime, data, stored, now)
+        if modified is None:
+            # Without a stamp, the file on disk is authoritative
+            try:
+                if os.stat(fname)[ST_MTIME] != mtime:
+                    self.discard(fname)
+                    return None
+            except OSError:
+                self.discard(fname)
+                return None
+        elif modified != mtime:
+            return None
+        if touch:
+            try:
+                os.utime(fname, (now, mtime))
+            except OSError:
+                # only the owner of the file may set its times
+                pass
+        return data
+
+    def set(self, fname, data, mtime):
+        if _settings.memory_size <= 0:
+            return
+        budget = _settings.memory_size // len(self.shards)
+        if len(data) > budget:
+            self.discard(fname)
+            return
+        index = self._shard(fname)
+        lock, entries = self.shards[index]
+        with lock:
+            self._remove(index, fname)
+            now = time.time()
+            entries[fname] = (mtime, data, now, now)
+            self.sizes[index] += len(data)
+            while self.sizes[index] > budget:
+                oldest = next(iter(entries))
+                self._remove(index, oldest)
+                _count('evictions')
+
+    def discard(self, fname):
+        index = self._shard(fname)
+        lock, _entries = self.shards[index]
+        with lock:
+            self._remove(index, fname)
+
+    def clear(self):
+        for index, (lock, entries) in enumerate(self.shards):
+            with lock:
+                entries.clear()
+                self.sizes[index] = 0
+
+    def _remove(self, index, fname):
+        entry = self.shards[index][1].pop(fname, None)
+        if entry is not None:
+            self.sizes[index] -= len(entry[1])
+
+
+_memory = _MemoryTier()
+
+
+class _Evictor:
+
+    """
+    Keeps the entries of the cache within cache_max_size and drops the ones
+    unused for longer than cache_ttl.
+
+    Only the entries listed in the EVICTION_INDEX files are considered:
+    every write appends the entry to the index of the writing user while
+    eviction is enabled, and every pass compacts the index of its own user.
+    The access time of an entry is refreshed on reads when possible, so
+    evicting by ascending atime is LRU across all processes. Passes run
+    every EVICTION_CHECK_BYTES written or EVICTION_CHECK_INTERVAL seconds,
+    and an exclusive lock ensures only one process runs one at a time.
+    """
+
+    def __init__(self):
+        self.written = 0
+        self.last_run = time.time()
+        self.lock = threading.Lock()
+
+    def wrote(self, fname, size):
+        if not _settings.eviction_enabled():
+            return
+        self._add_to_index(fname)
+        with self.lock:
+            self.written += size
+            if self.written < EVICTION_CHECK_BYTES and \
+                    self.last_run + EVICTION_CHECK_INTERVAL > time.time():
+                return
+            self.written = 0
+            self.last_run = time.time()
+        self.run()
+
+    def run(self):
+        """ Run an eviction pass, unless another process is running one. """
+        cachedir = cleanupPath(CACHEDIR)
+        try:
+            lock_fd = os.open(os.path.join(cachedir, EVICTION_LOCK),
+                              os.O_WRONLY | os.O_CREAT, int('0644', 8))
+        except OSError:
+            return 0
+        try:
+            try:
+                fcntl.flock(lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except IOError:
+                return 0
+            return self._evict(cachedir)
+        finally:
+            os.close(lock_fd)
+
+    def _evict(self, cachedir):
+        now = time.time()
+        # The index of this user is moved aside, so that the writes happening
+        # meanwhile go to a new one, and the entries left are appended to it
+        index = _index_file(cachedir)
+        compacted = "%s.old.%d" % (index, os.getpid())
+        try:
+            os.rename(index, compacted)
+        except OSError:
+            pass
+
+        # entry name -> whether the index of this user lists it
+        names = {}
+        own = []
+        for filename in os.listdir(cachedir):
+            if not filename.startswith(EVICTION_INDEX):
+                continue
+            path = os.path.join(cachedir, filename)
+            # also the ones left behind by an interrupted pass
+            owned = filename.startswith(os.path.basename(index) + ".old.")
+            if owned:
+                own.append(path)
+            for name in _read_index(path):
+                names[name] = names.get(name, False) or owned
+
+        entries = []
+        kept = []
+        total = 0
+        evicted = 0
+        for name, owned in names.items():
+            fname = os.path.join(cachedir, name)
+            try:
+                statinfo = os.stat(fname)
+            except OSError:
+                continue
+            if _settings.ttl and statinfo[ST_ATIME] + _settings.ttl < now:
+                evicted += self._unlink(fname)
+                continue
+            entries.append((statinfo[ST_ATIME], statinfo[ST_SIZE], fname))
+            total += statinfo[ST_SIZE]
+            if owned:
+                kept.append(fname)
+
+        if _settings.max_size and total > _settings.max_size:
+            target = _settings.max_size * EVICTION_LOW_WATERMARK
+            entries.sort()
+            for _atime, size, fname in entries:
+                if total <= target:
+                    break
+                if self._unlink(fname):
+                    evicted += 1
+                    total -= size
+
+        for fname in kept:
+            if os.path.exists(fname):
+                self._add_to_index(fname)
+        for path in own:
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+        return evicted
+
+    @staticmethod
+    def _add_to_index(fname):
+        cachedir = cleanupPath(CACHEDIR)
+        name = os.path.relpath(fname, cachedir)
+        if name.startswith(os.pardir) or "\n" in name:
+            return
+        try:
+            fd = os.open(_index_file(cachedir), os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                         int('0644', 8))
+        except OSError:
+            return
+        try:
+            # a single short append, which concurrent writers do not mix up
+            os.write(fd, (name + "\n").encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _unlink(fname):
+        try:
+            os.unlink(fname)
+        except OSError:
+            e = sys.exc_info()[1]
+            if e.errno != ENOENT:
+                return 0
+        _memory.discard(fname)
+        _count('evictions')
+        return 1
+
+
+def _index_file(cachedir):
+    return os.path.join(cachedir, "%s-%d" % (EVICTION_INDEX, os.getuid()))
+
+
+def _read_index(path):
+    """ The entry names listed in an index file, relative to CACHEDIR. """
+    try:
+        with open(path, "rb") as index:
+            lines = index.read().decode('utf-8', 'replace').splitlines()
+    except (IOError, OSError):
+        return []
+    return [line for line in lines
+            if line and not os.path.isabs(line) and
+            not os.path.normpath(line).startswith(os.pardir)]
+
+
+_evictor = _Evictor()
+
+
+def evict():
+    """ Run an eviction pass on the cache directory now. """
+    _settings.load()
+    return _evictor.run()
+
+
+@contextmanager
+def build_lock(name, timeout=BUILD_LOCK_TIMEOUT):
+    """
+    Serialize building the entry name across threads and processes: when
+    many requests miss the same entry at once, one of them builds it while
+    the others wait, and then find it in the cache.
+    """
+    fname = _fname(name) + BUILD_LOCK_SUFFIX
+    dirname = os.path.dirname(fname)
+    if not os.path.isdir(dirname):
+        makedirs(dirname)
+    # read only, so that a lock file created by another user still works
+    fd = os.open(fname, os.O_RDONLY | os.O_CREAT, int('0644', 8))
+    try:
+        deadline = time.time() + timeout
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except IOError:
+                if time.time() > deadline:
+                    log_error("Gave up waiting for the build of cache entry %s" % name)
+                    break
+                time.sleep(0.1)
+        yield
+    finally:
+        os.close(fd)
+
 # The following functions expose this module as a dictionary
 
 
@@ -84,6 +475,14 @@ def set(name, value, modified=None, raw=None, compressed=None,
     cache.set(name, value, modified, user, group, mode)
 
 
+def get_bytes(name, modified=None):
+    """ Return the raw bytes of the entry, or None. """
+    try:
+        return Cache().get_bytes(name, modified)
+    except KeyError:
+        return None
+
+
 def has_key(name, modified=None):
     cache = Cache()
     return cache.has_key(name, modified)
@@ -212,13 +611,26 @@ class ReadLockedFile(LockedFile):
         if not os.access(self.fname, os.R_OK):
             raise KeyError(name)
         fd = open(self.fname, "rb")
-
-        fcntl.lockf(fd.fileno(), fcntl.LOCK_SH)
-
-        if self.modified:
-            if os.fstat(fd.fileno())[ST_MTIME] != self.modified:
-                fd.close()
-                raise KeyError(name)
+        try:
+            fcntl.lockf(fd.fileno(), fcntl.LOCK_SH)
+
+            self.mtime = os.fstat(fd.fileno())[ST_MTIME]
+            if self.modified:
+                if self.mtime != self.modified:
+                    raise KeyError(name)
+
+            if _settings.eviction_enabled():
+                # Keep the access time current for the LRU eviction. Only
+                # the owner of the file may set it; the others rely on the
+                # access time the read updates.
+                try:
+                    os.utime(fd.fileno(), (time.time(), self.mtime))
+                except OSError:
+                    pass
+        except:
+            # closing the file also releases the lock
+            fd.close()
+            raise
 
         return fd
 
@@ -237,26 +649,29 @@ class WriteLockedFile(LockedFile):
 
         # now we have the fd open, lock it
         fcntl.lockf(fd, fcntl.LOCK_EX)
+        _memory.discard(self.fname)
         return os.fdopen(fd, 'wb')
 
     def close_fd(self):
-        # Set the file's mtime if necessary
+        # Set the file's mtime if necessary; the atime is the last access
+        # used by the LRU eviction
         self.flush()
         if self.modified:
-            os.utime(self.fname, (self.modified, self.modified))
+            os.utime(self.fname, (time.time(), self.modified))
+        _evictor.wrote(self.fname, self.tell())
 
 
 class Cache:
 
+    """
+    The cache files, with the optional memory tier in front of them.
+    """
+
     def __init__(self):
-        pass
+        _settings.load()
 
     def get(self, name, modified=None):
-        fd = self.get_file(name, modified)
-
-        s = fd.read()
-        fd.close()
-
+        s = self.get_bytes(name, modified)
         if sys.version_info[0] >= 3 and isinstance(s, bytes):
 
             try:
@@ -265,6 +680,27 @@ class Cache:
                s = s.decode('latin-1')
         return s
 
+    def get_bytes(self, name, modified=None):
+        fname = _fname(name)
+        if modified is not None:
+            modified = timestamp(modified)
+
+        s = _memory.get(fname, modified)
+        if s is not None:
+            _count('memory_hits')
+        else:
+            try:
+                fd = self.get_file(name, modified)
+            except KeyError:
+                _count('misses')
+                raise
+            _count('disk_hits')
+
+            s = fd.read()
+            fd.close()
+            _memory.set(fname, s, fd.mtime)
+        return s
+
     def set(self, name, value, modified=None, user='root', group='root',
             mode=int('0755', 8)):
         fd = self.set_file(name, modified, user, group, mode)
@@ -297,6 +733,7 @@ class Cache:
         # now can we delete it?
         if not os.access(fname, os.W_OK):
             raise OSError("Read-Only access for cache entry: %s" % name)
+        _memory.discard(fname)
         os.unlink(fname)
 
     @staticmethod
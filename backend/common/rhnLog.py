@@ -125,6 +125,11 @@ def log_debug(level, *args):
     if LOG and LOG.level >= level:
         LOG.logMessage(*args)
 
+
+def log_level_enabled(level):
+    """ Return True if log_debug(level, ...) writes anything """
+    return bool(LOG and LOG.level >= level)
+
 # Dump some information to stderr.
 
 
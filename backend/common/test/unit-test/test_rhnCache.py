@@ -15,8 +15,12 @@
 #
 #
 
+import os
 import sys
+import threading
+import time
 import unittest
+from unittest.mock import patch
 from spacewalk.common import rhnCache
 
 
@@ -97,6 +101,143 @@ class Tests(unittest.TestCase):
 
       self._cleanup(self.key)
 
+    def test_memory_tier(self):
+        "Tests serving entries from the memory tier"
+        rhnCache.configure(memory_size=1024 * 1024)
+        try:
+            timestamp = '20041110001122'
+            rhnCache.set(self.key, self.content, modified=timestamp, raw=1)
+            stats = rhnCache.get_stats()
+
+            self.assertEqual(self.content, rhnCache.get(self.key, modified=timestamp, raw=1))
+            self.assertEqual(self.content, rhnCache.get(self.key, modified=timestamp, raw=1))
+            self.assertEqual(None, rhnCache.get(self.key, modified='20001122112233', raw=1))
+
+            new_stats = rhnCache.get_stats()
+            self.assertEqual(stats['disk_hits'] + 1, new_stats['disk_hits'])
+            self.assertEqual(stats['memory_hits'] + 1, new_stats['memory_hits'])
+            self.assertEqual(stats['misses'] + 1, new_stats['misses'])
+
+            # Entries without a stamp are checked against the disk
+            self._cleanup(self.key)
+            self.assertEqual(None, rhnCache.get(self.key, raw=1))
+        finally:
+            rhnCache.configure(memory_size=0)
+
+    def test_eviction(self):
+        "Tests the size bound of the cache directory"
+        rhnCache.CACHEDIR = '/tmp/rhn-eviction'
+        keys = ["unit-test/evict-%d" % i for i in range(4)]
+        rhnCache.configure(max_size=3 * 1024)
+        try:
+            for i, key in enumerate(keys):
+                rhnCache.set(key, "x" * 1024, raw=1)
+                # oldest access first
+                os.utime(rhnCache._fname(key), (1000 + i, 1000 + i))
+            rhnCache.get(keys[0], raw=1)
+
+            self.assertEqual(2, rhnCache.evict())
+            self.assertTrue(rhnCache.has_key(keys[0]))
+            self.assertFalse(rhnCache.has_key(keys[1]))
+            self.assertFalse(rhnCache.has_key(keys[2]))
+            self.assertTrue(rhnCache.has_key(keys[3]))
+        finally:
+            rhnCache.configure(max_size=0)
+            for key in keys:
+                self._cleanup(key)
+
+    def test_eviction_of_cache_entries_only(self):
+        "Tests that files not written through the cache are never evicted"
+        rhnCache.CACHEDIR = '/tmp/rhn-eviction'
+        key = "unit-test/evict-ttl"
+        foreign = os.path.join(rhnCache.CACHEDIR, "repodata", "repomd.xml")
+        rhnCache.configure(ttl=60)
+        try:
+            rhnCache.set(key, "x" * 1024, raw=1)
+            if not os.path.isdir(os.path.dirname(foreign)):
+                os.makedirs(os.path.dirname(foreign))
+            with open(foreign, "w") as f:
+                f.write("<repomd/>")
+            for fname in (rhnCache._fname(key), foreign):
+                os.utime(fname, (1000, 1000))
+
+            self.assertEqual(1, rhnCache.evict())
+            self.assertFalse(rhnCache.has_key(key))
+            self.assertTrue(os.path.exists(foreign))
+            # the evicted entry left the index
+            self.assertEqual(0, rhnCache.evict())
+        finally:
+            rhnCache.configure(ttl=0)
+            os.unlink(foreign)
+
+    def test_memory_hits_refresh_the_access_time(self):
+        "Tests that entries served from memory are not evicted first"
+        rhnCache.CACHEDIR = '/tmp/rhn'
+        rhnCache.configure(max_size=1024 * 1024, memory_size=1024 * 1024)
+        fname = rhnCache._fname(self.key)
+        try:
+            rhnCache.set(self.key, self.content, raw=1)
+            self.assertEqual(self.content, rhnCache.get(self.key, raw=1))
+            memory_hits = rhnCache.get_stats()['memory_hits']
+            mtime = os.stat(fname).st_mtime
+            os.utime(fname, (1000, mtime))
+
+            # rate limited
+            self.assertEqual(self.content, rhnCache.get(self.key, raw=1))
+            self.assertEqual(1000, os.stat(fname).st_atime)
+
+            with patch.object(rhnCache, "MEMORY_TOUCH_INTERVAL", 0):
+                self.assertEqual(self.content, rhnCache.get(self.key, raw=1))
+            self.assertTrue(os.stat(fname).st_atime > 1000)
+            self.assertEqual(mtime, os.stat(fname).st_mtime)
+            self.assertEqual(2, rhnCache.get_stats()['memory_hits'] - memory_hits)
+        finally:
+            rhnCache.configure(max_size=0, memory_size=0)
+            self._cleanup(self.key)
+
+    def test_read_without_owning_the_entry(self):
+        "Tests reading an entry whose access time cannot be set"
+        rhnCache.CACHEDIR = '/tmp/rhn'
+        rhnCache.configure(ttl=60)
+        try:
+            rhnCache.set(self.key, self.content, raw=1)
+            with patch.object(rhnCache.os, "utime", side_effect=OSError(1, "Operation not permitted")):
+                self.assertEqual(self.content, rhnCache.get(self.key, raw=1))
+        finally:
+            rhnCache.configure(ttl=0)
+            self._cleanup(self.key)
+
+    def test_get_bytes(self):
+        "Tests reading binary raw content back unchanged"
+        rhnCache.CACHEDIR = '/tmp/rhn'
+        content = bytes(range(256)) * 10
+        rhnCache.set(self.key, content, modified='20041110001122', raw=1)
+
+        self.assertEqual(content, rhnCache.get_bytes(self.key, modified='20041110001122'))
+        self.assertEqual(None, rhnCache.get_bytes(self.key, modified='20001122112233'))
+        self._cleanup(self.key)
+        self.assertEqual(None, rhnCache.get_bytes(self.key))
+
+    def test_build_lock(self):
+        "Tests that only one builder holds the lock of an entry"
+        rhnCache.CACHEDIR = '/tmp/rhn'
+        events = []
+
+        def build(name):
+            with rhnCache.build_lock(self.key):
+                events.append(name + "-start")
+                time.sleep(0.2)
+                events.append(name + "-end")
+
+        threads = [threading.Thread(target=build, args=(name,)) for name in ("a", "b")]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(events[0][0], events[1][0])
+        self.assertEqual(events[2][0], events[3][0])
+
     def _cleanup(self, key):
         if rhnCache.has_key(key):
             rhnCache.delete(key)
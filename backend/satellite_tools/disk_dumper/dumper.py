@@ -622,34 +622,18 @@ class QueryIterator:
     def __init__(self, statement, params):
         self._statement = statement
         self._params = params
-        # Position in the params list
-        self._params_pos = -1
-        self._result_set_exhausted = 1
+        self._rows = self._iterate()
+
+    def _iterate(self):
+        for pos, params in enumerate(self._params):
+            log_debug(5, "Using param", pos, params)
+            self._statement.execute(**params)
+            for row in self._statement.iterate_dict():
+                yield row
 
     def fetchone_dict(self):
         log_debug(4)
-        while 1:
-            if self._result_set_exhausted:
-                # Nothing to do here, move to the next set of params
-                pos = self._params_pos
-                pos = pos + 1
-                self._params_pos = pos
-                if pos == len(self._params):
-                    # End of the list, we're done
-                    return None
-                # Execute the satement
-                log_debug(5, "Using param", pos, self._params[pos])
-                self._statement.execute(**self._params[pos])
-                self._result_set_exhausted = 0
-                # Go back into the loop
-                continue
-
-            # Result set not exhausted yet
-            row = self._statement.fetchone_dict()
-            if row:
-                return row
-
-            self._result_set_exhausted = 1
+        return next(self._rows, None)
 
 
 class CachedQueryIterator:
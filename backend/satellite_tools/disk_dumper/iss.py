@@ -18,8 +18,13 @@ import os.path
 import sys
 import time
 import gzip
+import errno
+import fcntl
 import shutil
 import gettext
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
 try:
     #  python 2
     import cStringIO
@@ -53,11 +58,79 @@ except AttributeError:
 class ISSError(Exception):
 
     def __init__(self, msg, tb):
-        Exception.__init__(self)
+        # the arguments are passed on so that the error can be pickled back
+        # from the export worker processes
+        Exception.__init__(self, msg, tb)
         self.msg = msg
         self.tb = tb
 
 
+# ioctl sharing the data blocks of two files, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+# Number of items an export worker process dumps per task
+EXPORT_SHARD_SIZE = 50
+
+
+def copy_file(src, dst):
+    """
+    Copy the content of src to dst. The data blocks are shared (reflink) if
+    the file system supports it, otherwise the data is copied in the kernel.
+    """
+    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return
+        except OSError as e:
+            if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                               errno.EINVAL, errno.EBADF, errno.EPERM):
+                raise
+        if hasattr(os, 'copy_file_range'):
+            try:
+                size = os.fstat(fsrc.fileno()).st_size
+                copied = 0
+                while copied < size:
+                    n = os.copy_file_range(fsrc.fileno(), fdst.fileno(), size - copied)
+                    if n == 0:
+                        break
+                    copied += n
+                return
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                   errno.EOPNOTSUPP, errno.EBADF):
+                    raise
+                fsrc.seek(0)
+                fdst.seek(0)
+                fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst)
+
+
+# The Dumper of the running export, inherited by the forked worker processes.
+_worker_dumper = None
+
+
+def _init_export_worker():
+    """Set up the database connection of an export worker process.
+
+    The connection inherited from the parent process is left alone.
+    """
+    rhnSQL.detachDB()
+    rhnSQL.initDB()
+
+
+def _export_worker(dump_name, file_name, prefix, id_key, shard):
+    try:
+        return _worker_dumper.dump_shard(dump_name, file_name, prefix, id_key, shard)
+    except ISSError:
+        raise
+    except Exception:
+        e = sys.exc_info()[1]
+        tbout = cStringIO.StringIO()
+        Traceback(mail=0, ostream=tbout, with_locals=1)
+        raise_with_tb(ISSError("%s caught in %s." % (e.__class__.__name__, dump_name),
+                               tbout.getvalue()), sys.exc_info()[2])
+
+
 # xmlDiskSource doesn't have a class for short channel packages, so I added one here.
 # I named _getFile that way so it's similar to the stuff in xmlDiskSource.
 # I grabbed the value of pathkey from dump_channel_packages_short in dumper.py.
@@ -120,9 +193,9 @@ class FileMapper:
         # Split the path. The filename is [1], and the directories are in [0].
         dirs_to_make = os.path.split(ofile)[0]
 
-        # Make the directories if they don't already exist.
-        if not os.path.exists(dirs_to_make):
-            os.makedirs(dirs_to_make)
+        # Make the directories if they don't already exist; export workers
+        # may be creating them at the same time.
+        os.makedirs(dirs_to_make, exist_ok=True)
 
         return ofile
 
@@ -225,7 +298,7 @@ class Dumper(dumper.XML_Dumper):
     """
 
     def __init__(self, outputdir, channel_labels, org_ids, hardlinks,
-                 start_date, end_date, use_rhn_date, whole_errata):
+                 start_date, end_date, use_rhn_date, whole_errata, workers=1):
         dumper.XML_Dumper.__init__(self)
         self.fm = FileMapper(outputdir)
         self.mp = outputdir
@@ -234,8 +307,10 @@ class Dumper(dumper.XML_Dumper):
         self.pb_complete = " - Done!"  # string that's printed when progress bar is done.
         self.pb_char = "#"  # the string used as each unit in the progress bar.
         self.hardlinks = hardlinks
+        self.workers = max(1, workers)
         self.filename = None
         self.outstream = None
+        self._pb_lock = threading.Lock()
 
         self.start_date = start_date
         self.end_date = end_date
@@ -679,6 +754,52 @@ class Dumper(dumper.XML_Dumper):
         self.outstream = open(self.filename, "w")
         return xmlWriter.XMLWriter(stream=self.outstream)
 
+    def dump_shard(self, dump_name, file_name, prefix, id_key, shard):
+        """ Dump every item of shard to its own file, using the dump_name
+            method of XML_Dumper and the file_name method of the FileMapper.
+            Returns the file names.
+        """
+        filenames = []
+        for info in shard:
+            self.set_filename(getattr(self.fm, file_name)(prefix + str(info[id_key])))
+            getattr(dumper.XML_Dumper, dump_name)(self, [info])
+            self.close()
+            filenames.append(self.filename)
+        return filenames
+
+    def _dump_files(self, items, dump_name, file_name, prefix, id_key):
+        """ Yields (item, file name) for every item of items once it has been
+            dumped; shards of the items are spread over the worker processes
+            when exporting in parallel.
+        """
+        if self.workers == 1 or len(items) <= EXPORT_SHARD_SIZE:
+            for info in items:
+                yield info, self.dump_shard(dump_name, file_name, prefix, id_key, [info])[0]
+            return
+
+        global _worker_dumper
+        shards = [items[i:i + EXPORT_SHARD_SIZE] for i in range(0, len(items), EXPORT_SHARD_SIZE)]
+        # the workers are forked with a copy of this dumper and open their own
+        # database connection
+        _worker_dumper = self
+        try:
+            # leaving the block terminates the workers, dropping the shards
+            # still pending when an error interrupts the export
+            with multiprocessing.get_context('fork').Pool(self.workers,
+                                                          initializer=_init_export_worker) as pool:
+                results = [(shard, pool.apply_async(_export_worker, (dump_name, file_name, prefix, id_key, shard)))
+                           for shard in shards]
+                for shard, result in results:
+                    for info, filename in zip(shard, result.get()):
+                        yield info, filename
+        finally:
+            _worker_dumper = None
+
+    def _advance(self, pb):
+        with self._pb_lock:
+            pb.addTo(1)
+            pb.printIncrement()
+
     # The dump_* methods aren't really overrides because they don't preserve the method
     # signature, but they are meant as replacements for the methods defined in the base
     # class that have the same name. They will set up the file for the dump, collect info
@@ -824,16 +945,13 @@ class Dumper(dumper.XML_Dumper):
                                           self.pb_length,
                                           self.pb_char)
             pb.printAll(1)
-            for pkg_info in self.pkg_info:
+            for pkg_info, filename in self._dump_files(self.pkg_info, 'dump_packages', 'getPackagesFile',
+                                                        "rhn-package-", 'package_id'):
                 package_name = "rhn-package-" + str(pkg_info['package_id'])
-                self.set_filename(self.fm.getPackagesFile(package_name))
-                dumper.XML_Dumper.dump_packages(self, [pkg_info])
-
                 log2email(4, "Package: %s" % package_name)
-                log2email(5, "Package exported to %s" % self.fm.getPackagesFile(package_name))
+                log2email(5, "Package exported to %s" % filename)
 
-                pb.addTo(1)
-                pb.printIncrement()
+                self._advance(pb)
             pb.printComplete()
             log2stdout(3, "Number of packages exported: %s" % str(len(self.pkg_info)))
 
@@ -854,15 +972,12 @@ class Dumper(dumper.XML_Dumper):
                                           self.pb_length,
                                           self.pb_char)
             pb.printAll(1)
-            for pkg_info in self.pkg_info:
+            for pkg_info, _filename in self._dump_files(self.pkg_info, 'dump_packages_short',
+                                                         'getShortPackagesFile', "rhn-package-", 'package_id'):
                 package_name = "rhn-package-" + str(pkg_info['package_id'])
-                self.set_filename(self.fm.getShortPackagesFile(package_name))
-                dumper.XML_Dumper.dump_packages_short(self, [pkg_info])
-
                 log2email(4, "Short Package: %s" % package_name)
                 log2email(5, "Short Package exported to %s" % package_name)
-                pb.addTo(1)
-                pb.printIncrement()
+                self._advance(pb)
             pb.printComplete()
             log2stdout(3, "Number of short packages exported: %s" % str(len(self.pkg_info)))
 
@@ -897,16 +1012,12 @@ class Dumper(dumper.XML_Dumper):
                                           self.pb_length,
                                           self.pb_char)
             pb.printAll(1)
-            for errata_info in self.errata_info:
-                erratum_name = "rhn-erratum-" + str(errata_info['errata_id'])
-                self.set_filename(self.fm.getErrataFile(erratum_name))
-                dumper.XML_Dumper.dump_errata(self, [errata_info])
-
+            for errata_info, filename in self._dump_files(self.errata_info, 'dump_errata', 'getErrataFile',
+                                                           "rhn-erratum-", 'errata_id'):
                 log2email(4, "Erratum: %s" % str(errata_info['advisory-name']))
-                log2email(5, "Erratum exported to %s" % self.fm.getErrataFile(erratum_name))
+                log2email(5, "Erratum exported to %s" % filename)
 
-                pb.addTo(1)
-                pb.printIncrement()
+                self._advance(pb)
             pb.printComplete()
             log2stdout(3, "Number of errata exported: %s" % str(len(self.errata_info)))
 
@@ -1025,66 +1136,72 @@ class Dumper(dumper.XML_Dumper):
                                           self.pb_length,
                                           self.pb_char)
             pb.printAll(1)
-            for rpm in self.brpms:
-                # generate path to the rpms under the mount point
-                path_to_rpm = diskImportLib.rpmsPath("rhn-package-%s" % str(rpm['id']), self.mp)
-
-                # get the dirs to the rpm
-                dirs_to_rpm = os.path.split(path_to_rpm)[0]
+            # copying is I/O bound, threads are enough to keep the disks busy
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for rpm in executor.map(self._export_rpm, self.brpms):
+                    log2email(5, "RPM: %s" % rpm['path'])
+                    self._advance(pb)
+            pb.printComplete()
+            log2stdout(3, "Number of RPMs exported: %s" % str(len(self.brpms)))
+        except ISSError:
+            raise
 
-                if (not rpm['path']):
-                    raise ISSError("Error: Missing RPM under the satellite mount point. (Package id: %s)" %
-                                   rpm['id'], "")
-                # get the path to the rpm from under the satellite's mountpoint
-                satellite_path = os.path.join(CFG.MOUNT_POINT, rpm['path'])
+        except Exception:
+            e = sys.exc_info()[1]
+            tbout = cStringIO.StringIO()
+            Traceback(mail=0, ostream=tbout, with_locals=1)
+            raise_with_tb(ISSError("%s caught in dump_rpms." % e.__class__.__name__,
+                                   tbout.getvalue()), sys.exc_info()[2])
 
-                if not os.path.exists(satellite_path):
-                    raise ISSError("Error: Missing RPM under mount point: %s" % (satellite_path,), "")
+    def _export_rpm(self, rpm):
+        # generate path to the rpms under the mount point
+        path_to_rpm = diskImportLib.rpmsPath("rhn-package-%s" % str(rpm['id']), self.mp)
 
-                # create the directory for the rpm, if necessary.
-                if not os.path.exists(dirs_to_rpm):
-                    os.makedirs(dirs_to_rpm)
+        # get the dirs to the rpm
+        dirs_to_rpm = os.path.split(path_to_rpm)[0]
 
-                # check if the path to rpm hardlink already exists
-                if os.path.exists(path_to_rpm):
-                    continue
+        if (not rpm['path']):
+            raise ISSError("Error: Missing RPM under the satellite mount point. (Package id: %s)" %
+                           rpm['id'], "")
+        # get the path to the rpm from under the satellite's mountpoint
+        satellite_path = os.path.join(CFG.MOUNT_POINT, rpm['path'])
 
-                try:
-                    # copy the file to the path under the mountpoint.
-                    if self.hardlinks:
-                        os.link(satellite_path, path_to_rpm)
-                    else:
-                        shutil.copyfile(satellite_path, path_to_rpm)
-                except IOError:
-                    e = sys.exc_info()[1]
-                    tbout = cStringIO.StringIO()
-                    Traceback(mail=0, ostream=tbout, with_locals=1)
-                    raise_with_tb(ISSError("Error: Error copying file %s: %s" %
-                                           (os.path.join(CFG.MOUNT_POINT, rpm['path']), e.__class__.__name__),
-                                           tbout.getvalue()), sys.exc_info()[2])
-                except OSError:
-                    e = sys.exc_info()[1]
-                    tbout = cStringIO.StringIO()
-                    Traceback(mail=0, ostream=tbout, with_locals=1)
-                    raise_with_tb(ISSError("Error: Could not make hard link %s: %s (different filesystems?)" %
-                                           (os.path.join(CFG.MOUNT_POINT, rpm['path']), e.__class__.__name__),
-                                           tbout.getvalue()), sys.exc_info()[2])
+        if not os.path.exists(satellite_path):
+            raise ISSError("Error: Missing RPM under mount point: %s" % (satellite_path,), "")
 
-                log2email(5, "RPM: %s" % rpm['path'])
+        # create the directory for the rpm, if necessary.
+        os.makedirs(dirs_to_rpm, exist_ok=True)
 
-                pb.addTo(1)
-                pb.printIncrement()
-            pb.printComplete()
-            log2stdout(3, "Number of RPMs exported: %s" % str(len(self.brpms)))
-        except ISSError:
-            raise
+        # check if the path to rpm hardlink already exists
+        if os.path.exists(path_to_rpm):
+            return rpm
 
-        except Exception:
+        try:
+            # copy the file to the path under the mountpoint.
+            if self.hardlinks:
+                os.link(satellite_path, path_to_rpm)
+            else:
+                # an interrupted copy must not be taken for an exported rpm
+                # by the next run
+                temp_path = "%s.%s.tmp" % (path_to_rpm, threading.get_ident())
+                try:
+                    copy_file(satellite_path, temp_path)
+                    os.rename(temp_path, path_to_rpm)
+                except:
+                    if os.path.exists(temp_path):
+                        os.unlink(temp_path)
+                    raise
+        except IOError:
             e = sys.exc_info()[1]
             tbout = cStringIO.StringIO()
             Traceback(mail=0, ostream=tbout, with_locals=1)
-            raise_with_tb(ISSError("%s caught in dump_rpms." % e.__class__.__name__,
+            if self.hardlinks:
+                msg = "Error: Could not make hard link %s: %s (different filesystems?)"
+            else:
+                msg = "Error: Error copying file %s: %s"
+            raise_with_tb(ISSError(msg % (satellite_path, e.__class__.__name__),
                                    tbout.getvalue()), sys.exc_info()[2])
+        return rpm
 
     def dump_support_information(self):
         self._dump_simple(self.fm.getSupportInformationFile(),
@@ -1311,6 +1428,10 @@ class ExporterMain:
             self.start_date = None
             self.end_date = None
 
+        if self.options.workers < 1:
+            sys.stderr.write("--workers must be at least 1.\n")
+            sys.exit(1)
+
         if self.start_date and self.options.whole_errata:
             self.whole_errata = self.options.whole_errata
 
@@ -1324,7 +1445,8 @@ class ExporterMain:
                                      start_date=self.start_date,
                                      end_date=self.end_date,
                                      use_rhn_date=self.options.use_rhn_date,
-                                     whole_errata=self.options.whole_errata)
+                                     whole_errata=self.options.whole_errata,
+                                     workers=self.options.workers)
                 self.actionmap = {
                     'arches':   {'dump': self.dumper.dump_arches},
                     'arches-extra':   {'dump': self.dumper.dump_server_group_type_server_arches},
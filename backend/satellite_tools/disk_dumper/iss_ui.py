@@ -31,6 +31,8 @@ class UI:
                    help="This is the directory that the information that you want to sync gets dumped in."),
             option("--hard-links",             action="store_true",        default=0,
                    help="Exported RPM and kickstart are hard linked to original files."),
+            option("--workers",                action="store",         type="int",     default=1,
+                   help="Number of processes exporting package and errata data, and of threads copying RPMs."),
             option("--list-channels",          action="store_true",    default=0,
                    help="List all of the channels that can be exported."),
             option("--list-steps",             action="store_true",    default=0,
@@ -17,7 +17,7 @@ import os
 import sys
 import re
 import time
-from threading import Thread, Lock
+from threading import Thread, Lock, Event
 try:
     #  python 2
     import urlparse
@@ -92,6 +92,42 @@ class TextLogger:
         self.lock.release()
 
 
+# HTTP/2 is negotiated over TLS when the mirror offers it, HTTP/1.1 otherwise
+HTTP_VERSION = getattr(pycurl, 'CURL_HTTP_VERSION_2TLS', None)
+
+
+def new_curl_share():
+    """Return a curl share handle, so all transfers use one connection, DNS and TLS session cache"""
+    # pylint: disable=E1101
+    share = pycurl.CurlShare()
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+    share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+    if hasattr(pycurl, 'LOCK_DATA_CONNECT'):
+        share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+    return share
+
+
+class HostStats:
+    """Bytes and files downloaded per host, to report the throughput of every mirror"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.start = time.time()
+        self.hosts = {}
+
+    def add(self, url, size):
+        host = urlparse.urlsplit(url).netloc.rpartition('@')[2]
+        with self.lock:
+            files, total, _ = self.hosts.get(host, (0, 0, None))
+            self.hosts[host] = (files + 1, total + size, time.time())
+
+    def report(self):
+        for host, (files, total, end) in sorted(self.hosts.items()):
+            elapsed = max(end - self.start, 0.001)
+            log(1, "Downloaded %d files (%.1f MiB) from %s at %.2f MiB/s." %
+                (files, total / 1048576.0, host, total / 1048576.0 / elapsed))
+
+
 # Older versions of urlgrabber don't allow to set proxy parameters separately
 # Simplified version from yumRepository class
 def get_proxies(proxy, user, password):
@@ -109,9 +145,10 @@ def get_proxies(proxy, user, password):
 
 
 class PyCurlFileObjectThread(PyCurlFileObject):
-    def __init__(self, url, filename, opts, curl_cache, parent):
+    def __init__(self, url, filename, opts, curl_cache, parent, share=None):
         self.curl_cache = curl_cache
         self.parent = parent
+        self.share = share
         (url, parts) = opts.urlparser.parse(url, opts)
         (scheme, host, path, parm, query, frag) = parts
         opts.find_proxy(url, scheme)
@@ -121,6 +158,11 @@ class PyCurlFileObjectThread(PyCurlFileObject):
         self.curl_obj = self.curl_cache
         self.curl_obj.reset()
         self._set_opts()
+        # reset() drops these, so they are set again for every transfer
+        if self.share is not None:
+            self.curl_obj.setopt(pycurl.SHARE, self.share)
+        if HTTP_VERSION is not None:
+            self.curl_obj.setopt(pycurl.HTTP_VERSION, HTTP_VERSION)
         self._do_grab()
         return self.fo
 
@@ -144,10 +186,12 @@ class FailedDownloadError(Exception):
 
 
 class DownloadThread(Thread):
-    def __init__(self, parent, queue):
+    def __init__(self, parent, queues, first_queue=0):
         super().__init__()
         self.parent = parent
-        self.queue = queue
+        # the threads take the files of all the queues, starting with
+        # different ones
+        self.queues = queues[first_queue:] + queues[:first_queue]
         # pylint: disable=E1101
         self.curl = pycurl.Curl()
         self.mirror = 0
@@ -229,12 +273,15 @@ class DownloadThread(Thread):
                     query.rstrip('/'), ''))
             try:
                 try:
-                    fo = PyCurlFileObjectThread(url, params['target_file'], opts, self.curl, self.parent)
+                    fo = PyCurlFileObjectThread(url, params['target_file'], opts, self.curl, self.parent,
+                                                self.parent.share)
                     # Check target file
                     if not self.__is_file_done(file_obj=fo, checksum_type=params['checksum_type'],
                                                checksum=params['checksum']):
                         raise FailedDownloadError("Target file isn't valid. Checksum should be %s (%s)."
                                                   % (params['checksum'], params['checksum_type']))
+                    # pylint: disable=E1101
+                    self.parent.stats.add(url, self.curl.getinfo(pycurl.SIZE_DOWNLOAD))
                     break
                 except (FailedDownloadError, URLGrabError):
                     e = sys.exc_info()[1]
@@ -263,19 +310,31 @@ class DownloadThread(Thread):
 
         return True
 
-    def run(self):
-        while not self.queue.empty() and self.parent.can_continue():
+    def __next_params(self):
+        for queue in self.queues:
             try:
-                params = self.queue.get(block=False)
+                return queue, queue.get(block=False)
             except Empty:
-                break
-            self.mirror = 0
-            success = self.__fetch_url(params)
-            if self.parent.log_obj:
-                # log_obj must be thread-safe
-                self.parent.log_obj.log(success, os.path.basename(params['relative_path']))
-            self.queue.task_done()
-        self.curl.close()
+                continue
+        return None, None
+
+    def run(self):
+        try:
+            while self.parent.can_continue():
+                queue, params = self.__next_params()
+                if queue is None:
+                    break
+                self.mirror = 0
+                success = self.__fetch_url(params)
+                if self.parent.log_obj:
+                    # log_obj must be thread-safe
+                    self.parent.log_obj.log(success, os.path.basename(params['relative_path']))
+                if self.parent.callback:
+                    self.parent.callback(params, success)
+                queue.task_done()
+            self.curl.close()
+        finally:
+            self.parent.thread_finished()
 
 
 class ThreadedDownloader:
@@ -308,8 +367,13 @@ class ThreadedDownloader:
         self.retries = retries
         self.log_obj = log_obj
         self.force = force
+        self.callback = None
         self.lock = Lock()
         self.exception = None
+        self.share = None
+        self.stats = None
+        self.running = 0
+        self.finished = Event()
         # WORKAROUND - BZ #1439758 - ensure first item in queue is performed alone to properly setup NSS
         self.first_in_queue_done = False
         self.first_in_queue_lock = Lock()
@@ -320,6 +384,10 @@ class ThreadedDownloader:
     def set_force(self, force):
         self.force = force
 
+    def set_callback(self, callback):
+        """callback(params, success) is called from the download threads once a file is finished"""
+        self.callback = callback
+
     @staticmethod
     def _validate(ssl_set):
         ssl_ca_cert, ssl_cert, ssl_key = ssl_set
@@ -347,26 +415,33 @@ class ThreadedDownloader:
             return
         log(1, "Downloading total %d files from %d queues." % (size, len(self.queues)))
 
-        for index, queue in enumerate(self.queues.values()):
+        # all queues are downloaded at the same time by the same threads,
+        # sharing one connection cache
+        self.share = new_curl_share()
+        self.stats = HostStats()
+        queues = list(self.queues.values())
+        for index, queue in enumerate(queues):
             log(2, "Downloading %d files from queue #%d." % (queue.qsize(), index))
-            self.first_in_queue_done = False
-            started_threads = []
-            for _ in range(self.threads):
-                thread = DownloadThread(self, queue)
-                thread.setDaemon(True)
-                thread.start()
-                started_threads.append(thread)
-
-            # wait to finish
-            try:
-                while any(t.isAlive() for t in started_threads):
-                    time.sleep(1)
-            except KeyboardInterrupt:
-                e = sys.exc_info()[1]
-                self.fail_download(e)
-                while any(t.isAlive() for t in started_threads):
-                    time.sleep(1)
-                break
+        threads = []
+        for index in range(min(self.threads, size)):
+            thread = DownloadThread(self, queues, index % len(queues))
+            thread.daemon = True
+            threads.append(thread)
+        self.first_in_queue_done = False
+        self.finished.clear()
+        self.running = len(threads)
+        for thread in threads:
+            thread.start()
+
+        # wait to finish
+        try:
+            self.finished.wait()
+        except KeyboardInterrupt:
+            e = sys.exc_info()[1]
+            self.fail_download(e)
+            self.finished.wait()
+        self.share.close()
+        self.stats.report()
 
         # raise first detected exception if any
         if self.exception:
@@ -378,6 +453,12 @@ class ThreadedDownloader:
         self.lock.release()
         return status
 
+    def thread_finished(self):
+        with self.lock:
+            self.running -= 1
+            if self.running <= 0:
+                self.finished.set()
+
     def fail_download(self, exception):
         self.lock.acquire()
         if not self.exception:
@@ -13,6 +13,7 @@
 # in this software or its documentation.
 #
 
+import fnmatch
 import re
 import rpm
 from uyuni.common import rhn_pkg
@@ -22,6 +23,51 @@ from spacewalk.server import rhnPackageUpload
 CACHE_DIR = '/var/cache/rhn/reposync/'
 
 
+class PackageFilter:
+    """ implement include / exclude logic
+        filters are: [ ('+', includelist1), ('-', excludelist1),
+                       ('+', includelist2), ... ]
+        A package is selected if the last filter matching its name is an
+        include. Packages matching no filter are selected only if the first
+        filter is an exclude. All patterns are compiled into one regular
+        expression and every package name is matched only once.
+    """
+
+    def __init__(self, filters, exclude_only=False):
+        for sense, _ in filters:
+            if sense not in ('+', '-'):
+                raise IOError("Filters are malformed")
+        if exclude_only:
+            filters = [f for f in filters if f[0] == '-']
+        self.default = exclude_only or not filters or filters[0][0] == '-'
+        self.senses = {}
+        groups = []
+        # the first alternative that matches wins, so later filters go first
+        for index in reversed(range(len(filters))):
+            sense, patterns = filters[index]
+            if not patterns:
+                continue
+            group = "f%d" % index
+            self.senses[group] = sense == '+'
+            groups.append("(?P<%s>%s)" % (group, "|".join(fnmatch.translate(p) for p in patterns)))
+        self.matcher = re.compile("|".join(groups)) if groups else None
+        self.cache = {}
+
+    def is_selected(self, name):
+        try:
+            return self.cache[name]
+        except KeyError:
+            pass
+        match = self.matcher.match(name) if self.matcher else None
+        selected = self.senses[match.lastgroup] if match else self.default
+        self.cache[name] = selected
+        return selected
+
+    def filter(self, packages):
+        """ return packages selected by the filters, in their original order """
+        return [pkg for pkg in packages if self.is_selected(pkg.name)]
+
+
 class ContentPackage:
 
     def __init__(self):
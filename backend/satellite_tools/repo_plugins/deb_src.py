@@ -13,13 +13,12 @@
 # in this software or its documentation.
 #
 
+import itertools
 import sys
 import os.path
 from shutil import rmtree
 from shutil import copyfile
 import time
-import re
-import fnmatch
 import requests
 from functools import cmp_to_key
 from salt.utils.versions import LooseVersion
@@ -27,7 +26,7 @@ from uyuni.common import fileutils
 from uyuni.common.context_managers import cfg_component
 from spacewalk.common.suseLib import get_proxy
 from spacewalk.satellite_tools.download import get_proxies
-from spacewalk.satellite_tools.repo_plugins import ContentPackage, CACHE_DIR
+from spacewalk.satellite_tools.repo_plugins import ContentPackage, PackageFilter, CACHE_DIR
 from spacewalk.satellite_tools.syncLib import log2
 from spacewalk.server import rhnSQL
 from spacewalk.common import repo
@@ -44,9 +43,15 @@ except ImportError:
 RETRIES = 10
 RETRY_DELAY = 1
 FORMAT_PRIORITY = ['.xz', '.gz', '']
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+CHECKSUM_FIELDS = {'SHA256:': 'sha256', 'SHA1:': 'sha1', 'MD5sum:': 'md5'}
+CHECKSUM_PRIORITY = ['sha256', 'sha1', 'md5']
 
 
 class DebPackage:
+    # a repository index holds a lot of these
+    __slots__ = ('name', 'epoch', 'version', 'release', 'arch', 'relativepath', 'checksum_type', 'checksum')
+
     def __init__(self):
         self.name = None
         self.epoch = None
@@ -213,18 +218,14 @@ class DebRepo:
             return filename
         for _ in range(0, RETRIES):
             try:
-                data = requests.get(url, proxies=self._get_proxies(), cert=(self.sslclientcert, self.sslclientkey),
-                                    verify=self.sslcacert)
-                if not data.ok:
-                    return ''
-                filename = os.path.join(self.basecachedir, os.path.basename(urlparse.urlparse(url).path))
-                fd = open(filename, 'wb')
-                try:
-                    for chunk in data.iter_content(chunk_size=1024):
-                        fd.write(chunk)
-                finally:
-                    if fd is not None:
-                        fd.close()
+                with requests.get(url, proxies=self._get_proxies(), cert=(self.sslclientcert, self.sslclientkey),
+                                  verify=self.sslcacert, stream=True) as data:
+                    if not data.ok:
+                        return ''
+                    filename = os.path.join(self.basecachedir, os.path.basename(urlparse.urlparse(url).path))
+                    with open(filename, 'wb') as fd:
+                        for chunk in data.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                            fd.write(chunk)
                 return filename
             except requests.exceptions.RequestException as exc:
                 print("ERROR: requests.exceptions.RequestException occurred:", exc)
@@ -234,8 +235,6 @@ class DebRepo:
 
     def get_package_list(self):
         decompressed = None
-        packages_raw = []
-        to_return = []
 
         for extension in FORMAT_PRIORITY:
             scheme, netloc, path, query, fragid = urlparse.urlsplit(self.url)
@@ -250,60 +249,62 @@ class DebRepo:
                 decompressed = fileutils.decompress_open(filename)
                 break
 
-        if decompressed:
-            for pkg in decompressed.read().split("\n\n"):
-                packages_raw.append(pkg)
-            decompressed.close()
-        else:
+        if not decompressed:
             print("ERROR: Download of package list failed.")
+            return []
+        try:
+            return list(self.parse_packages_index(decompressed))
+        finally:
+            decompressed.close()
 
-        # Parse and format package metadata
-        for chunk in packages_raw:
-            package = DebPackage()
-            package.epoch = ""
-            lines = chunk.split("\n")
-            checksums = {}
-            for line in lines:
-                pair = line.split(" ", 1)
-                if pair[0] == "Package:":
-                    package.name = pair[1]
-                elif pair[0] == "Architecture:":
-                    package.arch = pair[1] + '-deb'
-                elif pair[0] == "Version:":
-                    package['epoch'] = ''
-                    version = pair[1]
-                    if version.find(':') != -1:
-                        package['epoch'], version = version.split(':')
-                    if version.find('-') != -1:
-                        tmp = version.split('-')
-                        package['version'] = '-'.join(tmp[:-1])
-                        package['release'] = tmp[-1]
-                    else:
-                        package['version'] = version
-                        package['release'] = 'X'
-                elif pair[0] == "Filename:":
-                    package.relativepath = pair[1]
-                elif pair[0] == "SHA256:":
-                    checksums['sha256'] = pair[1]
-                elif pair[0] == "SHA1:":
-                    checksums['sha1'] = pair[1]
-                elif pair[0] == "MD5sum:":
-                    checksums['md5'] = pair[1]
-
-            # Pick best available checksum
-            if 'sha256' in checksums:
-                package.checksum_type = 'sha256'
-                package.checksum = checksums['sha256']
-            elif 'sha1' in checksums:
-                package.checksum_type = 'sha1'
-                package.checksum = checksums['sha1']
-            elif 'md5' in checksums:
-                package.checksum_type = 'md5'
-                package.checksum = checksums['md5']
-
-            if package.is_populated():
-                to_return.append(package)
-        return to_return
+    @staticmethod
+    def parse_packages_index(stream):
+        """
+        Parse a Packages index stanza by stanza while reading it line by line
+        from stream, and yield a DebPackage for every complete entry.
+        """
+        package = None
+        for line in itertools.chain(stream, [""]):
+            line = line.rstrip("\n")
+            if not line:
+                if package is None:
+                    continue
+                # Pick best available checksum
+                for checksum_type in CHECKSUM_PRIORITY:
+                    if checksum_type in checksums:
+                        package.checksum_type = checksum_type
+                        package.checksum = checksums[checksum_type]
+                        break
+                if package.is_populated():
+                    yield package
+                package = None
+                continue
+            if package is None:
+                package = DebPackage()
+                package.epoch = ""
+                checksums = {}
+            pair = line.split(" ", 1)
+            if len(pair) < 2:
+                continue
+            key, value = pair
+            if key == "Package:":
+                package.name = value
+            elif key == "Architecture:":
+                package.arch = value + '-deb'
+            elif key == "Version:":
+                package.epoch = ''
+                version = value
+                if version.find(':') != -1:
+                    package.epoch, version = version.split(':', 1)
+                if version.find('-') != -1:
+                    package.version, package.release = version.rsplit('-', 1)
+                else:
+                    package.version = version
+                    package.release = 'X'
+            elif key == "Filename:":
+                package.relativepath = value
+            elif key in CHECKSUM_FIELDS:
+                checksums[CHECKSUM_FIELDS[key]] = value
 
 
 class ContentSource:
@@ -427,44 +428,7 @@ class ContentSource:
         if filters is None:
             return
 
-        selected = []
-        excluded = []
-        allmatched_include = []
-        allmatched_exclude = []
-        if filters[0][0] == '-':
-            # first filter is exclude, start with full package list
-            # and then exclude from it
-            selected = packages
-        else:
-            excluded = packages
-
-        for filter_item in filters:
-            sense, pkg_list = filter_item
-            regex = fnmatch.translate(pkg_list[0])
-            reobj = re.compile(regex)
-            if sense == '+':
-                # include
-                for excluded_pkg in excluded:
-                    if reobj.match(excluded_pkg['name']):
-                        allmatched_include.insert(0, excluded_pkg)
-                        selected.insert(0, excluded_pkg)
-                for pkg in allmatched_include:
-                    if pkg in excluded:
-                        excluded.remove(pkg)
-            elif sense == '-':
-                # exclude
-                for selected_pkg in selected:
-                    if reobj.match(selected_pkg['name']):
-                        allmatched_exclude.insert(0, selected_pkg)
-                        excluded.insert(0, selected_pkg)
-
-                for pkg in allmatched_exclude:
-                    if pkg in selected:
-                        selected.remove(pkg)
-                excluded = (excluded + allmatched_exclude)
-            else:
-                raise IOError("Filters are malformed")
-        return selected
+        return PackageFilter(filters).filter(packages)
 
     def clear_cache(self, directory=None):
         if directory is None:
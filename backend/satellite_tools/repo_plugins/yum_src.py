@@ -24,7 +24,6 @@ from __future__ import absolute_import, unicode_literals
 from shutil import rmtree, copytree
 
 import configparser
-import fnmatch
 import glob
 import gzip
 import bz2
@@ -51,7 +50,7 @@ from salt.utils.versions import LooseVersion
 from uyuni.common import checksum, fileutils
 from uyuni.common.context_managers import cfg_component
 from spacewalk.common import rhnLog
-from spacewalk.satellite_tools.repo_plugins import ContentPackage, CACHE_DIR
+from spacewalk.satellite_tools.repo_plugins import ContentPackage, PackageFilter, CACHE_DIR
 from spacewalk.satellite_tools.download import get_proxies
 from spacewalk.common.rhnConfig import CFG, initCFG
 from spacewalk.common.suseLib import get_proxy
@@ -839,46 +838,7 @@ type=rpm-md
         if filters is None:
             return
 
-        selected = []
-        excluded = []
-        allmatched_include = []
-        allmatched_exclude = []
-        if exclude_only or filters[0][0] == '-':
-            # first filter is exclude, start with full package list
-            # and then exclude from it
-            selected = packages
-        else:
-            excluded = packages
-
-        for filter_item in filters:
-            sense, pkg_list = filter_item
-            regex = fnmatch.translate(pkg_list[0])
-            reobj = re.compile(regex)
-            if sense == '+':
-                if exclude_only:
-                    continue
-                # include
-                for excluded_pkg in excluded:
-                    if reobj.match(excluded_pkg.name):
-                        allmatched_include.insert(0, excluded_pkg)
-                        selected.insert(0, excluded_pkg)
-                for pkg in allmatched_include:
-                    if pkg in excluded:
-                        excluded.remove(pkg)
-            elif sense == '-':
-                # exclude
-                for selected_pkg in selected:
-                    if reobj.match(selected_pkg.name):
-                        allmatched_exclude.insert(0, selected_pkg)
-                        excluded.insert(0, selected_pkg)
-
-                for pkg in allmatched_exclude:
-                    if pkg in selected:
-                        selected.remove(pkg)
-                excluded = (excluded + allmatched_exclude)
-            else:
-                raise IOError("Filters are malformed")
-        return selected
+        return PackageFilter(filters, exclude_only).filter(packages)
 
     def get_susedata(self):
         """
@@ -32,6 +32,9 @@ from dateutil.tz import tzutc
 import gettext
 import errno
 import multiprocessing
+import queue
+from collections import deque
+from threading import Thread
 
 from rhn.connections import idn_puny_to_unicode
 
@@ -251,6 +254,16 @@ def set_filter_opt(option, opt_str, value, parser):
     parser.values.filters.append((f_type, [v.strip() for v in value.split(',') if v.strip()]))
 
 
+def init_import_worker():
+    """Set up the database connection of a package import worker process.
+
+    The worker keeps it for all the batches it imports; the connection
+    inherited from the parent process is left alone.
+    """
+    rhnSQL.detachDB()
+    rhnSQL.initDB()
+
+
 def getChannelRepo():
 
     rhnSQL.initDB()
@@ -671,6 +684,8 @@ class RepoSync(object):
             taskomatic.add_to_erratacache_queue(self.channel_label)
         self.update_date()
         rhnSQL.commit()
+        if self.regen:
+            self.precompute_package_lists()
         with cfg_component('server.susemanager') as CFG:
             if CFG.AUTO_GENERATE_BOOTSTRAP_REPO and self.regenerate_bootstrap_repo:
                 log(0, '  Regenerating bootstrap repositories.')
@@ -694,6 +709,15 @@ class RepoSync(object):
             sync_error = failed_packages
         return elapsed_time, sync_error
 
+    def precompute_package_lists(self):
+        """Build the package lists served to clients for the new version of
+        the channel now, instead of on the first client requests."""
+        try:
+            rhnChannel.precompute_package_lists(self.channel_label)
+        except Exception as e: # pylint: disable=broad-except
+            log2(0, 0, "Could not precompute the package lists of the channel: %s" % e,
+                 stream=sys.stderr)
+
     def set_ks_tree_type(self, tree_type='externally-managed'):
         self.ks_tree_type = tree_type
 
@@ -1010,6 +1034,7 @@ class RepoSync(object):
 
         with cfg_component('server.susemanager') as CFG:
             mount_point = CFG.MOUNT_POINT
+        compatible = []
         for pack in packages:
             if pack.arch not in self.arches:
                 # skip packages with incompatible architecture
@@ -1020,10 +1045,9 @@ class RepoSync(object):
                 epoch = "%s:" % pack.epoch
             ident = "%s-%s%s-%s.%s" % (pack.name, epoch, pack.version, pack.release, pack.arch)
             self.available_packages[ident] = 1
+            compatible.append(pack)
 
-            packs = rhnPackage.get_info_for_package(
-                [pack.name, pack.version, pack.release, pack.epoch, pack.arch],
-                channel_id, self.org_id)
+        for pack, packs in zip(compatible, self._lookup_db_packages(compatible, channel_id)):
             db_pack = None
             for p in packs:
                 if p['checksum'] == pack.checksum:
@@ -1078,7 +1102,8 @@ class RepoSync(object):
 
         downloader = ThreadedDownloader()
         to_download_count = 0
-        for what in to_process:
+        staged = {}
+        for index, what in enumerate(to_process):
             pack, to_download, to_link = what
             if to_download:
                 target_file = os.path.join(plug.repo.pkgdir, pack.checksum, os.path.basename(pack.unique_id.relativepath))
@@ -1089,33 +1114,18 @@ class RepoSync(object):
                 plug.set_download_parameters(params, pack.unique_id.relativepath, target_file,
                                              checksum_type=checksum_type, checksum_value=checksum)
                 downloader.add(params)
+                staged[target_file] = index
                 to_download_count += 1
         if num_to_process != 0:
             log(0, "    New packages to download:     %5d" % to_download_count)
-            log2(0, 0, "  Downloading packages:")
+            log2(0, 0, "  Downloading and importing packages:")
         logger = TextLogger(None, to_download_count)
         downloader.set_log_obj(logger)
-        downloader.run()
 
         log2background(0, "Importing packages started.")
-        log(0, '')
-        log(0, '  Importing packages to DB:')
-
-        twisted_batch_indexes = self.twisted_batch_indexes(len(to_process), self.import_batch_size)
-        to_process_batches = [[to_process[twisted_index] for twisted_index in twisted_batch] for twisted_batch in twisted_batch_indexes]
-
-        affected_channels = []
-        with multiprocessing.Pool(processes=min(os.cpu_count() * 2, 32), maxtasksperchild=1) as pool:
-            results = [pool.apply_async(self.import_package_batch, args=[to_process_batch, to_disassociate, is_non_local_repo, i, len(to_process_batches)])
-                       for i, to_process_batch in enumerate(to_process_batches)]
-
-            for i, result in enumerate(results):
-                affected_channels_batch, failed_packages_batch, all_packages, processed_batch = result.get()
-                affected_channels += affected_channels_batch
-                failed_packages += failed_packages_batch
-                self.all_packages.update(all_packages)
-                for j, processed in enumerate(processed_batch):
-                    to_process[twisted_batch_indexes[i][j]] = processed
+        affected_channels, failed_packages_batch = self.download_and_import(downloader, to_process, staged,
+                                                                            to_disassociate, is_non_local_repo)
+        failed_packages += failed_packages_batch
 
         if affected_channels:
             errataCache.schedule_errata_cache_update(affected_channels)
@@ -1149,48 +1159,95 @@ class RepoSync(object):
         self._normalize_orphan_vendor_packages()
         return failed_packages
 
-    def twisted_batch_indexes(self, total_size, batch_size):
-        """Assume a list of total_size elements, and consider the following two possible divisions of its elements: per "batch" or per "chunk".
-        Batches are contiguous sub-lists of the original list with batch_size elements each (and there's batch_count=total_size/batch_size of them).
-        Example with total_size = 12 and batch_size = 3, thus batch_count = 4:
-
-        List:    [ 0,   1,   2,   3,   4,   5,   6,   7,   8,   9,  10,  11 ]
-        Batches: [[0,   1,   2], [3,   4,   5], [6,   7,   8], [9,  10,  11]]
-
-        Chunks are contiguous sub-lists as well, but have batch_count instead of batch_size elements each. Example:
-
-        Chunks:  [[0,   1,   2,   3], [4,   5,   6,   7], [8,   9,  10,  11]]
-
-        This function returns sub-lists of the same size of batches, each with elements sampled from every chunk. Example:
+    def download_and_import(self, downloader, to_process, staged, to_disassociate, is_non_local_repo):
+        """Import downloaded packages in batches while the download is still running.
 
-        Twisted: [[0,   4,   8], [1,   5,   9], [2,   6,  10], [3,   7,  11]]
-
-        Intuitively, this rearranges elements across batches so that each batch contains a "sample" of elements from "all over" the original list -
-        in particular, from every chunk.
+        Finished downloads reach the import workers through a bounded queue, so
+        the download threads stall as soon as the import falls behind and only a
+        few batches of packages are ever kept in the staging directory.
+        staged maps the target file of every queued download to its index in
+        to_process.
         """
-        # integer division rounded up
-        batch_count = (total_size + batch_size - 1) // batch_size
-
-        # compute element indexes in all batches
-        batches = [[batch_size * batch_index + element_index for element_index in range(0, batch_size)] for batch_index
-                   in range(0, batch_count)]
+        if not staged:
+            return [], 0
+        workers = min(os.cpu_count() * 2, 32)
+        batch_size = self.import_batch_size
+        batch_count = (len(staged) + batch_size - 1) // batch_size
+        downloaded = queue.Queue(maxsize=batch_size * 2)
+        finished = object()
+        download_errors = []
+
+        def download():
+            # pylint: disable=W0703
+            try:
+                downloader.run()
+            except Exception as e:
+                download_errors.append(e)
+            finally:
+                downloaded.put(finished)
 
-        # twist elements across batches. Specifically: the n-th element in a batch has to be picked from the n-th chunk
-        twisted_batches = [[self.twisted_index(batches[i][j], batch_count, batch_size) for j in range(0, batch_size)] for i in
-                           range(0, batch_count)]
+        downloader.set_callback(lambda params, _success: downloaded.put(staged[params['target_file']]))
 
-        # discard elements greater than total_size (those were created because we rounded up earlier)
-        return [[twisted_batches[i][j] for j in range(0, batch_size) if twisted_batches[i][j] < total_size] for i in
-                  range(0, batch_count)]
+        affected_channels = []
+        failed_packages = 0
+        pending = deque()
+        submitted = 0
+
+        def collect():
+            nonlocal failed_packages
+            indexes, result = pending.popleft()
+            affected_channels_batch, failed_packages_batch, all_packages, processed_batch = result.get()
+            affected_channels.extend(affected_channels_batch)
+            failed_packages += failed_packages_batch
+            self.all_packages.update(all_packages)
+            for index, processed in zip(indexes, processed_batch):
+                to_process[index] = processed
+
+        def submit(indexes):
+            nonlocal submitted
+            # at most one batch per worker is in flight, the rest waits in the download queue
+            if len(pending) >= workers:
+                collect()
+            pending.append((indexes, pool.apply_async(
+                self.import_package_batch,
+                args=[[to_process[i] for i in indexes], to_disassociate, is_non_local_repo,
+                      submitted, max(batch_count, submitted + 1)])))
+            submitted += 1
+
+        # the workers are forked before the download threads are started and
+        # keep their database connection until all the batches are imported
+        with multiprocessing.Pool(processes=workers, initializer=init_import_worker) as pool:
+            download_thread = Thread(target=download, daemon=True)
+            download_thread.start()
+            try:
+                imported = set()
+                batch = []
+                while True:
+                    index = downloaded.get()
+                    if index is finished:
+                        break
+                    imported.add(index)
+                    batch.append(index)
+                    if len(batch) == batch_size:
+                        submit(batch)
+                        batch = []
+                # packages the downloader never picked up are imported as well, so they get reported as failed
+                batch.extend(index for index in sorted(staged.values()) if index not in imported)
+                for i in range(0, len(batch), batch_size):
+                    submit(batch[i:i + batch_size])
+                while pending:
+                    collect()
+            except BaseException as e:
+                downloader.fail_download(e)
+                raise
+        download_thread.join()
 
-    def twisted_index(self, i, batch_count, batch_size):
-        batch_index = i // batch_size
-        element_index = i % batch_size
-        return batch_count * element_index + batch_index
+        if download_errors:
+            raise download_errors[0]
+        return affected_channels, failed_packages
 
     def import_package_batch(self, to_process, to_disassociate, is_non_local_repo, batch_index, batch_count):
         # Prepare SQL statements
-        rhnSQL.closeDB(committing=False, closing=False)
         rhnSQL.initDB()
         h_delete_package_queue = rhnSQL.prepare("""delete from rhnPackageFileDeleteQueue where path = :path""")
         backend = SQLBackend()
@@ -1332,7 +1389,7 @@ class RepoSync(object):
                                     raise exc
             pack.clear_header()
 
-        rhnSQL.closeDB()
+        rhnSQL.commit()
         log(0, "  Package batch #{} of {} completed...".format(batch_index + 1, batch_count))
         return affected_channels, failed_packages, all_packages, to_process
 
@@ -1366,11 +1423,7 @@ class RepoSync(object):
         with cfg_component('server.susemanager') as CFG:
             mount_point = CFG.MOUNT_POINT
 
-        for pack in packages:
-
-            packs = rhnPackage.get_info_for_package(
-                [pack.name, pack.version, pack.release, pack.epoch, pack.arch],
-                channel_id, self.org_id)
+        for pack, packs in zip(packages, self._lookup_db_packages(packages, channel_id)):
             db_pack = None
             for p in packs:
                 if p['checksum'] == pack.checksum:
@@ -1401,6 +1454,15 @@ class RepoSync(object):
 
             log(0, "    " + pack_status + pack_full_name + pack_size + pack_hash_info)
 
+    def _lookup_db_packages(self, packages, channel_id):
+        """Return the DB packages matching the NEVRA of every package, in the same order"""
+        start_time = datetime.now()
+        db_packages = rhnPackage.get_info_for_packages(
+            [[pack.name, pack.version, pack.release, pack.epoch, pack.arch] for pack in packages],
+            channel_id, self.org_id)
+        log(0, "    Looked up packages in DB in %.2fs" % (datetime.now() - start_time).total_seconds())
+        return db_packages
+
     def _normalize_orphan_vendor_packages(self):
         # Sometimes reposync disassociates vendor packages (org_id = 0) from
         # channels.
@@ -0,0 +1,102 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Time decompressing and parsing a Debian Packages index stored plain, with
+# gzip and with xz, and report the peak memory used by the parser.
+# Without an index file a synthetic one is generated.
+#
+# Usage: benchmark_deb_packages.py [number of packages | Packages file]
+#
+
+import gzip
+import lzma
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from uyuni.common import fileutils
+from spacewalk.satellite_tools.repo_plugins.deb_src import DebRepo
+
+STANZA = """Package: package%(i)d
+Architecture: amd64
+Version: 1:%(i)d.0-1ubuntu%(i)d
+Priority: optional
+Section: libs
+Maintainer: Ubuntu Developers <ubuntu-devel-discuss@lists.ubuntu.com>
+Installed-Size: %(i)d
+Depends: libc6 (>= 2.14), libpackage%(i)d-common
+Filename: pool/main/p/package%(i)d/package%(i)d_%(i)d.0-1ubuntu%(i)d_amd64.deb
+Size: %(i)d
+MD5sum: %(md5)s
+SHA1: %(sha1)s
+SHA256: %(sha256)s
+Description: synthetic package %(i)d
+ This is a long description of the synthetic package, it is spread
+ over several continuation lines like the real ones.
+
+"""
+
+
+def write_synthetic(filename, count):
+    with open(filename, 'w') as index:
+        for i in range(count):
+            index.write(STANZA % {'i': i, 'md5': '%032x' % i, 'sha1': '%040x' % i, 'sha256': '%064x' % i})
+
+
+def main():
+    count = 50000
+    workdir = tempfile.mkdtemp()
+    try:
+        plain = os.path.join(workdir, 'Packages')
+        if len(sys.argv) > 1 and os.path.isfile(sys.argv[1]):
+            shutil.copyfile(sys.argv[1], plain)
+        else:
+            if len(sys.argv) > 1:
+                count = int(sys.argv[1])
+            write_synthetic(plain, count)
+
+        with open(plain, 'rb') as src, gzip.open(plain + '.gz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+        with open(plain, 'rb') as src, lzma.open(plain + '.xz', 'wb') as dst:
+            shutil.copyfileobj(src, dst)
+
+        for filename in (plain, plain + '.gz', plain + '.xz'):
+            start = time.time()
+            with fileutils.decompress_open(filename) as stream:
+                while stream.read(1024 * 1024):
+                    pass
+            decompress = time.time() - start
+
+            start = time.time()
+            with fileutils.decompress_open(filename) as stream:
+                packages = sum(1 for _ in DebRepo.parse_packages_index(stream))
+            parse = time.time() - start
+
+            tracemalloc.start()
+            with fileutils.decompress_open(filename) as stream:
+                for _ in DebRepo.parse_packages_index(stream):
+                    pass
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            print("%-12s %6.1f MiB: decompress %.2fs, parse %d packages %.2fs, parser peak %.1f MiB" % (
+                os.path.basename(filename), os.path.getsize(filename) / 1048576.0, decompress,
+                packages, parse, peak / 1048576.0))
+    finally:
+        shutil.rmtree(workdir)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Time the repo plugin include/exclude filters on a synthetic package list.
+# With --legacy the former list based implementation is timed as well; it
+# is quadratic, so keep the package count low in that case.
+#
+# Usage: benchmark_filter_packages.py [number of packages] [--legacy]
+#
+
+import fnmatch
+import re
+import sys
+import time
+from collections import namedtuple
+
+from spacewalk.satellite_tools.repo_plugins import PackageFilter
+
+Package = namedtuple('Package', ['name', 'version'])
+
+FILTERS = [('+', ['lib*']), ('+', ['python3-*']), ('-', ['*-devel']), ('-', ['*-debug*']),
+           ('+', ['kernel-*']), ('-', ['*-32bit']), ('+', ['libzypp-devel'])]
+
+
+def synthetic_packages(count):
+    prefixes = ['lib', 'python3-', 'kernel-', 'perl-', 'golang-', 'texlive-', '']
+    suffixes = ['', '-devel', '-debuginfo', '-32bit', '-doc', '-lang']
+    packages = []
+    for i in range(count):
+        name = "%spkg%d%s" % (prefixes[i % len(prefixes)], i // 10, suffixes[i % len(suffixes)])
+        packages.append(Package(name, str(i % 10)))
+    return packages
+
+
+def legacy_filter(packages, filters):
+    selected = []
+    excluded = []
+    allmatched_include = []
+    allmatched_exclude = []
+    if filters[0][0] == '-':
+        selected = packages
+    else:
+        excluded = packages
+
+    for sense, pkg_list in filters:
+        reobj = re.compile(fnmatch.translate(pkg_list[0]))
+        if sense == '+':
+            for excluded_pkg in excluded:
+                if reobj.match(excluded_pkg.name):
+                    allmatched_include.insert(0, excluded_pkg)
+                    selected.insert(0, excluded_pkg)
+            for pkg in allmatched_include:
+                if pkg in excluded:
+                    excluded.remove(pkg)
+        else:
+            for selected_pkg in selected:
+                if reobj.match(selected_pkg.name):
+                    allmatched_exclude.insert(0, selected_pkg)
+                    excluded.insert(0, selected_pkg)
+            for pkg in allmatched_exclude:
+                if pkg in selected:
+                    selected.remove(pkg)
+            excluded = (excluded + allmatched_exclude)
+    return selected
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main():
+    count = 100000
+    args = [arg for arg in sys.argv[1:] if arg != '--legacy']
+    if args:
+        count = int(args[0])
+    packages = synthetic_packages(count)
+
+    selected, elapsed = timed(lambda: PackageFilter(FILTERS).filter(packages))
+    print("PackageFilter: %d of %d packages selected in %.3fs" % (len(selected), count, elapsed))
+
+    if '--legacy' in sys.argv:
+        legacy, legacy_elapsed = timed(legacy_filter, list(packages), FILTERS)
+        print("legacy filter: %d of %d packages selected in %.3fs" % (len(legacy), count, legacy_elapsed))
+        if set(legacy) != set(selected):
+            print("results differ")
+            return 1
+        if elapsed:
+            print("speedup: %.1fx" % (legacy_elapsed / elapsed))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,53 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import io
+
+from spacewalk.satellite_tools.repo_plugins.deb_src import DebRepo
+
+PACKAGES = """Package: libsample1
+Architecture: amd64
+Version: 1:2.4.1-3ubuntu1
+Description: sample library
+ with a continuation line
+Filename: pool/main/libs/libsample1_2.4.1-3ubuntu1_amd64.deb
+MD5sum: 0123456789abcdef0123456789abcdef
+SHA1: 0123456789abcdef0123456789abcdef01234567
+SHA256: 0123456789abcdef0123456789abcdef0123456789abcdef0123456789abcdef
+
+Package: incomplete
+Architecture: all
+Version: 1.0
+
+Package: sample-doc
+Architecture: all
+Version: 0.9
+Filename: pool/main/s/sample-doc_0.9_all.deb
+MD5sum: fedcba9876543210fedcba9876543210
+"""
+
+
+def test_parse_packages_index():
+    packages = list(DebRepo.parse_packages_index(io.StringIO(PACKAGES)))
+
+    assert [(p.name, p.epoch, p.version, p.release, p.arch, p.relativepath, p.checksum_type)
+            for p in packages] == [
+        ("libsample1", "1", "2.4.1", "3ubuntu1", "amd64-deb",
+         "pool/main/libs/libsample1_2.4.1-3ubuntu1_amd64.deb", "sha256"),
+        ("sample-doc", "", "0.9", "X", "all-deb", "pool/main/s/sample-doc_0.9_all.deb", "md5"),
+    ]
+    assert packages[1].checksum == "fedcba9876543210fedcba9876543210"
+
+
+def test_parse_packages_index_without_trailing_newline():
+    packages = list(DebRepo.parse_packages_index(io.StringIO(PACKAGES.rstrip("\n"))))
+
+    assert [p.name for p in packages] == ["libsample1", "sample-doc"]
@@ -9,6 +9,9 @@
 # along with this software; if not, see
 # http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
 
+import threading
+import time
+
 from mock import Mock, patch
 
 from spacewalk.satellite_tools.download import ThreadedDownloader, pycurl
@@ -37,6 +40,7 @@ def test_reposync_timeout_minrate_are_passed_to_curl():
     CFG.REPOSYNC_DOWNLOAD_THREADS = 42 # Throws ValueError if not defined
 
     curl_spy = Mock()
+    curl_spy.getinfo.return_value = 1024
 
     with patch(
         "spacewalk.satellite_tools.download.pycurl.Curl", Mock(return_value=curl_spy)
@@ -48,3 +52,93 @@ def test_reposync_timeout_minrate_are_passed_to_curl():
 
         curl_spy.setopt.assert_any_call(pycurl.LOW_SPEED_LIMIT, 42)
         curl_spy.setopt.assert_any_call(pycurl.LOW_SPEED_TIME, 42)
+
+
+@patch("uyuni.common.context_managers.initCFG", Mock())
+@patch("spacewalk.satellite_tools.download.log", Mock())  # no logging
+@patch("urlgrabber.grabber.PyCurlFileObject._do_grab", Mock())  # no downloads
+@patch("urlgrabber.grabber.PyCurlFileObject.close", Mock())  # no need to close files
+@patch("spacewalk.satellite_tools.download.os.path.isfile", Mock(return_value=False))
+@patch("spacewalk.satellite_tools.download.ThreadedDownloader._validate", Mock(return_value=True))
+def test_queues_share_connections_and_count_per_host():
+    CFG = Mock()
+    CFG.REPOSYNC_TIMEOUT = 42
+    CFG.REPOSYNC_MINRATE = 42
+    CFG.REPOSYNC_DOWNLOAD_THREADS = 2
+
+    curl_spy = Mock()
+    curl_spy.getinfo.return_value = 1024
+    finished = []
+
+    with patch(
+        "spacewalk.satellite_tools.download.pycurl.Curl", Mock(return_value=curl_spy)
+    ), patch("uyuni.common.context_managers.CFG", CFG):
+
+        td = ThreadedDownloader(force=True)
+        td.set_callback(lambda params, success: finished.append((params["relative_path"], success)))
+        for i, (url, ssl_ca_cert) in enumerate([("http://one.example.com/", None),
+                                                ("http://two.example.com/", None),
+                                                ("http://one.example.com/", "/ca.pem")]):
+            params = NoKeyErrorsDict({"http_headers": dict(), "urls": [url],
+                                      "relative_path": "file%d" % i, "ssl_ca_cert": ssl_ca_cert})
+            td.add(params)
+        assert len(td.queues) == 2
+        td.run()
+
+        curl_spy.setopt.assert_any_call(pycurl.SHARE, td.share)
+        assert sorted(finished) == [("file0", True), ("file1", True), ("file2", True)]
+        assert {host: stats[:2] for host, stats in td.stats.hosts.items()} == {
+            "one.example.com": (2, 2048),
+            "two.example.com": (1, 1024),
+        }
+
+
+@patch("uyuni.common.context_managers.initCFG", Mock())
+@patch("spacewalk.satellite_tools.download.log", Mock())  # no logging
+@patch("urlgrabber.grabber.PyCurlFileObject.close", Mock())  # no need to close files
+@patch("spacewalk.satellite_tools.download.os.path.isfile", Mock(return_value=False))
+@patch("spacewalk.satellite_tools.download.ThreadedDownloader._validate", Mock(return_value=True))
+def test_queues_share_the_threads_and_the_first_transfer_runs_alone():
+    CFG = Mock()
+    CFG.REPOSYNC_TIMEOUT = 42
+    CFG.REPOSYNC_MINRATE = 42
+    CFG.REPOSYNC_DOWNLOAD_THREADS = 2
+
+    curl_spy = Mock()
+    curl_spy.getinfo.return_value = 1024
+    lock = threading.Lock()
+    running = []
+    concurrency = []
+    threads = set()
+
+    def perform(_self):
+        with lock:
+            running.append(1)
+            concurrency.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.pop()
+
+    def finished(_params, success):
+        assert success
+        threads.add(threading.current_thread())
+
+    with patch(
+        "spacewalk.satellite_tools.download.pycurl.Curl", Mock(return_value=curl_spy)
+    ), patch("uyuni.common.context_managers.CFG", CFG), \
+            patch("urlgrabber.grabber.PyCurlFileObject._do_grab", lambda self: self._do_perform()), \
+            patch("urlgrabber.grabber.PyCurlFileObject._do_perform", perform):
+
+        td = ThreadedDownloader(force=True)
+        td.set_callback(finished)
+        for i in range(6):
+            params = NoKeyErrorsDict({"http_headers": dict(), "urls": ["http://example.com/"],
+                                      "relative_path": "file%d" % i, "ssl_ca_cert": "/ca%d.pem" % (i % 3)})
+            td.add(params)
+        assert len(td.queues) == 3
+        td.run()
+
+    assert len(concurrency) == 6
+    assert concurrency[0] == 1
+    assert max(concurrency) == 2
+    assert len(threads) == 2
@@ -0,0 +1,231 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2024 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+
+import errno
+import os
+
+import pytest
+from mock import Mock, patch
+
+from spacewalk.satellite_tools.disk_dumper import iss
+
+
+def _enotsup(*args):
+    raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+
+def _exdev(*args):
+    raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "src.rpm"
+    path.write_bytes(b"rpm" * 100000)
+    return path
+
+
+def test_copy_file_clones_the_data(src, tmp_path):
+    dst = tmp_path / "dst.rpm"
+    ioctl = Mock()
+    with patch.object(iss.fcntl, "ioctl", ioctl), \
+         patch.object(iss.os, "copy_file_range", Mock(), create=True) as copy_file_range:
+        iss.copy_file(str(src), str(dst))
+
+    assert ioctl.call_args[0][1] == iss.FICLONE
+    copy_file_range.assert_not_called()
+
+
+@pytest.mark.skipif(not hasattr(os, "copy_file_range"), reason="no copy_file_range()")
+def test_copy_file_falls_back_to_copy_file_range(src, tmp_path):
+    dst = tmp_path / "dst.rpm"
+    with patch.object(iss.fcntl, "ioctl", _enotsup), \
+         patch.object(iss.shutil, "copyfileobj", Mock()) as copyfileobj:
+        iss.copy_file(str(src), str(dst))
+
+    copyfileobj.assert_not_called()
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_copy_file_falls_back_to_a_plain_copy(src, tmp_path):
+    dst = tmp_path / "dst.rpm"
+    with patch.object(iss.fcntl, "ioctl", _enotsup), \
+         patch.object(iss.os, "copy_file_range", _exdev, create=True):
+        iss.copy_file(str(src), str(dst))
+
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_copy_file_plain_copy_discards_a_partial_copy(src, tmp_path):
+    dst = tmp_path / "dst.rpm"
+    calls = []
+
+    def copy_file_range(fd_in, fd_out, count):
+        if calls:
+            raise OSError(errno.EXDEV, os.strerror(errno.EXDEV))
+        calls.append(count)
+        return os.write(fd_out, os.read(fd_in, 1000))
+
+    with patch.object(iss.fcntl, "ioctl", _enotsup), \
+         patch.object(iss.os, "copy_file_range", copy_file_range, create=True):
+        iss.copy_file(str(src), str(dst))
+
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_copy_file_raises_unexpected_errors(src, tmp_path):
+    def ioctl(*args):
+        raise OSError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    with patch.object(iss.fcntl, "ioctl", ioctl):
+        with pytest.raises(OSError) as excinfo:
+            iss.copy_file(str(src), str(tmp_path / "dst.rpm"))
+    assert excinfo.value.errno == errno.ENOSPC
+
+
+class FakeDumper:
+    """Stands in for the Dumper in _dump_files, dump_shard encodes the shard in the file names"""
+
+    def __init__(self, workers, fail_on=None, error=iss.ISSError("boom", "")):
+        self.workers = workers
+        self.fail_on = fail_on
+        self.error = error
+
+    def dump_shard(self, dump_name, file_name, prefix, id_key, shard):
+        if self.fail_on in [info[id_key] for info in shard]:
+            raise self.error
+        return ["%s%s-%s-of-%d" % (prefix, info[id_key], os.getpid(), len(shard)) for info in shard]
+
+
+def _dump_files(dumper, count):
+    items = [{"id": i} for i in range(count)]
+    return list(iss.Dumper._dump_files(dumper, items, "dump_errata", "getErratumFile", "rhn-erratum-", "id"))
+
+
+@patch.object(iss, "_init_export_worker", Mock())
+@patch.object(iss, "EXPORT_SHARD_SIZE", 5)
+def test_dump_files_splits_the_items_in_shards():
+    dumped = _dump_files(FakeDumper(workers=2), 12)
+
+    assert [info["id"] for info, _ in dumped] == list(range(12))
+    assert [filename.split("-of-")[1] for _, filename in dumped] == ["5"] * 10 + ["2"] * 2
+    assert all(filename.startswith("rhn-erratum-%d-" % info["id"]) for info, filename in dumped)
+    # the shards were dumped by the worker processes
+    assert str(os.getpid()) not in {filename.split("-")[3] for _, filename in dumped}
+
+
+@patch.object(iss, "_init_export_worker", Mock())
+@patch.object(iss, "EXPORT_SHARD_SIZE", 5)
+def test_dump_files_dumps_small_exports_in_process():
+    dumped = _dump_files(FakeDumper(workers=2), 5)
+
+    assert [filename for _, filename in dumped] == \
+        ["rhn-erratum-%d-%d-of-1" % (i, os.getpid()) for i in range(5)]
+
+
+@patch.object(iss, "_init_export_worker", Mock())
+@patch.object(iss, "EXPORT_SHARD_SIZE", 5)
+def test_dump_files_single_worker_dumps_in_process():
+    dumped = _dump_files(FakeDumper(workers=1), 12)
+
+    assert {filename.split("-")[3] for _, filename in dumped} == {str(os.getpid())}
+
+
+@patch.object(iss, "_init_export_worker", Mock())
+@patch.object(iss, "EXPORT_SHARD_SIZE", 5)
+def test_dump_files_passes_worker_iss_errors_on():
+    with pytest.raises(iss.ISSError) as excinfo:
+        _dump_files(FakeDumper(workers=2, fail_on=13), 20)
+    assert excinfo.value.msg == "boom"
+    assert iss._worker_dumper is None
+
+
+@patch.object(iss, "_init_export_worker", Mock())
+@patch.object(iss, "Traceback", Mock())
+@patch.object(iss, "EXPORT_SHARD_SIZE", 5)
+def test_dump_files_wraps_worker_errors():
+    with pytest.raises(iss.ISSError) as excinfo:
+        _dump_files(FakeDumper(workers=2, fail_on=7, error=KeyError("id")), 20)
+    assert excinfo.value.msg == "KeyError caught in dump_errata."
+
+
+def _rpm_dumper(tmp_path, workers=2, hardlinks=False):
+    dumper = iss.Dumper.__new__(iss.Dumper)
+    dumper.mp = str(tmp_path / "export")
+    dumper.hardlinks = hardlinks
+    dumper.workers = workers
+    dumper._pb_lock = iss.threading.Lock()
+    dumper.pb_label = dumper.pb_complete = dumper.pb_char = ""
+    dumper.pb_length = 10
+    return dumper
+
+
+@pytest.fixture
+def satellite(tmp_path):
+    mount_point = tmp_path / "satellite"
+    for i in range(4):
+        path = mount_point / "packages" / ("pkg-%d.rpm" % i)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"rpm %d" % i)
+    with patch.object(iss, "CFG", Mock(MOUNT_POINT=str(mount_point))):
+        yield mount_point
+
+
+@patch.object(iss, "progress_bar", Mock())
+@patch.object(iss, "log2stdout", Mock())
+@patch.object(iss, "log2email", Mock())
+def test_dump_rpms_exports_the_packages(satellite, tmp_path):
+    dumper = _rpm_dumper(tmp_path)
+    dumper.brpms = [{"id": i, "path": "packages/pkg-%d.rpm" % i} for i in range(4)]
+
+    dumper.dump_rpms()
+
+    for rpm in dumper.brpms:
+        path = iss.diskImportLib.rpmsPath("rhn-package-%s" % rpm["id"], dumper.mp)
+        with open(path, "rb") as f:
+            assert f.read() == b"rpm %d" % rpm["id"]
+        assert not [name for name in os.listdir(os.path.dirname(path)) if name.endswith(".tmp")]
+
+
+@patch.object(iss, "progress_bar", Mock())
+@patch.object(iss, "log2stdout", Mock())
+@patch.object(iss, "log2email", Mock())
+def test_dump_rpms_passes_worker_errors_on(satellite, tmp_path):
+    dumper = _rpm_dumper(tmp_path)
+    dumper.brpms = [{"id": i, "path": "packages/pkg-%d.rpm" % i} for i in range(4)]
+    dumper.brpms[2]["path"] = None
+
+    with pytest.raises(iss.ISSError) as excinfo:
+        dumper.dump_rpms()
+    assert "Package id: 2" in excinfo.value.msg
+
+
+@patch.object(iss, "Traceback", Mock())
+def test_export_rpm_removes_the_partial_copy(satellite, tmp_path):
+    dumper = _rpm_dumper(tmp_path)
+    rpm = {"id": 1, "path": "packages/pkg-1.rpm"}
+    path = iss.diskImportLib.rpmsPath("rhn-package-1", dumper.mp)
+
+    def copy_file(src, dst):
+        with open(dst, "wb") as f:
+            f.write(b"rp")
+        raise IOError(errno.ENOSPC, os.strerror(errno.ENOSPC))
+
+    with patch.object(iss, "copy_file", copy_file):
+        with pytest.raises(iss.ISSError) as excinfo:
+            dumper._export_rpm(rpm)
+    assert excinfo.value.msg.startswith("Error: Error copying file")
+    assert os.listdir(os.path.dirname(path)) == []
+
+    # the next run copies the package
+    assert dumper._export_rpm(rpm) is rpm
+    with open(path, "rb") as f:
+        assert f.read() == b"rpm 1"
@@ -540,6 +540,57 @@ class RepoSyncTest(unittest.TestCase):
         ipack = rs.associate_package(pack)
         self.assertEqual(ipack, refpack)
 
+    def test_download_and_import(self):
+        class SyncPool:
+            def __init__(self, processes, initializer=None):
+                pass
+
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                pass
+
+            @staticmethod
+            def apply_async(func, args):
+                return Mock(get=Mock(return_value=func(*args)))
+
+        class Downloader:
+            def __init__(self, target_files):
+                self.target_files = target_files
+                self.callback = None
+
+            def set_callback(self, callback):
+                self.callback = callback
+
+            def run(self):
+                # the last file is never reported, e.g. because of a bad SSL setup
+                for target_file in self.target_files[:-1]:
+                    self.callback({'target_file': target_file}, True)
+
+        def import_package_batch(to_process, to_disassociate, is_non_local_repo, batch_index, batch_count):
+            return (['channel%d' % batch_index], 0, set((pack, ) for pack, _, _ in to_process),
+                    [(pack, True, False) for pack, _, _ in to_process])
+
+        with patch.object(self.reposync.os, 'cpu_count', Mock(return_value=1)), \
+                patch.object(self.reposync.multiprocessing, 'Pool', SyncPool):
+            rs = self._create_mocked_reposync()
+            rs.import_batch_size = 2
+            rs.import_package_batch = Mock(side_effect=import_package_batch)
+
+            to_process = [('pack%d' % i, True, True) for i in range(5)]
+            staged = dict(('file%d' % i, i) for i in range(5))
+            affected_channels, failed_packages = rs.download_and_import(
+                Downloader(sorted(staged)), to_process, staged, {}, True)
+
+            self.assertEqual(affected_channels, ['channel0', 'channel1', 'channel2'])
+            self.assertEqual(failed_packages, 0)
+            self.assertEqual(to_process, [('pack%d' % i, True, False) for i in range(5)])
+            self.assertEqual([c[0][0] for c in rs.import_package_batch.call_args_list],
+                             [[('pack0', True, True), ('pack1', True, True)],
+                              [('pack2', True, True), ('pack3', True, True)],
+                              [('pack4', True, True)]])
+
     def test_get_errata_no_advisories_found(self):
         rs = self._create_mocked_reposync()
         _mock_rhnsql(self.reposync, None)
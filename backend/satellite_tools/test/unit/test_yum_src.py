@@ -210,3 +210,22 @@ class YumSrcTest(unittest.TestCase):
                 "http://host2/base/arch1/os/",
                 "http://host3/base/arch1/os/",
             ])
+
+    def test_filter_packages(self):
+        Package = namedtuple('Package', ['name'])
+        packages = [Package(name) for name in ['kernel-default', 'kernel-devel', 'vim', 'vim-data', 'zsh']]
+
+        def names(filters, exclude_only=False):
+            return [p.name for p in yum_src.ContentSource._filter_packages(packages, filters, exclude_only)]
+
+        # starting with an include, everything else is excluded
+        self.assertEqual(names([('+', ['kernel*'])]), ['kernel-default', 'kernel-devel'])
+        # starting with an exclude, everything else is included
+        self.assertEqual(names([('-', ['kernel*'])]), ['vim', 'vim-data', 'zsh'])
+        # the last matching filter wins and all patterns of a filter are used
+        self.assertEqual(names([('+', ['kernel*', 'vim*']), ('-', ['*-d*']), ('+', ['kernel-devel'])]),
+                         ['kernel-devel', 'vim'])
+        # includes are ignored in exclude only mode
+        self.assertEqual(names([('+', ['kernel*']), ('-', ['vim*'])], exclude_only=True),
+                         ['kernel-default', 'kernel-devel', 'zsh'])
+        self.assertRaises(IOError, names, [('?', ['vim'])])
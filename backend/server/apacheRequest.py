@@ -19,6 +19,8 @@
 import os
 import sys
 import base64
+import uuid
+import zlib
 try:
     #  python 2
     import xmlrpclib
@@ -245,30 +247,35 @@ class apacheRequest:
                 rhnFlags.get("outputTransportOptions")['Last-Modified'] == self.req.headers_in['If-Modified-Since']):
             return apache.HTTP_NOT_MODIFIED
 
-        # Serve up the requested byte range
+        # Serve up the requested byte ranges
+        byteranges = None
         if "Range" in self.req.headers_in:
             try:
-                range_start, range_end = \
-                    byterange.parse_byteranges(self.req.headers_in["Range"],
-                                               file_size)
-                response_size = range_end - range_start
-                self.req.headers_out["Content-Range"] = \
-                    byterange.get_content_range(range_start, range_end, file_size)
-                self.req.headers_out["Accept-Ranges"] = "bytes"
-
-                response.file_obj.seek(range_start)
-
-                # We'll want to send back a partial content rather than ok
-                # if this works
-                self.req.status = apache.HTTP_PARTIAL_CONTENT
-                success_response = apache.HTTP_PARTIAL_CONTENT
-
+                byteranges = byterange.parse_multiple_byteranges(
+                    self.req.headers_in["Range"], file_size)
             # For now we will just return the file file on the following exceptions
             except byterange.InvalidByteRangeException:
                 pass
             except byterange.UnsatisfyableByteRangeException:
                 pass
 
+        parts = None
+        if byteranges:
+            self.req.headers_out["Accept-Ranges"] = "bytes"
+            # We'll want to send back a partial content rather than ok
+            self.req.status = apache.HTTP_PARTIAL_CONTENT
+            success_response = apache.HTTP_PARTIAL_CONTENT
+            if len(byteranges) == 1:
+                range_start, range_end = byteranges[0]
+                response_size = range_end - range_start
+                self.req.headers_out["Content-Range"] = \
+                    byterange.get_content_range(range_start, range_end, file_size)
+            else:
+                boundary = uuid.uuid4().hex
+                parts, response_size = byterange.multipart_byteranges(
+                    byteranges, file_size, self.req.content_type, boundary)
+                self.req.content_type = "multipart/byteranges; boundary=%s" % boundary
+
         self.req.headers_out["Content-Length"] = str(response_size)
 
         # if we loaded this from a real fd, set it as the X-Replace-Content
@@ -292,33 +299,17 @@ class apacheRequest:
         # send the headers
         self.req.send_http_header()
 
-        if "Range" in self.req.headers_in:
-            # and the file
-            read = 0
-            while read < response_size:
-                # We check the size here in case we're not asked for the entire file.
-                if (read + CFG.BUFFER_SIZE > response_size):
-                    to_read = read + CFG.BUFFER_SIZE - response_size
-                else:
-                    to_read = CFG.BUFFER_SIZE
-                buf = response.read(CFG.BUFFER_SIZE)
-                if not buf:
-                    break
-                try:
-                    self.req.write(buf)
-                    read = read + CFG.BUFFER_SIZE
-                except IOError:
-                    if xrepcon:
-                        # We're talking to a proxy, so don't bother to report
-                        # a SIGPIPE
-                        break
-                    return apache.HTTP_BAD_REQUEST
-            response.close()
+        if parts:
+            self.req.output = _multipart_chunks(response, parts, boundary)
         else:
+            range_start = byteranges and byteranges[0][0] or 0
+            body = byterange.FileRange(response.file_obj, range_start, response_size,
+                                       owner=response)
             if 'wsgi.file_wrapper' in self.req.headers_in:
-                self.req.output = self.req.headers_in['wsgi.file_wrapper'](response, CFG.BUFFER_SIZE)
+                # lets the WSGI server sendfile() real files
+                self.req.output = self.req.headers_in['wsgi.file_wrapper'](body, CFG.BUFFER_SIZE)
             else:
-                self.req.output = iter(lambda: response.read(CFG.BUFFER_SIZE), '')
+                self.req.output = iter(lambda: body.read(CFG.BUFFER_SIZE), b'')
 
         return success_response
 
@@ -363,6 +354,26 @@ class apacheRequest:
                 output.set_transport_flags(output.TRANSFER_BASE64,
                                            output.ENCODE_ZLIB)
 
+        # Responses stored compressed (see rhnChannel._list_packages) are
+        # sent as they are when the client takes zlib compressed data
+        precompressed = None
+        if rhnFlags.test("XMLRPC-Compressed-Response") and \
+                not isinstance(response, xmlrpclib.Fault):
+            if output.encoding == output.ENCODE_ZLIB and \
+                    output.transfer == output.TRANSFER_BINARY:
+                precompressed = response
+                output.set_transport_flags(output.TRANSFER_BINARY, output.ENCODE_NONE)
+            else:
+                response = zlib.decompress(response).decode()
+
+        # Compressing the whole body in memory before sending the first
+        # byte is avoided for clients able to receive it chunked
+        stream_compressed = (output.encoding == output.ENCODE_ZLIB and
+                             output.transfer == output.TRANSFER_BINARY and
+                             self.req.proto_num >= 1.1)
+        if stream_compressed:
+            output.set_transport_flags(output.TRANSFER_BINARY, output.ENCODE_NONE)
+
         # We simply add the transport options to the output headers
         output.headers.update(rhnFlags.get('outputTransportOptions').dict())
 
@@ -385,7 +396,18 @@ class apacheRequest:
                 return apache.HTTP_INTERNAL_SERVER_ERROR
 
         # we're about done here, patch up the headers
-        output.process(response)
+        if precompressed is not None:
+            output.process("")
+            output.set_header("Content-Encoding", output.encodings[output.ENCODE_ZLIB][0])
+            output.set_header("Content-Length", len(precompressed))
+            output.data = precompressed
+        elif stream_compressed:
+            # only the headers, the body is compressed while it is sent
+            output.process("")
+            output.clear_header("Content-Length")
+            output.set_header("Content-Encoding", output.encodings[output.ENCODE_ZLIB][0])
+        else:
+            output.process(response)
         # Copy the rest of the fields
         for k, v in list(output.headers.items()):
             if k.lower() == 'content-type':
@@ -402,10 +424,10 @@ class apacheRequest:
 
         # send the headers
         self.req.send_http_header()
+        if stream_compressed:
+            self.req.output = _compressed_chunks(response, CFG.BUFFER_SIZE)
+            return apache.OK
         try:
-            # XXX: in case data is really large maybe we should split
-            # it in smaller chunks instead of blasting everything at
-            # once. Not yet a problem...
             self.req.write(output.data)
         except IOError:
             # send_http_header is already sent, so it doesn't make a lot of
@@ -668,3 +690,34 @@ class GetHandler(apacheRequest):
         else:
             req.status = apache.HTTP_MOVED_PERMANENTLY
         return req.status
+
+
+def _multipart_chunks(response, parts, boundary):
+    """ Generate the multipart/byteranges body laid out by
+        byterange.multipart_byteranges, reading only the requested ranges.
+    """
+    try:
+        for header, start, end in parts:
+            yield header
+            body = byterange.FileRange(response.file_obj, start, end - start)
+            while True:
+                buf = body.read(CFG.BUFFER_SIZE)
+                if not buf:
+                    break
+                yield buf
+        yield byterange.multipart_trailer(boundary)
+    finally:
+        response.close()
+
+
+def _compressed_chunks(data, chunk_size):
+    """ Generate the zlib compressed data in pieces of chunk_size. """
+    if isinstance(data, str):
+        data = data.encode()
+    compressor = zlib.compressobj(transports.COMPRESS_LEVEL)
+    view = memoryview(data)
+    for offset in range(0, len(view), chunk_size):
+        buf = compressor.compress(view[offset:offset + chunk_size])
+        if buf:
+            yield buf
+    yield compressor.flush()
@@ -908,10 +908,17 @@ class Registration(rhnHandler):
             log_debug(1, self.server_id, "deleted: %d" % len(removed_packages))
         # Update the capabilities list
         rhnCapability.update_client_capabilities(self.server_id)
-        for package in added_packages or []:
-            server.add_package(package)
+        digest = packages.get('digest')
+        if digest is not None and digest != server.get_profile_digest():
+            # The changes are relative to a profile we do not have; ask the
+            # client for all its packages instead
+            log_debug(1, self.server_id, "package profile digest mismatch")
+            return 1
+        # Deleted first: a reinstalled package is both deleted and added
         for package in removed_packages or []:
             server.delete_package(package)
+        for package in added_packages or []:
+            server.add_package(package)
         server.save_packages()
         return 0
 
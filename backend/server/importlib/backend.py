@@ -32,7 +32,7 @@ from .importLib import Diff, Package, IncompletePackage, Erratum, \
     AlreadyUploadedError, InvalidPackageError, TransactionError, \
     SourcePackage
 from .backendLib import TableCollection, sanitizeValue, TableDelete, \
-    TableUpdate, TableLookup, addHash, TableInsert
+    TableUpdate, TableLookup, addHash, TableInsert, DBint, valuesTemplate
 
 sequences = {
     'rhnPackageCapability': 'rhn_pkg_capability_id_seq',
@@ -2126,14 +2126,6 @@ class Backend:
             # saving id
             hash[k] = h.fetchone_dict().popitem()[1]
 
-    def __buildQueries(self, childTables):
-        childTableLookups = {}
-        queryTempl = "select * from %s where %s = :id"
-        for childTableName in childTables:
-            childTableLookups[childTableName] = self.dbmodule.prepare(
-                queryTempl % (childTableName, childTables[childTableName]))
-        return childTableLookups
-
     def __processObjectCollection(self, objColl, parentTable, childTables=[],
                                   colname=None, **kwargs):
         # Returns the DML object that was processed
@@ -2208,8 +2200,6 @@ class Backend:
 
         # Lookup object
         lookup = TableLookup(parentTableObj, self.dbmodule)
-        # XXX
-        childTableLookups = self.__buildQueries(childTables)
         # For each valid object in the collection, look it up
         #   if it doesn't exist, insert all the associated information
         #   if it already exists:
@@ -2223,12 +2213,10 @@ class Backend:
         #       one if not explicitly specified). The "global" severity is the
         #       max of all severities.
         #   New objects will have a diff level of -1
-        for object in objColl:
-            if object.ignored:
-                # Skip it
-                continue
-            h = lookup.query(object)
-            row = h.fetchone_dict()
+        objects = [object for object in objColl if not object.ignored]
+        # Look up the whole collection at once
+        rows = lookup.queryMany(objects)
+        for object, row in zip(objects, rows):
             if not row:
                 # Object does not exist
                 id = self.sequences[parentTable].next()
@@ -2276,6 +2264,7 @@ class Backend:
             uploadedObjects[row['id']] = [object, row]
 
         # Deal with already-uploaded objects
+        toVerify = []
         for objid, (object, row) in list(uploadedObjects.items()):
             # Build the external value
             extObject = {'id': row['id']}
@@ -2292,9 +2281,14 @@ class Backend:
                     # Same object, or not different enough
                     # not enough karma either
                     continue
+            toVerify.append((objid, object, extObject, diffval))
 
+        # Grab the child tables information for all the objects at once
+        childTablesInfo = self.__getChildTablesInfo([objid for objid, _, _, _ in toVerify],
+                                                    childTables)
+        for objid, object, extObject, diffval in toVerify:
             localDML = self.__processUploaded(objid, object, childTables,
-                                              childTableLookups)
+                                              childTablesInfo[objid])
 
             if uploadForce < object.diff.level:
                 # Not enough karma
@@ -2321,7 +2315,7 @@ class Backend:
             raise TransactionError("Error uploading package source batch")
         return self.__doDML(dml)
 
-    def __processUploaded(self, objid, object, childTables, childTableLookups):
+    def __processUploaded(self, objid, object, childTables, childTablesInfo):
         # Store the DML operations locally
         localDML = {
             'insert': {},
@@ -2329,10 +2323,6 @@ class Backend:
             'delete': {},
         }
 
-        # Grab the rest of the information
-        childTablesInfo = self.__getChildTablesInfo(objid, list(childTables.keys()),
-                                                    childTableLookups)
-
         # Start computing deltas
         for childTableName in childTables:
             # Init the local hashes
@@ -2491,12 +2481,9 @@ class Backend:
     def __lookupObjectCollection(self, objColl, tableName, ignore_missing=0):
         # Looks the object up in tableName, and fills in its id
         lookup = TableLookup(self.tables[tableName], self.dbmodule)
-        for object in objColl:
-            if object.ignored:
-                # Skip it
-                continue
-            h = lookup.query(object)
-            row = h.fetchone_dict()
+        objects = [object for object in objColl if not object.ignored]
+        rows = lookup.queryMany(objects)
+        for object, row in zip(objects, rows):
             if not row:
                 if ignore_missing:
                     # Ignore the missing objects
@@ -2506,20 +2493,34 @@ class Backend:
                 raise InvalidPackageError(object, "Could not find object %s in table %s" % (object, tableName))
             object.id = row['id']
 
-    def __getChildTablesInfo(self, id, tables, queries):
-        # Returns a hash with the information about package id from tables
-        result = {}
-        for tname in tables:
+    def __getChildTablesInfo(self, ids, childTables):
+        # Returns a hash keyed on the object ids, with the information about
+        # each object from the child tables; one query per child table
+        result = dict((id, dict((tname, {}) for tname in childTables)) for id in ids)
+        if not ids:
+            return result
+        wanted = list(enumerate(ids))
+        template = valuesTemplate([DBint(), DBint()])
+        for tname, colname in list(childTables.items()):
             tableobj = self.tables[tname]
             fields = tableobj.getFields()
-            q = queries[tname]
-            q.execute(id=id)
-            hash = {}
-            while 1:
-                row = q.fetchone_dict()
-                if not row:
-                    break
-                pks = tableobj.getPK()
+            pks = tableobj.getPK()
+            sql = """
+                WITH wanted (ordering, id) AS (
+                  VALUES %%s
+                )
+                SELECT wanted.ordering, t.*
+                  FROM wanted
+                  JOIN %s t
+                    ON t.%s = wanted.id
+            """ % (tname, colname)
+            h = self.dbmodule.prepare(sql)
+            rows = h.execute_values(sql, wanted, template=template, page_size=len(wanted))
+            if not rows:
+                continue
+            names = [d[0].lower() for d in h.description[1:]]
+            for r in rows:
+                row = dict(zip(names, r[1:]))
                 key = []
                 for f in pks:
                     value = row[f]
@@ -2531,9 +2532,7 @@ class Backend:
                     value = row[f]
                     value = sanitizeValue(value, datatype)
                     val[f] = value
-                hash[tuple(key)] = val
-
-            result[tname] = hash
+                result[ids[r[0]]][tname][tuple(key)] = val
         return result
 
     def __populateTable(self, table_name, data, delete_extra=1):
@@ -251,6 +251,24 @@ class BaseTableLookup:
         return statement
 
 
+def valuesTemplate(datatypes):
+    # Row template for execute_values(), with casts so the VALUES columns
+    # compare against table columns of the right type
+    casts = []
+    for datatype in datatypes:
+        if isinstance(datatype, DBint):
+            casts.append("%s::numeric")
+        elif isinstance(datatype, DBstring):
+            casts.append("%s::varchar")
+        elif isinstance(datatype, DBdate):
+            casts.append("%s::date")
+        elif isinstance(datatype, DBdateTime):
+            casts.append("%s::timestamptz")
+        else:
+            casts.append("%s")
+    return "(%s)" % ", ".join(casts)
+
+
 class TableLookup(BaseTableLookup):
 
     def __init__(self, table, dbmodule):
@@ -260,6 +278,53 @@ class TableLookup(BaseTableLookup):
     def _buildQuery(self, key):
         return self.queryTemplate % (self.table.name, self.whereclauses[key])
 
+    def _buildBulkQuery(self, key):
+        columns = []
+        conditions = []
+        for col, isnull in zip(self.pks, key):
+            if isnull:
+                conditions.append("t.%s is null" % col)
+            else:
+                columns.append(col)
+                conditions.append("t.%s = wanted.%s" % (col, col))
+        sql = """
+            WITH wanted (ordering, %s) AS (
+              VALUES %%s
+            )
+            SELECT wanted.ordering, t.*
+              FROM wanted
+              JOIN %s t
+                ON %s
+        """ % (", ".join(columns), self.table.name, " and ".join(conditions))
+        fields = self.table.getFields()
+        template = valuesTemplate([DBint()] + [fields[col] for col in columns])
+        return sql, template, columns
+
+    def queryMany(self, objects, page_size=1000):
+        """
+        Look up all the objects with one query per combination of null
+        primary key columns. Returns the first matching row as a dictionary,
+        or None, for every object.
+        """
+        result = [None] * len(objects)
+        groups = {}
+        for i, obj in enumerate(objects):
+            key, values = self._selectQueryKey(obj)
+            groups.setdefault(key, []).append((i, values))
+
+        for key, entries in groups.items():
+            sql, template, columns = self._buildBulkQuery(key)
+            h = self.dbmodule.prepare(sql)
+            rows = h.execute_values(sql, [[i] + [values[col] for col in columns] for i, values in entries],
+                                    template=template, page_size=page_size)
+            if not rows:
+                continue
+            names = [d[0].lower() for d in h.description[1:]]
+            for row in rows:
+                if result[row[0]] is None:
+                    result[row[0]] = dict(zip(names, row[1:]))
+        return result
+
 
 class TableUpdate(BaseTableLookup):
 
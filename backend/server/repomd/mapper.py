@@ -22,6 +22,7 @@ import time
 
 from spacewalk.common import rhnCache
 from spacewalk.common.rhnConfig import CFG
+from spacewalk.common.rhnLog import log_debug, log_error
 from uyuni.common.usix import UnicodeType
 from spacewalk.server import rhnSQL
 
@@ -30,15 +31,19 @@ from . import domain
 
 CACHE_PREFIX = "/var/cache/rhn/"
 
+# Number of packages loaded per round trip by the bulk package mapper
+BULK_CHUNK_SIZE = 1000
+
 
 class ChannelMapper:
 
     """ Data Mapper for Channels to the RHN db. """
 
-    def __init__(self, pkg_mapper, erratum_mapper, repomd_mapper):
+    def __init__(self, pkg_mapper, erratum_mapper, repomd_mapper, chunk_size=1):
         self.pkg_mapper = pkg_mapper
         self.erratum_mapper = erratum_mapper
         self.repomd_mapper = repomd_mapper
+        self.chunk_size = max(chunk_size, 1)
 
         self.channel_details_sql = rhnSQL.prepare("""
         select
@@ -69,7 +74,7 @@ class ChannelMapper:
         where id = :channel_id
         """)
 
-        self.errata_id_sql = rhnSQL.prepare("""
+        self.errata_id_query = rhnSQL.Statement("""
         select
             e.id
         from
@@ -132,6 +137,7 @@ class ChannelMapper:
         package_ids = self.channel_sql.fetchall()
 
         channel.num_packages = len(package_ids)
+        channel.package_ids = [package_id[0] for package_id in package_ids]
         channel.packages = self._package_generator(package_ids)
 
         channel.errata = self._erratum_generator(channel_id)
@@ -156,15 +162,23 @@ class ChannelMapper:
         return channel
 
     def _package_generator(self, package_ids):
-        for package_id in package_ids:
-            pkg = self.pkg_mapper.get_package(package_id[0])
-            yield pkg
+        if self.chunk_size == 1:
+            for package_id in package_ids:
+                pkg = self.pkg_mapper.get_package(package_id[0])
+                yield pkg
+            return
+
+        for i in range(0, len(package_ids), self.chunk_size):
+            chunk = [package_id[0] for package_id in package_ids[i:i + self.chunk_size]]
+            for pkg in self.pkg_mapper.get_packages(chunk):
+                yield pkg
 
     def _erratum_generator(self, channel_id):
-        self.errata_id_sql.execute(channel_id=channel_id)
-        erratum_ids = self.errata_id_sql.fetchall()
+        # every generator streams its own result set
+        errata_id_sql = rhnSQL.prepare(self.errata_id_query, server_side=True)
+        errata_id_sql.execute(channel_id=channel_id)
 
-        for erratum_id in erratum_ids:
+        for erratum_id in errata_id_sql.iterate():
             erratum = self.erratum_mapper.get_erratum(erratum_id[0])
             yield erratum
 
@@ -192,10 +206,7 @@ class CachedPackageMapper:
         """
         package_id = str(package_id)
 
-        last_modified = str(self.mapper.last_modified(package_id))
-        last_modified = last_modified.replace(" ", "")
-        last_modified = last_modified.replace(":", "")
-        last_modified = last_modified.replace("-", "")
+        last_modified = cache_timestamp(self.mapper.last_modified(package_id))
 
         cache_key = "repomd-packages/" + package_id
         if self.cache.has_key(cache_key, last_modified):
@@ -206,6 +217,40 @@ class CachedPackageMapper:
 
         return package
 
+    def get_packages(self, package_ids):
+        """
+        Load the packages with ids package_ids, in the given order.
+
+        Packages with a cache entry that is new enough are loaded from the
+        cache, all others are fetched with a single call to the provided
+        mapper.
+        """
+        last_modified = self.mapper.last_modified_packages(package_ids)
+
+        packages = {}
+        missing = []
+        for package_id in package_ids:
+            stamp = cache_timestamp(last_modified.get(int(package_id)))
+            cache_key = "repomd-packages/%s" % package_id
+            package = None
+            if self.cache.has_key(cache_key, stamp):
+                package = self.cache.get(cache_key)
+            if package is None:
+                missing.append(package_id)
+            else:
+                packages[int(package_id)] = package
+
+        if missing:
+            for package in self.mapper.get_packages(missing):
+                stamp = cache_timestamp(last_modified.get(int(package.id)))
+                self.cache.set("repomd-packages/%s" % package.id, package, stamp)
+                packages[int(package.id)] = package
+        log_debug(4, "Loaded %s packages, %s from cache"
+                  % (len(packages), len(packages) - len(missing)))
+
+        return [packages[int(package_id)] for package_id in package_ids
+                if int(package_id) in packages]
+
 
 class SqlPackageMapper:
 
@@ -410,6 +455,11 @@ class SqlPackageMapper:
         self.last_modified_sql.execute(package_id=package_id)
         return self.last_modified_sql.fetchone()[0]
 
+    def last_modified_packages(self, package_ids):
+        """ Get a dictionary of package id -> last_modified date. """
+        return dict((int(package_id), self.last_modified(package_id))
+                    for package_id in package_ids)
+
     def get_package(self, package_id):
         """ Get the package with id package_id from the RHN db. """
         package = domain.Package(package_id)
@@ -419,6 +469,10 @@ class SqlPackageMapper:
         self._fill_package_other(package)
         return package
 
+    def get_packages(self, package_ids):
+        """ Get the packages with ids package_ids from the RHN db. """
+        return [self.get_package(package_id) for package_id in package_ids]
+
     def _get_package_filename(self, pkg):
         if pkg[18]:
             path = pkg[18]
@@ -435,7 +489,10 @@ class SqlPackageMapper:
         """ Load the packages basic details (summary, description, etc). """
         self.details_sql.execute(package_id=package.id)
         pkg = self.details_sql.fetchone()
+        self._set_package_details(package, pkg)
 
+    def _set_package_details(self, package, pkg):
+        """ Fill the package's basic details from a details_sql row. """
         package.name = pkg[0]
         package.version = pkg[1]
         package.release = pkg[2]
@@ -468,49 +525,53 @@ class SqlPackageMapper:
         deps = self.prco_sql.fetchall() or []
 
         for item in deps:
-            version = item[3] or ""
-            relation = ""
-            release = None
-            epoch = 0
-            if version:
-                sense = item[1] or 0
-                relation = SqlPackageMapper.__get_relation(sense)
-
-                vertup = version.split('-')
-                if len(vertup) > 1:
-                    version = vertup[0]
-                    release = vertup[1]
-
-                vertup = version.split(':')
-                if len(vertup) > 1:
-                    epoch = vertup[0]
-                    version = vertup[1]
-
-            dep = {'name': string_to_unicode(item[2]), 'flag': relation,
-                   'version': version, 'release': release, 'epoch': epoch}
-
-            if item[0] == "provides":
-                package.provides.append(dep)
-            elif item[0] == "requires":
-                package.requires.append(dep)
-            elif item[0] == "conflicts":
-                package.conflicts.append(dep)
-            elif item[0] == "obsoletes":
-                package.obsoletes.append(dep)
-            elif item[0] == "recommends":
-                package.recommends.append(dep)
-            elif item[0] == "supplements":
-                package.supplements.append(dep)
-            elif item[0] == "enhances":
-                package.enhances.append(dep)
-            elif item[0] == "suggests":
-                package.suggests.append(dep)
-            elif item[0] == "breaks":
-                package.breaks.append(dep)
-            elif item[0] == "predepends":
-                package.predepends.append(dep)
-            else:
-                assert False, "Unknown PRCO type: %s" % item[0]
+            self._add_package_dep(package, item)
+
+    def _add_package_dep(self, package, item):
+        """ Add a (type, sense, name, version) prco_sql row to the package. """
+        version = item[3] or ""
+        relation = ""
+        release = None
+        epoch = 0
+        if version:
+            sense = item[1] or 0
+            relation = SqlPackageMapper.__get_relation(sense)
+
+            vertup = version.split('-')
+            if len(vertup) > 1:
+                version = vertup[0]
+                release = vertup[1]
+
+            vertup = version.split(':')
+            if len(vertup) > 1:
+                epoch = vertup[0]
+                version = vertup[1]
+
+        dep = {'name': string_to_unicode(item[2]), 'flag': relation,
+               'version': version, 'release': release, 'epoch': epoch}
+
+        if item[0] == "provides":
+            package.provides.append(dep)
+        elif item[0] == "requires":
+            package.requires.append(dep)
+        elif item[0] == "conflicts":
+            package.conflicts.append(dep)
+        elif item[0] == "obsoletes":
+            package.obsoletes.append(dep)
+        elif item[0] == "recommends":
+            package.recommends.append(dep)
+        elif item[0] == "supplements":
+            package.supplements.append(dep)
+        elif item[0] == "enhances":
+            package.enhances.append(dep)
+        elif item[0] == "suggests":
+            package.suggests.append(dep)
+        elif item[0] == "breaks":
+            package.breaks.append(dep)
+        elif item[0] == "predepends":
+            package.predepends.append(dep)
+        else:
+            assert False, "Unknown PRCO type: %s" % item[0]
 
 #    @staticmethod
     def __get_relation(sense):
@@ -551,12 +612,185 @@ class SqlPackageMapper:
         log_data = self.other_sql.fetchall() or []
 
         for data in log_data:
+            self._add_package_changelog(package, data)
 
-            date = oratimestamp_to_sinceepoch(data[2])
+    def _add_package_changelog(self, package, data):
+        """ Add a (name, text, time) other_sql row to the package. """
+        date = oratimestamp_to_sinceepoch(data[2])
 
-            chglog = {'author': string_to_unicode(data[0]), 'date': date,
-                      'text': string_to_unicode(data[1])}
-            package.changelog.append(chglog)
+        chglog = {'author': string_to_unicode(data[0]), 'date': date,
+                  'text': string_to_unicode(data[1])}
+        package.changelog.append(chglog)
+
+
+class BulkSqlPackageMapper(SqlPackageMapper):
+
+    """
+    Data Mapper for Packages to the RHN db, loading whole sets of packages.
+
+    Instead of running one query per package and per kind of data, the
+    details, capabilities, files and changelogs of a list of packages are
+    loaded with one query each.
+    """
+
+    # (prco type, table name) pairs, in the order of SqlPackageMapper.prco_sql
+    prco_tables = [
+        ('provides', 'rhnPackageProvides'),
+        ('requires', 'rhnPackageRequires'),
+        ('recommends', 'rhnPackageRecommends'),
+        ('supplements', 'rhnPackageSupplements'),
+        ('enhances', 'rhnPackageEnhances'),
+        ('suggests', 'rhnPackageSuggests'),
+        ('conflicts', 'rhnPackageConflicts'),
+        ('obsoletes', 'rhnPackageObsoletes'),
+        ('breaks', 'rhnPackageBreaks'),
+        ('predepends', 'rhnPackagePredepends'),
+    ]
+
+    def __init__(self):
+        SqlPackageMapper.__init__(self)
+
+        self.bulk_details_sql = """
+        with wanted (package_id) as (
+            values %s
+        )
+        select
+            pn.name,
+            pevr.version,
+            pevr.release,
+            pevr.epoch,
+            pa.label arch,
+            c.checksum checksum,
+            p.summary,
+            p.description,
+            p.vendor,
+            p.build_time,
+            p.package_size,
+            p.payload_size,
+            p.installed_size,
+            p.header_start,
+            p.header_end,
+            pg.name package_group,
+            p.build_host,
+            p.copyright,
+            p.path,
+            sr.name source_rpm,
+            p.last_modified,
+            c.checksum_type,
+            p.id
+        from
+            wanted
+            join rhnPackage p on p.id = wanted.package_id
+            join rhnPackageName pn on p.name_id = pn.id
+            join rhnPackageEVR pevr on p.evr_id = pevr.id
+            join rhnPackageArch pa on p.package_arch_id = pa.id
+            join rhnPackageGroup pg on p.package_group = pg.id
+            join rhnSourceRPM sr on p.source_rpm_id = sr.id
+            join rhnChecksumView c on p.checksum_id = c.id
+        """
+
+        prco_selects = []
+        for prco_type, table in self.prco_tables:
+            prco_selects.append("""
+        select
+           dep.package_id,
+           '%s',
+           dep.sense,
+           pc.name,
+           pc.version
+        from
+           wanted
+           join %s dep on dep.package_id = wanted.package_id
+           join rhnPackageCapability pc on dep.capability_id = pc.id
+        """ % (prco_type, table))
+        self.bulk_prco_sql = """
+        with wanted (package_id) as (
+            values %s
+        )
+        """ + "union all".join(prco_selects)
+
+        self.bulk_filelist_sql = """
+        with wanted (package_id) as (
+            values %s
+        )
+        select
+            pf.package_id,
+            pc.name
+        from
+            wanted
+            join rhnPackageFile pf on pf.package_id = wanted.package_id
+            join rhnPackageCapability pc on pf.capability_id = pc.id
+        """
+
+        self.bulk_other_sql = """
+        with wanted (package_id) as (
+            values %s
+        )
+        select
+            cl.package_id,
+            cl.name,
+            cl.text,
+            cl.time
+        from
+            wanted
+            join rhnPackageChangelog cl on cl.package_id = wanted.package_id
+        """
+
+        self.bulk_last_modified_sql = """
+        with wanted (package_id) as (
+            values %s
+        )
+        select
+            p.id,
+            to_char(p.last_modified, 'YYYYMMDDHH24MISS') as last_modified
+        from
+            wanted
+            join rhnPackage p on p.id = wanted.package_id
+        """
+
+    @staticmethod
+    def _fetch_bulk(sql, package_ids):
+        """ Run one of the bulk statements over the list of package ids. """
+        if not package_ids:
+            return []
+        wanted = [(int(package_id),) for package_id in package_ids]
+        h = rhnSQL.prepare(sql)
+        return h.execute_values(sql, wanted, page_size=max(len(wanted), 1)) or []
+
+    def last_modified_packages(self, package_ids):
+        """ Get a dictionary of package id -> last_modified date. """
+        rows = self._fetch_bulk(self.bulk_last_modified_sql, package_ids)
+        return dict((row[0], row[1]) for row in rows)
+
+    def get_packages(self, package_ids):
+        """
+        Get the packages with ids package_ids from the RHN db.
+
+        The packages are returned in the order of package_ids.
+        """
+        packages = {}
+        for row in self._fetch_bulk(self.bulk_details_sql, package_ids):
+            package = domain.Package(row[22])
+            self._set_package_details(package, row)
+            packages[row[22]] = package
+
+        missing = [package_id for package_id in package_ids
+                   if int(package_id) not in packages]
+        if missing:
+            log_error("Package details not found for package ids %s" % missing)
+        package_ids = [int(package_id) for package_id in package_ids
+                       if int(package_id) in packages]
+
+        for row in self._fetch_bulk(self.bulk_prco_sql, package_ids):
+            self._add_package_dep(packages[row[0]], row[1:])
+
+        for row in self._fetch_bulk(self.bulk_filelist_sql, package_ids):
+            packages[row[0]].files.append(string_to_unicode(row[1]))
+
+        for row in self._fetch_bulk(self.bulk_other_sql, package_ids):
+            self._add_package_changelog(packages[row[0]], row[1:])
+
+        return [packages[package_id] for package_id in package_ids]
 
 
 class CachedErratumMapper:
@@ -588,9 +822,8 @@ class CachedErratumMapper:
         cache_key = "repomd-errata/" + erratum_id
         if self.cache.has_key(cache_key, last_modified):
             erratum = self.cache.get(cache_key)
-            for package_id in erratum.package_ids:
-                package = self.package_mapper.get_package(package_id)
-                erratum.packages.append(package)
+            erratum.packages.extend(
+                self.package_mapper.get_packages(erratum.package_ids))
         else:
             erratum = self.mapper.get_erratum(erratum_id)
 
@@ -720,10 +953,9 @@ class SqlErratumMapper:
         self.erratum_packages_sql.execute(erratum_id=erratum.id)
         pkgs = self.erratum_packages_sql.fetchall()
 
-        for pkg in pkgs:
-            package = self.package_mapper.get_package(pkg[0])
-            erratum.packages.append(package)
-            erratum.package_ids.append(pkg[0])
+        erratum.package_ids.extend([pkg[0] for pkg in pkgs])
+        erratum.packages.extend(
+            self.package_mapper.get_packages(erratum.package_ids))
 
 
 class SqlRepoMDMapper:
@@ -745,19 +977,37 @@ class SqlRepoMDMapper:
         return domain.RepoMD(repomd_id, filename)
 
 
+def get_bulk_chunk_size():
+    """
+    Number of packages loaded at once when generating repomd files.
+
+    Controlled by the repomd_bulk_chunk_size option; a value of 1 or less
+    switches back to loading the packages one by one.
+    """
+    return int(CFG.get('repomd_bulk_chunk_size', BULK_CHUNK_SIZE))
+
+
 def get_channel_mapper():
     """ Factory Method-ish function to load a Channel Mapper. """
     package_mapper = get_package_mapper()
     erratum_mapper = get_erratum_mapper(package_mapper)
     repomd_mapper = SqlRepoMDMapper()
-    channel_mapper = ChannelMapper(package_mapper, erratum_mapper, repomd_mapper)
+    channel_mapper = ChannelMapper(package_mapper, erratum_mapper, repomd_mapper,
+                                   chunk_size=get_bulk_chunk_size())
 
     return channel_mapper
 
 
+def get_sql_package_mapper():
+    """ Factory Method-ish function to load an uncached Package Mapper. """
+    if get_bulk_chunk_size() > 1:
+        return BulkSqlPackageMapper()
+    return SqlPackageMapper()
+
+
 def get_package_mapper():
     """ Factory Method-ish function to load a Package Mapper. """
-    package_mapper = SqlPackageMapper()
+    package_mapper = get_sql_package_mapper()
     package_mapper = CachedPackageMapper(package_mapper)
 
     return package_mapper
@@ -771,6 +1021,15 @@ def get_erratum_mapper(package_mapper):
     return erratum_mapper
 
 
+def cache_timestamp(last_modified):
+    """ Strip a last_modified date down to the digits used as cache stamp. """
+    last_modified = str(last_modified)
+    last_modified = last_modified.replace(" ", "")
+    last_modified = last_modified.replace(":", "")
+    last_modified = last_modified.replace("-", "")
+    return last_modified
+
+
 def oratimestamp_to_sinceepoch(ts):
     return time.mktime((ts.year, ts.month, ts.day, ts.hour, ts.minute,
                         ts.second, 0, 0, -1))
@@ -17,28 +17,20 @@
 #
 
 import time
-try:
-    #  python 2
-    import StringIO
-except ImportError:
-    #  python3
-    import io as StringIO
-import shutil
+import threading
 import os.path
 
 from gzip import GzipFile
-from gzip import write32u
 
-from uyuni.common.usix import LongType
 from uyuni.common import checksum
 from spacewalk.common import rhnCache
-from spacewalk.common.rhnLog import log_debug
+from spacewalk.common.rhnLog import log_debug, log_error
 from spacewalk.common.rhnConfig import CFG
 
 from . import mapper
 from . import view
 from .domain import RepoMD
-from spacewalk.server import rhnChannel
+from spacewalk.server import rhnChannel, rhnSQL
 
 # One meg
 CHUNK_SIZE = 1048576
@@ -78,6 +70,7 @@ class Repository(object):
 
         cache = rhnCache.Cache()
         self.cache = rhnCache.NullCache(cache)
+        self.object_cache = rhnCache.NullCache(rhnCache.ObjectCache(cache))
 
     def get_primary_xml_file(self):
         """ Return a file-like object of the primarl.xml for this channel. """
@@ -120,11 +113,7 @@ class Repository(object):
         ret = self.get_cache_file(self.updateinfo_prefix)
 
         if not ret:
-            viewobj = self.get_cache_view(self.updateinfo_prefix,
-                                          view.UpdateinfoView)
-
-            viewobj.write_updateinfo()
-            viewobj.fileobj.close()
+            self.generate_updateinfo()
             ret = self.get_cache_file(self.updateinfo_prefix)
 
         return ret
@@ -138,11 +127,41 @@ class Repository(object):
         return ret
 
     def get_cache_view(self, cache_prefix, view_class):
-        cache_entry = self.get_cache_entry_name(cache_prefix)
-        ret = self.cache.set_file(cache_entry, self.last_modified)
-        viewobj = view_class(self.channel, ret)
+        viewobj = view_class(self.channel, self.get_cache_writer(cache_prefix))
         return viewobj
 
+    def get_cache_writer(self, cache_prefix):
+        """
+        Return a file-like object storing cache_prefix in the cache.
+
+        The data is written uncompressed and gzipped in the same pass, and
+        the checksums of both files are stored along with them on close.
+        """
+        plain_file = self.cache.set_file(self.get_cache_entry_name(cache_prefix),
+                                         self.last_modified)
+        gzip_file = self.cache.set_file(self.get_cache_entry_name(cache_prefix + ".gz"),
+                                        self.last_modified)
+
+        def store_checksums(checksums):
+            self.object_cache.set(self.get_cache_entry_name(cache_prefix + ".checksums"),
+                                    checksums, self.last_modified)
+
+        return MetadataFileWriter(plain_file, gzip_file, self.channel.checksum_type,
+                                  store_checksums)
+
+    def get_checksums(self, cache_prefix):
+        """ Return the open and gzip checksums stored for cache_prefix. """
+        return self.object_cache.get(self.get_cache_entry_name(cache_prefix + ".checksums"),
+                                       self.last_modified)
+
+    def has_metadata_cache(self, cache_prefix):
+        """ True if the plain and gzipped file and their checksums are cached. """
+        for suffix in ("", ".gz", ".checksums"):
+            cache_entry = self.get_cache_entry_name(cache_prefix + suffix)
+            if not self.cache.has_key(cache_entry, self.last_modified):
+                return False
+        return True
+
     def get_primary_cache(self):
         return self.get_cache_file(self.primary_prefix)
 
@@ -161,6 +180,9 @@ class Repository(object):
     def get_filelists_view(self):
         return self.get_cache_view(self.filelists_prefix, view.FilelistsView)
 
+    def get_updateinfo_view(self):
+        return self.get_cache_view(self.updateinfo_prefix, view.UpdateinfoView)
+
     def get_repomd_file(self, repomd_obj, func_name):
         """ Return a file-like object of the comps.xml/modules.yaml for the channel. """
         if repomd_obj:
@@ -190,14 +212,98 @@ class Repository(object):
         for view in views:
             view.write_start()
 
-        for package in self.channel.packages:
-            for view in views:
-                view.write_package(package)
+        if int(CFG.get('repomd_incremental_generation', 1)):
+            for fragments in self._package_fragments():
+                for view in views:
+                    view.write_fragment(fragments[view.fragment_name])
+        else:
+            for package in self.channel.packages:
+                for view in views:
+                    view.write_package(package)
 
         for view in views:
             view.write_end()
             view.fileobj.close()
 
+    def _package_fragments(self):
+        """
+        Yield the primary, filelists and other XML fragments of every
+        package in the channel, as a dictionary keyed by the views'
+        fragment_name.
+
+        Fragments do not depend on the channel, so they are cached per
+        package and stamped with the package's last_modified date. Only
+        packages which are new or changed since they were last rendered
+        are loaded from the database.
+        """
+        package_mapper = mapper.get_sql_package_mapper()
+        renderers = [view_class(self.channel, None) for view_class in
+                     (view.PrimaryView, view.FilelistsView, view.OtherView)]
+        chunk_size = max(mapper.get_bulk_chunk_size(), 1)
+        package_ids = self.channel.package_ids
+
+        rendered = 0
+        for i in range(0, len(package_ids), chunk_size):
+            chunk = package_ids[i:i + chunk_size]
+            last_modified = package_mapper.last_modified_packages(chunk)
+
+            fragments = {}
+            missing = []
+            for package_id in chunk:
+                cached = None
+                if package_id in last_modified:
+                    cached = self.object_cache.get("repomd-fragments/%s" % package_id,
+                                                   mapper.cache_timestamp(last_modified[package_id]))
+                if cached is None:
+                    missing.append(package_id)
+                else:
+                    fragments[package_id] = cached
+
+            for package in package_mapper.get_packages(missing):
+                package_id = int(package.id)
+                fragments[package_id] = dict((renderer.fragment_name, renderer.get_fragment(package))
+                                             for renderer in renderers)
+                if package_id in last_modified:
+                    self.object_cache.set("repomd-fragments/%s" % package_id, fragments[package_id],
+                                          mapper.cache_timestamp(last_modified[package_id]))
+            rendered += len(missing)
+
+            for package_id in chunk:
+                if package_id in fragments:
+                    yield fragments[package_id]
+
+        log_debug(2, "Channel %s: rendered %s of %s packages, reused the others"
+                  % (self.channel_id, rendered, len(package_ids)))
+
+    def generate_updateinfo(self):
+        viewobj = self.get_updateinfo_view()
+        viewobj.write_updateinfo()
+        viewobj.fileobj.close()
+
+    def start_updateinfo_worker(self):
+        """
+        Generate updateinfo.xml in a worker thread with its own database
+        connection, so that it runs alongside the package metadata.
+
+        Returns the worker thread, or None if parallel generation is
+        disabled; updateinfo.xml is then generated before returning.
+        """
+        if not int(CFG.get('repomd_parallel_generation', 1)):
+            self.generate_updateinfo()
+            return None
+
+        worker = UpdateinfoWorker({'id': self.channel_id, 'last_modified': self.last_modified})
+        worker.start()
+        return worker
+
+    def join_updateinfo_worker(self, worker):
+        """ Wait for a worker from start_updateinfo_worker to finish. """
+        worker.join()
+        if worker.failed:
+            log_error("Generating updateinfo.xml for channel %s in a worker "
+                      "thread failed, retrying" % self.channel_id)
+            self.generate_updateinfo()
+
     def __get_channel(self):
         """ Late binding for the channel. """
         if self._channel is None:
@@ -210,7 +316,12 @@ class Repository(object):
 
 class CompressedRepository:
 
-    """ Decorator for Repositories adding gzip compression of the output. """
+    """
+    Decorator for Repositories serving the gzip compressed output.
+
+    The compressed files are written to the cache by the repository along
+    with the uncompressed ones.
+    """
 
     def __init__(self, repository):
         self.repository = repository
@@ -221,93 +332,42 @@ class CompressedRepository:
         self.updateinfo_prefix = self.repository.updateinfo_prefix + ".gz"
 
     def get_primary_xml_file(self):
-        xml_file = self.repository.get_primary_xml_file()
-        return self.__get_compressed_file(xml_file)
+        """ Return gzipped primary.xml file """
+        return self.__get_compressed_file(self.primary_prefix,
+                                          self.repository.get_primary_view)
 
     def get_other_xml_file(self):
         """ Return gzipped other.xml file """
-        xml_file = self.repository.get_other_xml_file()
-        return self.__get_compressed_file(xml_file)
+        return self.__get_compressed_file(self.other_prefix,
+                                          self.repository.get_other_view)
 
     def get_filelists_xml_file(self):
         """ Return gzipped filelists.xml file """
-        xml_file = self.repository.get_filelists_xml_file()
-        return self.__get_compressed_file(xml_file)
+        return self.__get_compressed_file(self.filelists_prefix,
+                                          self.repository.get_filelists_view)
 
     def get_updateinfo_xml_file(self):
         """ Return gzipped updateinfo.xml file """
-        xml_file = self.repository.get_updateinfo_xml_file()
-        return self.__get_compressed_file(xml_file)
+        ret = self.repository.get_cache_file(self.updateinfo_prefix)
+        if ret:
+            log_debug(4, "Scored cache hit", self.channel_id)
+        else:
+            self.repository.generate_updateinfo()
+            ret = self.repository.get_cache_file(self.updateinfo_prefix)
+        return ret
 
     def __getattr__(self, x):
         return getattr(self.repository, x)
 
-    def __get_compressed_file(self, uncompressed_file):
-        string_file = StringIO.StringIO()
-        gzip_file = NoTimeStampGzipFile(mode="wb", fileobj=string_file)
-
-        shutil.copyfileobj(uncompressed_file, gzip_file)
-
-        gzip_file.close()
-
-        string_file.seek(0, 0)
-
-        return string_file
-
-
-class CachedRepository:
-
-    """ Decorator for Repositories adding caching. """
-
-    def __init__(self, repository):
-        self.repository = repository
-
-        cache = rhnCache.Cache()
-        self.cache = rhnCache.NullCache(cache)
-
-    def get_primary_xml_file(self):
-        """ Return the cached primary metadata file, if it exists. """
-        return self._cached(self.primary_prefix,
-                            self.repository.get_primary_xml_file)
-
-    def get_other_xml_file(self):
-        return self._cached(self.other_prefix,
-                            self.repository.get_other_xml_file)
-
-    def get_filelists_xml_file(self):
-        return self._cached(self.filelists_prefix,
-                            self.repository.get_filelists_xml_file)
-
-    def get_updateinfo_xml_file(self):
-        return self._cached(self.updateinfo_prefix,
-                            self.repository.get_updateinfo_xml_file)
-
-    def _cached(self, cache_prefix, fallback_method):
-        """
-        Return the cached results if they are new enough, else get new results.
-
-        cache_prefix is a unique string that will identify the cached data.
-        fallback_method is the method to call if the cached data doesn't exist
-        or isn't new enough.
-        """
-        cache_entry = "%s-%s" % (cache_prefix, self.channel_id)
-        ret = self.cache.get_file(cache_entry, self.last_modified)
+    def __get_compressed_file(self, cache_prefix, get_view):
+        ret = self.repository.get_cache_file(cache_prefix)
         if ret:
             log_debug(4, "Scored cache hit", self.channel_id)
         else:
-            ret = fallback_method()
-            cache_file = self.cache.set_file(cache_entry, self.last_modified)
-
-            shutil.copyfileobj(ret, cache_file)
-
-            ret.close
-            cache_file.close()
-            ret = self.cache.get_file(cache_entry, self.last_modified)
+            self.repository.generate_files([get_view()])
+            ret = self.repository.get_cache_file(cache_prefix)
         return ret
 
-    def __getattr__(self, x):
-        return getattr(self.repository, x)
-
 
 class MetadataRepository:
 
@@ -335,32 +395,35 @@ class MetadataRepository:
             timestamp = int(time.mktime(time.strptime(self.last_modified,
                                                       "%Y%m%d%H%M%S")))
 
+            # updateinfo.xml does not depend on the packages, so it is
+            # generated by a worker thread while primary, filelists and
+            # other are written in a single pass over the packages here.
+            updateinfo_worker = None
+            if not self.repository.has_metadata_cache(self.repository.updateinfo_prefix):
+                updateinfo_worker = self.repository.start_updateinfo_worker()
+
             to_generate = []
 
-            if not self.repository.get_primary_cache():
+            if not self.repository.has_metadata_cache(self.repository.primary_prefix):
                 to_generate.append(self.repository.get_primary_view())
-            if not self.repository.get_other_cache():
+            if not self.repository.has_metadata_cache(self.repository.other_prefix):
                 to_generate.append(self.repository.get_other_view())
-            if not self.repository.get_filelists_cache():
+            if not self.repository.has_metadata_cache(self.repository.filelists_prefix):
                 to_generate.append(self.repository.get_filelists_view())
 
-            self.repository.generate_files(to_generate)
-
-            primary = self.__compute_checksums(timestamp,
-                                               self.repository.get_primary_xml_file(),
-                                               self.compressed_repository.get_primary_xml_file())
-
-            filelists = self.__compute_checksums(timestamp,
-                                                 self.repository.get_filelists_xml_file(),
-                                                 self.compressed_repository.get_filelists_xml_file())
-
-            other = self.__compute_checksums(timestamp,
-                                             self.repository.get_other_xml_file(),
-                                             self.compressed_repository.get_other_xml_file())
-
-            updateinfo = self.__compute_checksums(timestamp,
-                                                  self.repository.get_updateinfo_xml_file(),
-                                                  self.compressed_repository.get_updateinfo_xml_file())
+            try:
+                if to_generate:
+                    self.repository.generate_files(to_generate)
+            finally:
+                if updateinfo_worker is not None:
+                    updateinfo_worker.join()
+            if updateinfo_worker is not None:
+                self.repository.join_updateinfo_worker(updateinfo_worker)
+
+            primary = self.__get_checksums(timestamp, self.repository.primary_prefix)
+            filelists = self.__get_checksums(timestamp, self.repository.filelists_prefix)
+            other = self.__get_checksums(timestamp, self.repository.other_prefix)
+            updateinfo = self.__get_checksums(timestamp, self.repository.updateinfo_prefix)
 
             # Comps and modules might not exist on disc
             comps = None
@@ -415,6 +478,13 @@ class MetadataRepository:
 
         return template_hash
 
+    def __get_checksums(self, timestamp, cache_prefix):
+        """ Checksums stored by the repository when writing cache_prefix. """
+        template_hash = dict(self.repository.get_checksums(cache_prefix))
+        template_hash['timestamp'] = timestamp
+
+        return template_hash
+
     def __get_checksumtype(self):
         return self.repository.channel.checksum_type
 
@@ -427,7 +497,6 @@ def get_repository(channel):
     repository = Repository(channel)
 
     compressed_repository = CompressedRepository(repository)
-    compressed_repository = CachedRepository(compressed_repository)
 
     meta_repository = MetadataRepository(repository, compressed_repository)
 
@@ -436,11 +505,89 @@ def get_repository(channel):
 
 class NoTimeStampGzipFile(GzipFile):
 
-    def _write_gzip_header(self):
-        self.fileobj.write('\037\213')
-        self.fileobj.write('\010')
-        # no flags
-        self.fileobj.write('\x00')
-        write32u(self.fileobj, LongType(0))
-        self.fileobj.write('\002')
-        self.fileobj.write('\377')
+    """ GzipFile without file name and time stamp in the header. """
+
+    def __init__(self, mode="wb", fileobj=None, compresslevel=9):
+        GzipFile.__init__(self, filename="", mode=mode, compresslevel=compresslevel,
+                          fileobj=fileobj, mtime=0)
+
+
+class ChecksumFile:
+
+    """ Write-only file-like object checksumming everything written to it. """
+
+    def __init__(self, fileobj, checksum_type):
+        self.fileobj = fileobj
+        self.hash_computer = checksum.getHashlibInstance(checksum_type, False)
+
+    def write(self, data):
+        self.hash_computer.update(data)
+        return self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.fileobj.close()
+
+    def hexdigest(self):
+        return self.hash_computer.hexdigest()
+
+
+class MetadataFileWriter:
+
+    """
+    Write-only file-like object for a repository metadata file.
+
+    Everything written goes to the uncompressed and to the gzipped file in
+    the same pass, while computing the checksums of both. Nothing is held in
+    memory apart from the compressor state. On close, the checksums are
+    handed to the on_close callback as a dictionary with the open_checksum
+    and gzip_checksum keys.
+    """
+
+    def __init__(self, plain_file, gzip_file, checksum_type, on_close=None):
+        self.plain_file = ChecksumFile(plain_file, checksum_type)
+        self.gzip_file = ChecksumFile(gzip_file, checksum_type)
+        self.compressor = NoTimeStampGzipFile(mode="wb", fileobj=self.gzip_file)
+        self.on_close = on_close
+        self.closed = False
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.plain_file.write(data)
+        self.compressor.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # GzipFile.close() only flushes, it doesn't close a passed fileobj
+        self.compressor.close()
+        self.plain_file.close()
+        self.gzip_file.close()
+
+        if self.on_close is not None:
+            self.on_close({'open_checksum': self.plain_file.hexdigest(),
+                           'gzip_checksum': self.gzip_file.hexdigest()})
+
+
+class UpdateinfoWorker(threading.Thread):
+
+    """ Generates the updateinfo.xml of a channel with its own database connection. """
+
+    def __init__(self, channel):
+        threading.Thread.__init__(self, name="repomd-updateinfo-%s" % channel['id'])
+        self.daemon = True
+        self.channel = channel
+        self.failed = False
+
+    def run(self):
+        try:
+            with rhnSQL.threadDB():
+                Repository(self.channel).generate_updateinfo()
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed = True
+            log_error("Generating updateinfo.xml for channel %s failed: %s"
+                      % (self.channel['id'], e))
@@ -84,11 +84,14 @@ class RepoView:
         output.extend(self._get_comps_data())
         output.extend(self._get_modules_data())
         output.append("</repomd>")
-        self.fileobj.write('\n'.join(output))
+        self.fileobj.write('\n'.join(output).encode('utf-8'))
 
 
 class PrimaryView(object):
 
+    # key of this view's fragments in the package fragment cache
+    fragment_name = "primary"
+
     def __init__(self, channel, fileobj):
         self.channel = channel
         self.fileobj = fileobj
@@ -202,8 +205,15 @@ class PrimaryView(object):
 
         self.fileobj.write(output)
 
+    def get_fragment(self, package):
+        """ Return the XML of a single package, as written by write_package. """
+        return '\n'.join(self._get_package(package))
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+
     def write_package(self, package):
-        self.fileobj.write('\n'.join(self._get_package(package)))
+        self.write_fragment(self.get_fragment(package))
 
     def write_end(self):
         self.fileobj.write("</metadata>")
@@ -211,6 +221,9 @@ class PrimaryView(object):
 
 class FilelistsView(object):
 
+    # key of this view's fragments in the package fragment cache
+    fragment_name = "filelists"
+
     def __init__(self, channel, fileobj):
         self.channel = channel
         self.fileobj = fileobj
@@ -234,8 +247,15 @@ class FilelistsView(object):
 
         self.fileobj.write(output)
 
+    def get_fragment(self, package):
+        """ Return the XML of a single package, as written by write_package. """
+        return '\n'.join(self._get_package(package))
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+
     def write_package(self, package):
-        self.fileobj.write('\n'.join(self._get_package(package)))
+        self.write_fragment(self.get_fragment(package))
 
     def write_end(self):
         self.fileobj.write("</filelists>")
@@ -243,6 +263,9 @@ class FilelistsView(object):
 
 class OtherView(object):
 
+    # key of this view's fragments in the package fragment cache
+    fragment_name = "other"
+
     def __init__(self, channel, fileobj):
         self.channel = channel
         self.fileobj = fileobj
@@ -270,8 +293,15 @@ class OtherView(object):
 
         self.fileobj.write(output)
 
+    def get_fragment(self, package):
+        """ Return the XML of a single package, as written by write_package. """
+        return '\n'.join(self._get_package(package))
+
+    def write_fragment(self, fragment):
+        self.fileobj.write(fragment)
+
     def write_package(self, package):
-        self.fileobj.write('\n'.join(self._get_package(package)))
+        self.write_fragment(self.get_fragment(package))
 
     def write_end(self):
         self.fileobj.write("</otherdata>")
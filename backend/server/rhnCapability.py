@@ -162,7 +162,7 @@ def _set_server_capabilities():
         'registration.finish_message': {'version': 1, 'value': 1},
         'registration.remaining_subscriptions': {'version': 1, 'value': 1},
         'registration.update_contact_info': {'version': 1, 'value': 1},
-        'registration.delta_packages': {'version': 1, 'value': 1},
+        'registration.delta_packages': {'version': '1-2', 'value': 1},
         'registration.extended_update_support': {'version': 1, 'value': 1},
         'registration.smbios': {'version': 1, 'value': 1},
         'registration.update_systemid': {'version': 1, 'value': 1},
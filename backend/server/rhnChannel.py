@@ -18,14 +18,17 @@
 import time
 import rpm
 import sys
+import zlib
 try:
     #  python 2
     import xmlrpclib
 except ImportError:
     #  python3
     import xmlrpc.client as xmlrpclib
+from rhn.rpclib import transports
 
 from uyuni.common.usix import IntType, raise_with_tb
+from uyuni.common.rhnLib import isSUSE
 
 # common module
 from spacewalk.common import rhnCache, rhnFlags, suseLib
@@ -1325,8 +1328,9 @@ def list_all_packages_sql(channel_id):
 
 def list_all_packages_complete_sql(channel_id):
     log_debug(3, channel_id)
-    # return the latest packages from the specified channel
-    h = rhnSQL.prepare(_query_latest_packages_from_channel)
+    # return the latest packages from the specified channel; the rows are
+    # streamed, a channel may have hundreds of thousands of packages
+    h = rhnSQL.prepare(_query_latest_packages_from_channel, server_side=True)
     # This gathers the provides, requires, conflicts, obsoletes info
     g = rhnSQL.prepare("""
     select
@@ -1475,10 +1479,8 @@ def list_all_packages_complete_sql(channel_id):
     # client was broken and was selecting the wrong architecture if athlons
     # are passed first. The rank ordering here should make sure that i386
     # kernels appear before athlons.
-    ret = h.fetchall_dict()
-    if not ret:
-        return []
-    for pkgi in ret:
+    ret = []
+    for pkgi in h.iterate_dict():
         pkgi['provides'] = []
         pkgi['requires'] = []
         pkgi['conflicts'] = []
@@ -1508,16 +1510,20 @@ def list_all_packages_complete_sql(channel_id):
                     version = " " + version
             dep = item['name'] + relation + version
             pkgi[item['capability_type']].append(dep)
-    # process the results
-    ret = [(a["name"], a["version"], a["release"], a["epoch"],
-                         a["arch"], a["package_size"], a['provides'],
-                         a['requires'], a['conflicts'], a['obsoletes'], a['recommends'], a['suggests'], a['supplements'], a['enhances'], a['breaks'], a['predepends']) for a in __stringify(ret)]
+        # process the results
+        a = __stringify(pkgi)
+        ret.append((a["name"], a["version"], a["release"], a["epoch"],
+                    a["arch"], a["package_size"], a['provides'],
+                    a['requires'], a['conflicts'], a['obsoletes'], a['recommends'], a['suggests'],
+                    a['supplements'], a['enhances'], a['breaks'], a['predepends']))
     return ret
 
 
 def list_packages_path(channel_id):
+    """ Yields the path of every package of the channel, as a row. """
     log_debug(3, channel_id)
-    # return the latest packages from the specified channel
+    # the rows are streamed, a channel may have hundreds of thousands of
+    # packages
     h = rhnSQL.prepare("""
     select
         p.path
@@ -1527,15 +1533,10 @@ def list_packages_path(channel_id):
     where
         cp.channel_id = :channel_id
     and cp.package_id = p.id
-    """)
+    """, server_side=True)
     h.execute(channel_id=str(channel_id))
-    ret = h.fetchall()
-    if not ret:
-        return []
-    # process the results
-    # ret = map(lambda a: (a["path"]),
-        # __stringify(ret))
-    return ret
+    for row in h.iterate():
+        yield row
 
 
 # list the latest packages for a channel
@@ -1564,6 +1565,13 @@ def list_all_packages_complete(channel):
     return _list_packages(channel, cache_prefix="list_all_packages_complete",
                           function=list_all_packages_complete_sql)
 
+# The package lists built ahead of the clients by precompute_package_lists
+PRECOMPUTED_PACKAGE_LISTS = (
+    ("list_all_packages", list_all_packages_sql),
+    ("list_all_packages_checksum", list_all_packages_checksum_sql),
+    ("list_all_packages_complete", list_all_packages_complete_sql),
+)
+
 # Common part of list_packages and list_all_packages*
 # cache_prefix is the prefix for the file name we're caching this request as
 # function is the generator function
@@ -1576,31 +1584,70 @@ def _list_packages(channel, cache_prefix, function):
     c_info = channel_info(channel)
     if not c_info:  # unknown channel
         raise rhnFault(40, "could not find any data on channel '%s'" % channel)
-    cache_entry = "%s-%s" % (cache_prefix, channel)
-    ret = rhnCache.get(cache_entry, c_info["last_modified"])
+    ret = _cached_package_list(channel, c_info, cache_prefix, function)
+    if ret is None:
+        return []
+    # Mark the response as being already XMLRPC-encoded and compressed
+    rhnFlags.set("XMLRPC-Encoded-Response", 1)
+    rhnFlags.set("XMLRPC-Compressed-Response", 1)
+    return ret
+
+
+def _cached_package_list(channel, c_info, cache_prefix, function):
+    """ Returns the zlib compressed XML-RPC response listing the packages
+        of the channel, or None for a channel without packages.
+
+        Concurrent misses of the same list wait for one of them to build it
+        instead of all running the query.
+    """
+    cache_entry = "%s-%s.zlib" % (cache_prefix, channel)
+    ret = rhnCache.get_bytes(cache_entry, c_info["last_modified"])
     if ret:  # we scored a cache hit
         log_debug(4, "Scored cache hit", channel)
-        # Mark the response as being already XMLRPC-encoded
-        rhnFlags.set("XMLRPC-Encoded-Response", 1)
         return ret
 
-    ret = function(c_info["id"])
-    if not ret:
-        # we assume that channels with no packages are very fast to list,
-        # so we don't bother caching...
-        log_error("No packages found in channel",
-                  c_info["id"], c_info["label"])
-        return []
-    # we need to append the channel label to the list
-    ret = list(map(lambda a, c=channel: a + (c,), ret))
-    ret = xmlrpclib.dumps((ret, ), methodresponse=1)
-    # Mark the response as being already XMLRPC-encoded
-    rhnFlags.set("XMLRPC-Encoded-Response", 1)
-    # set the cache
-    rhnCache.set(cache_entry, ret, c_info["last_modified"])
+    with rhnCache.build_lock(cache_entry):
+        ret = rhnCache.get_bytes(cache_entry, c_info["last_modified"])
+        if ret:  # built while we were waiting
+            log_debug(4, "Scored cache hit after waiting", channel)
+            return ret
+
+        packages = function(c_info["id"])
+        if not packages:
+            # we assume that channels with no packages are very fast to list,
+            # so we don't bother caching...
+            log_error("No packages found in channel",
+                      c_info["id"], c_info["label"])
+            return None
+        # we need to append the channel label to the list
+        packages = [a + (channel,) for a in packages]
+        ret = xmlrpclib.dumps((packages, ), methodresponse=1)
+        ret = zlib.compress(ret.encode(), transports.COMPRESS_LEVEL)
+        # set the cache; the files are owned by the web server user even when
+        # precomputed by another tool
+        user = 'apache'
+        group = 'apache'
+        if isSUSE():
+            user = 'wwwrun'
+            group = 'www'
+        rhnCache.set(cache_entry, ret, c_info["last_modified"], raw=1,
+                     user=user, group=group, mode=int('0755', 8))
     return ret
 
 
+def precompute_package_lists(channel):
+    """ Build the listAllPackages* responses of the channel if they are not
+        cached for its current version, so that the first clients after a
+        change of the channel do not wait for them.
+    """
+    log_debug(3, channel)
+    c_info = channel_info(channel)
+    if not c_info:
+        return
+    for cache_prefix, function in PRECOMPUTED_PACKAGE_LISTS:
+        _cached_package_list(channel, c_info, cache_prefix, function)
+
+
 def getChannelInfoForKickstart(kickstart):
     query = """
     select c.label,
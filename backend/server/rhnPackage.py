@@ -260,6 +260,75 @@ def get_info_for_package(pkg, channel_id, org_id):
     return ret
 
 
+def get_info_for_packages(pkgs, channel_id, org_id, page_size=1000):
+    """
+    Bulk variant of get_info_for_package: pkgs is a list of
+    [name, version, release, epoch, arch] entries. Returns a list with one
+    entry per element of pkgs, each of them the list get_info_for_package
+    would have returned for it. Lookups are sent page_size packages at a time.
+    """
+    log_debug(3, len(pkgs), channel_id, org_id)
+    wanted = []
+    for i, pkg in enumerate(pkgs):
+        name, version, release, epoch, arch = [None if x is None else str(x) for x in pkg]
+        # yum repo has epoch="0" not only when epoch is "0" but also if it's NULL
+        if epoch in ('0', ''):
+            epoch = None
+        wanted.append((i, name, version, release, epoch, arch))
+    ret = [[] for _ in pkgs]
+    if not wanted:
+        return ret
+
+    if org_id:
+        orgStatement = "p.org_id = %d" % int(org_id)
+    else:
+        orgStatement = "p.org_id is null"
+
+    statement = """
+    WITH wanted (ordering, name, version, release, epoch, arch) AS (
+      VALUES %%s
+    )
+    select wanted.ordering, p.path, cp.channel_id,
+           cv.checksum_type, cv.checksum, p.org_id, pe.epoch
+      from wanted
+      join rhnPackageName pn
+        on pn.name = wanted.name
+      join rhnPackageEVR pe
+        on pe.version = wanted.version
+       and pe.release = wanted.release
+       and ((wanted.epoch is null and (pe.epoch is null or pe.epoch = '0'))
+            or pe.epoch = wanted.epoch)
+      join rhnPackageArch pa
+        on pa.label = wanted.arch
+      join rhnPackage p
+        on p.name_id = pn.id
+       and p.evr_id = pe.id
+       and p.package_arch_id = pa.id
+      left join rhnChannelPackage cp
+        on p.id = cp.package_id
+       and cp.channel_id = %d
+      join rhnChecksumView cv
+        on p.checksum_id = cv.id
+     where %s
+     order by wanted.ordering,
+              cp.channel_id nulls last,
+              p.id desc
+    """ % (int(channel_id), orgStatement)
+
+    h = rhnSQL.prepare(statement)
+    rows = h.execute_values(statement, wanted, page_size=page_size) or []
+    for (ordering, path, row_channel_id, checksum_type, checksum, row_org_id, epoch) in rows:
+        ret[ordering].append({
+            'path': path,
+            'channel_id': row_channel_id,
+            'checksum_type': checksum_type,
+            'checksum': checksum,
+            'org_id': '' if row_org_id is None else str(row_org_id),
+            'epoch': epoch,
+        })
+    return ret
+
+
 def _none2emptyString(foo):
     if foo is None:
         return ""
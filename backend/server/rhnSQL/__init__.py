@@ -16,6 +16,8 @@
 #
 
 import sys
+import contextlib
+import threading
 
 from uyuni.common.usix import raise_with_tb
 from spacewalk.common.rhnLog import log_debug
@@ -29,6 +31,7 @@ from . import sql_row
 from . import sql_sequence
 from . import dbi
 from . import sql_types
+from .sql_pool import ConnectionPool
 types = sql_types
 
 from .const import POSTGRESQL, SUPPORTED_BACKENDS
@@ -41,6 +44,42 @@ from .sql_base import SQLError, SQLSchemaError, SQLConnectError, \
 # instantiated by the initDB call. This object/instance should NEVER,
 # EVER be exposed to the calling applications.
 
+# connection pools of this process, keyed by the connection parameters
+__pools = {}
+
+
+def __get_pool(backend, host, port, username, password, database, sslmode, sslrootcert):
+    key = (backend, host, port, username, password, database, sslmode, sslrootcert)
+    if key not in __pools:
+        db_class = dbi.get_database_class(backend=backend)
+        min_size, max_size, check_interval = 0, 1, 30
+        if CFG is not None and CFG.is_initialized():
+            min_size = int(CFG.get('db_pool_min_size', min_size))
+            max_size = int(CFG.get('db_pool_max_size', max_size))
+            check_interval = int(CFG.get('db_pool_check_interval', check_interval))
+        __pools[key] = ConnectionPool(
+            lambda: db_class(host, port, username, password, database, sslmode, sslrootcert),
+            min_size=min_size, max_size=max_size, check_interval=check_interval)
+    return __pools[key]
+
+
+def __release_DB(db):
+    """ Hand a connection back to the pool it came from. """
+    for key, pool in __pools.items():
+        if db.is_connected_to(*key):
+            pool.put(db)
+            return
+    db.close()
+
+
+def __close_DB(db):
+    """ Close a connection, freeing its place in the pool it came from. """
+    for key, pool in __pools.items():
+        if db.is_connected_to(*key):
+            pool.discard(db)
+            return
+    db.close()
+
 
 def __init__DB(backend, host, port, username, password, database, sslmode, sslrootcert):
     """
@@ -52,9 +91,7 @@ def __init__DB(backend, host, port, username, password, database, sslmode, sslro
     try:
         my_db = __DB
     except NameError:  # __DB has not been set up
-        db_class = dbi.get_database_class(backend=backend)
-        __DB = db_class(host, port, username, password, database, sslmode, sslrootcert)
-        __DB.connect()
+        __DB = __get_pool(backend, host, port, username, password, database, sslmode, sslrootcert).get()
         return
     else:
         del my_db
@@ -65,11 +102,9 @@ def __init__DB(backend, host, port, username, password, database, sslmode, sslro
         return
 
     __DB.commit()
-    __DB.close()
+    __release_DB(__DB)
     # now we have to get a different connection
-    __DB = dbi.get_database_class(backend=backend)(
-        host, port, username, password, database, sslmode, sslrootcert)
-    __DB.connect()
+    __DB = __get_pool(backend, host, port, username, password, database, sslmode, sslrootcert).get()
     return 0
 
 
@@ -130,6 +165,11 @@ def initDB(backend=None, host=None, port=None, username=None,
 
 
 def closeDB(committing=True, closing=True):
+    """
+    Forget the connection of initDB(). It is closed, or with closing=False
+    handed back to its pool, so that the next initDB() of this process
+    reuses it.
+    """
     global __DB
     try:
         my_db = __DB
@@ -140,14 +180,98 @@ def closeDB(committing=True, closing=True):
     if committing:
         __DB.commit()
     if closing:
-        __DB.close()
+        __close_DB(__DB)
+    else:
+        __release_DB(__DB)
     del __DB
     return
 
 
+def __new_DB():
+    """ Open a connection, outside of the pools, with the parameters of the
+        last initDB() call. """
+    db = __test_DB()
+    for key in __pools:
+        if db.is_connected_to(*key):
+            break
+    else:
+        raise SystemError("Database connection not from a pool")
+    new_db = dbi.get_database_class(backend=key[0])(*key[1:])
+    new_db.connect()
+    return new_db
+
+
+def listen(channel):
+    """
+    Open a database connection, outside of the pools, receiving the
+    notifications sent on channel. Wait for its fileno() to become readable
+    and read them with notifications(); close() it when done.
+
+    The same parameters as for the last initDB() call are used.
+    """
+    listener = __new_DB()
+    try:
+        listener.listen(channel)
+    except:
+        listener.close()
+        raise
+    return listener
+
+
+# the connections of the threads running a threadDB() block
+__thread_DBs = threading.local()
+
+
+@contextlib.contextmanager
+def threadDB():
+    """
+    Give the calling thread a database connection of its own: in the block,
+    the module functions called from this thread use it instead of the one
+    of initDB(). It is rolled back and closed when the block ends.
+
+    The same parameters as for the last initDB() call are used. The
+    connection does not come from the pool, which may only hold the one the
+    other threads are using.
+    """
+    thread_db = __new_DB()
+    __thread_DBs.db = thread_db
+    try:
+        yield
+    finally:
+        del __thread_DBs.db
+        try:
+            thread_db.rollback()
+        finally:
+            thread_db.close()
+
+
+# connections inherited from a parent process, see detachDB()
+__detached_DBs = []
+
+
+def detachDB():
+    """
+    Forget the database connection inherited from the parent process after a
+    fork, without closing it.
+
+    Closing the inherited connection in the child would end the server
+    session the parent is still using, so it is kept referenced (and never
+    used) until the child exits. Call initDB() afterwards to get a new one.
+    """
+    global __DB
+    try:
+        __detached_DBs.append(__DB)
+    except NameError:
+        return
+    del __DB
+
+
 # common function for testing the connection state (ie, __DB defined
 def __test_DB():
     global __DB
+    thread_db = getattr(__thread_DBs, 'db', None)
+    if thread_db is not None:
+        return thread_db
     try:
         return __DB
     except NameError:
@@ -195,11 +319,11 @@ def cursor():
     return db.cursor()
 
 
-def prepare(sql, blob_map=None):
+def prepare(sql, blob_map=None, server_side=False):
     db = __test_DB()
     if isinstance(sql, Statement):
         sql = sql.statement
-    return db.prepare(sql, blob_map=blob_map)
+    return db.prepare(sql, blob_map=blob_map, server_side=server_side)
 
 
 def execute(sql, *args, **kwargs):
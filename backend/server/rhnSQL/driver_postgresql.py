@@ -20,6 +20,10 @@
 import sys
 import string
 import re
+import hashlib
+import functools
+import itertools
+from collections import deque
 import psycopg2
 import psycopg2.extras
 
@@ -33,10 +37,21 @@ from rhn.UserDictCase import UserDictCase
 from spacewalk.server import rhnSQL
 
 from uyuni.common.usix import BufferType, raise_with_tb
-from spacewalk.common.rhnLog import log_debug, log_error
+from spacewalk.common.rhnLog import log_debug, log_error, log_level_enabled
+from spacewalk.common.rhnConfig import CFG
 from spacewalk.common.rhnException import rhnException
 from .const import POSTGRESQL
 
+# Number of converted statements kept by the process wide cache
+CONVERTED_QUERY_CACHE_SIZE = 1024
+# A statement is prepared on the server once it ran this many times
+PREPARE_THRESHOLD = 2
+# Maximum number of prepared statements per connection
+PREPARED_STATEMENTS_MAX = 256
+# Rows transferred at once from a server side cursor
+SERVER_SIDE_BATCH_SIZE = 1000
+PREPARABLE_QUERY = re.compile(r'\s*(select|insert|update|delete|with)\b', re.IGNORECASE)
+
 
 def convert_named_query_params(query):
     """
@@ -55,6 +70,86 @@ def convert_named_query_params(query):
     return new_query
 
 
+@functools.lru_cache(maxsize=CONVERTED_QUERY_CACHE_SIZE)
+def convert_named_query_params_cached(query):
+    """
+    convert_named_query_params() for statements that are run over and over,
+    the result is kept in a process wide LRU cache.
+    """
+    return convert_named_query_params(query)
+
+
+def convert_to_positional_params(query):
+    """
+    Convert a query with named parameters into one that uses the $1, $2, ...
+    parameters of PREPARE.
+
+    RETURNS: the new query and the parameter names, ordered by position
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1).lower()
+        if name not in names:
+            names.append(name)
+        return "$%d" % (names.index(name) + 1)
+
+    # a colon after another one is a cast (x::numeric), not a parameter
+    return re.sub(r'(?<![:\w]):(\w+)', replace, query), names
+
+
+class PreparedStatements:
+
+    """
+    Server side prepared statements of one connection, keyed by the
+    statement text with named parameters.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        # statement text -> EXECUTE statement, or None if it can't be prepared
+        self.statements = {}
+
+    def lookup(self, cursor, query):
+        """
+        Return the EXECUTE statement to run instead of query, preparing
+        query if it is run often enough, or None to run query as it is.
+        """
+        if query in self.statements:
+            return self.statements[query]
+        if len(self.statements) >= PREPARED_STATEMENTS_MAX or not PREPARABLE_QUERY.match(query):
+            return None
+        count = self.counts.get(query, 0) + 1
+        if count < PREPARE_THRESHOLD:
+            if len(self.counts) >= PREPARED_STATEMENTS_MAX * 4:
+                # statements built on the fly never run twice, forget them
+                self.counts.clear()
+            self.counts[query] = count
+            return None
+        self.counts.pop(query, None)
+        self.statements[query] = self._prepare(cursor, query)
+        return self.statements[query]
+
+    @staticmethod
+    def _prepare(cursor, query):
+        name = "rhn_%s" % hashlib.sha1(query.encode('utf-8')).hexdigest()[:20]
+        positional, names = convert_to_positional_params(query)
+        # a failed PREPARE must not abort the current transaction
+        cursor.execute("SAVEPOINT rhn_prepare")
+        try:
+            cursor.execute("PREPARE %s AS %s" % (name, positional))
+        except psycopg2.Error:
+            e = sys.exc_info()[1]
+            cursor.execute("ROLLBACK TO SAVEPOINT rhn_prepare")
+            log_debug(4, "Statement will not be prepared", query, e.pgerror)
+            return None
+        finally:
+            cursor.execute("RELEASE SAVEPOINT rhn_prepare")
+        if not names:
+            return "EXECUTE %s" % name
+        return "EXECUTE %s (%s)" % (name, ", ".join("%%(%s)s" % n for n in names))
+
+
 class Function(sql_base.Procedure):
 
     """
@@ -162,6 +257,8 @@ class Database(sql_base.Database):
             self.port = -1
 
         self.dbh = None
+        self.use_prepared_statements = CFG.is_initialized() and bool(int(CFG.get('db_prepared_statements', 0)))
+        self.prepared_statements = None
 
         sql_base.Database.__init__(self)
 
@@ -183,6 +280,9 @@ class Database(sql_base.Database):
                 raise AttributeError("Attribute sslrootcert needs to be set if sslmode is set.")
 
             self.dbh = psycopg2.connect(" ".join("%s=%s" % (k, re.escape(str(v))) for k, v in list(dsndata.items())))
+            # prepared statements belong to the database session
+            if self.use_prepared_statements:
+                self.prepared_statements = PreparedStatements()
 
             # convert all DECIMAL types to float (let Python to choose one)
             DEC2INTFLOAT = psycopg2.extensions.new_type(psycopg2._psycopg.DECIMAL.values,
@@ -199,6 +299,41 @@ class Database(sql_base.Database):
                 self.database, e.pgcode, e.pgerror,
                 "All attempts to connect to the database failed"), sys.exc_info()[2])
 
+    def close(self):
+        if self.dbh is not None:
+            self.dbh.close()
+            self.dbh = None
+
+    def listen(self, channel):
+        """
+        Receive the notifications sent on channel (NOTIFY or pg_notify()),
+        see notifications(). The connection is switched to autocommit for
+        them to arrive as soon as they are sent: use it for nothing else.
+        """
+        try:
+            self.dbh.autocommit = True
+            c = self.dbh.cursor()
+            c.execute('LISTEN "%s"' % channel.replace('"', '""'))
+            c.close()
+        except psycopg2.Error:
+            e = sys.exc_info()[1]
+            raise sql_base.SQLError("Cannot listen on %s: %s" % (channel, str(e)))
+
+    def fileno(self):
+        """ The socket of the connection, readable when notifications arrived """
+        return self.dbh.fileno()
+
+    def notifications(self):
+        """ The payloads of the notifications received since the last call """
+        try:
+            self.dbh.poll()
+        except psycopg2.Error:
+            e = sys.exc_info()[1]
+            raise sql_base.SQLError("Cannot receive notifications: %s" % str(e))
+        payloads = [n.payload for n in self.dbh.notifies]
+        del self.dbh.notifies[:]
+        return payloads
+
     def is_connected_to(self, backend, host, port, username, password,
                         database, sslmode, sslrootcert):
         if host is None or host == '' or host == 'localhost':
@@ -220,8 +355,10 @@ class Database(sql_base.Database):
                       "Exception information: %s" % sys.exc_info()[1])
             self.connect()  # only allow one try
 
-    def prepare(self, sql, force=0, blob_map=None):
-        return Cursor(dbh=self.dbh, sql=sql, force=force, blob_map=blob_map)
+    def prepare(self, sql, force=0, blob_map=None, server_side=False):
+        return Cursor(dbh=self.dbh, sql=sql, force=force, blob_map=blob_map,
+                      prepared_statements=self.prepared_statements,
+                      server_side=server_side)
 
     def execute(self, sql, *args, **kwargs):
         cursor = self.prepare(sql)
@@ -265,27 +402,46 @@ class Cursor(sql_base.Cursor):
 
     """ PostgreSQL specific wrapper over sql_base.Cursor. """
 
-    def __init__(self, dbh=None, sql=None, force=None, blob_map=None):
+    # Names of the server side cursors
+    _cursor_names = itertools.count()
 
+    def __init__(self, dbh=None, sql=None, force=None, blob_map=None, prepared_statements=None,
+                 server_side=False):
+
+        # A server side (named) cursor keeps the result set on the database
+        # server until the end of the transaction; the rows are transferred
+        # in batches of SERVER_SIDE_BATCH_SIZE while they are fetched.
+        self.server_side = server_side
+        self._rows = deque()
         sql_base.Cursor.__init__(self, dbh, sql, force)
         self.blob_map = blob_map
+        self.prepared_statements = prepared_statements
 
         # Accept Oracle style named query params, but convert for python-pgsql
         # under the hood:
         temp_sql = ""
         if self.sql is not None:
             temp_sql = self.sql
-        self.sql = convert_named_query_params(temp_sql)
+        self.named_sql = temp_sql
+        self.sql = convert_named_query_params_cached(temp_sql)
+
+    def _prepare(self, force=None):
+        if self.server_side:
+            # a named cursor runs a single statement, a new one is opened
+            # on every execute
+            return None
+        return sql_base.Cursor._prepare(self, force=force)
 
     def _prepare_sql(self):
         cursor = self.dbh.cursor()
         return cursor
 
     def _execute_wrapper(self, function, *p, **kw):
-        params = ','.join(["%s: %s" % (key, value) for key, value
-                           in list(kw.items())])
-        log_debug(5, "Executing SQL: \"%s\" with bind params: {%s}"
-                  % (self.sql, params))
+        if log_level_enabled(5):
+            params = ','.join(["%s: %s" % (key, value) for key, value
+                               in list(kw.items())])
+            log_debug(5, "Executing SQL: \"%s\" with bind params: {%s}"
+                      % (self.sql, params))
         if self.sql is None:
             raise rhnException("Cannot execute empty cursor")
         if self.blob_map:
@@ -318,8 +474,13 @@ class Cursor(sql_base.Cursor):
         PostgreSQL specific execution of the query.
         """
         params = UserDictCase(kwargs)
+        if self.server_side:
+            return self._execute_server_side(params)
+        sql = self.sql
+        if self.prepared_statements is not None and not self.blob_map:
+            sql = self.prepared_statements.lookup(self._real_cursor, self.named_sql) or sql
         try:
-            self._real_cursor.execute(self.sql, params)
+            self._real_cursor.execute(sql, params)
         except psycopg2.OperationalError:
             e = sys.exc_info()[1]
             raise sql_base.SQLError("Cannot execute SQL statement: %s" % str(e))
@@ -327,6 +488,46 @@ class Cursor(sql_base.Cursor):
         self.description = self._real_cursor.description
         return self._real_cursor.rowcount
 
+    def _execute_server_side(self, params):
+        self.close()
+        self._real_cursor = self.dbh.cursor(name="rhn_cursor_%d" % next(self._cursor_names))
+        try:
+            self._real_cursor.execute(self.sql, params)
+            # the description of a named cursor is only known after the
+            # first fetch, get the first batch right away
+            self._rows.extend(self._real_cursor.fetchmany(SERVER_SIDE_BATCH_SIZE))
+        except psycopg2.OperationalError:
+            e = sys.exc_info()[1]
+            raise sql_base.SQLError("Cannot execute SQL statement: %s" % str(e))
+
+        self.description = self._real_cursor.description
+        # the number of rows is unknown until all of them are fetched
+        return -1
+
+    def fetchone(self):
+        if not self.server_side:
+            return self._real_cursor.fetchone()
+        rows = self.fetchmany(1)
+        if rows:
+            return rows[0]
+        return None
+
+    def fetchmany(self, size):
+        if not self.server_side:
+            return self._real_cursor.fetchmany(size)
+        if len(self._rows) < size and self._real_cursor is not None:
+            self._rows.extend(self._real_cursor.fetchmany(max(size, SERVER_SIDE_BATCH_SIZE)))
+        return [self._rows.popleft() for _ in range(min(size, len(self._rows)))]
+
+    def fetchall(self):
+        if not self.server_side:
+            return self._real_cursor.fetchall()
+        rows = list(self._rows)
+        self._rows.clear()
+        if self._real_cursor is not None:
+            rows.extend(self._real_cursor.fetchall())
+        return rows
+
     def _executemany(self, *args, **kwargs):
         if not kwargs:
             return 0
@@ -354,6 +555,15 @@ class Cursor(sql_base.Cursor):
         self.description = self._real_cursor.description
         return results
 
+    def _copy_from(self, data):
+        # the statement has no parameters to convert
+        try:
+            self._real_cursor.copy_expert(self.named_sql, data)
+        except psycopg2.OperationalError:
+            e = sys.exc_info()[1]
+            raise sql_base.SQLError("Cannot execute SQL statement: %s" % str(e))
+        return self._real_cursor.rowcount
+
     def update_blob(self, table_name, column_name, where_clause, data,
                     **kwargs):
         """
@@ -368,4 +578,11 @@ class Cursor(sql_base.Cursor):
         c.execute(**kwargs)
 
     def close(self):
-        pass
+        if self.server_side and self._real_cursor is not None:
+            self._rows.clear()
+            try:
+                self._real_cursor.close()
+            except psycopg2.Error:
+                # the cursor is already gone with the transaction
+                pass
+            self._real_cursor = None
@@ -165,6 +165,14 @@ class Cursor:
         """
         return self._execute_wrapper(self._execute_values, sql, argslist, template, page_size, fetch)
 
+    def copy_from(self, data):
+        """
+        Run the prepared COPY ... FROM STDIN statement, reading the rows from
+        the file-like object data (text format: tab separated columns, \\N
+        for NULL).
+        """
+        return self._execute_wrapper(self._copy_from, data)
+
     def _execute_wrapper(self, function, *p, **kw):
         """
         Database specific execute wrapper. Mostly used just to catch DB
@@ -187,6 +195,9 @@ class Cursor:
     def _execute_values(self, *args, **kwargs):
         raise NotImplementedError()
 
+    def _copy_from(self, data):
+        raise NotImplementedError()
+
     def _execute_(self, args, kwargs):
         """ Database specific execution of the query. """
         raise NotImplementedError()
@@ -202,12 +213,15 @@ class Cursor:
         rows = self._real_cursor.fetchall()
         return rows
 
+    def fetchmany(self, size):
+        return self._real_cursor.fetchmany(size)
+
     def fetchone_dict(self):
         """
         Return a dictionary for the row returned mapping column name to
         it's value.
         """
-        ret = ociDict(self.description, self._real_cursor.fetchone())
+        ret = ociDict(self.description, self.fetchone())
 
         if len(ret) == 0:
             return None
@@ -217,7 +231,7 @@ class Cursor:
         """
         Fetch all rows as a list of dictionaries.
         """
-        rows = self._real_cursor.fetchall()
+        rows = self.fetchall()
 
         ret = []
         for x in rows:
@@ -228,6 +242,25 @@ class Cursor:
             return None
         return ret
 
+    def iterate(self, batch_size=1000):
+        """
+        Yield the rows of the executed query, fetching batch_size rows at a
+        time so that the whole result set is never held in memory.
+        """
+        while 1:
+            rows = self.fetchmany(batch_size)
+            if not rows:
+                return
+            for row in rows:
+                yield row
+
+    def iterate_dict(self, batch_size=1000):
+        """
+        Like iterate(), but yield dictionaries mapping column names to values.
+        """
+        for row in self.iterate(batch_size):
+            yield ociDict(self.description, row)
+
     def _is_sequence_type(self, val):
         if type(val) in (usix.ListType, usix.TupleType):
             return 1
@@ -278,8 +311,13 @@ class Database:
         # query:
         raise NotImplementedError()
 
-    def prepare(self, sql, force=0):
-        """ Prepare an SQL statement. """
+    def prepare(self, sql, force=0, server_side=False):
+        """
+        Prepare an SQL statement.
+
+        With server_side the result set stays on the database server and is
+        only transferred in batches while the rows are fetched.
+        """
         raise NotImplementedError()
 
     def commit(self):
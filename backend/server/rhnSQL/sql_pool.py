@@ -0,0 +1,139 @@
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Pool of database connections of one process
+#
+
+import os
+import threading
+import time
+
+from spacewalk.common.rhnLog import log_debug, log_error
+from .sql_base import SQLConnectError
+
+# Seconds to wait for a connection when all of them are in use
+POOL_WAIT_TIMEOUT = 60
+
+
+class ConnectionPool:
+
+    """
+    Keep connected Database objects for reuse.
+
+    At most max_size connections are open at any time, and min_size of them
+    are opened up front. A connection that sat idle for more than
+    check_interval seconds is checked (and reconnected if needed) before it
+    is handed out again.
+
+    The pool belongs to the process that created it: after a fork the
+    connections of the parent are left alone and new ones are opened.
+    """
+
+    def __init__(self, connect, min_size=0, max_size=1, check_interval=30):
+        self._connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.check_interval = check_interval
+        self._lock = threading.Condition()
+        self._pid = os.getpid()
+        # (database, time it was returned) pairs, the most recent last
+        self._idle = []
+        self._in_use = 0
+        # connections inherited from the parent process, never used again
+        self._detached = []
+        for _ in range(self.min_size):
+            self._idle.append((self._new_connection(), time.time()))
+
+    def _new_connection(self):
+        db = self._connect()
+        db.connect()
+        return db
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # closing them would end the sessions of the parent process
+            self._detached.extend(db for db, _ in self._idle)
+            self._idle = []
+            self._in_use = 0
+            self._pid = os.getpid()
+
+    def get(self):
+        """ Return a connected Database object, opening one if needed. """
+        with self._lock:
+            self._check_fork()
+            deadline = time.time() + POOL_WAIT_TIMEOUT
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise SQLConnectError(None, None, "All %d database connections are in use" % self.max_size)
+                self._lock.wait(remaining)
+            self._in_use += 1
+            if self._idle:
+                db, returned = self._idle.pop()
+            else:
+                db, returned = None, None
+
+        try:
+            if db is None:
+                log_debug(4, "Opening a new database connection")
+                db = self._new_connection()
+            elif time.time() - returned > self.check_interval:
+                db.check_connection()
+        except:
+            self._release_slot()
+            raise
+        return db
+
+    def put(self, db):
+        """
+        Give back a connection obtained with get(). Uncommitted changes are
+        rolled back; broken connections and the ones exceeding max_size
+        are closed.
+        """
+        with self._lock:
+            self._check_fork()
+        keep = True
+        # pylint: disable=W0702
+        try:
+            db.rollback()
+        except:
+            log_error("Dropping broken database connection")
+            keep = False
+
+        with self._lock:
+            if self._in_use > 0:
+                self._in_use -= 1
+            if keep and len(self._idle) + self._in_use < self.max_size:
+                self._idle.append((db, time.time()))
+                db = None
+            self._lock.notify()
+        if db is not None:
+            self._close(db)
+
+    def discard(self, db):
+        """ Close a connection obtained with get() instead of giving it back. """
+        with self._lock:
+            self._check_fork()
+        self._release_slot()
+        self._close(db)
+
+    def _release_slot(self):
+        with self._lock:
+            if self._in_use > 0:
+                self._in_use -= 1
+            self._lock.notify()
+
+    @staticmethod
+    def _close(db):
+        # pylint: disable=W0702
+        try:
+            db.close()
+        except:
+            pass
@@ -17,9 +17,9 @@
 # profiles.
 #
 
-import sys
-import time
-from uyuni.common.usix import DictType, raise_with_tb
+import hashlib
+import io
+from uyuni.common.usix import DictType
 from uyuni.common import rhn_rpm
 from spacewalk.common.rhnLog import log_debug
 from spacewalk.common.rhnException import rhnFault
@@ -120,12 +120,18 @@ class dbPackage:
          where pa.id = lookup_package_arch(:arch)
     """)
 
+    # arch label -> package type, the arches do not change at runtime
+    _package_types = {}
+
     def get_package_type_by_arch(self, arch):
+        if arch in self._package_types:
+            return self._package_types[arch]
         h = rhnSQL.prepare(self._query_get_package_type_by_arch)
         h.execute(arch=arch)
         row = h.fetchone_dict()
         if not row:
             return None
+        self._package_types[arch] = row['label']
         return row['label']
 
 
@@ -188,13 +194,6 @@ class Packages:
         """ produce a list of packages """
         return [a.nvrea for a in [a for a in list(self.__p.values()) if a.status != DELETED]]
 
-    def __expand_installtime(self, installtime):
-        """ Simulating the ternary operator, one liner is ugly """
-        if installtime:
-            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(installtime))
-        else:
-            return None
-
     def save_packages_byid(self, sysid, schedule=1):
         """ save the package list """
         log_debug(3, sysid, "Errata cache to run:", schedule,
@@ -203,69 +202,9 @@ class Packages:
         if not self.__changed:
             return 0
 
-        commits = 0
-
-        # get rid of the deleted packages
-        dlist = [a for a in list(self.__p.values()) if a.real and a.status in (DELETED, UPDATED)]
-        if dlist:
-            log_debug(4, sysid, len(dlist), "deleted packages")
-            h = rhnSQL.prepare("""
-            delete from rhnServerPackage
-            where server_id = :sysid
-            and name_id = :name_id
-            and evr_id = :evr_id
-            and ((:package_arch_id is null and package_arch_id is null)
-                or package_arch_id = :package_arch_id)
-            """)
-            h.executemany(**{
-                'sysid': [sysid] * len(dlist),
-                'name_id': [a.name_id for a in dlist],
-                'evr_id': [a.evr_id for a in dlist],
-                'package_arch_id': [a.package_arch_id for a in dlist],
-            })
-            commits = commits + len(dlist)
-            del dlist
-
-        # And now add packages
-        alist = [a for a in list(self.__p.values()) if a.status in (ADDED, UPDATED)]
-        if alist:
-            log_debug(4, sysid, len(alist), "added packages")
-            h = rhnSQL.prepare("""
-            insert into rhnServerPackage
-            (server_id, name_id, evr_id, package_arch_id, installtime)
-            values (:sysid, LOOKUP_PACKAGE_NAME(:n), LOOKUP_EVR(:e, :v, :r, :t),
-                LOOKUP_PACKAGE_ARCH(:a), TO_TIMESTAMP(:instime, 'YYYY-MM-DD HH24:MI:SS')
-            )
-            """)
-            # some fields are not allowed to contain empty string (varchar)
-
-            def lambdaae(a):
-                if a.e == '':
-                    return None
-                else:
-                    return a.e
-            package_data = {
-                'sysid': [sysid] * len(alist),
-                'n': [a.n for a in alist],
-                'v': [a.v for a in alist],
-                'r': [a.r for a in alist],
-                'e': list(map(lambdaae, alist)),
-                'a': [a.a for a in alist],
-                't': [a.t for a in alist],
-                'instime': [self.__expand_installtime(a.installtime) for a in alist],
-            }
-            try:
-                h.executemany(**package_data)
-                rhnSQL.commit()
-            except rhnSQL.SQLSchemaError:
-                e = sys.exc_info()[1]
-                # LOOKUP_PACKAGE_ARCH failed
-                if e.errno == 20243:
-                    log_debug(2, "Unknown package arch found", e)
-                    raise_with_tb(rhnFault(45, "Unknown package arch found"), sys.exc_info()[2])
-
-            commits = commits + len(alist)
-            del alist
+        commits = write_profile_changes(sysid, list(self.__p.values()))
+        if commits:
+            rhnSQL.commit()
 
         if schedule:
             # queue this server for an errata update
@@ -281,6 +220,32 @@ class Packages:
         self.__changed = 0
         return 0
 
+    # Same text the clients compute their digest of: one line per package,
+    # byte ordered, so it does not depend on the database collation
+    _query_profile_digest = rhnSQL.Statement("""
+        select encode(sha256(convert_to(
+                   string_agg(p.line, E'\\n' order by p.line collate "C"),
+                   'UTF8')), 'hex') digest
+          from (select distinct rpn.name || E'\\t' || coalesce(rpe.epoch, '') || E'\\t' ||
+                       rpe.version || E'\\t' || rpe.release || E'\\t' ||
+                       coalesce(rpa.label, '') line
+                  from rhnServerPackage sp
+                  join rhnPackageName rpn on rpn.id = sp.name_id
+                  join rhnPackageEVR rpe on rpe.id = sp.evr_id
+             left join rhnPackageArch rpa on rpa.id = sp.package_arch_id
+                 where sp.server_id = :sysid) p
+    """)
+
+    def get_profile_digest_byid(self, sysid):
+        """ sha256 of the package profile stored for the server """
+        h = rhnSQL.prepare(self._query_profile_digest)
+        h.execute(sysid=sysid)
+        row = h.fetchone_dict()
+        if not row or row['digest'] is None:
+            # no packages at all
+            return hashlib.sha256(b"").hexdigest()
+        return row['digest']
+
     _query_get_package_arches = rhnSQL.Statement("""
         select id, label
           from rhnPackageArch
@@ -316,7 +281,7 @@ class Packages:
             sp.name_id,
             sp.evr_id,
             sp.package_arch_id,
-            TO_CHAR(sp.installtime, 'YYYY-MM-DD HH24:MI:SS') installtime
+            extract(epoch from sp.installtime) installtime
         from
             rhnServerPackage sp,
             rhnPackageName rpn,
@@ -332,9 +297,8 @@ class Packages:
             if not t:
                 break
             t['arch'] = package_arches_hash[t['package_arch_id']]
-            if 'installtime' in t and t['installtime'] is not None:
-                t['installtime'] = time.mktime(time.strptime(t['installtime'],
-                                                             "%Y-%m-%d %H:%M:%S"))
+            if t['installtime'] is not None:
+                t['installtime'] = int(t['installtime'])
             p = dbPackage(t, real=1, name_id=t['name_id'], evr_id=t['evr_id'],
                           package_arch_id=t['package_arch_id'])
             self.__p[p.nvrea] = p
@@ -439,6 +403,212 @@ def update_errata_cache(server_id):
     update_needed_cache(server_id, 0)
 
 
+_query_lookup_names = """
+    WITH wanted (ordering, name) AS (
+      VALUES %s
+    ),
+    missing AS (
+      SELECT nextval('rhn_pkg_name_seq') AS id, wanted.*
+        FROM wanted
+        LEFT JOIN rhnPackageName
+          ON rhnPackageName.name = wanted.name
+       WHERE rhnPackageName.id IS NULL
+    )
+    INSERT INTO rhnPackageName (id, name)
+      SELECT id, name
+        FROM missing
+       ORDER BY ordering
+      ON CONFLICT DO NOTHING
+"""
+
+_query_select_names = """
+    WITH wanted (ordering, name) AS (
+      VALUES %s
+    )
+    SELECT wanted.name, rhnPackageName.id
+      FROM wanted
+      JOIN rhnPackageName
+        ON rhnPackageName.name = wanted.name
+"""
+
+_query_lookup_evrs = """
+    WITH wanted (ordering, epoch, version, release, type) AS (
+      VALUES %s
+    ),
+    missing AS (
+      SELECT nextval('rhn_pkg_evr_seq') AS id, wanted.*
+        FROM wanted
+        LEFT JOIN rhnPackageEVR
+          ON rhnPackageEVR.epoch IS NOT DISTINCT FROM wanted.epoch
+         AND rhnPackageEVR.version = wanted.version
+         AND rhnPackageEVR.release = wanted.release
+         AND (rhnPackageEVR.evr).type = wanted.type
+       WHERE rhnPackageEVR.id IS NULL
+    )
+    INSERT INTO rhnPackageEVR (id, epoch, version, release, evr)
+      SELECT id, epoch, version, release,
+             evr_t(epoch, version, release, type)
+        FROM missing
+       ORDER BY ordering
+      ON CONFLICT DO NOTHING
+"""
+
+_query_select_evrs = """
+    WITH wanted (ordering, epoch, version, release, type) AS (
+      VALUES %s
+    )
+    SELECT wanted.epoch, wanted.version, wanted.release, wanted.type, rhnPackageEVR.id
+      FROM wanted
+      JOIN rhnPackageEVR
+        ON rhnPackageEVR.epoch IS NOT DISTINCT FROM wanted.epoch
+       AND rhnPackageEVR.version = wanted.version
+       AND rhnPackageEVR.release = wanted.release
+       AND (rhnPackageEVR.evr).type = wanted.type
+"""
+
+# Typed, so that the VALUES columns are varchar even when all are NULL
+_template_evrs = "(%s, CAST(%s AS VARCHAR), CAST(%s AS VARCHAR), CAST(%s AS VARCHAR), CAST(%s AS VARCHAR))"
+
+_query_create_profile_changes = rhnSQL.Statement("""
+    create temporary table if not exists tmp_server_package_changes (
+        change           char(1),
+        name_id          numeric,
+        evr_id           numeric,
+        package_arch_id  numeric,
+        installtime      double precision
+    ) on commit delete rows
+""")
+
+_query_copy_profile_changes = rhnSQL.Statement("""
+    copy tmp_server_package_changes
+         (change, name_id, evr_id, package_arch_id, installtime)
+    from stdin
+""")
+
+_query_apply_profile_changes = rhnSQL.Statement("""
+    with deleted as (
+        delete from rhnServerPackage sp
+         using tmp_server_package_changes c
+         where c.change = 'D'
+           and sp.server_id = :sysid
+           and sp.name_id = c.name_id
+           and sp.evr_id = c.evr_id
+           and sp.package_arch_id is not distinct from c.package_arch_id
+        returning 1
+    ), updated as (
+        update rhnServerPackage sp
+           set installtime = to_timestamp(c.installtime),
+               created = current_timestamp
+          from tmp_server_package_changes c
+         where c.change = 'U'
+           and sp.server_id = :sysid
+           and sp.name_id = c.name_id
+           and sp.evr_id = c.evr_id
+           and sp.package_arch_id is not distinct from c.package_arch_id
+        returning 1
+    ), added as (
+        insert into rhnServerPackage
+               (server_id, name_id, evr_id, package_arch_id, installtime)
+        select :sysid, c.name_id, c.evr_id, c.package_arch_id,
+               to_timestamp(c.installtime)
+          from tmp_server_package_changes c
+         where c.change = 'A'
+        returning 1
+    )
+    select (select count(*) from deleted) +
+           (select count(*) from updated) +
+           (select count(*) from added) changes
+""")
+
+
+def write_profile_changes(sysid, packages):
+    """ Write the changed dbPackages of a server profile with a few set
+        statements: the ids of the new names and EVRs are looked up (or
+        created) for the whole batch, the changes are loaded with COPY and
+        applied by a single statement. Returns the number of changed rows.
+    """
+    deleted = []
+    updated = []
+    added = []
+    for p in packages:
+        if p.status == DELETED and p.real:
+            deleted.append(p)
+        elif p.status == UPDATED and p.real:
+            updated.append(p)
+        elif p.status in (ADDED, UPDATED):
+            added.append(p)
+    log_debug(4, sysid, "%d deleted, %d updated, %d added packages" %
+              (len(deleted), len(updated), len(added)))
+    if not deleted and not updated and not added:
+        return 0
+
+    lookup_package_ids(added)
+
+    data = io.StringIO()
+    for change, plist in (('D', deleted), ('U', updated), ('A', added)):
+        for p in plist:
+            data.write("%s\t%s\t%s\t%s\t%s\n" % (
+                change, p.name_id, p.evr_id, _copy_value(p.package_arch_id),
+                _copy_value(p.installtime)))
+    data.seek(0)
+
+    rhnSQL.prepare(_query_create_profile_changes).execute()
+    # left over from an earlier save in the same transaction
+    rhnSQL.prepare("delete from tmp_server_package_changes").execute()
+    rhnSQL.prepare(_query_copy_profile_changes).copy_from(data)
+    h = rhnSQL.prepare(_query_apply_profile_changes)
+    h.execute(sysid=sysid)
+    return h.fetchone_dict()['changes']
+
+
+def lookup_package_ids(packages):
+    """ Set the name, EVR and arch ids of new dbPackages. Missing names and
+        EVRs are created, in a fixed order so that concurrent registrations
+        do not deadlock.
+    """
+    if not packages:
+        return
+    # packages without an arch have none in the database either
+    arch_ids = {'': None}
+    h = rhnSQL.prepare("select id, label from rhnPackageArch")
+    h.execute()
+    for arch_id, label in h.fetchall():
+        arch_ids[label] = arch_id
+    for p in packages:
+        if p.a not in arch_ids:
+            log_debug(2, "Unknown package arch found", p.a)
+            raise rhnFault(45, "Unknown package arch found")
+
+    names = sorted(set(p.n for p in packages))
+    wanted = list(enumerate(names))
+    h = rhnSQL.prepare(_query_lookup_names)
+    h.execute_values(_query_lookup_names, wanted, fetch=False)
+    h = rhnSQL.prepare(_query_select_names)
+    name_ids = dict(h.execute_values(_query_select_names, wanted))
+
+    evrs = sorted(set((p.e or None, p.v, p.r, p.t) for p in packages),
+                  key=lambda k: (k[0] or '', k[1], k[2], k[3] or ''))
+    wanted = [(i,) + evr for i, evr in enumerate(evrs)]
+    h = rhnSQL.prepare(_query_lookup_evrs)
+    h.execute_values(_query_lookup_evrs, wanted, template=_template_evrs, fetch=False)
+    h = rhnSQL.prepare(_query_select_evrs)
+    evr_ids = dict(((e, v, r, t), evr_id) for e, v, r, t, evr_id
+                   in h.execute_values(_query_select_evrs, wanted, template=_template_evrs))
+
+    for p in packages:
+        p.name_id = name_ids[p.n]
+        p.evr_id = evr_ids[(p.e or None, p.v, p.r, p.t)]
+        p.package_arch_id = arch_ids[p.a]
+
+
+def _copy_value(value):
+    """ A column of the text format of COPY """
+    if value is None:
+        return "\\N"
+    return str(value).replace("\\", "\\\\").replace("\t", "\\t") \
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
 def processPackageKeyAssociations(header, checksum_type, checksum):
     provider_sql = rhnSQL.prepare("""
         insert into rhnPackageKeyAssociation
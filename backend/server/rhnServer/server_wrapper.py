@@ -68,6 +68,9 @@ class ServerWrapper(Packages, Hardware, History, SuseData):
     def dispose_packages(self):
         return Packages.dispose_packages(self, self.server["id"])
 
+    def get_profile_digest(self):
+        return Packages.get_profile_digest_byid(self, self.server["id"])
+
     def save_packages(self, schedule=1):
         """ wrapper for the Packages.save_packages_byid() which requires the sysid """
         ret = self.save_packages_byid(self.server["id"], schedule=schedule)
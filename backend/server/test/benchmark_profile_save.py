@@ -0,0 +1,144 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Time concurrent registrations saving a whole package profile, row by row
+# (one lookup function call per package) and with the bulk writer, against
+# the configured database. Every worker replaces the profile of an existing
+# system in a transaction that is rolled back: nothing is left behind.
+# The profiles are made of packages already in the database, so that the
+# workers do not wait for each other on new names and EVRs.
+#
+# Usage: benchmark_profile_save.py [concurrent registrations] [packages] [rounds]
+#
+
+import multiprocessing
+import sys
+import time
+
+from spacewalk.common.rhnConfig import initCFG
+from spacewalk.server import rhnSQL
+from spacewalk.server.rhnServer import server_packages
+
+ROW_BY_ROW_DELETE = """
+    delete from rhnServerPackage
+     where server_id = :sysid
+       and name_id = :name_id
+       and evr_id = :evr_id
+       and ((:package_arch_id is null and package_arch_id is null)
+           or package_arch_id = :package_arch_id)
+"""
+
+ROW_BY_ROW_INSERT = """
+    insert into rhnServerPackage
+           (server_id, name_id, evr_id, package_arch_id, installtime)
+    values (:sysid, LOOKUP_PACKAGE_NAME(:n), LOOKUP_EVR(:e, :v, :r, :t),
+            LOOKUP_PACKAGE_ARCH(:a), TO_TIMESTAMP(:instime, 'YYYY-MM-DD HH24:MI:SS'))
+"""
+
+
+def save_row_by_row(sysid, packages):
+    """ What save_packages_byid did before the bulk writer """
+    dlist = [p for p in packages if p.real and p.status in (server_packages.DELETED, server_packages.UPDATED)]
+    if dlist:
+        h = rhnSQL.prepare(ROW_BY_ROW_DELETE)
+        h.executemany(sysid=[sysid] * len(dlist),
+                      name_id=[p.name_id for p in dlist],
+                      evr_id=[p.evr_id for p in dlist],
+                      package_arch_id=[p.package_arch_id for p in dlist])
+    alist = [p for p in packages if p.status in (server_packages.ADDED, server_packages.UPDATED)]
+    if alist:
+        h = rhnSQL.prepare(ROW_BY_ROW_INSERT)
+        h.executemany(sysid=[sysid] * len(alist),
+                      n=[p.n for p in alist],
+                      e=[p.e for p in alist],
+                      v=[p.v for p in alist],
+                      r=[p.r for p in alist],
+                      t=[p.t for p in alist],
+                      a=[p.a for p in alist],
+                      instime=[time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(p.installtime))
+                               for p in alist])
+
+
+def new_profile(sysid, profile):
+    """ The dbPackages of a registration replacing the profile of sysid """
+    packages = server_packages.Packages()
+    packages.dispose_packages(sysid)
+    for package in profile:
+        packages.add_package(sysid, dict(package))
+    # pylint: disable=protected-access
+    return list(packages._Packages__p.values())
+
+
+def register(args):
+    bulk, sysid, profile = args
+    rhnSQL.initDB()
+    try:
+        packages = new_profile(sysid, profile)
+        start = time.time()
+        if bulk:
+            server_packages.write_profile_changes(sysid, packages)
+        else:
+            save_row_by_row(sysid, packages)
+        return time.time() - start
+    finally:
+        rhnSQL.rollback()
+        rhnSQL.closeDB()
+
+
+def profiles(count):
+    h = rhnSQL.prepare("""
+        select distinct pn.name, pe.epoch, pe.version, pe.release, pa.label arch, at.label type
+          from rhnPackage p
+          join rhnPackageName pn on pn.id = p.name_id
+          join rhnPackageEVR pe on pe.id = p.evr_id
+          join rhnPackageArch pa on pa.id = p.package_arch_id
+          join rhnArchType at on at.id = pa.arch_type_id
+         limit :count
+    """)
+    h.execute(count=count)
+    packages = [dict(row, installtime=1600000000 + i) for i, row in enumerate(h.fetchall_dict() or [])]
+    for i in range(len(packages), count):
+        packages.append({'name': 'benchmark-package-%d' % i, 'epoch': None, 'version': '1.0',
+                         'release': '1', 'arch': 'noarch', 'type': 'rpm', 'installtime': 1600000000})
+    return packages
+
+
+def main():
+    registrations = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 3000
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+
+    initCFG('server')
+    rhnSQL.initDB()
+    profile = profiles(count)
+    h = rhnSQL.prepare("select id from rhnServer order by id")
+    h.execute()
+    sysids = [row[0] for row in h.fetchall() or []][:registrations]
+    rhnSQL.closeDB()
+    if len(sysids) < registrations:
+        print("Only %d systems registered, %d needed" % (len(sysids), registrations))
+        return 1
+
+    with multiprocessing.get_context('fork').Pool(registrations) as pool:
+        for bulk in (False, True):
+            elapsed = []
+            start = time.time()
+            for _ in range(rounds):
+                elapsed.extend(pool.map(register, [(bulk, sysid, profile) for sysid in sysids]))
+            total = time.time() - start
+            print("%s: %d registrations of %d packages, %d at once: %.3fs, %.3fs per save" % (
+                bulk and "bulk" or "row by row", len(elapsed), count, registrations,
+                total, sum(elapsed) / len(elapsed)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
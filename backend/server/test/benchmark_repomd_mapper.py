@@ -0,0 +1,71 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Compare the time needed to render primary/filelists/other.xml for a
+# channel with the per-package and the bulk package mapper.
+#
+# Usage: benchmark_repomd_mapper.py <channel label> [chunk size]
+#
+
+import sys
+import time
+import io
+
+from spacewalk.common.rhnConfig import initCFG
+from spacewalk.server import rhnSQL
+from spacewalk.server.repomd import mapper, view
+
+
+def render(channel_id, pkg_mapper, chunk_size):
+    channel_mapper = mapper.ChannelMapper(pkg_mapper, None, mapper.SqlRepoMDMapper(),
+                                          chunk_size=chunk_size)
+    channel = channel_mapper.get_channel(channel_id)
+    views = [view_class(channel, io.StringIO())
+             for view_class in (view.PrimaryView, view.FilelistsView, view.OtherView)]
+
+    start = time.time()
+    for viewobj in views:
+        viewobj.write_start()
+    for package in channel.packages:
+        for viewobj in views:
+            viewobj.write_package(package)
+    for viewobj in views:
+        viewobj.write_end()
+    return channel.num_packages, time.time() - start
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.stderr.write("Usage: %s <channel label> [chunk size]\n" % sys.argv[0])
+        return 1
+    label = sys.argv[1]
+    chunk_size = mapper.BULK_CHUNK_SIZE
+    if len(sys.argv) > 2:
+        chunk_size = int(sys.argv[2])
+
+    initCFG("server.xmlrpc")
+    rhnSQL.initDB()
+    row = rhnSQL.fetchone_dict("select id from rhnChannel where label = :label", label=label)
+    if not row:
+        sys.stderr.write("No such channel: %s\n" % label)
+        return 1
+
+    count, single = render(row['id'], mapper.SqlPackageMapper(), 1)
+    print("per-package mapper: %d packages in %.2fs" % (count, single))
+    count, bulk = render(row['id'], mapper.BulkSqlPackageMapper(), chunk_size)
+    print("bulk mapper (chunk %d): %d packages in %.2fs" % (chunk_size, count, bulk))
+    if bulk:
+        print("speedup: %.1fx" % (single / bulk))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Time the named parameter conversion of the PostgreSQL driver with and
+# without the statement cache and, with --db, run a typical lookup against
+# the configured database with and without server side prepared statements.
+#
+# Usage: benchmark_rhnsql_prepare.py [iterations] [--db]
+#
+
+import sys
+import time
+
+from spacewalk.common.rhnConfig import CFG, initCFG
+from spacewalk.server.rhnSQL import driver_postgresql
+
+QUERY = """
+    select p.id, p.path, c.checksum_type, c.checksum
+      from rhnPackage p
+      join rhnPackageName pn on pn.id = p.name_id
+      join rhnPackageEVR pe on pe.id = p.evr_id
+      join rhnChecksumView c on c.id = p.checksum_id
+     where pn.name = :name
+       and pe.version = :version
+       and pe.release = :release
+       and p.org_id = :org_id
+"""
+
+
+def timed(function, iterations):
+    start = time.time()
+    for _ in range(iterations):
+        function()
+    return time.time() - start
+
+
+def benchmark_conversion(iterations):
+    uncached = timed(lambda: driver_postgresql.convert_named_query_params(QUERY), iterations)
+    cached = timed(lambda: driver_postgresql.convert_named_query_params_cached(QUERY), iterations)
+    print("convert query %d times: uncached %.3fs, cached %.3fs" % (iterations, uncached, cached))
+
+
+def benchmark_database(iterations):
+    initCFG('server')
+    for prepared in (False, True):
+        db = driver_postgresql.Database(CFG.DB_HOST, CFG.DB_PORT and int(CFG.DB_PORT), CFG.DB_USER,
+                                        CFG.DB_PASSWORD, CFG.DB_NAME)
+        db.use_prepared_statements = prepared
+        db.connect()
+        try:
+            def lookup():
+                h = db.prepare(QUERY)
+                h.execute(name='kernel-default', version='1.0', release='1', org_id=1)
+                h.fetchall_dict()
+            elapsed = timed(lookup, iterations)
+        finally:
+            db.rollback()
+            db.close()
+        print("run query %d times: prepared statements %s, %.3fs" %
+              (iterations, prepared and "on" or "off", elapsed))
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != '--db']
+    iterations = 10000
+    if args:
+        iterations = int(args[0])
+
+    benchmark_conversion(iterations)
+    if '--db' in sys.argv:
+        benchmark_database(iterations)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
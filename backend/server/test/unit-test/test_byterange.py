@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+"""
+Tests for the multiple byte range support of common/byterange.
+"""
+
+import io
+
+import pytest
+
+from spacewalk.common import byterange
+
+
+def test_multiple_byteranges_are_sorted_and_merged():
+    ranges = byterange.parse_multiple_byteranges("bytes=50-59, 0-9,5-19,-10", 100)
+
+    assert ranges == [(0, 20), (50, 60), (90, 100)]
+
+
+def test_multiple_byteranges_skip_unsatisfiable_ones():
+    assert byterange.parse_multiple_byteranges("bytes=200-300,0-0", 100) == [(0, 1)]
+    with pytest.raises(byterange.UnsatisfyableByteRangeException):
+        byterange.parse_multiple_byteranges("bytes=200-300", 100)
+    with pytest.raises(byterange.InvalidByteRangeException):
+        byterange.parse_multiple_byteranges("bytes=0-9,x", 100)
+
+
+def test_end_past_file_size_is_clamped():
+    assert byterange.parse_byteranges("bytes=10-500", 100) == (10, 100)
+
+
+def test_multipart_byteranges():
+    data = bytes(range(100))
+    parts, length = byterange.multipart_byteranges([(0, 10), (90, 100)], 100, "application/x-rpm", "XYZ")
+
+    body = b""
+    for header, start, end in parts:
+        body += header + data[start:end]
+    body += byterange.multipart_trailer("XYZ")
+
+    assert len(body) == length
+    assert body.startswith(b"\r\n--XYZ\r\nContent-Type: application/x-rpm\r\nContent-Range: bytes 0-9/100\r\n\r\n")
+    assert body.endswith(data[90:] + b"\r\n--XYZ--\r\n")
+
+
+def test_file_range_reads_only_the_range():
+    file_obj = io.BytesIO(bytes(range(100)))
+    body = byterange.FileRange(file_obj, 10, 15)
+
+    assert file_obj.tell() == 10
+    assert body.read(10) == bytes(range(10, 20))
+    assert body.read() == bytes(range(20, 25))
+    assert body.read(10) == b""
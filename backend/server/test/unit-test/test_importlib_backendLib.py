@@ -0,0 +1,63 @@
+#!/usr/bin/python3
+"""
+Tests for the bulk lookups of the importlib table helpers.
+"""
+
+from unittest.mock import MagicMock
+
+from spacewalk.server.importlib.backendLib import DBint, DBstring, Table, TableLookup
+
+
+TABLE = Table('rhnSample',
+              fields={
+                  'id': DBint(),
+                  'org_id': DBint(),
+                  'name': DBstring(128),
+              },
+              pk=['org_id', 'name'],
+              nullable=['org_id'],
+              )
+
+
+class FakeCursor:
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.description = None
+        self.calls = []
+
+    def execute_values(self, sql, argslist, template=None, page_size=1000, fetch=True):
+        self.calls.append((argslist, template))
+        self.description = [('ordering',), ('id',), ('org_id',), ('name',)]
+        if "t.org_id is null" in sql:
+            return [(i, 100 + i, None, name) for i, name in argslist if name != "missing"]
+        return [(i, 200 + i, org_id, name) for i, org_id, name in argslist]
+
+
+def test_query_many_groups_by_null_columns():
+    cursors = []
+
+    def prepare(sql):
+        cursors.append(FakeCursor(sql))
+        return cursors[-1]
+
+    lookup = TableLookup(TABLE, MagicMock(prepare=prepare))
+    objects = [{'org_id': 1, 'name': 'a'}, {'org_id': None, 'name': 'b'},
+               {'org_id': '', 'name': 'missing'}, {'org_id': 2, 'name': 'c'}]
+
+    rows = lookup.queryMany(objects)
+
+    assert rows == [{'id': 200, 'org_id': 1, 'name': 'a'},
+                    {'id': 101, 'org_id': None, 'name': 'b'},
+                    None,
+                    {'id': 203, 'org_id': 2, 'name': 'c'}]
+    assert len(cursors) == 2
+    by_nullness = dict(("is null" in c.sql, c.calls) for c in cursors)
+    assert by_nullness[False] == [([[0, 1, 'a'], [3, 2, 'c']], "(%s::numeric, %s::numeric, %s::varchar)")]
+    assert by_nullness[True] == [([[1, 'b'], [2, 'missing']], "(%s::numeric, %s::varchar)")]
+
+
+def test_query_many_empty():
+    lookup = TableLookup(TABLE, MagicMock())
+
+    assert lookup.queryMany([]) == []
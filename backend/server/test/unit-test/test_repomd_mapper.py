@@ -0,0 +1,130 @@
+#!/usr/bin/python3
+"""
+Tests for the bulk repomd package mapper.
+
+The database is replaced by canned rows, so the tests compare the packages
+built by the bulk mapper against the ones built by the per-package mapper.
+"""
+
+import datetime
+from unittest.mock import patch
+
+import pytest
+from spacewalk.server.repomd import mapper
+
+
+# string_to_unicode() passes bytes through untouched
+TIMESTAMP = datetime.datetime(2020, 1, 1, 10, 0, 0)
+
+DETAILS = {
+    1: ("pkg-a", "1.0", "1", None, "x86_64", "abc", b"summary a", b"desc a",
+        b"vendor", TIMESTAMP, 100, 200, 300, 10, 20, "group", "host", b"GPL",
+        "packages/1/pkg-a-1.0-1.x86_64.rpm", "pkg-a-1.0-1.src.rpm",
+        TIMESTAMP, "sha256"),
+    2: ("pkg-b", "2.0", "3", "1", "noarch", "def", b"summary b", b"desc b",
+        b"vendor", TIMESTAMP, 101, 201, 301, 11, 21, "group", "host", b"MIT",
+        None, "pkg-b-2.0-3.src.rpm", TIMESTAMP, "sha256"),
+}
+
+PRCO = {
+    1: [("provides", 8, b"pkg-a", "1.0-1"), ("requires", 0, b"/bin/sh", None),
+        ("requires", 12, b"pkg-b", "1:2.0-3")],
+    2: [("provides", 8, b"pkg-b", "1:2.0-3"), ("obsoletes", 2, b"pkg-old", "1.0")],
+}
+
+FILES = {
+    1: [(b"/usr/bin/a",), (b"/etc/a.conf",)],
+    2: [(b"/usr/share/b",)],
+}
+
+CHANGELOG = {
+    1: [(b"Some One <one@example.com>", b"- initial", TIMESTAMP)],
+    2: [],
+}
+
+
+class FakeCursor:
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.rows = []
+
+    def execute(self, package_id):
+        package_id = int(package_id)
+        if "rhnPackageChangelog" in self.sql:
+            self.rows = CHANGELOG[package_id]
+        elif "rhnPackageFile" in self.sql:
+            self.rows = FILES[package_id]
+        elif "rhnPackageProvides" in self.sql:
+            self.rows = PRCO[package_id]
+        elif "to_char" in self.sql:
+            self.rows = [("20200101100000",)]
+        else:
+            self.rows = [DETAILS[package_id]]
+
+    def fetchone(self):
+        return self.rows[0]
+
+    def fetchall(self):
+        return self.rows
+
+    def execute_values(self, sql, argslist, template=None, page_size=1000, fetch=True):
+        assert page_size >= len(argslist)
+        package_ids = [arg[0] for arg in argslist]
+        rows = []
+        for package_id in package_ids:
+            if "rhnPackageChangelog" in sql:
+                rows.extend((package_id,) + row for row in CHANGELOG[package_id])
+            elif "rhnPackageFile" in sql:
+                rows.extend((package_id,) + row for row in FILES[package_id])
+            elif "rhnPackageProvides" in sql:
+                rows.extend((package_id,) + row for row in PRCO[package_id])
+            elif "to_char" in sql:
+                rows.append((package_id, "20200101100000"))
+            elif package_id in DETAILS:
+                rows.append(DETAILS[package_id] + (package_id,))
+        return rows
+
+
+@pytest.fixture
+def fake_db():
+    with patch("spacewalk.server.repomd.mapper.rhnSQL.prepare", side_effect=FakeCursor) as prepare:
+        yield prepare
+
+
+def test_bulk_mapper_matches_per_package_mapper(fake_db):
+    single = mapper.SqlPackageMapper()
+    bulk = mapper.BulkSqlPackageMapper()
+
+    packages = bulk.get_packages([2, 1])
+
+    assert [package.id for package in packages] == [2, 1]
+    for package in packages:
+        expected = single.get_package(package.id)
+        assert vars(package) == vars(expected)
+
+
+def test_bulk_mapper_skips_missing_packages(fake_db):
+    bulk = mapper.BulkSqlPackageMapper()
+    packages = bulk.get_packages([1, 3])
+
+    assert [package.id for package in packages] == [1]
+
+
+def test_bulk_mapper_last_modified(fake_db):
+    bulk = mapper.BulkSqlPackageMapper()
+
+    assert bulk.last_modified_packages([1, 2]) == {1: "20200101100000", 2: "20200101100000"}
+    assert bulk.last_modified_packages([]) == {}
+
+
+def test_channel_mapper_chunks_packages(fake_db):
+    pkg_mapper = mapper.BulkSqlPackageMapper()
+    with patch.object(pkg_mapper, "get_packages", wraps=pkg_mapper.get_packages) as get_packages:
+        channel_mapper = mapper.ChannelMapper(pkg_mapper, None, None, chunk_size=1)
+        assert [p.id for p in channel_mapper._package_generator([(1,), (2,)])] == [1, 2]
+        assert get_packages.call_count == 0
+
+        channel_mapper.chunk_size = 2
+        assert [p.id for p in channel_mapper._package_generator([(1,), (2,)])] == [1, 2]
+        assert get_packages.call_count == 1
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""
+Tests for the repomd metadata file generation.
+"""
+
+import gzip
+import hashlib
+import io
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+from spacewalk.common import rhnCache
+from spacewalk.server.repomd import domain, repository
+
+
+class CacheFile(io.BytesIO):
+
+    """ BytesIO keeping its content after close, like a cache file. """
+
+    def close(self):
+        self.content = self.getvalue()
+        io.BytesIO.close(self)
+
+
+def test_writer_produces_plain_and_gzip_file_with_checksums():
+    plain_file = CacheFile()
+    gzip_file = CacheFile()
+    checksums = {}
+
+    writer = repository.MetadataFileWriter(plain_file, gzip_file, "sha256", checksums.update)
+    writer.write("<metadata>")
+    writer.write("ü" * 100000)
+    writer.write(b"</metadata>")
+    writer.close()
+
+    assert plain_file.content == ("<metadata>" + "ü" * 100000).encode("utf-8") + b"</metadata>"
+    assert gzip.decompress(gzip_file.content) == plain_file.content
+    assert checksums == {
+        "open_checksum": hashlib.sha256(plain_file.content).hexdigest(),
+        "gzip_checksum": hashlib.sha256(gzip_file.content).hexdigest(),
+    }
+
+
+def test_writer_close_is_idempotent():
+    calls = []
+    writer = repository.MetadataFileWriter(CacheFile(), CacheFile(), "sha1", calls.append)
+    writer.close()
+    writer.close()
+
+    assert len(calls) == 1
+
+
+def test_gzip_output_has_no_timestamp():
+    first = io.BytesIO()
+    second = io.BytesIO()
+    for fileobj in (first, second):
+        gzip_file = repository.NoTimeStampGzipFile(mode="wb", fileobj=fileobj)
+        gzip_file.write(b"data")
+        gzip_file.close()
+
+    assert first.getvalue() == second.getvalue()
+    assert first.getvalue()[4:8] == b"\x00\x00\x00\x00"
+
+
+class FakePackageMapper:
+
+    """ Package mapper serving packages from a dictionary. """
+
+    def __init__(self, packages, last_modified):
+        self.packages = packages
+        self.last_modified = last_modified
+        self.loaded = []
+
+    def last_modified_packages(self, package_ids):
+        return dict((package_id, self.last_modified[package_id]) for package_id in package_ids)
+
+    def get_packages(self, package_ids):
+        self.loaded.extend(package_ids)
+        return [self.packages[package_id] for package_id in package_ids]
+
+
+def make_package(package_id):
+    package = domain.Package(package_id)
+    package.name = "pkg-%d" % package_id
+    package.version = "1.0"
+    package.release = "1"
+    package.arch = "noarch"
+    package.checksum = "%040d" % package_id
+    package.checksum_type = "sha1"
+    for attr in ("summary", "description", "vendor", "copyright", "package_group",
+                 "build_host", "source_rpm"):
+        setattr(package, attr, attr)
+    for attr in ("build_time", "package_size", "installed_size", "payload_size",
+                 "header_start", "header_end"):
+        setattr(package, attr, package_id)
+    package.filename = "pkg-%d-1.0-1.noarch.rpm" % package_id
+    package.files = ["/usr/bin/pkg-%d" % package_id]
+    return package
+
+
+@pytest.fixture
+def channel_repository(tmpdir):
+    packages = dict((package_id, make_package(package_id)) for package_id in (1, 2, 3))
+    pkg_mapper = FakePackageMapper(packages, dict((package_id, "20200101100000") for package_id in packages))
+
+    channel = domain.Channel(10)
+    channel.label = channel.name = "channel"
+    channel.checksum_type = "sha1"
+    channel.package_ids = [1, 2, 3]
+    channel.num_packages = 3
+
+    def get_repository():
+        repo = repository.Repository({"id": 10, "last_modified": "20200101100000"})
+        channel.packages = iter([packages[package_id] for package_id in channel.package_ids])
+        repo._channel = channel
+        return repo
+
+    with patch.object(rhnCache, "CACHEDIR", str(tmpdir)), \
+            patch.object(repository.mapper, "get_sql_package_mapper", return_value=pkg_mapper), \
+            patch.object(repository.mapper, "get_bulk_chunk_size", return_value=2):
+        yield get_repository, pkg_mapper
+
+
+def generate_primary(repo, incremental):
+    with patch.object(repository.CFG, "get", create=True,
+                      side_effect=lambda key, default=None: incremental):
+        repo.generate_files([repo.get_primary_view()])
+    return repo.get_primary_xml_file().read()
+
+
+def test_incremental_generation_matches_full_generation(channel_repository):
+    get_repository, pkg_mapper = channel_repository
+
+    full = generate_primary(get_repository(), 0)
+    incremental = generate_primary(get_repository(), 1)
+
+    assert incremental == full
+    assert pkg_mapper.loaded == [1, 2, 3]
+
+
+def test_incremental_generation_renders_only_changed_packages(channel_repository):
+    get_repository, pkg_mapper = channel_repository
+
+    generate_primary(get_repository(), 1)
+    pkg_mapper.loaded = []
+    pkg_mapper.last_modified[2] = "20200102100000"
+    pkg_mapper.packages[2].summary = "new summary"
+
+    primary = generate_primary(get_repository(), 1)
+
+    assert pkg_mapper.loaded == [2]
+    assert b"<summary>new summary</summary>" in primary
+
+
+def test_updateinfo_worker_is_retried_in_the_request_thread(tmpdir):
+    threads = []
+
+    def generate_updateinfo(repo):
+        threads.append(threading.current_thread())
+        if len(threads) == 1:
+            raise Exception("server closed the connection unexpectedly")
+
+    with patch.object(rhnCache, "CACHEDIR", str(tmpdir)), \
+            patch.object(repository.CFG, "get", create=True, return_value=1), \
+            patch.object(repository.rhnSQL, "threadDB", MagicMock()) as thread_db, \
+            patch.object(repository.Repository, "generate_updateinfo", generate_updateinfo):
+        repo = repository.Repository({"id": 10, "last_modified": "20200101100000"})
+        worker = repo.start_updateinfo_worker()
+        repo.join_updateinfo_worker(worker)
+
+    assert thread_db.called
+    assert worker.failed
+    assert threads == [worker, threading.current_thread()]
@@ -0,0 +1,57 @@
+#!/usr/bin/python3
+"""
+Tests for the bulk package lookup used by reposync.
+"""
+
+from unittest.mock import MagicMock, patch
+
+from spacewalk.server import rhnPackage
+
+
+def _lookup(rows, pkgs, channel_id=10, org_id=1):
+    cursor = MagicMock()
+    cursor.execute_values.return_value = rows
+    with patch("spacewalk.server.rhnPackage.rhnSQL.prepare", return_value=cursor):
+        return rhnPackage.get_info_for_packages(pkgs, channel_id, org_id), cursor
+
+
+def test_get_info_for_packages_groups_rows_by_input_position():
+    pkgs = [["pkg-a", "1.0", "1", "0", "x86_64"],
+            ["pkg-b", "2.0", "1", "3", "noarch"],
+            ["pkg-c", "1.0", "1", "", "x86_64"]]
+    rows = [(0, "path/a", 10, "sha256", "aaa", 1, None),
+            (0, "path/a2", None, "sha256", "bbb", None, None),
+            (1, "path/b", None, "sha1", "ccc", 1, "3")]
+
+    result, cursor = _lookup(rows, pkgs)
+
+    assert result == [
+        [{'path': "path/a", 'channel_id': 10, 'checksum_type': "sha256", 'checksum': "aaa",
+          'org_id': "1", 'epoch': None},
+         {'path': "path/a2", 'channel_id': None, 'checksum_type': "sha256", 'checksum': "bbb",
+          'org_id': "", 'epoch': None}],
+        [{'path': "path/b", 'channel_id': None, 'checksum_type': "sha1", 'checksum': "ccc",
+          'org_id': "1", 'epoch': "3"}],
+        [],
+    ]
+    sql, wanted = cursor.execute_values.call_args[0]
+    assert "cp.channel_id = 10" in sql
+    assert "p.org_id = 1" in sql
+    # epoch "0" and "" both mean "no epoch"
+    assert wanted == [(0, "pkg-a", "1.0", "1", None, "x86_64"),
+                      (1, "pkg-b", "2.0", "1", "3", "noarch"),
+                      (2, "pkg-c", "1.0", "1", None, "x86_64")]
+
+
+def test_get_info_for_packages_without_org():
+    result, cursor = _lookup([], [["pkg-a", "1.0", "1", None, "x86_64"]], org_id=None)
+
+    assert result == [[]]
+    assert "p.org_id is null" in cursor.execute_values.call_args[0][0]
+
+
+def test_get_info_for_packages_empty():
+    result, cursor = _lookup([], [])
+
+    assert result == []
+    assert not cursor.execute_values.called
@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+"""
+Tests for the rhnSQL connection pool.
+"""
+
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from spacewalk.server import rhnSQL
+from spacewalk.server.rhnSQL import sql_pool
+from spacewalk.server.rhnSQL.sql_base import SQLConnectError
+from spacewalk.server.rhnSQL.sql_pool import ConnectionPool
+
+
+class FakeDatabase:
+
+    def __init__(self, broken=False):
+        self.connects = 0
+        self.checks = 0
+        self.rollbacks = 0
+        self.closed = False
+        self.broken = broken
+
+    def connect(self):
+        self.connects += 1
+
+    def check_connection(self):
+        self.checks += 1
+
+    def rollback(self):
+        if self.broken:
+            raise Exception("server closed the connection unexpectedly")
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
+
+
+def test_connections_are_reused():
+    created = []
+
+    def connect():
+        created.append(FakeDatabase())
+        return created[-1]
+
+    pool = ConnectionPool(connect, max_size=2)
+
+    db = pool.get()
+    pool.put(db)
+
+    assert pool.get() is db
+    assert len(created) == 1
+    assert db.connects == 1
+    assert db.rollbacks == 1
+    assert db.checks == 0
+
+
+def test_min_size_connections_are_opened_up_front():
+    pool = ConnectionPool(FakeDatabase, min_size=2, max_size=4)
+
+    assert len(pool._idle) == 2
+    assert pool._in_use == 0
+
+
+def test_idle_connection_is_checked():
+    pool = ConnectionPool(FakeDatabase, check_interval=0)
+    db = pool.get()
+    pool.put(db)
+
+    with patch("spacewalk.server.rhnSQL.sql_pool.time.time", side_effect=lambda: 10 ** 10):
+        assert pool.get() is db
+    assert db.checks == 1
+
+
+def test_broken_and_surplus_connections_are_dropped():
+    pool = ConnectionPool(FakeDatabase, max_size=1)
+    broken = pool.get()
+    broken.broken = True
+    pool.put(broken)
+
+    assert broken.closed
+    assert pool._idle == []
+    assert pool._in_use == 0
+    assert pool.get() is not broken
+
+
+def test_get_waits_for_a_free_connection():
+    pool = ConnectionPool(FakeDatabase, max_size=1)
+    db = pool.get()
+    got = []
+
+    waiter = threading.Thread(target=lambda: got.append(pool.get()))
+    waiter.start()
+    pool.put(db)
+    waiter.join(5)
+
+    assert got == [db]
+
+
+def test_get_gives_up_when_exhausted():
+    pool = ConnectionPool(FakeDatabase, max_size=1)
+    pool.get()
+
+    with patch.object(sql_pool, "POOL_WAIT_TIMEOUT", 0):
+        with pytest.raises(SQLConnectError):
+            pool.get()
+
+
+def test_connections_of_the_parent_process_are_not_used():
+    pool = ConnectionPool(FakeDatabase, min_size=1)
+    parent_db = pool._idle[0][0]
+
+    with patch("spacewalk.server.rhnSQL.sql_pool.os.getpid", return_value=-1):
+        db = pool.get()
+
+    assert db is not parent_db
+    assert not parent_db.closed
+
+
+class FakeBackendDatabase(FakeDatabase):
+
+    """ A database of the rhnSQL module functions. """
+
+    def __init__(self, *params):
+        FakeDatabase.__init__(self)
+        self.params = params
+
+    def is_connected_to(self, backend, *params):
+        return params == self.params
+
+    def commit(self):
+        pass
+
+    def prepare(self, sql, **kwargs):
+        return self
+
+
+@pytest.fixture
+def backend():
+    with patch.object(rhnSQL.dbi, "get_database_class", return_value=FakeBackendDatabase), \
+            patch.dict(getattr(rhnSQL, "__pools"), clear=True):
+        rhnSQL.initDB("postgresql", "localhost", 5432, "spacewalk", "secret", "susemanager")
+        yield
+        rhnSQL.closeDB(committing=False)
+
+
+def test_thread_db_is_used_by_its_thread_only(backend):
+    used = {}
+
+    def worker():
+        with rhnSQL.threadDB():
+            used["in block"] = rhnSQL.prepare("select 1")
+        used["after block"] = rhnSQL.prepare("select 1")
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    thread.join()
+    db = rhnSQL.prepare("select 1")
+
+    assert used["in block"] is not db
+    assert used["after block"] is db
+    assert used["in block"].rollbacks == 1
+    assert used["in block"].closed
+
+
+def test_close_db_closes_the_connection(backend):
+    db = rhnSQL.prepare("select 1")
+    rhnSQL.closeDB()
+
+    assert db.closed
+    rhnSQL.initDB("postgresql", "localhost", 5432, "spacewalk", "secret", "susemanager")
+    assert rhnSQL.prepare("select 1") is not db
+
+
+def test_close_db_without_closing_keeps_the_connection_for_reuse(backend):
+    db = rhnSQL.prepare("select 1")
+    rhnSQL.closeDB(closing=False)
+
+    assert not db.closed
+    rhnSQL.initDB("postgresql", "localhost", 5432, "spacewalk", "secret", "susemanager")
+    assert rhnSQL.prepare("select 1") is db
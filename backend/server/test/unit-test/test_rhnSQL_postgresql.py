@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+"""
+Tests for the statement handling of the PostgreSQL rhnSQL driver.
+"""
+
+from unittest.mock import MagicMock, patch
+
+import psycopg2
+import pytest
+
+from spacewalk.server.rhnSQL import driver_postgresql, sql_base
+from spacewalk.server.rhnSQL.driver_postgresql import Cursor, PreparedStatements
+
+
+QUERY = "select id from rhnServer where org_id = :org_id and name = :NAME and id > :org_id"
+
+
+class FakeCursor:
+
+    def __init__(self, failing=()):
+        self.executed = []
+        self.failing = failing
+        self.description = None
+        self.rowcount = 1
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        if any(sql.startswith(prefix) for prefix in self.failing):
+            raise psycopg2.ProgrammingError("cannot prepare")
+
+    def close(self):
+        pass
+
+
+def test_convert_named_query_params_cached():
+    converted = driver_postgresql.convert_named_query_params_cached(QUERY)
+
+    assert converted == driver_postgresql.convert_named_query_params(QUERY)
+    assert driver_postgresql.convert_named_query_params_cached(QUERY) is converted
+
+
+def test_convert_to_positional_params():
+    query, names = driver_postgresql.convert_to_positional_params(QUERY)
+
+    assert query == "select id from rhnServer where org_id = $1 and name = $2 and id > $1"
+    assert names == ["org_id", "name"]
+
+
+def test_convert_to_positional_params_keeps_casts():
+    query, names = driver_postgresql.convert_to_positional_params(
+        "select :size::numeric, created::date from rhnPackage where id = (:id)::bigint")
+
+    assert query == "select $1::numeric, created::date from rhnPackage where id = ($2)::bigint"
+    assert names == ["size", "id"]
+
+
+def test_prepared_after_threshold():
+    statements = PreparedStatements()
+    cursor = FakeCursor()
+
+    assert statements.lookup(cursor, QUERY) is None
+    assert cursor.executed == []
+
+    execute = statements.lookup(cursor, QUERY)
+    name = cursor.executed[1].split()[1]
+    assert cursor.executed == ["SAVEPOINT rhn_prepare",
+                               "PREPARE %s AS %s" % (name, driver_postgresql.convert_to_positional_params(QUERY)[0]),
+                               "RELEASE SAVEPOINT rhn_prepare"]
+    assert execute == "EXECUTE %s (%%(org_id)s, %%(name)s)" % name
+    # no further round trip once prepared
+    assert statements.lookup(cursor, QUERY) == execute
+    assert len(cursor.executed) == 3
+
+
+def test_failed_prepare_is_not_retried():
+    statements = PreparedStatements()
+    cursor = FakeCursor(failing=("PREPARE",))
+
+    statements.lookup(cursor, QUERY)
+    assert statements.lookup(cursor, QUERY) is None
+    assert "ROLLBACK TO SAVEPOINT rhn_prepare" in cursor.executed
+    assert statements.lookup(cursor, QUERY) is None
+    assert len([sql for sql in cursor.executed if sql.startswith("PREPARE")]) == 1
+
+
+def test_only_dml_is_prepared():
+    statements = PreparedStatements()
+    cursor = FakeCursor()
+
+    for _ in range(3):
+        assert statements.lookup(cursor, "lock table rhnServer in exclusive mode") is None
+    assert cursor.executed == []
+
+
+def test_cursor_executes_prepared_statement():
+    statements = PreparedStatements()
+    real_cursor = FakeCursor()
+    dbh = MagicMock()
+    dbh.cursor.return_value = real_cursor
+
+    for _ in range(2):
+        cursor = Cursor(dbh=dbh, sql=QUERY, prepared_statements=statements)
+        cursor.execute(org_id=1, name="server")
+
+    assert real_cursor.executed[0] == driver_postgresql.convert_named_query_params(QUERY)
+    assert real_cursor.executed[-1].startswith("EXECUTE rhn_")
+
+
+def test_bind_params_formatted_only_when_logged():
+    dbh = MagicMock()
+    dbh.cursor.return_value = FakeCursor()
+    value = MagicMock()
+    cursor = Cursor(dbh=dbh, sql="select :value")
+
+    with patch("spacewalk.server.rhnSQL.driver_postgresql.log_level_enabled", return_value=False):
+        cursor.execute(value=value)
+    assert not value.__str__.called
+
+    with patch("spacewalk.server.rhnSQL.driver_postgresql.log_level_enabled", return_value=True):
+        cursor.execute(value=value)
+    assert value.__str__.called
+
+
+class FakeNamedCursor:
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = list(rows)
+        self.fetches = []
+        self.description = None
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        self.sql = sql
+
+    def fetchmany(self, size):
+        self.fetches.append(size)
+        # like psycopg2, the description is known after the first fetch
+        self.description = [("id", None, None, None, None, None, None), ("NAME", None, None, None, None, None, None)]
+        rows, self.rows = self.rows[:size], self.rows[size:]
+        return rows
+
+    def fetchall(self):
+        return self.fetchmany(len(self.rows))
+
+    def close(self):
+        self.closed = True
+
+
+def _server_side_dbh(rows):
+    dbh = MagicMock()
+    dbh.cursor.side_effect = lambda name=None: FakeNamedCursor(name, rows)
+    return dbh
+
+
+def test_server_side_cursor_streams_in_batches():
+    rows = [(i, "name%d" % i) for i in range(2500)]
+    dbh = _server_side_dbh(rows)
+    cursor = Cursor(dbh=dbh, sql="select id, name from rhnPackage where id > :id", server_side=True)
+
+    assert cursor.execute(id=0) == -1
+    named = cursor._real_cursor
+    assert named.name.startswith("rhn_cursor_")
+    assert cursor.description is not None
+    assert named.fetches == [driver_postgresql.SERVER_SIDE_BATCH_SIZE]
+
+    assert cursor.fetchone_dict() == {"id": 0, "name": "name0"}
+    assert list(cursor.iterate(batch_size=100)) == rows[1:]
+    assert max(named.fetches) == driver_postgresql.SERVER_SIDE_BATCH_SIZE
+    assert cursor.fetchone() is None
+
+
+def test_server_side_cursor_reexecute():
+    dbh = _server_side_dbh([(1, "a"), (2, "b")])
+    cursor = Cursor(dbh=dbh, sql="select id, name from rhnPackage", server_side=True)
+
+    cursor.execute()
+    first = cursor._real_cursor
+    assert cursor.fetchone() == (1, "a")
+    cursor.execute()
+
+    assert first.closed
+    assert cursor._real_cursor is not first
+    assert cursor.fetchall_dict() == [{"id": 1, "name": "a"}, {"id": 2, "name": "b"}]
+    assert list(cursor.iterate_dict()) == []
+
+
+def test_listen_and_notifications():
+    db = driver_postgresql.Database(username="spacewalk", database="susemanager")
+    db.dbh = MagicMock()
+    cursor = FakeCursor()
+    db.dbh.cursor.return_value = cursor
+    db.dbh.notifies = [MagicMock(payload="1000010000"), MagicMock(payload="1000010001")]
+
+    db.listen("rhn_server_action")
+    assert db.dbh.autocommit is True
+    assert cursor.executed == ['LISTEN "rhn_server_action"']
+
+    assert db.notifications() == ["1000010000", "1000010001"]
+    assert db.dbh.poll.called
+    assert db.notifications() == []
+
+    db.dbh.poll.side_effect = psycopg2.OperationalError("server closed the connection")
+    with pytest.raises(sql_base.SQLError):
+        db.notifications()
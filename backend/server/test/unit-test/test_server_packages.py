@@ -0,0 +1,93 @@
+#!/usr/bin/python3
+"""
+Tests for the bulk writer of the server package profiles.
+"""
+
+from unittest.mock import patch
+
+import pytest
+
+from spacewalk.common.rhnException import rhnFault
+from spacewalk.server.rhnServer import server_packages
+from spacewalk.server.rhnServer.server_packages import dbPackage, DELETED, UPDATED
+
+
+class FakeCursor:
+
+    """ Answers the lookups of write_profile_changes, records the rest. """
+
+    statements = []
+    copied = []
+
+    def __init__(self, sql):
+        self.sql = sql
+        self.statements.append(str(sql).split()[0].lower())
+
+    def execute(self, **kwargs):
+        pass
+
+    def fetchall(self):
+        return [(100, "x86_64"), (101, "noarch")]
+
+    def fetchone_dict(self):
+        return {'changes': 3}
+
+    def execute_values(self, sql, wanted, template=None, fetch=True):
+        if not fetch:
+            return None
+        if "rhnPackageName" in sql:
+            return [(name, 10 + i) for i, name in wanted]
+        return [(e, v, r, t, 20 + i) for i, e, v, r, t in wanted]
+
+    def copy_from(self, data):
+        self.copied.extend(data.read().splitlines())
+
+
+def _package(name, real=False, **kwargs):
+    pdict = {'name': name, 'epoch': '', 'version': '1.0', 'release': '1',
+             'arch': 'x86_64', 'type': 'rpm', 'installtime': 1000}
+    pdict.update(kwargs)
+    return dbPackage(pdict, real=real, name_id=real and 1, evr_id=real and 2,
+                     package_arch_id=real and 100)
+
+
+@pytest.fixture
+def cursor():
+    FakeCursor.statements = []
+    FakeCursor.copied = []
+    with patch("spacewalk.server.rhnServer.server_packages.rhnSQL.prepare", side_effect=FakeCursor):
+        yield FakeCursor
+
+
+def test_write_profile_changes(cursor):
+    deleted = _package("old", real=True)
+    deleted.delete()
+    updated = _package("reinstalled", real=True, installtime=2000)
+    updated.setval(UPDATED)
+    unchanged = _package("unchanged", real=True)
+    added = _package("new", epoch='3', arch='noarch', installtime=None)
+
+    changes = server_packages.write_profile_changes(1000010000, [deleted, updated, unchanged, added])
+
+    assert changes == 3
+    assert deleted.status == DELETED
+    assert (added.name_id, added.evr_id, added.package_arch_id) == (10, 20, 101)
+    assert cursor.copied == ["D\t1\t2\t100\t1000",
+                             "U\t1\t2\t100\t2000",
+                             "A\t10\t20\t101\t\\N"]
+    assert cursor.statements[-3:] == ["delete", "copy", "with"]
+
+
+def test_write_profile_changes_without_changes(cursor):
+    assert server_packages.write_profile_changes(1000010000, [_package("unchanged", real=True)]) == 0
+    assert cursor.statements == []
+
+
+def test_lookup_package_ids_unknown_arch(cursor):
+    with pytest.raises(rhnFault):
+        server_packages.lookup_package_ids([_package("new", arch="unknown")])
+
+
+def test_copy_value():
+    assert server_packages._copy_value(None) == "\\N"
+    assert server_packages._copy_value("a\tb\\c\n") == "a\\tb\\\\c\\n"
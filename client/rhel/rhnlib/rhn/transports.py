@@ -11,8 +11,12 @@
 
 # Transport objects
 import os
+import select
+import socket
 import sys
+import threading
 import time
+import zlib
 from rhn import connections
 from rhn.i18n import sstr, bstr
 from rhn.SmartIO import SmartIO
@@ -32,10 +36,108 @@ __version__ = "$Revision$"
 # XXX
 COMPRESS_LEVEL = 6
 
+# Size of the reads from the network
+READ_BUFFER_SIZE = 65536
+# Bodies bigger than this are spooled to a temporary file
+MAX_MEM_SIZE = 1048576
+
+# Idle keep-alive connections are reused for this many seconds
+POOL_IDLE_TIMEOUT = 30
+# Idle connections kept per server
+POOL_MAX_IDLE = 4
+
+# Errors showing that the server closed a kept-alive connection while it
+# was idle
+try: # python3
+    _STALE_CONNECTION_ERRORS = (connections.httplib.RemoteDisconnected,
+                                ConnectionResetError, BrokenPipeError,
+                                ConnectionAbortedError)
+except AttributeError: # python2
+    _STALE_CONNECTION_ERRORS = (connections.httplib.BadStatusLine, socket.error)
+
 # Exceptions
 class NotProcessed(Exception):
     pass
 
+class ConnectionPool:
+    """
+    Idle keep-alive connections, shared by all the transports of the process.
+    Connections are keyed by everything they were set up with (host, proxy,
+    proxy credentials, trusted certificates, timeout), so that a request only
+    reuses a connection it could have opened itself.
+    """
+    def __init__(self, idle_timeout=POOL_IDLE_TIMEOUT, max_idle=POOL_MAX_IDLE):
+        self.idle_timeout = idle_timeout
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        # key -> list of (connection, time it became idle)
+        self._idle = {}
+        self._pid = os.getpid()
+
+    def _check_pid(self):
+        # Connections inherited from the parent process are its own: they are
+        # forgotten, not closed, since closing a TLS connection would end the
+        # session the parent is using
+        if self._pid != os.getpid():
+            self._idle = {}
+            self._pid = os.getpid()
+
+    def get(self, key):
+        """Returns an idle connection for key, or None"""
+        now = time.time()
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            idle = self._idle.get(key, [])
+            while idle:
+                connection, since = idle.pop()
+                if now - since < self.idle_timeout and not _is_stale(connection):
+                    return connection
+                connection.close()
+        finally:
+            self._lock.release()
+        return None
+
+    def put(self, key, connection):
+        """Keeps connection, which has no request in progress, for key"""
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append((connection, time.time()))
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def close(self, keys=None):
+        """Closes the idle connections of keys, or all of them"""
+        self._lock.acquire()
+        try:
+            self._check_pid()
+            if keys is None:
+                keys = list(self._idle.keys())
+            for key in keys:
+                for connection, since in self._idle.pop(key, []):
+                    connection.close()
+        finally:
+            self._lock.release()
+
+def _is_stale(connection):
+    """Returns true if the server closed the idle connection; there is
+    nothing to read on a connection that is still usable"""
+    sock = connection.sock
+    if sock is None:
+        return 1
+    try:
+        readable = select.select([sock], [], [], 0)[0]
+    except (socket.error, ValueError):
+        return 1
+    return len(readable) > 0
+
+connection_pool = ConnectionPool()
+
 class Transport(xmlrpclib.Transport):
     user_agent = "rhn.rpclib.py/%s" % __version__
 
@@ -58,6 +160,8 @@ class Transport(xmlrpclib.Transport):
         self._redirected = None
         self._use_datetime = use_datetime
         self.timeout = timeout
+        # keys of the pooled connections this transport used
+        self._connection_keys = set()
 
     # set the progress callback
     def set_progress_callback(self, progressCallback, bufferSize=16384):
@@ -137,25 +241,60 @@ class Transport(xmlrpclib.Transport):
         else:
             return connections.HTTPConnection(host)
 
+    def connection_key(self, host):
+        """Returns what identifies the connections get_connection(host)
+        opens, for reusing them"""
+        return (self.__class__.__name__, host, self.timeout)
+
+    def _open_connection(self, key, host):
+        """Returns a kept-alive connection for host if there is one, or a new
+        one, together with a flag telling if it was reused"""
+        self._connection_keys.add(key)
+        connection = connection_pool.get(key)
+        reused = connection is not None
+        if not reused:
+            connection = self._new_connection(host)
+        elif self.verbose:
+            connection.set_debuglevel(self.verbose - 1)
+        return connection, reused
+
+    def _new_connection(self, host):
+        connection = self.get_connection(host)
+        # Setting the user agent. Only interesting for SSL tunnels, in any
+        # other case the general headers are good enough.
+        connection.set_user_agent(self.user_agent)
+        if self.verbose:
+            connection.set_debuglevel(self.verbose - 1)
+        return connection
+
+    def _release_connection(self, connection, response):
+        """Keeps connection for the next request if the server agreed and
+        the response has been read completely"""
+        key = getattr(connection, '_pool_key', None)
+        if key is not None and not response.will_close and \
+                response.length in (0, None) and response.isclosed():
+            connection_pool.put(key, connection)
+        else:
+            connection.close()
+
+    def close(self):
+        connection_pool.close(self._connection_keys)
+        self._connection_keys = set()
+
     def request(self, host, handler, request_body, verbose=0):
         # issue XML-RPC request
         # XXX: automatically compute how to send depending on how much data
         #      you want to send
 
-        # XXX Deal with HTTP/1.1 if necessary
         self.verbose = verbose
 
         # implement BASIC HTTP AUTHENTICATION
         host, extra_headers, x509 = self.get_host_info(host)
         if not extra_headers:
             extra_headers = []
-        # Establish the connection
-        connection = self.get_connection(host)
-        # Setting the user agent. Only interesting for SSL tunnels, in any
-        # other case the general headers are good enough.
-        connection.set_user_agent(self.user_agent)
-        if self.verbose:
-            connection.set_debuglevel(self.verbose - 1)
+        # Establish the connection, or reuse a kept-alive one
+        key = self.connection_key(host)
+        connection, reused = self._open_connection(key, host)
         # Get the output object to push data with
         req = Output(connection=connection, method=self.method)
         req.set_transport_flags(**self._transport_flags)
@@ -174,7 +313,18 @@ class Transport(xmlrpclib.Transport):
         for h in ['Content-Length', 'Host']:
             req.clear_header(h)
 
-        headers, fd = req.send_http(host, handler)
+        try:
+            headers, fd = req.send_http(host, handler)
+        except _STALE_CONNECTION_ERRORS:
+            if not reused:
+                raise
+            # The server closed the kept-alive connection before it got the
+            # request; retry once on a new connection
+            connection.close()
+            connection = self._new_connection(host)
+            req.set_connection(connection)
+            headers, fd = req.send_http(host, handler)
+        connection._pool_key = key
 
         if self.verbose:
             print("Incoming headers:")
@@ -198,6 +348,7 @@ class Transport(xmlrpclib.Transport):
         resp = Input(self.headers_in, progressCallback=self.progressCallback,
                 bufferSize=self.bufferSize)
 
+        response = fd
         fd = resp.decode(fd)
 
         if isinstance(fd, InputStream):
@@ -213,11 +364,11 @@ class Transport(xmlrpclib.Transport):
             f.close = connection.close
             return f
 
-        # We can safely close the connection now; if we had an
+        # We can safely release the connection now; if we had an
         # application/octet/stream (for which Input.read passes the original
         # socket object), Input.decode would return an InputStream,
         # so we wouldn't reach this point
-        connection.close()
+        self._release_connection(connection, response)
 
         return self.parse_response(fd)
 
@@ -232,7 +383,7 @@ class Transport(xmlrpclib.Transport):
         p, u = self.getparser()
 
         while 1:
-            response = f.read(1024)
+            response = f.read(READ_BUFFER_SIZE)
             if not response:
                 break
             if self.refreshCallback:
@@ -276,6 +427,9 @@ class SafeTransport(Transport):
             return connections.HTTPSConnection(host,
                     trusted_certs=self.trusted_certs)
 
+    def connection_key(self, host):
+        return Transport.connection_key(self, host) + (tuple(self.trusted_certs), )
+
 
 class ProxyTransport(Transport):
     def __init__(self, proxy, proxyUsername=None, proxyPassword=None,
@@ -300,6 +454,10 @@ class ProxyTransport(Transport):
             return connections.HTTPProxyConnection(self._proxy, host,
                 username=self._proxy_username, password=self._proxy_password)
 
+    def connection_key(self, host):
+        return Transport.connection_key(self, host) + (self._proxy,
+            self._proxy_username, self._proxy_password)
+
 class SafeProxyTransport(ProxyTransport):
     def __init__(self, proxy, proxyUsername=None, proxyPassword=None,
             transfer=0, encoding=0, refreshCallback=None,
@@ -332,6 +490,9 @@ class SafeProxyTransport(ProxyTransport):
                 username=self._proxy_username, password=self._proxy_password,
                 trusted_certs=self.trusted_certs)
 
+    def connection_key(self, host):
+        return ProxyTransport.connection_key(self, host) + (tuple(self.trusted_certs), )
+
 # ============================================================================
 # Extended capabilities for transport
 #
@@ -357,8 +518,8 @@ class SafeProxyTransport(ProxyTransport):
 # Input class to automate reading the posting from the network
 # Having to work with environment variables blows, though
 class Input:
-    def __init__(self, headers=None, progressCallback=None, bufferSize=1024,
-            max_mem_size=16384):
+    def __init__(self, headers=None, progressCallback=None,
+            bufferSize=READ_BUFFER_SIZE, max_mem_size=MAX_MEM_SIZE):
         self.transfer = None
         self.encoding = None
         self.type = None
@@ -412,21 +573,37 @@ class Input:
                     self.name = value
 
         self.io = None
+        # set if the data got decompressed while it was read
+        self._decoded = 0
 
     def read(self, fd = sys.stdin):
         # The octet-streams are passed right back
         if self.type == "application/octet-stream":
             return
 
+        # Binary data is decompressed as it comes in, without keeping the
+        # compressed copy around
+        decompressor = None
+        if not self.transfer or self.transfer == "binary":
+            decompressor = _decompressor(self.encoding)
+
         if self.length:
             # Read exactly the amount of data we were told
             self.io = _smart_read(fd, self.length,
                 bufferSize=self.bufferSize,
                 progressCallback=self.progressCallback,
-                max_mem_size=self.max_mem_size)
+                max_mem_size=self.max_mem_size,
+                decompressor=decompressor)
         else:
             # Oh well, no clue; read until EOF (hopefully)
-            self.io = _smart_total_read(fd)
+            self.io = _smart_total_read(fd, bufferSize=self.bufferSize,
+                max_mem_size=self.max_mem_size, decompressor=decompressor)
+
+        if decompressor is not None:
+            self._decoded = 1
+            self.io.seek(0, 2)
+            self.length = self.io.tell()
+            self.io.seek(0, 0)
 
         if not self.transfer or self.transfer == "binary":
             return
@@ -456,11 +633,10 @@ class Input:
             fd.close()
 
         # Now we have the binary goo
-        if not self.encoding or self.encoding == "__plain":
+        if self._decoded or not self.encoding or self.encoding == "__plain":
             # all is fine.
             pass
         elif self.encoding in ("x-zlib", "deflate"):
-            import zlib
             obj = zlib.decompressobj()
             self.io.seek(0, 0)
             data = obj.decompress(self.io.read()) + obj.flush()
@@ -492,7 +668,35 @@ class Input:
 
 # Utility functions
 
-def _smart_total_read(fd, bufferSize=1024, max_mem_size=16384):
+class _Decompressor:
+    """Incremental decompression of x-zlib and x-gzip data; gzip data may
+    consist of several members"""
+    def __init__(self, wbits):
+        self._wbits = wbits
+        self._obj = zlib.decompressobj(wbits)
+
+    def decompress(self, data):
+        ret = self._obj.decompress(data)
+        while getattr(self._obj, 'eof', 0) and self._obj.unused_data:
+            data = self._obj.unused_data
+            self._obj = zlib.decompressobj(self._wbits)
+            ret = ret + self._obj.decompress(data)
+        return ret
+
+    def flush(self):
+        return self._obj.flush()
+
+def _decompressor(encoding):
+    """Returns a decompressor for the Content-Encoding, or None if the data
+    is not compressed (or not in a way we can decompress incrementally)"""
+    if encoding in ("x-zlib", "deflate"):
+        return _Decompressor(zlib.MAX_WBITS)
+    if encoding in ("x-gzip", "gzip"):
+        return _Decompressor(16 + zlib.MAX_WBITS)
+    return None
+
+def _smart_total_read(fd, bufferSize=READ_BUFFER_SIZE, max_mem_size=16384,
+        decompressor=None):
     """
     Tries to read data from the supplied stream, and puts the results into a
     StmartIO object. The data will be in memory or in a temporary file,
@@ -505,12 +709,16 @@ def _smart_total_read(fd, bufferSize=1024, max_mem_size=16384):
         if not chunk:
             # EOF reached
             break
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
         io.write(chunk)
+    if decompressor is not None:
+        io.write(decompressor.flush())
 
     return io
 
-def _smart_read(fd, amt, bufferSize=1024, progressCallback=None,
-        max_mem_size=16384):
+def _smart_read(fd, amt, bufferSize=READ_BUFFER_SIZE, progressCallback=None,
+        max_mem_size=16384, decompressor=None):
     # Reads amt bytes from fd, or until the end of file, whichever
     # occurs first
     # The function will read in memory if the amout to be read is smaller than
@@ -540,6 +748,8 @@ def _smart_read(fd, amt, bufferSize=1024, progressCallback=None,
 
         # And since the original l was smaller than amt, we know amt >= 0
         amt = amt - l
+        if decompressor is not None:
+            chunk = decompressor.decompress(chunk)
         buf.write(chunk)
         if progressCallback is None:
             # No progress callback, so don't do fancy computations
@@ -565,6 +775,8 @@ def _smart_read(fd, amt, bufferSize=1024, progressCallback=None,
                 secs = amt / speed
             progressCallback(bytesRead, origsize, speed, secs)
 
+    if decompressor is not None:
+        buf.write(decompressor.flush())
     # Now rewind the SmartIO
     buf.seek(0, 0)
     return buf
@@ -664,25 +876,17 @@ class BaseOutput:
 
         # Content-Encoding header
         if self.encoding == self.ENCODE_GZIP:
-            import gzip
             encoding_name = self.encodings[self.ENCODE_GZIP][0]
             self.set_header("Content-Encoding", encoding_name)
-            f = SmartIO(force_mem=1)
-            gz = gzip.GzipFile(mode="wb", compresslevel=COMPRESS_LEVEL,
-                               fileobj = f)
-            if sys.version_info[0] == 3:
-                gz.write(bstr(data))
-            else:
-                gz.write(sstr(data))
-            gz.close()
-            self.data = f.getvalue()
-            f.close()
+            # the gzip format, straight from zlib
+            obj = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED,
+                                   16 + zlib.MAX_WBITS)
+            self.data = obj.compress(bstr(data)) + obj.flush()
         elif self.encoding == self.ENCODE_ZLIB:
-            import zlib
             encoding_name = self.encodings[self.ENCODE_ZLIB][0]
             self.set_header("Content-Encoding", encoding_name)
             obj = zlib.compressobj(COMPRESS_LEVEL)
-            self.data = obj.compress(data.encode()) + obj.flush()
+            self.data = obj.compress(bstr(data)) + obj.flush()
         elif self.encoding == self.ENCODE_GPG:
             # XXX: fix me.
             raise NotImplementedError(self.transfer, self.encoding)
@@ -717,6 +921,9 @@ class BaseOutput:
         self.encoding = encoding
         self.transport_flags.update(kwargs)
 
+    def set_connection(self, connection):
+        self._connection = connection
+
     def send_http(self, host, handler="/RPC2"):
         if not self.__processed:
             raise NotProcessed
@@ -725,7 +932,9 @@ class BaseOutput:
 
         if self._connection is None:
             raise Exception("No connection object found")
-        self._connection.connect()
+        # kept-alive connections are connected already
+        if self._connection.sock is None:
+            self._connection.connect()
         # wrap self data into binary object, otherwise HTTPConnection.request
         # will encode it as ISO-8859-1 https://docs.python.org/3/library/http.client.html#httpconnection-objects
         self._connection.request(self.method, handler, body=bstr(self.data), headers=self.headers)
@@ -1,5 +1,6 @@
 import unittest
 import test_server
+import test_transports
 
 def testSuite():
         suite = unittest.TestSuite()
@@ -12,6 +13,7 @@ def testSuite():
 
         """
         suite.addTest(loader.loadTestsFromModule(test_server))
+        suite.addTest(loader.loadTestsFromModule(test_transports))
         return suite
 
 if __name__ == "__main__":
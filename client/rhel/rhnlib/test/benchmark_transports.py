@@ -0,0 +1,98 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Compare XML-RPC calls with and without kept-alive connections against a
+# local stand-in server, for small calls (latency) and big gzip compressed
+# responses (throughput).
+#
+# Usage: benchmark_transports.py [calls] [packages per big response]
+#
+
+import sys
+import threading
+import time
+
+sys.path.insert(0, '..')
+
+try: # python2
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError: # python3
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+    from socketserver import ThreadingMixIn
+
+from rhn import rpclib, transports
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    # keep-alive, like the server behind Apache
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ('/XMLRPC', )
+
+    def log_message(self, *args):
+        pass
+
+
+class Server(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+def start_server():
+    server = Server(("127.0.0.1", 0), requestHandler=RequestHandler,
+                    logRequests=False)
+    server.register_function(lambda: "pong", "ping")
+    server.register_function(
+        lambda n: [["package-%d" % i, "1.0", str(i), "", "x86_64"] for i in range(n)],
+        "packages")
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return "http://127.0.0.1:%d/XMLRPC" % server.server_address[1]
+
+
+def run(url, calls, packages):
+    start = time.time()
+    for _ in range(calls):
+        rpclib.Server(url).ping()
+    small = time.time() - start
+
+    start = time.time()
+    for _ in range(max(1, calls // 20)):
+        s = rpclib.Server(url)
+        s.add_header("Accept-Encoding", "gzip")
+        assert len(s.packages(packages)) == packages
+    big = time.time() - start
+    return small, big
+
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    packages = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    url = start_server()
+
+    pool = transports.connection_pool
+    # a pool keeping nothing means a new connection for every call
+    transports.connection_pool = transports.ConnectionPool(max_idle=0)
+    try:
+        small_new, big_new = run(url, calls, packages)
+    finally:
+        transports.connection_pool = pool
+    small_kept, big_kept = run(url, calls, packages)
+
+    print("%d small calls: %.3fs new connections, %.3fs kept-alive (%.1fx)" % (
+        calls, small_new, small_kept, small_new / small_kept))
+    print("%d big calls: %.3fs new connections, %.3fs kept-alive" % (
+        max(1, calls // 20), big_new, big_kept))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
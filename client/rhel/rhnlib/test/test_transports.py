@@ -0,0 +1,263 @@
+#!/usr/bin/python3
+#
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+# Tests of the kept-alive connection pool and of the incremental
+# decompression of the responses.
+#
+
+import gzip
+import os
+import sys
+import threading
+import unittest
+import zlib
+
+try:
+    from unittest import mock
+except ImportError:
+    import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+try: # python2
+    from SimpleXMLRPCServer import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+except ImportError: # python3
+    from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+from rhn import rpclib, transports
+
+
+class FakeConnection:
+    def __init__(self):
+        self.sock = None
+        self.closed = 0
+
+    def close(self):
+        self.closed = 1
+
+
+class FakeResponse:
+    def __init__(self, will_close=0, length=0, closed=1):
+        self.will_close = will_close
+        self.length = length
+        self.closed = closed
+
+    def isclosed(self):
+        return self.closed
+
+
+class ConnectionPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = transports.ConnectionPool(idle_timeout=30, max_idle=2)
+        patcher = mock.patch.object(transports, '_is_stale', lambda connection: 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def testGetReturnsTheIdleConnectionOfTheKey(self):
+        connection = FakeConnection()
+        self.pool.put('a', connection)
+        self.assertEqual(self.pool.get('b'), None)
+        self.assertTrue(self.pool.get('a') is connection)
+        # it is in use now
+        self.assertEqual(self.pool.get('a'), None)
+        self.assertFalse(connection.closed)
+
+    def testIdleConnectionsExpire(self):
+        connection = FakeConnection()
+        with mock.patch.object(transports.time, 'time', return_value=1000):
+            self.pool.put('a', connection)
+        with mock.patch.object(transports.time, 'time', return_value=1031):
+            self.assertEqual(self.pool.get('a'), None)
+        self.assertTrue(connection.closed)
+
+    def testStaleConnectionsAreClosed(self):
+        connection = FakeConnection()
+        self.pool.put('a', connection)
+        with mock.patch.object(transports, '_is_stale', lambda connection: 1):
+            self.assertEqual(self.pool.get('a'), None)
+        self.assertTrue(connection.closed)
+
+    def testMaxIdleConnectionsPerKey(self):
+        connections = [FakeConnection() for i in range(3)]
+        for connection in connections:
+            self.pool.put('a', connection)
+        other = FakeConnection()
+        self.pool.put('b', other)
+
+        self.assertEqual([c.closed for c in connections], [0, 0, 1])
+        self.assertFalse(other.closed)
+        self.assertTrue(self.pool.get('a') is connections[1])
+        self.assertTrue(self.pool.get('a') is connections[0])
+        self.assertEqual(self.pool.get('a'), None)
+
+    def testConnectionsOfTheParentProcessAreDiscarded(self):
+        connection = FakeConnection()
+        self.pool.put('a', connection)
+        with mock.patch.object(transports.os, 'getpid', return_value=os.getpid() + 1):
+            self.assertEqual(self.pool.get('a'), None)
+        # closing would end the session of the parent
+        self.assertFalse(connection.closed)
+
+    def testClose(self):
+        a, b = FakeConnection(), FakeConnection()
+        self.pool.put('a', a)
+        self.pool.put('b', b)
+        self.pool.close(['a'])
+        self.assertEqual((a.closed, b.closed), (1, 0))
+        self.pool.close()
+        self.assertTrue(b.closed)
+        self.assertEqual(self.pool.get('b'), None)
+
+
+class ReleaseConnectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = transports.ConnectionPool()
+        patcher = mock.patch.object(transports, 'connection_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(transports, '_is_stale', lambda connection: 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.transport = transports.Transport()
+        self.connection = FakeConnection()
+        self.connection._pool_key = 'a'
+
+    def release(self, response):
+        self.transport._release_connection(self.connection, response)
+        return self.pool.get('a')
+
+    def testResponseReadCompletely(self):
+        self.assertTrue(self.release(FakeResponse()) is self.connection)
+        self.assertTrue(self.release(FakeResponse(length=None)) is self.connection)
+
+    def testServerClosesTheConnection(self):
+        self.assertEqual(self.release(FakeResponse(will_close=1)), None)
+        self.assertTrue(self.connection.closed)
+
+    def testBodyNotReadCompletely(self):
+        self.assertEqual(self.release(FakeResponse(length=10, closed=0)), None)
+        self.assertTrue(self.connection.closed)
+
+    def testResponseNotClosed(self):
+        self.assertEqual(self.release(FakeResponse(closed=0)), None)
+        self.assertTrue(self.connection.closed)
+
+    def testConnectionWithoutKey(self):
+        del self.connection._pool_key
+        self.assertEqual(self.release(FakeResponse()), None)
+        self.assertTrue(self.connection.closed)
+
+
+class RequestHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = "HTTP/1.1"
+    rpc_paths = ('/XMLRPC', )
+
+    def setup(self):
+        SimpleXMLRPCRequestHandler.setup(self)
+        self.server.connections = self.server.connections + 1
+
+    def handle_one_request(self):
+        SimpleXMLRPCRequestHandler.handle_one_request(self)
+        # the server drops the connection it offered to keep alive, as a
+        # server does once its keep-alive timeout has expired
+        if self.server.drop_connections:
+            self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SimpleXMLRPCServer(("127.0.0.1", 0), requestHandler=RequestHandler,
+                                         logRequests=False)
+        self.server.connections = 0
+        self.server.drop_connections = 0
+        self.server.register_function(lambda: "pong", "ping")
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        patcher = mock.patch.object(transports, 'connection_pool', transports.ConnectionPool())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.rpc = rpclib.Server("http://127.0.0.1:%d/XMLRPC" % self.server.server_address[1])
+        self.addCleanup(self.rpc.close)
+
+    def testConnectionIsReused(self):
+        for i in range(3):
+            self.assertEqual(self.rpc.ping(), "pong")
+        self.assertEqual(self.server.connections, 1)
+
+    def testStaleConnectionIsRetriedOnce(self):
+        self.server.drop_connections = 1
+        self.assertEqual(self.rpc.ping(), "pong")
+        # the server closes the connection after it was checked
+        with mock.patch.object(transports, '_is_stale', lambda connection: 0):
+            self.assertEqual(self.rpc.ping(), "pong")
+        self.assertEqual(self.server.connections, 2)
+
+    def testNewConnectionIsNotRetried(self):
+        self.server.drop_connections = 1
+        self.assertEqual(self.rpc.ping(), "pong")
+        with mock.patch.object(transports, '_is_stale', lambda connection: 0), \
+             mock.patch.object(transports.Transport, '_new_connection',
+                               side_effect=transports.connections.httplib.RemoteDisconnected("closed")):
+            self.assertRaises(transports.connections.httplib.RemoteDisconnected, self.rpc.ping)
+
+
+class DecompressorTest(unittest.TestCase):
+
+    data = b"".join(b"<value><string>package-%d</string></value>" % i for i in range(5000))
+
+    def decompress(self, encoding, compressed, chunk_size):
+        decompressor = transports._decompressor(encoding)
+        ret = b""
+        for i in range(0, len(compressed), chunk_size):
+            ret = ret + decompressor.decompress(compressed[i:i + chunk_size])
+        return ret + decompressor.flush()
+
+    def testZlibAcrossChunks(self):
+        compressed = zlib.compress(self.data)
+        for chunk_size in (1, 7, 4096, len(compressed)):
+            self.assertEqual(self.decompress("x-zlib", compressed, chunk_size), self.data)
+
+    def testGzipAcrossChunks(self):
+        compressed = gzip.compress(self.data)
+        for chunk_size in (1, 7, 4096, len(compressed)):
+            self.assertEqual(self.decompress("x-gzip", compressed, chunk_size), self.data)
+
+    def testGzipMembers(self):
+        compressed = gzip.compress(self.data[:1000]) + gzip.compress(self.data[1000:])
+        for chunk_size in (1, 7, 4096, len(compressed)):
+            self.assertEqual(self.decompress("gzip", compressed, chunk_size), self.data)
+
+    def testNotCompressed(self):
+        self.assertEqual(transports._decompressor("identity"), None)
+
+    def testSmartReadDecompresses(self):
+        compressed = gzip.compress(self.data)
+        fd = transports.SmartIO()
+        fd.write(compressed)
+        fd.seek(0, 0)
+        io = transports._smart_read(fd, len(compressed), bufferSize=100,
+                                    decompressor=transports._decompressor("x-gzip"))
+        io.seek(0, 0)
+        self.assertEqual(io.read(), self.data)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,12 +3,15 @@
 # updating/fetching package lists, channels, etc
 
 
+import hashlib
+import json
 import os
 import tempfile
 try:
     import ConfigParser
 except ImportError:
     import configparser
+from rhn.i18n import bstr
 from up2date_client import up2dateAuth
 from up2date_client import up2dateLog
 from up2date_client import rhnserver
@@ -16,6 +19,9 @@ from up2date_client import pkgUtils
 
 from suseRegister.info import getProductProfile
 
+# The last package profile sent to the server, to only send the changes
+# the next time
+profileSnapshotFileName = "/var/spool/up2date/packageProfile.json"
 
 def logDeltaPackages(pkgs):
     log = up2dateLog.initLog()
@@ -30,21 +36,132 @@ def updatePackageProfile(timeout=None):
     log.log_me("Updating package profile")
     packages = pkgUtils.getInstalledPackageList(getArch=1)
     s = rhnserver.RhnServer(timeout=timeout)
+    systemId = up2dateAuth.getSystemId()
     if not s.capabilities.hasCapability('xmlrpc.packages.extended_profile', 2):
         # for older satellites and hosted - convert to old format
-        packages = convertPackagesFromHashToList(packages)
-    s.registration.update_packages(up2dateAuth.getSystemId(), packages)
+        s.registration.update_packages(systemId,
+                                       convertPackagesFromHashToList(packages))
+    elif not s.capabilities.hasCapability('registration.delta_packages', 2):
+        s.registration.update_packages(systemId, packages)
+        removeProfileSnapshot()
+    else:
+        sendPackageProfile(s, systemId, packages)
 
     if s.capabilities.hasCapability('xmlrpc.packages.suse_products', 1):
         # also send information about the installed products
         log.log_me('Updating product profile')
         productProfile = getProductProfile()
-        s.registration.suse_update_products(up2dateAuth.getSystemId(),
+        s.registration.suse_update_products(systemId,
                                             productProfile['guid'],
                                             productProfile['secret'],
                                             productProfile['ostarget'],
                                             productProfile['products'])
 
+def sendPackageProfile(s, systemId, packages):
+    """ Send only the changes since the last profile sent, when there is
+        one. The server checks the digest of that profile against what it
+        has stored and asks for the whole profile if they do not match.
+    """
+    log = up2dateLog.initLog()
+    snapshot = readProfileSnapshot()
+    fullProfile = True
+    if snapshot is not None:
+        delta = packageProfileDelta(snapshot['packages'], packages)
+        if not delta['added'] and not delta['deleted']:
+            log.log_debug("Package profile did not change")
+            return
+        log.log_debug("Sending package profile changes: %d added, %d deleted" %
+                      (len(delta['added']), len(delta['deleted'])))
+        delta['digest'] = snapshot['digest']
+        if s.registration.delta_packages(systemId, delta) == 0:
+            fullProfile = False
+        else:
+            log.log_me("Package profile on the server differs, sending all packages")
+    if fullProfile:
+        s.registration.update_packages(systemId, packages)
+    writeProfileSnapshot(packages)
+
+def _profileKey(package):
+    return (package['name'], package['epoch'], package['version'],
+            package['release'], package.get('arch', ''),
+            package.get('installtime'))
+
+def packageProfileDelta(oldPackages, newPackages):
+    """ Returns the packages added and deleted between two profiles """
+    oldKeys = set(_profileKey(p) for p in oldPackages)
+    newKeys = set(_profileKey(p) for p in newPackages)
+    return {
+        'added': [p for p in newPackages if _profileKey(p) not in oldKeys],
+        'deleted': [p for p in oldPackages if _profileKey(p) not in newKeys],
+    }
+
+def profileDigest(packages):
+    """ sha256 of a package profile, as the server computes it from its
+        stored profile: one "name epoch version release arch" line (tab
+        separated) for every package, sorted and joined by newlines.
+    """
+    lines = set()
+    for p in packages:
+        lines.add("\t".join([p['name'], p['epoch'] or "", p['version'],
+                             p['release'], p.get('arch') or ""]))
+    return hashlib.sha256(bstr("\n".join(sorted(lines)))).hexdigest()
+
+def readProfileSnapshot():
+    """ Returns the last package profile sent, or None """
+    if not os.access(profileSnapshotFileName, os.R_OK):
+        return None
+    try:
+        f = open(profileSnapshotFileName, 'r')
+        try:
+            snapshot = json.load(f)
+        finally:
+            f.close()
+        if snapshot.get('systemId') != _systemIdDigest():
+            # registered again since: the server has a new profile
+            return None
+        return snapshot
+    except (IOError, ValueError, AttributeError, KeyError):
+        log = up2dateLog.initLog()
+        log.log_debug("Unable to read the package profile snapshot %s" %
+                      profileSnapshotFileName)
+        return None
+
+def writeProfileSnapshot(packages):
+    """ Remember the package profile the server has now """
+    log = up2dateLog.initLog()
+    snapshot = {'systemId': _systemIdDigest(),
+                'digest': profileDigest(packages),
+                'packages': packages}
+    snapshotDir = os.path.dirname(profileSnapshotFileName)
+    try:
+        if not os.access(snapshotDir, os.W_OK):
+            os.mkdir(snapshotDir)
+            os.chmod(snapshotDir, int('0700', 8))
+        # written aside and renamed, so a crash never leaves half a profile
+        fd, tmpName = tempfile.mkstemp(dir=snapshotDir)
+        f = os.fdopen(fd, 'w')
+        try:
+            json.dump(snapshot, f)
+        finally:
+            f.close()
+        os.rename(tmpName, profileSnapshotFileName)
+    except (IOError, OSError):
+        log.log_me("Unable to write the package profile snapshot to %s" %
+                   profileSnapshotFileName)
+        removeProfileSnapshot()
+
+def removeProfileSnapshot():
+    try:
+        os.unlink(profileSnapshotFileName)
+    except OSError:
+        pass
+
+def _systemIdDigest():
+    systemId = up2dateAuth.getSystemId()
+    if systemId is None:
+        return None
+    return hashlib.sha256(bstr(systemId)).hexdigest()
+
 def pprint_pkglist(pkglist):
     if type(pkglist) == type([]):
         output = ["%s-%s-%s" % (a[0],a[1],a[2]) for a in pkglist]
@@ -124,13 +124,16 @@ def getInstalledPackageList(msgCallback = None, progressCallback = None,
     count = 0
     total = 0
 
-    dbmatch = _ts.dbMatch()
-    for h in dbmatch:
-        if h == None:
-            break
-        count = count + 1
-
-    total = count
+    if progressCallback != None:
+        # walking the whole rpmdb just for the progress total is expensive,
+        # so only do it when somebody shows the progress
+        dbmatch = _ts.dbMatch()
+        for h in dbmatch:
+            if h == None:
+                break
+            count = count + 1
+
+        total = count
 
     count = 0
     dbmatch = _ts.dbMatch()
@@ -38,15 +38,55 @@ class TestPprint_pkglist(unittest.TestCase):
         """Verify that pprint_pkglist proper handles a single list (IndexError)"""
         try:
             res = rhnPackageInfo.pprint_pkglist(self.pkgList5)
-            print res
+            print(res)
         except IndexError:
             pass
         else:
             self.fail("expected a IndexError")
 
+class TestPackageProfileDelta(unittest.TestCase):
+    def setUp(self):
+        self.foo = {'name': 'foo', 'epoch': '', 'version': '1.0', 'release': '1',
+                    'arch': 'x86_64', 'installtime': 1000}
+        self.bar = {'name': 'bar', 'epoch': '2', 'version': '2.0', 'release': '1',
+                    'arch': 'noarch', 'installtime': 1000}
+        self.newFoo = dict(self.foo, version='1.1')
+
+    def testUnchanged(self):
+        """Verify that an unchanged profile has no delta"""
+        res = rhnPackageInfo.packageProfileDelta([self.foo, self.bar],
+                                                 [self.bar, self.foo])
+        assert res == {'added': [], 'deleted': []}
+
+    def testUpdated(self):
+        """Verify that an updated package is both deleted and added"""
+        res = rhnPackageInfo.packageProfileDelta([self.foo, self.bar],
+                                                 [self.newFoo, self.bar])
+        assert res == {'added': [self.newFoo], 'deleted': [self.foo]}
+
+    def testReinstalled(self):
+        """Verify that a reinstalled package is part of the delta"""
+        reinstalled = dict(self.foo, installtime=2000)
+        res = rhnPackageInfo.packageProfileDelta([self.foo], [reinstalled])
+        assert res == {'added': [reinstalled], 'deleted': [self.foo]}
+
+    def testDigest(self):
+        """Verify the text the profile digest is computed from"""
+        import hashlib
+        text = "bar\t2\t2.0\t1\tnoarch\nfoo\t\t1.0\t1\tx86_64"
+        res = rhnPackageInfo.profileDigest([self.foo, self.bar, self.foo])
+        assert res == hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def testDigestIgnoresInstalltime(self):
+        """Verify that the profile digest does not depend on installtimes"""
+        reinstalled = dict(self.foo, installtime=2000)
+        assert rhnPackageInfo.profileDigest([self.foo]) == \
+            rhnPackageInfo.profileDigest([reinstalled])
+
 def suite():
     suite = unittest.TestSuite()
     suite.addTest(unittest.makeSuite(TestPprint_pkglist))
+    suite.addTest(unittest.makeSuite(TestPackageProfileDelta))
     return suite
 
 if __name__ == "__main__":
@@ -28,6 +28,9 @@ class Client(jabber_lib.JabberClient):
         jabber_lib.JabberClient.__init__(self, *args, **kwargs)
         self.username = None
         self.resource = None
+        # jids that came online since the runner last looked, the actions
+        # waiting for them are notified right away
+        self.jids_available = set()
         #self.DEBUG = jabber_lib.my_debug
 
     def start(self, username, password, resource):
@@ -167,6 +170,7 @@ class Client(jabber_lib.JabberClient):
     def set_jid_available(self, jid):
         jabber_lib.JabberClient.set_jid_available(self, jid)
         self._set_state(jid, self._get_push_state_id('online'))
+        self.jids_available.add(str(jid))
 
     def set_jid_unavailable(self, jid):
         jabber_lib.JabberClient.set_jid_unavailable(self, jid)
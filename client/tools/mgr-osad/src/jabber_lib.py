@@ -185,9 +185,7 @@ class Runner(object):
         while 1:
             try:
                 self.process_once(client)
-                # random sleep so we don't kill CPU performance, bz 222988
-                time_to_sleep = random.randint(6, 10)
-                time.sleep(time_to_sleep)
+                self.idle()
             except KeyboardInterrupt:
                 # CTRL+C
                 client.disconnect()
@@ -200,6 +198,12 @@ class Runner(object):
         "To be overridden in a client class"
         raise NotImplementedError
 
+    def idle(self):
+        "Pause between two calls of process_once"
+        # random sleep so we don't kill CPU performance, bz 222988
+        time_to_sleep = random.randint(6, 10)
+        time.sleep(time_to_sleep)
+
     def setup_config(self, config):
         pass
 
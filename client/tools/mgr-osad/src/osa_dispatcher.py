@@ -17,6 +17,7 @@ import sys
 import select
 import socket
 import string
+import time
 try: # python 3
     import socketserver
 except ImportError: # python 2
@@ -36,6 +37,10 @@ except ImportError: # python 2
 jabber_lib.log_debug = log_debug
 jabber_lib.log_error = log_error
 
+# Channel the rhnServerAction triggers send the server ids with actions to
+# pick up on
+ACTION_CHANNEL = 'rhn_server_action'
+
 def main():
     return Runner().main()
 
@@ -53,6 +58,13 @@ class Runner(jabber_lib.Runner):
         self._notifier = Notifier()
         self._poll_interval = None
         self._next_poll_interval = None
+        # Database connection receiving the notifications of the scheduled
+        # actions, None when polling for them
+        self._listener = None
+        # When to try listening again after it failed, None if not needed
+        self._next_listen = None
+        self._next_poll = 0
+        self._next_scan = 0
         # Cache states
         self._state_ids = {}
 
@@ -134,6 +146,7 @@ class Runner(jabber_lib.Runner):
 
         self._poll_interval = CFG.poll_interval
         self._next_poll_interval = self._poll_interval
+        self._listen()
 
         if self._jabber_servers and self._jabber_servers[0]:
             hostname = self._jabber_servers[0]
@@ -181,7 +194,41 @@ class Runner(jabber_lib.Runner):
 
         client.cancel_subscription(to_remove)
 
+    def _listen(self):
+        self._close_listener()
+        self._next_listen = None
+        if not int(CFG.get('use_notifications', 1)):
+            return
+        try:
+            self._listener = rhnSQL.listen(ACTION_CHANNEL)
+        except rhnSQL.SQLError:
+            e = sys.exc_info()[1]
+            log_error("Unable to listen for scheduled actions, polling for them:", e)
+            # try again at the next scan
+            self._next_listen = time.time() + int(CFG.get('scan_interval', 300))
+            return
+        log_debug(2, "Listening for scheduled actions")
+        # look for everything scheduled before
+        self._next_poll = self._next_scan = 0
+
+    def _close_listener(self):
+        if self._listener is not None:
+            try:
+                self._listener.close()
+            except rhnSQL.SQLError:
+                pass
+            self._listener = None
+
+    def idle(self):
+        if self._listener is None:
+            jabber_lib.Runner.idle(self)
+        # else process_once() waits for the events itself
+
     def process_once(self, client):
+        if self._next_listen is not None and time.time() >= self._next_listen:
+            self._listen()
+        if self._listener is not None:
+            return self._process_events(client)
         log_debug(3)
         # First, clean up the nodes that have been pinged and have not
         # responded
@@ -207,6 +254,69 @@ class Runner(jabber_lib.Runner):
         else:
             log_debug(5,"Not notifying jabber nodes")
 
+    def _process_events(self, client):
+        """ Wait for scheduled actions, messages of the jabber server and
+            the time of the next poll, then react to them.
+
+            The pinging of the clients happens every poll_interval seconds.
+            Only the servers the database notified about are looked at for
+            actions to pick up; all of them are looked at every
+            scan_interval seconds, when clients come online, when future
+            actions are due or the notify_threshold was reached.
+        """
+        log_debug(3)
+        now = time.time()
+        if now >= self._next_poll:
+            client.retrieve_roster()
+            self.reap_pinged_clients()
+            need_pinging = self._fetch_clients_to_be_pinged()
+            log_debug(4, "Clients to be pinged:", need_pinging)
+            if need_pinging:
+                client.ping_clients(need_pinging)
+            self._next_poll = now + self._poll_interval
+        if client.jids_available:
+            log_debug(4, "Clients online:", client.jids_available)
+            client.jids_available.clear()
+            self._next_scan = now
+        if now >= self._next_scan:
+            log_debug(5, "Notifying jabber nodes")
+            self._notifier.notify_jabber_nodes()
+            self._schedule_scan(now)
+
+        timeout = max(0, min(self._next_poll, self._next_scan) - time.time())
+        rfds, wfds, efds = select.select([client, self._listener], [], [], timeout)
+        if client in rfds:
+            log_debug(5, "before process")
+            client.process(timeout=None)
+            log_debug(5, "after process")
+        if self._listener in rfds:
+            try:
+                server_ids = set(self._listener.notifications())
+            except rhnSQL.SQLError:
+                e = sys.exc_info()[1]
+                log_error("Lost the notifications of scheduled actions:", e)
+                # get a new connection; if that fails, poll until the next
+                # attempt at the next scan
+                self._listen()
+                return
+            log_debug(4, "Servers with scheduled actions:", server_ids)
+            if self._notifier.throttled() or self._next_scan <= time.time():
+                # every server waiting for a free slot gets one in order
+                self._notifier.notify_jabber_nodes()
+                self._schedule_scan(time.time())
+            elif server_ids:
+                self._notifier.notify_jabber_nodes(server_ids=[int(i) for i in server_ids])
+                delta = self._notifier.get_next_poll_interval()
+                if delta:
+                    self._next_scan = min(self._next_scan, time.time() + delta)
+
+    def _schedule_scan(self, now):
+        self._next_scan = now + int(CFG.get('scan_interval', 300))
+        delta = self._notifier.get_next_poll_interval()
+        if delta:
+            # a future action becomes due
+            self._next_scan = min(self._next_scan, now + delta)
+
 
     _query_reap_pinged_clients = rhnSQL.Statement("""
         update rhnPushClient
@@ -314,10 +424,15 @@ class Notifier:
     def __init__(self):
         self._next_poll_interval = None
         self._notify_threshold = CFG.get('notify_threshold')
+        self._throttled = False
 
     def get_next_poll_interval(self):
         return self._next_poll_interval
 
+    def throttled(self):
+        """ Whether the last notification stopped at the notify_threshold """
+        return self._throttled
+
     def set_jabber_connection(self, jabber_connection):
         self.jabber_connection = jabber_connection
 
@@ -329,8 +444,11 @@ class Notifier:
         row = h.fetchone_dict() or {}
         return int(row.get("clients", 0))
 
-    def notify_jabber_nodes(self):
-        log_debug(3)
+    def notify_jabber_nodes(self, server_ids=None):
+        """ Notify the clients with actions to pick up, of the servers in
+            server_ids only if given
+        """
+        log_debug(3, server_ids)
         running_clients = self.get_running_clients()
         free_slots = 0
         if self._notify_threshold:
@@ -338,20 +456,24 @@ class Notifier:
         log_debug(4, "notify_threshold: %s running_clients: %s free_slots: %s" %
                 (self._notify_threshold, running_clients, free_slots))
 
-        h = rhnSQL.prepare(self._query_get_pending_clients)
-        h.execute()
+        if server_ids is None:
+            h = rhnSQL.prepare(self._query_get_pending_clients)
+            h.execute()
+        else:
+            h = rhnSQL.prepare(self._query_get_pending_clients_of_servers)
+            h.execute(server_ids=list(server_ids))
+        rows = h.fetchall_dict() or []
+        rebooting = reboots_in_progress(
+            set(row['server_id'] for row in rows if row['jabber_id'] is not None))
         self._next_poll_interval = None
+        self._throttled = False
         notified = []
 
-        while 1:
+        for row in rows:
             if self._notify_threshold and free_slots <= 0:
                 # End of loop
                 log_debug(4, "max running clients reached; stop notifying")
-                break
-
-            row = h.fetchone_dict()
-            if not row:
-                # End of loop
+                self._throttled = True
                 break
 
             delta = row['delta']
@@ -370,7 +492,7 @@ class Notifier:
                 # Not even online
                 continue
             server_id = row['server_id']
-            if server_id and reboot_in_progress(server_id):
+            if server_id in rebooting:
                 # don't call when a reboot is in progress
                 continue
 
@@ -418,6 +540,28 @@ class Notifier:
          order by sa.status, earliest_action, sa.server_id
     """)
 
+    # The same, for some servers
+    _query_get_pending_clients_of_servers = rhnSQL.Statement("""
+        select a.id, sa.server_id, pc.jabber_id,
+               date_diff_in_days(current_timestamp, earliest_action) * 86400 delta
+          from
+               rhnServerAction sa,
+               rhnAction a,
+               rhnPushClient pc
+         where pc.server_id = sa.server_id
+           and sa.server_id = any(:server_ids)
+           and sa.action_id = a.id
+           and sa.status in (0, 1) -- Queued or picked up
+           and not exists (
+               select 1
+                 from rhnServerAction sap
+                where sap.server_id = sa.server_id
+                  and sap.action_id = a.prerequisite
+                  and sap.status != 2
+            )
+         order by sa.status, earliest_action, sa.server_id
+    """)
+
     _query_get_running_clients = rhnSQL.Statement("""
         select count(distinct sa.server_id) clients
           from rhnServerAction sa
@@ -427,22 +571,21 @@ class Notifier:
            and sa.status = 1 -- picked up
     """)
 
-def reboot_in_progress(server_id):
-    """check for a reboot action for this server in status Picked Up"""
+def reboots_in_progress(server_ids):
+    """the servers of server_ids with a reboot action in status Picked Up"""
+    if not server_ids:
+        return set()
     h = rhnSQL.prepare("""
-        select 1
+        select distinct sa.server_id
           from rhnServerAction sa
           join rhnAction a on sa.action_id = a.id
           join rhnActionType at on a.action_type = at.id
-         where sa.server_id = :server_id
+         where sa.server_id = any(:server_ids)
            and at.label = 'reboot.reboot'
            and sa.status = 1 -- Picked Up
     """)
-    h.execute(server_id = server_id)
-    ret = h.fetchone_dict() or None
-    if ret:
-        return True
-    return False
+    h.execute(server_ids=list(server_ids))
+    return set(row['server_id'] for row in h.fetchall_dict() or [])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,285 @@
+#
+# Copyright (c) 2024 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+import unittest
+from unittest import mock
+
+import osa_dispatcher
+from osa_dispatcher import rhnSQL
+
+
+class FakeCFG:
+    poll_interval = 60
+
+    def __init__(self, **values):
+        self.values = {'use_notifications': 1, 'scan_interval': 300}
+        self.values.update(values)
+
+    def get(self, name, default=None):
+        return self.values.get(name, default)
+
+
+class FakeCursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.params = None
+
+    def execute(self, **params):
+        self.params = params
+        if 'server_ids' in params:
+            self.rows = [row for row in self.rows if row['server_id'] in params['server_ids']]
+
+    def fetchall_dict(self):
+        return self.rows or None
+
+    def fetchone_dict(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeDatabase:
+    """ Answers the queries of the Notifier """
+
+    def __init__(self, pending, running=0, rebooting=()):
+        self.pending = pending
+        self.running = running
+        self.rebooting = rebooting
+        self.cursors = []
+
+    def prepare(self, query):
+        if query is osa_dispatcher.Notifier._query_get_running_clients:
+            rows = [{'clients': self.running}]
+        elif query in (osa_dispatcher.Notifier._query_get_pending_clients,
+                       osa_dispatcher.Notifier._query_get_pending_clients_of_servers):
+            rows = [dict(row) for row in self.pending]
+        elif 'reboot.reboot' in query:
+            rows = [{'server_id': server_id} for server_id in self.rebooting]
+        else:
+            raise AssertionError("unexpected query %s" % query)
+        cursor = FakeCursor(rows)
+        self.cursors.append((query, cursor))
+        return cursor
+
+    def params(self, query):
+        return [cursor.params for q, cursor in self.cursors if q is query]
+
+
+def pending(server_id, delta=0):
+    return {'id': 100 + server_id, 'server_id': server_id,
+            'jabber_id': 'client-%d@jabber/osad' % server_id, 'delta': delta}
+
+
+class NotifierTest(unittest.TestCase):
+
+    def setUp(self):
+        for patcher in (mock.patch.object(osa_dispatcher, 'log_debug'),
+                        mock.patch.object(osa_dispatcher.rhnSQL, 'commit')):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def notify(self, db, server_ids=None, **config):
+        with mock.patch.object(osa_dispatcher, 'CFG', FakeCFG(**config)):
+            notifier = osa_dispatcher.Notifier()
+        connection = mock.Mock()
+        connection.jid_available.return_value = True
+        notifier.set_jabber_connection(connection)
+        with mock.patch.object(osa_dispatcher.rhnSQL, 'prepare', db.prepare):
+            notifier.notify_jabber_nodes(server_ids=server_ids)
+        notified = [c[0][0] for c in connection.send_message.call_args_list]
+        return notifier, notified
+
+    def test_notify_all_servers(self):
+        db = FakeDatabase([pending(1), pending(2), pending(3)])
+        notifier, notified = self.notify(db)
+
+        self.assertEqual(notified, ['client-1@jabber/osad', 'client-2@jabber/osad',
+                                    'client-3@jabber/osad'])
+        self.assertEqual(db.params(osa_dispatcher.Notifier._query_get_pending_clients), [{}])
+        self.assertFalse(notifier.throttled())
+
+    def test_notify_by_server_ids(self):
+        db = FakeDatabase([pending(1), pending(2), pending(3)])
+        notifier, notified = self.notify(db, server_ids=set([3, 1]))
+
+        self.assertEqual(notified, ['client-1@jabber/osad', 'client-3@jabber/osad'])
+        self.assertEqual(db.params(osa_dispatcher.Notifier._query_get_pending_clients), [])
+        params = db.params(osa_dispatcher.Notifier._query_get_pending_clients_of_servers)
+        self.assertEqual([sorted(p['server_ids']) for p in params], [[1, 3]])
+
+    def test_notify_threshold_throttles(self):
+        db = FakeDatabase([pending(1), pending(2), pending(3)], running=1)
+        notifier, notified = self.notify(db, notify_threshold=2)
+
+        self.assertEqual(notified, ['client-1@jabber/osad'])
+        self.assertTrue(notifier.throttled())
+
+    def test_rebooting_servers_are_not_notified(self):
+        db = FakeDatabase([pending(1), pending(2)], rebooting=[1])
+        notifier, notified = self.notify(db)
+
+        self.assertEqual(notified, ['client-2@jabber/osad'])
+
+    def test_future_actions_set_the_next_poll_interval(self):
+        db = FakeDatabase([pending(1, delta=600), pending(2, delta=120), pending(3)])
+        notifier, notified = self.notify(db)
+
+        self.assertEqual(notified, ['client-3@jabber/osad'])
+        self.assertEqual(notifier.get_next_poll_interval(), 120)
+
+
+class RebootsInProgressTest(unittest.TestCase):
+
+    def test_no_servers(self):
+        with mock.patch.object(osa_dispatcher.rhnSQL, 'prepare') as prepare:
+            self.assertEqual(osa_dispatcher.reboots_in_progress(set()), set())
+        prepare.assert_not_called()
+
+    def test_one_query_for_all_servers(self):
+        db = FakeDatabase([], rebooting=[2, 2, 5])
+        with mock.patch.object(osa_dispatcher.rhnSQL, 'prepare', db.prepare):
+            self.assertEqual(osa_dispatcher.reboots_in_progress(set([2, 3, 5])), set([2, 5]))
+        self.assertEqual(len(db.cursors), 1)
+        self.assertEqual(sorted(db.cursors[0][1].params['server_ids']), [2, 3, 5])
+
+
+class ProcessEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        self.listeners = []
+        self.listen_error = None
+        self.select = mock.Mock(return_value=([], [], []))
+        for patcher in (mock.patch.object(osa_dispatcher, 'CFG', FakeCFG()),
+                        mock.patch.object(osa_dispatcher, 'initCFG'),
+                        mock.patch.object(osa_dispatcher, 'log_debug'),
+                        mock.patch.object(osa_dispatcher, 'log_error'),
+                        mock.patch.object(osa_dispatcher.time, 'time', lambda: self.now),
+                        mock.patch.object(osa_dispatcher.select, 'select', self.select),
+                        mock.patch.object(osa_dispatcher.rhnSQL, 'listen', self.listen)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.runner = osa_dispatcher.Runner()
+        self.runner._poll_interval = self.runner._next_poll_interval = 60
+        self.runner.reap_pinged_clients = mock.Mock()
+        self.runner._fetch_clients_to_be_pinged = mock.Mock(return_value=None)
+        self.notifier = self.runner._notifier = mock.Mock()
+        self.notifier.throttled.return_value = False
+        self.notifier.get_next_poll_interval.return_value = None
+        self.client = mock.Mock()
+        self.client.jids_available = set()
+
+        self.runner._listen()
+        self.listener = self.runner._listener
+        # the pinging and the scan of everything scheduled before listening
+        self.runner.process_once(self.client)
+        self.notifier.reset_mock()
+
+    def listen(self, channel):
+        self.assertEqual(channel, osa_dispatcher.ACTION_CHANNEL)
+        if self.listen_error:
+            raise self.listen_error
+        listener = mock.Mock()
+        listener.notifications.return_value = []
+        self.listeners.append(listener)
+        return listener
+
+    def notify(self, server_ids):
+        self.listener.notifications.return_value = server_ids
+        self.select.return_value = ([self.listener], [], [])
+        self.now += 1
+        self.runner.process_once(self.client)
+
+    def test_first_pass_scans_all_servers(self):
+        self.assertEqual(self.runner._next_scan, 1300)
+        self.assertEqual(self.runner._next_poll, 1060)
+        self.client.ping_clients.assert_not_called()
+        self.select.assert_called_with([self.client, self.listener], [], [], 60)
+
+    def test_notified_servers_are_looked_at(self):
+        self.notify(['12', '7', '12'])
+
+        self.assertEqual(len(self.notifier.notify_jabber_nodes.call_args_list), 1)
+        server_ids = self.notifier.notify_jabber_nodes.call_args[1]['server_ids']
+        self.assertEqual(sorted(server_ids), [7, 12])
+        self.assertEqual(self.runner._next_scan, 1300)
+
+    def test_future_action_brings_the_scan_forward(self):
+        self.notifier.get_next_poll_interval.return_value = 30
+        self.notify(['7'])
+
+        self.assertEqual(self.runner._next_scan, 1031)
+
+    def test_throttled_notifier_scans_all_servers(self):
+        self.notifier.throttled.return_value = True
+        self.notify(['7'])
+
+        self.notifier.notify_jabber_nodes.assert_called_once_with()
+        self.assertEqual(self.runner._next_scan, 1301)
+
+    def test_scan_interval(self):
+        self.now = 1300
+        self.runner.process_once(self.client)
+
+        self.notifier.notify_jabber_nodes.assert_called_once_with()
+        self.assertEqual(self.runner._next_scan, 1600)
+
+    def test_clients_coming_online_trigger_a_scan(self):
+        self.client.jids_available.add('client-7@jabber/osad')
+        self.now += 1
+        self.runner.process_once(self.client)
+
+        self.notifier.notify_jabber_nodes.assert_called_once_with()
+        self.assertEqual(self.client.jids_available, set())
+
+    def test_lost_listener_is_replaced(self):
+        self.listener.notifications.side_effect = rhnSQL.SQLError("connection lost")
+        self.notify([])
+
+        self.listener.close.assert_called_once_with()
+        self.assertEqual(len(self.listeners), 2)
+        self.assertTrue(self.runner._listener is self.listeners[1])
+        # everything scheduled meanwhile is looked at
+        self.assertEqual(self.runner._next_scan, 0)
+
+    def test_lost_listener_polls_until_the_next_scan(self):
+        self.listener.notifications.side_effect = rhnSQL.SQLError("connection lost")
+        self.listen_error = rhnSQL.SQLError("database down")
+        self.notify([])
+        self.assertEqual(self.runner._listener, None)
+        self.assertEqual(self.runner._next_listen, 1301)
+
+        # polling
+        self.select.return_value = ([], [self.client], [])
+        self.now = 1200
+        self.runner.process_once(self.client)
+        self.notifier.notify_jabber_nodes.assert_called_once_with()
+        self.assertEqual(self.runner._listener, None)
+
+        # the database is back
+        self.listen_error = None
+        self.now = 1301
+        self.runner.process_once(self.client)
+        self.assertEqual(len(self.listeners), 2)
+        self.assertTrue(self.runner._listener is self.listeners[1])
+        self.assertEqual(self.runner._next_listen, None)
+        # with a scan of everything scheduled meanwhile
+        self.assertEqual(self.notifier.notify_jabber_nodes.call_args_list, [mock.call(), mock.call()])
+        self.select.assert_called_with([self.client, self.listeners[1]], [], [], 60)
+
+    def test_polling_without_notifications(self):
+        with mock.patch.object(osa_dispatcher, 'CFG', FakeCFG(use_notifications=0)):
+            self.runner._listen()
+        self.listener.close.assert_called_once_with()
+        self.assertEqual((self.runner._listener, self.runner._next_listen), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
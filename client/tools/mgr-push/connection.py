@@ -13,6 +13,7 @@
 # in this software or its documentation.
 #
 
+import errno
 import socket
 import base64
 import sys
@@ -24,9 +25,11 @@ from uyuni.common.rhn_pkg import InvalidPackageError, package_from_filename
 from rhnpush.utils import tupleify_urlparse
 
 if sys.version_info[0] == 3:
+    from http.client import BadStatusLine
     from urllib.parse import splitport
     from urllib.parse import urlparse
 else:
+    from httplib import BadStatusLine
     from urlparse import urlparse
     from urllib import splitport # pylint: disable=C0412
 
@@ -34,6 +37,20 @@ else:
 class ConnectionError(Exception):
     pass
 
+
+class _StaleConnection(Exception):
+    """ The server closed the kept-alive connection before the request
+        reached it
+    """
+    pass
+
+
+def _closed_by_server(e):
+    # RemoteDisconnected (no status line at all) is a BadStatusLine
+    if isinstance(e, BadStatusLine):
+        return True
+    return isinstance(e, socket.error) and e.errno in (errno.EPIPE, errno.ECONNRESET)
+
 # pylint: disable=R0902
 
 
@@ -86,6 +103,13 @@ class BaseConnection:
         self._connection = self.get_connection()
         self._connection.connect()
 
+    def is_connected(self):
+        return self._connection is not None and self._connection.sock is not None
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+
     def putrequest(self, method, url=None, skip_host=0):
         if url is None:
             url = self._path
@@ -100,8 +124,11 @@ class PackageUpload:
     header_prefix = "X-RHN-Upload"
     user_agent = "rhn-package-upload"
 
-    def __init__(self, url, proxy=None):
+    def __init__(self, url, proxy=None, keep_alive=False):
         self.connection = BaseConnection(url, proxy)
+        # Reuse the connection for the next upload, as long as the server
+        # keeps it open
+        self.keep_alive = keep_alive
         self.headers = {}
         self.package_name = None
         self.package_epoch = None
@@ -125,17 +152,23 @@ class PackageUpload:
         vlist.append(value)
 
     def send_http_headers(self, method, content_length=None):
+        if self.keep_alive and self.connection.is_connected():
+            self.connection.putrequest(method)
+            self._send_headers(content_length)
+            return
         try:
             self.connection.connect()
         except socket.error:
             e = sys.exc_info()[1]
             raise_with_tb(ConnectionError("Error connecting", str(e)), sys.exc_info()[2])
+        self.connection.putrequest(method)
+        self._send_headers(content_length)
 
+    def _send_headers(self, content_length):
         # Add content_length
         if 'Content-Length' not in self.headers and \
                 content_length is not None:
             self.set_header('Content-Length', content_length)
-        self.connection.putrequest(method)
 
         # Additional headers
         for hname, hval in self.headers.items():
@@ -163,14 +196,40 @@ class PackageUpload:
                 raise_with_tb(ConnectionError("Error sending body", str(e)), sys.exc_info()[2])
 
     def send_http(self, method, stream_body=None):
+        if not (self.keep_alive and self.connection.is_connected()):
+            return self._send_http(method, stream_body)
+        try:
+            return self._send_http(method, stream_body, reused=True)
+        except _StaleConnection:
+            # The server closed the kept-alive connection in the meantime,
+            # it did not get the request: send it again on a new one
+            self.connection.close()
+            return self._send_http(method, stream_body)
+
+    def _send_http(self, method, stream_body=None, reused=False):
         if stream_body is None:
             content_length = 0
         else:
             stream_body.seek(0, 2)
             content_length = stream_body.tell()
-        self.send_http_headers(method, content_length=content_length)
+        # Only the failures of sending the headers and of reading the status
+        # line show that a reused connection was closed before the request;
+        # anything else may have reached the server already
+        try:
+            self.send_http_headers(method, content_length=content_length)
+        except socket.error:
+            e = sys.exc_info()[1]
+            if reused and _closed_by_server(e):
+                raise_with_tb(_StaleConnection(str(e)), sys.exc_info()[2])
+            raise
         self.send_http_body(stream_body)
-        self._response = self.connection.getresponse()
+        try:
+            self._response = self.connection.getresponse()
+        except (BadStatusLine, socket.error):
+            e = sys.exc_info()[1]
+            if reused and _closed_by_server(e):
+                raise_with_tb(_StaleConnection(str(e)), sys.exc_info()[2])
+            raise
         self._resp_headers = self._response.msg
 
         return self._response
@@ -219,6 +278,11 @@ class PackageUpload:
         self.checksum_type = fileChecksumType
         self.checksum = fileChecksum
 
+        # The headers of this package only: the connection may be reused for
+        # the next one
+        headers = self.headers
+        self.headers = dict(headers)
+
         # Set headers
         self.set_header("Content-Type", "application/x-rpm")
         self.set_header("User-Agent", self.user_agent)
@@ -236,11 +300,18 @@ class PackageUpload:
             self.set_header("%s-%s" % (prefix, "File-Checksum"), self.checksum)
 
         a_pkg.input_stream.seek(0, 0)
-        self._response = self.send_http('POST', stream_body=a_pkg.input_stream)
-        a_pkg.input_stream.close()
+        try:
+            self._response = self.send_http('POST', stream_body=a_pkg.input_stream)
+        finally:
+            a_pkg.input_stream.close()
+            self.headers = headers
 
         retval = self.process_response()
-        self.connection.close()
+        if self.keep_alive and not self._response.will_close:
+            # The whole response has to be read before the next request
+            self._response.read()
+        else:
+            self.connection.close()
         return retval
 
     def process_response(self):
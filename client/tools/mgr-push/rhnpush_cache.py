@@ -21,8 +21,15 @@
 #            Cache won't be valid after a certain amount of time.
 #
 # CacheManager - Controls access to the cache.
+#
+# RHNPushManifest - The packages a push already did, to resume it.
 
+import errno
+import hashlib
+import json
 import os
+import sys
+import threading
 from rhnpush import utils
 
 # This is the class that contains the session.
@@ -49,3 +56,67 @@ class RHNPushSession:
         sessionfile = open(self.location, "w")
         sessionfile.write(self.session)
         sessionfile.close()
+
+
+# The packages of an interrupted push, so that running the same push again
+# skips them. One JSON line is appended per package, so that a push killed
+# while writing loses the last package at most.
+
+
+class RHNPushManifest:
+
+    def __init__(self, key):
+        name = hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+        self.location = os.path.join(utils.get_home_dir(), ".rhnpush-manifest-%s" % name)
+        self.packages = {}
+        self._lock = threading.Lock()
+
+    def readManifest(self):
+        self.packages = {}
+        try:
+            manifestfile = open(self.location, "r")
+        except IOError:
+            return
+        for line in manifestfile:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # the package being written when the push was killed
+                continue
+            self.packages[entry['path']] = entry
+        manifestfile.close()
+
+    def getPackage(self, filename):
+        """ The channel package info of filename if it was pushed and did
+            not change since, None otherwise.
+        """
+        path = os.path.abspath(filename)
+        entry = self.packages.get(path)
+        if entry is None:
+            return None
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry['size'] != st.st_size or entry['mtime'] != st.st_mtime:
+            return None
+        return entry['info']
+
+    def addPackage(self, filename, info):
+        path = os.path.abspath(filename)
+        st = os.stat(path)
+        entry = {'path': path, 'size': st.st_size, 'mtime': st.st_mtime, 'info': info}
+        with self._lock:
+            self.packages[path] = entry
+            manifestfile = open(self.location, "a")
+            manifestfile.write(json.dumps(entry) + "\n")
+            manifestfile.close()
+
+    def removeManifest(self):
+        try:
+            os.unlink(self.location)
+        except OSError:
+            e = sys.exc_info()[1]
+            if e.errno != errno.ENOENT:
+                raise
+        self.packages = {}
@@ -67,7 +67,8 @@ class rhnpushConfigParser:
             'proxy':   '',
             'tolerant':   '0',
             'ca_chain':   '/usr/share/rhn/RHN-ORG-TRUSTED-SSL-CERT',
-            'timeout': None
+            'timeout': None,
+            'parallel': '1'
         }
 
         # Used to parse the config file.
@@ -100,6 +100,9 @@ class ConfManager:
         if self.defaultconfig.timeout:
             self.defaultconfig.timeout = int(self.defaultconfig.timeout)
 
+        if self.defaultconfig.parallel:
+            self.defaultconfig.parallel = int(self.defaultconfig.parallel)
+
         # Copy the settings in argoptions into self.defaultconfig.
         self.defaultconfig, argoptions = utils.make_common_attr_equal(self.defaultconfig, argoptions)
 
@@ -28,10 +28,13 @@ This script performs various management operations on the Spacewalk Proxy:
   ones)
 """
 
+import functools
 import os
 import random
 import sys
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 # pylint: disable=W0402
 from optparse import Option, OptionParser
 
@@ -44,7 +47,7 @@ from uyuni.common.rhn_pkg import InvalidPackageError, package_from_filename
 from uyuni.common.usix import raise_with_tb
 
 from rhnpush.utils import tupleify_urlparse
-from rhnpush import rhnpush_confmanager, uploadLib, rhnpush_v2
+from rhnpush import rhnpush_cache, rhnpush_confmanager, uploadLib, rhnpush_v2
 
 if sys.version_info[0] == 3:
     import urllib.parse as urlparse
@@ -54,6 +57,8 @@ else:
 # Global settings
 BUFFER_SIZE = 65536
 HEADERS_PER_CALL = 10
+# Packages checked against the server at once by parallel pushes
+PACKAGES_PER_CHECK = 500
 DEBUG = 0
 RPMTAG_NOSOURCE = 1051
 
@@ -111,7 +116,9 @@ def main():
                help='If rhnpush errors while uploading a package, continue uploading the rest of the packages.'),
         Option('--ca-chain', action='store', help='alternative SSL CA Cert'),
         Option('--timeout', action='store', type='int', metavar='SECONDS',
-               help='Change default connection timeout.')
+               help='Change default connection timeout.'),
+        Option('--parallel', action='store', type='int', metavar='N',
+               help='Checksum and upload N packages at a time, resuming interrupted pushes')
     ]
 
     # Having to maintain a store_true list is ugly. I'm trying to get rid of this.
@@ -187,6 +194,10 @@ class UploadClass(uploadLib.UploadClass):
     def __init__(self, options, files=None):
         uploadLib.UploadClass.__init__(self, options, files)
         self.url_v2 = None
+        # self.server and the session are shared by the upload workers
+        self._server_lock = threading.RLock()
+        # the PackageUpload of every thread, keeping its connection open
+        self._uploads = threading.local()
 
     def setURL(self):
         server = sstr(idn_ascii_to_puny(self.options.server))
@@ -311,6 +322,10 @@ class UploadClass(uploadLib.UploadClass):
     def _test_authenticate(self):
         self.authenticate()
 
+    def authenticate(self):
+        with self._server_lock:
+            uploadLib.UploadClass.authenticate(self)
+
     def extended_test(self):
         self._test_force()
         self._test_set_org()
@@ -358,9 +373,7 @@ class UploadClass(uploadLib.UploadClass):
 
         channel_packages = []
 
-        # a little fault tolarence is in order
         random.seed()
-        tries = 3
 
         # satellites < 4.1.0 are no more supported
         if sys.version_info[0] == 3:
@@ -370,11 +383,12 @@ class UploadClass(uploadLib.UploadClass):
         if not pack_exist_check:
             self.die(-1, "Pushing to Satellite < 4.1.0 is not supported.")
 
+        if self.options.parallel and self.options.parallel > 1:
+            return self.parallel_packages(self.options.parallel)
+
         (server_digest_hash, pkgs_info, digest_hash) = self.check_package_exists()
 
         for pkg in self.files:
-            ret = None  # pkilambi:errors off as not initialized.this fixes it.
-
             # temporary fix for picking pkgs instead of full paths
             pkg_key = (pkg.strip()).split('/')[-1]
 
@@ -384,79 +398,14 @@ class UploadClass(uploadLib.UploadClass):
             checksum_type, checksum = digest = digest_hash[pkg_key]
             server_digest = tuple(server_digest_hash[pkg_key])
 
-            # compare checksums for existance check
-            if server_digest == digest and not self.options.force:
-                channel_packages.append(pkgs_info[pkg_key])
-                self.warn(1, "Package %s already exists on the SUSE Manager Server-- Skipping Upload...." % pkg)
+            upload = self._upload_needed(pkg, digest, server_digest)
+            if upload is None:
                 continue
-
-            elif server_digest == ():
-                self.warn(1,"Package %s Not Found on SUSE Manager Server -- Uploading" % pkg)
-
-            elif server_digest == "on-disk" and not self.options.force:
+            if not upload:
                 channel_packages.append(pkgs_info[pkg_key])
-                self.warn(0, "Package on disk but not on db -- Skipping Upload " % pkg)
                 continue
 
-            elif server_digest != digest:
-                if self.options.force:
-                    self.warn(1, "Package checksum %s mismatch  -- Forcing Upload" % pkg)
-                else:
-                    msg = "Error: Package %s already exists on the server with" \
-                          " a different checksum. Skipping upload to prevent" \
-                          " overwriting existing package. (You may use rhnpush with" \
-                          " the --force option to force this upload if the" \
-                          " force_upload option is enabled on your server.)\n" % pkg
-                    if not self.options.tolerant:
-                        self.die(-1, msg)
-                    self.warn(0, msg)
-                    continue
-
-            for _t in range(0, tries):
-                try:
-                    ret = self.package(pkg, checksum_type, checksum)
-                    if ret is None:
-                        raise uploadLib.UploadError()
-
-                # TODO:  Revisit this.  We throw this error all over the place,
-                #        but doing so will cause us to skip the --tolerant logic
-                #        below.  I don't think we really want this behavior.
-                #        There are some cases where we don't want to retry 3
-                #        times, but not at the expense of disabling the tolerant
-                #        flag, IMHO.  This loop needs some lovin'.  -- pav
-
-                # FIX: it checks for tolerant flag and aborts only if the flag is
-                #not specified
-                except uploadLib.UploadError:
-                    ue = sys.exc_info()[1]
-                    if not self.options.tolerant:
-                        self.die(1, ue)
-                    self.warn(2, ue)
-                except AuthenticationRequired:
-                    # session expired so we re-authenticate for the process to complete
-                    # this uses the username and password from memory if available
-                    # else it prompts for one.
-                    self.authenticate()
-                except:
-                    self.warn(2, sys.exc_info()[1])
-                    wait = random.randint(1, 5)
-                    self.warn(0, "Waiting %d seconds and trying again..." % wait)
-                    time.sleep(wait)
-                # The else clause gets executed in the stuff in the try-except block *succeeds*.
-                else:
-                    break
-
-            # if the preceeding for-loop exits without a call to break, then this else clause gets called.
-            # What's kind of weird is that if the preceeding for-loop doesn't call break then an error occurred
-            # and all of retry attempts failed. If the for-loop *does* call break then everything is hunky-dory.
-            # In short, this else clause only get's called if something is F.U.B.A.R and the retry attempts don't
-            # fix anything.
-            else:
-                if not self.options.tolerant:
-                    # pkilambi:bug#176358:this exits with a error code of 1
-                    self.die(1, "Giving up after %d attempts" % tries)
-                else:
-                    print("Giving up after %d attempts and continuing on..." % (tries,))
+            ret = self._upload_retrying(pkg, checksum_type, checksum)
 
             # 5/13/05 wregglej - 154248 ?? we still want to add the packages if they're source.
             if ret and self.channels:  # and ret['arch'] != 'src':
@@ -464,6 +413,9 @@ class UploadClass(uploadLib.UploadClass):
                 # no channel was specified or a source rpm was passed
                 channel_packages.append(ret)
 
+        return self.subscribe_packages(channel_packages)
+
+    def subscribe_packages(self, channel_packages):
         # self.channels is never None, it always has at least one entry with an empty string.
         if len(self.channels) == 1 and self.channels[0] == '':
             return
@@ -481,6 +433,177 @@ class UploadClass(uploadLib.UploadClass):
                            self.session.getSessionString(), info)
         return 0
 
+    def _upload_needed(self, pkg, digest, server_digest):
+        """ Compares the checksum of pkg with the one the server has.
+            Returns True if pkg has to be uploaded, False if the server
+            already has it and None if it has to be left out.
+        """
+        # compare checksums for existance check
+        if server_digest == digest and not self.options.force:
+            self.warn(1, "Package %s already exists on the SUSE Manager Server-- Skipping Upload...." % pkg)
+            return False
+
+        elif server_digest == ():
+            self.warn(1,"Package %s Not Found on SUSE Manager Server -- Uploading" % pkg)
+
+        elif server_digest == "on-disk" and not self.options.force:
+            self.warn(0, "Package %s on disk but not on db -- Skipping Upload " % pkg)
+            return False
+
+        elif server_digest != digest:
+            if self.options.force:
+                self.warn(1, "Package checksum %s mismatch  -- Forcing Upload" % pkg)
+            else:
+                msg = "Error: Package %s already exists on the server with" \
+                      " a different checksum. Skipping upload to prevent" \
+                      " overwriting existing package. (You may use rhnpush with" \
+                      " the --force option to force this upload if the" \
+                      " force_upload option is enabled on your server.)\n" % pkg
+                if not self.options.tolerant:
+                    self.die(-1, msg)
+                self.warn(0, msg)
+                return None
+        return True
+
+    def _upload_retrying(self, pkg, checksum_type, checksum):
+        # a little fault tolarence is in order
+        tries = 3
+        ret = None  # pkilambi:errors off as not initialized.this fixes it.
+
+        for _t in range(0, tries):
+            try:
+                ret = self.package(pkg, checksum_type, checksum)
+                if ret is None:
+                    raise uploadLib.UploadError()
+
+            # TODO:  Revisit this.  We throw this error all over the place,
+            #        but doing so will cause us to skip the --tolerant logic
+            #        below.  I don't think we really want this behavior.
+            #        There are some cases where we don't want to retry 3
+            #        times, but not at the expense of disabling the tolerant
+            #        flag, IMHO.  This loop needs some lovin'.  -- pav
+
+            # FIX: it checks for tolerant flag and aborts only if the flag is
+            #not specified
+            except uploadLib.UploadError:
+                ue = sys.exc_info()[1]
+                if not self.options.tolerant:
+                    self.die(1, ue)
+                self.warn(2, ue)
+            except AuthenticationRequired:
+                # session expired so we re-authenticate for the process to complete
+                # this uses the username and password from memory if available
+                # else it prompts for one.
+                self.authenticate()
+            except:
+                self.warn(2, sys.exc_info()[1])
+                wait = random.randint(1, 5)
+                self.warn(0, "Waiting %d seconds and trying again..." % wait)
+                time.sleep(wait)
+            # The else clause gets executed in the stuff in the try-except block *succeeds*.
+            else:
+                break
+
+        # if the preceeding for-loop exits without a call to break, then this else clause gets called.
+        # What's kind of weird is that if the preceeding for-loop doesn't call break then an error occurred
+        # and all of retry attempts failed. If the for-loop *does* call break then everything is hunky-dory.
+        # In short, this else clause only get's called if something is F.U.B.A.R and the retry attempts don't
+        # fix anything.
+        else:
+            if not self.options.tolerant:
+                # pkilambi:bug#176358:this exits with a error code of 1
+                self.die(1, "Giving up after %d attempts" % tries)
+            else:
+                print("Giving up after %d attempts and continuing on..." % (tries,))
+        return ret
+
+    def parallel_packages(self, workers):
+        """ Pushes the packages with workers threads checksumming the files
+            ahead of the uploads and workers threads uploading them. The
+            packages done are written to a manifest: running an interrupted
+            push again skips them.
+        """
+        manifest = rhnpush_cache.RHNPushManifest(" ".join(
+            [self.url_v2, str(self.orgId), str(self.options.source or 0)] + sorted(self.channels)))
+        manifest.readManifest()
+        checksum_pool = ThreadPool(workers)
+        upload_pool = ThreadPool(workers)
+        channel_packages = []
+        try:
+            # the patch clusters were moved to the end, and all their patches
+            # have to be pushed before them
+            files1 = [f for f in self.files if not f.startswith('patch-cluster-')]
+            files2 = [f for f in self.files if f.startswith('patch-cluster-')]
+            for files in (files1, files2):
+                channel_packages.extend(self._push_parallel(files, manifest, checksum_pool, upload_pool))
+        except WorkerExit:
+            e = sys.exc_info()[1]
+            checksum_pool.terminate()
+            upload_pool.terminate()
+            sys.exit(e.args[0])
+        checksum_pool.close()
+        upload_pool.close()
+
+        ret = self.subscribe_packages(channel_packages)
+        manifest.removeManifest()
+        return ret
+
+    def _push_parallel(self, files, manifest, checksum_pool, upload_pool):
+        channel_packages = []
+        todo = []
+        for pkg in files:
+            pkg_info = manifest.getPackage(pkg)
+            if pkg_info is None:
+                todo.append(pkg)
+                continue
+            self.warn(1, "Package %s already pushed -- Skipping Upload" % pkg)
+            channel_packages.append(pkg_info)
+
+        # the checksums of the next packages are computed while the ones
+        # already checked are uploaded
+        infos = checksum_pool.imap(functools.partial(_in_worker, self._package_info), todo)
+        uploads = []
+        for start in range(0, len(todo), PACKAGES_PER_CHECK):
+            pkgs_info = {}
+            batch = []
+            for pkg in todo[start:start + PACKAGES_PER_CHECK]:
+                pkg_info = next(infos)
+                if pkg_info is not None:
+                    pkg_key = (pkg.strip()).split('/')[-1]
+                    pkgs_info[pkg_key] = pkg_info
+                    batch.append((pkg, pkg_key))
+            if not pkgs_info:
+                continue
+            server_digest_hash = self._server_checksums(pkgs_info)
+
+            for pkg, pkg_key in batch:
+                if pkg_key not in server_digest_hash:
+                    continue
+                pkg_info = pkgs_info[pkg_key]
+                digest = (pkg_info['checksum_type'], pkg_info['checksum'])
+                upload = self._upload_needed(pkg, digest, tuple(server_digest_hash[pkg_key]))
+                if upload is None:
+                    continue
+                if not upload:
+                    channel_packages.append(pkg_info)
+                    manifest.addPackage(pkg, pkg_info)
+                    continue
+                uploads.append(upload_pool.apply_async(
+                    _in_worker, (self._upload_package, pkg, digest, manifest)))
+
+        for upload in uploads:
+            ret = upload.get()
+            if ret:
+                channel_packages.append(ret)
+        return channel_packages
+
+    def _upload_package(self, pkg, digest, manifest):
+        checksum_type, checksum = digest
+        ret = self._upload_retrying(pkg, checksum_type, checksum)
+        if ret:
+            manifest.addPackage(pkg, ret)
+        return ret
+
     # does an existance check of the packages to be uploaded and returns their checksum and other info
     def check_package_exists(self):
         self.warn(2, "Computing checksum and package info. This may take some time ...")
@@ -488,50 +611,60 @@ class UploadClass(uploadLib.UploadClass):
         digest_hash = {}
 
         for pkg in self.files:
-            pkg_info = {}
             pkg_key = (pkg.strip()).split('/')[-1]
-
-            if not os.access(pkg, os.R_OK):
-                if not self.options.tolerant:
-                    self.die(-1, "Could not read file %s" % pkg)
-                self.warn(-1, "Could not read file %s" % pkg)
+            pkg_info = self._package_info(pkg)
+            if pkg_info is None:
                 continue
-            try:
-                a_pkg = package_from_filename(pkg)
-                a_pkg.read_header()
-                a_pkg.payload_checksum()
-            except InvalidPackageError:
-                if not self.options.tolerant:
-                    self.die(-1, "ERROR: %s: This file doesn't appear to be a package" % pkg)
-                self.warn(2, "ERROR: %s: This file doesn't appear to be a package" % pkg)
-                continue
-            except IOError:
-                if not self.options.tolerant:
-                    self.die(-1, "ERROR: %s: No such file or directory available" % pkg)
-                self.warn(2, "ERROR: %s: No such file or directory available" % pkg)
-                continue
-
-            digest_hash[pkg_key] = (a_pkg.checksum_type, a_pkg.checksum)
-            a_pkg.input_stream.close()
-
-            for tag in ('name', 'version', 'release', 'epoch', 'arch'):
-                val = a_pkg.header[tag]
-                if val is None:
-                    val = ''
-                pkg_info[tag] = val
-            # b195903:the arch for srpms should be obtained by is_source check
-            # instead of checking arch in header
-            if a_pkg.header.is_source:
-                if not self.options.source:
-                    self.die(-1, "ERROR: Trying to Push src rpm, Please re-try with --source.")
-                if RPMTAG_NOSOURCE in a_pkg.header.keys():
-                    pkg_info['arch'] = 'nosrc'
-                else:
-                    pkg_info['arch'] = 'src'
-            pkg_info['checksum_type'] = a_pkg.checksum_type
-            pkg_info['checksum'] = a_pkg.checksum
+            digest_hash[pkg_key] = (pkg_info['checksum_type'], pkg_info['checksum'])
             pkg_hash[pkg_key] = pkg_info
 
+        return (self._server_checksums(pkg_hash), pkg_hash, digest_hash)
+
+    def _package_info(self, pkg):
+        """ The header and checksum info of pkg, None if it is left out """
+        pkg_info = {}
+        if not os.access(pkg, os.R_OK):
+            if not self.options.tolerant:
+                self.die(-1, "Could not read file %s" % pkg)
+            self.warn(-1, "Could not read file %s" % pkg)
+            return None
+        try:
+            a_pkg = package_from_filename(pkg)
+            a_pkg.read_header()
+            a_pkg.payload_checksum()
+        except InvalidPackageError:
+            if not self.options.tolerant:
+                self.die(-1, "ERROR: %s: This file doesn't appear to be a package" % pkg)
+            self.warn(2, "ERROR: %s: This file doesn't appear to be a package" % pkg)
+            return None
+        except IOError:
+            if not self.options.tolerant:
+                self.die(-1, "ERROR: %s: No such file or directory available" % pkg)
+            self.warn(2, "ERROR: %s: No such file or directory available" % pkg)
+            return None
+
+        a_pkg.input_stream.close()
+
+        for tag in ('name', 'version', 'release', 'epoch', 'arch'):
+            val = a_pkg.header[tag]
+            if val is None:
+                val = ''
+            pkg_info[tag] = val
+        # b195903:the arch for srpms should be obtained by is_source check
+        # instead of checking arch in header
+        if a_pkg.header.is_source:
+            if not self.options.source:
+                self.die(-1, "ERROR: Trying to Push src rpm, Please re-try with --source.")
+            if RPMTAG_NOSOURCE in a_pkg.header.keys():
+                pkg_info['arch'] = 'nosrc'
+            else:
+                pkg_info['arch'] = 'src'
+        pkg_info['checksum_type'] = a_pkg.checksum_type
+        pkg_info['checksum'] = a_pkg.checksum
+        return pkg_info
+
+    def _server_checksums(self, pkg_hash):
+        """ The checksums the server has for the packages of pkg_hash """
         if self.options.nullorg:
             # to satisfy xmlrpc from None values.
             orgid = 'null'
@@ -544,31 +677,32 @@ class UploadClass(uploadLib.UploadClass):
             'org_id': orgid,
             'force': self.options.force or 0
         }
-        # rpc call to get checksum info for all the packages to be uploaded
-        if not self.options.source:
-            # computing checksum and other info is expensive process and session
-            # could have expired.Make sure its re-authenticated.
-            self.authenticate()
-            if uploadLib.exists_getPackageChecksumBySession(self.server):
-                checksum_data = uploadLib.getPackageChecksumBySession(self.server,
-                                                                      self.session.getSessionString(), info)
-            else:
-                # old server only md5 capable
-                checksum_data = uploadLib.getPackageMD5sumBySession(self.server,
-                                                                    self.session.getSessionString(), info)
-        else:
-            # computing checksum and other info is expensive process and session
-            # could have expired.Make sure its re-authenticated.
-            self.authenticate()
-            if uploadLib.exists_getPackageChecksumBySession(self.server):
-                checksum_data = uploadLib.getSourcePackageChecksumBySession(self.server,
-                                                                            self.session.getSessionString(), info)
-            else:
-                # old server only md5 capable
-                checksum_data = uploadLib.getSourcePackageMD5sumBySession(self.server,
+        with self._server_lock:
+            # rpc call to get checksum info for all the packages to be uploaded
+            if not self.options.source:
+                # computing checksum and other info is expensive process and session
+                # could have expired.Make sure its re-authenticated.
+                self.authenticate()
+                if uploadLib.exists_getPackageChecksumBySession(self.server):
+                    checksum_data = uploadLib.getPackageChecksumBySession(self.server,
                                                                           self.session.getSessionString(), info)
+                else:
+                    # old server only md5 capable
+                    checksum_data = uploadLib.getPackageMD5sumBySession(self.server,
+                                                                        self.session.getSessionString(), info)
+            else:
+                # computing checksum and other info is expensive process and session
+                # could have expired.Make sure its re-authenticated.
+                self.authenticate()
+                if uploadLib.exists_getPackageChecksumBySession(self.server):
+                    checksum_data = uploadLib.getSourcePackageChecksumBySession(self.server,
+                                                                                self.session.getSessionString(), info)
+                else:
+                    # old server only md5 capable
+                    checksum_data = uploadLib.getSourcePackageMD5sumBySession(self.server,
+                                                                              self.session.getSessionString(), info)
 
-        return (checksum_data, pkg_hash, digest_hash)
+        return checksum_data
 
     def package(self, package, fileChecksumType, fileChecksum):
         self.warn(1, "Uploading package %s" % package)
@@ -624,12 +758,15 @@ class UploadClass(uploadLib.UploadClass):
 
     def _push_package_v2(self, package, fileChecksumType, fileChecksum):
         self.warn(1, "Using POST request")
-        pu = rhnpush_v2.PackageUpload(self.url_v2, self.options.proxy)
+        pu = getattr(self._uploads, 'package_upload', None)
+        if pu is None:
+            pu = rhnpush_v2.PackageUpload(self.url_v2, self.options.proxy, keep_alive=True)
+            pu.set_force(self.options.force)
+            pu.set_null_org(self.options.nullorg)
+            pu.set_timeout(self.options.timeout)
+            self._uploads.package_upload = pu
 
         pu.set_session(self.session.getSessionString())
-        pu.set_force(self.options.force)
-        pu.set_null_org(self.options.nullorg)
-        pu.set_timeout(self.options.timeout)
 
         status, msgstr = pu.upload(package, fileChecksumType, fileChecksum)
 
@@ -669,6 +806,19 @@ class UploadClass(uploadLib.UploadClass):
 class AuthenticationRequired(Exception):
     pass
 
+
+class WorkerExit(Exception):
+    pass
+
+
+def _in_worker(function, *args):
+    # die() in a worker thread has to end rhnpush, not only the worker
+    try:
+        return function(*args)
+    except SystemExit:
+        e = sys.exc_info()[1]
+        raise_with_tb(WorkerExit(e.code), sys.exc_info()[2])
+
 if __name__ == '__main__':
     # test code
     sys.exit(main() or 0)
@@ -13,6 +13,9 @@
 # in this software or its documentation.
 #
 
+import os
+import shutil
+import tempfile
 import unittest
 import rhnpush_cache
 import time
@@ -113,5 +116,40 @@ class CacheManagerTestCase(unittest.TestCase):
     def testGetTimeLeft(self):
         pass
 
+
+class RHNPushManifestTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.package = os.path.join(self.dir, 'foo-1.0-1.noarch.rpm')
+        with open(self.package, 'w') as f:
+            f.write('foo')
+        self.manifest = rhnpush_cache.RHNPushManifest('http://localhost/PACKAGE-PUSH -1 0 chan')
+        self.manifest.location = os.path.join(self.dir, 'manifest')
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testResume(self):
+        self.manifest.addPackage(self.package, {'name': 'foo'})
+        with open(self.manifest.location, 'a') as f:
+            f.write('{"path": "/killed/while/writ')
+        self.manifest.readManifest()
+        assert self.manifest.getPackage(self.package) == {'name': 'foo'}
+
+    def testChangedPackage(self):
+        self.manifest.addPackage(self.package, {'name': 'foo'})
+        with open(self.package, 'a') as f:
+            f.write('bar')
+        self.manifest.readManifest()
+        assert self.manifest.getPackage(self.package) is None
+
+    def testRemoveManifest(self):
+        self.manifest.addPackage(self.package, {'name': 'foo'})
+        self.manifest.removeManifest()
+        self.manifest.removeManifest()
+        self.manifest.readManifest()
+        assert self.manifest.getPackage(self.package) is None
+
 if __name__ == "__main__":
     unittest.main()
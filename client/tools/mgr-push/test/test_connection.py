@@ -0,0 +1,203 @@
+#
+# Copyright (c) 2024 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+import errno
+import io
+import os
+import socket
+import threading
+import unittest
+from http.client import RemoteDisconnected
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+from rhnpush import connection
+
+
+class FakeHeader(dict):
+    is_source = 0
+    packaging = 'rpm'
+
+
+class FakePackage:
+    def __init__(self, name):
+        self.header = FakeHeader(name=name, epoch=None, version='1.0', release='1', arch='x86_64')
+        self.input_stream = io.BytesIO(b"rpm of " + name.encode())
+
+    def read_header(self):
+        pass
+
+
+def package_from_filename(filename):
+    return FakePackage(filename.split('.')[0])
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.requests.append((self.headers, body))
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def log_message(self, *args):
+        pass
+
+
+class KeepAliveUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = HTTPServer(("127.0.0.1", 0), RequestHandler)
+        self.server.connections = 0
+        self.server.requests = []
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = "http://127.0.0.1:%d/PACKAGE-PUSH" % self.server.server_address[1]
+
+        patcher = mock.patch.object(connection, 'package_from_filename', package_from_filename)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, pu, names):
+        for name in names:
+            self.assertEqual(pu.upload(name + ".rpm", 'sha256', 'checksum-' + name), (200, "OK"))
+        pu.connection.close()
+
+    def test_uploads_reuse_the_connection(self):
+        pu = connection.PackageUpload(self.url, keep_alive=True)
+        pu.set_header("X-RHN-Upload-Session", "session")
+        self.upload(pu, ['foo', 'bar', 'baz'])
+
+        self.assertEqual(self.server.connections, 1)
+        self.assertEqual([body for headers, body in self.server.requests],
+                         [b"rpm of foo", b"rpm of bar", b"rpm of baz"])
+        # every request has the headers of its own package only
+        for (headers, body), name in zip(self.server.requests, ['foo', 'bar', 'baz']):
+            self.assertEqual(headers.get_all('X-RHN-Upload-Package-Name'), [name])
+            self.assertEqual(headers.get_all('X-RHN-Upload-Session'), ['session'])
+        self.assertEqual(pu.headers, {'X-RHN-Upload-Session': ['session']})
+
+    def test_uploads_without_keep_alive(self):
+        pu = connection.PackageUpload(self.url)
+        self.upload(pu, ['foo', 'bar'])
+
+        self.assertEqual(self.server.connections, 2)
+
+
+class FakeResponse:
+    status = 200
+    reason = "OK"
+    will_close = 0
+    msg = {}
+
+    def read(self):
+        return b""
+
+
+class FakeConnection:
+    """ Stands in for the BaseConnection, errors are raised by the steps of
+        the requests in the order given
+    """
+
+    def __init__(self, errors=None):
+        self.sock = None
+        self.connects = 0
+        self.requests = 0
+        self.errors = errors or {}
+
+    def _step(self, step):
+        errors = self.errors.get(step)
+        if errors:
+            error = errors.pop(0)
+            if error is not None:
+                raise error
+
+    def connect(self):
+        self.sock = object()
+        self.connects += 1
+
+    def is_connected(self):
+        return self.sock is not None
+
+    def close(self):
+        self.sock = None
+
+    def putrequest(self, method):
+        self.requests += 1
+
+    def putheader(self, name, value):
+        pass
+
+    def endheaders(self):
+        self._step('headers')
+
+    def send(self, data):
+        self._step('body')
+
+    def getresponse(self):
+        self._step('response')
+        return FakeResponse()
+
+
+def socket_error(code):
+    # OSError picks the subclass of the errno, as the socket module does
+    return OSError(code, os.strerror(code))
+
+
+class StaleConnectionTest(unittest.TestCase):
+
+    def send(self, errors, reused=True):
+        pu = connection.PackageUpload("http://localhost/PACKAGE-PUSH", keep_alive=True)
+        pu.connection = FakeConnection(errors)
+        if reused:
+            pu.connection.connect()
+        return pu, pu.send_http('POST', stream_body=io.BytesIO(b"rpm"))
+
+    def test_reset_while_sending_the_headers_is_retried(self):
+        for error in (socket_error(errno.EPIPE), socket_error(errno.ECONNRESET)):
+            pu, response = self.send({'headers': [error]})
+            self.assertEqual(response.status, 200)
+            self.assertEqual((pu.connection.connects, pu.connection.requests), (2, 2))
+
+    def test_missing_status_line_is_retried(self):
+        for error in (RemoteDisconnected("closed"), socket_error(errno.ECONNRESET)):
+            pu, response = self.send({'response': [error]})
+            self.assertEqual(response.status, 200)
+            self.assertEqual((pu.connection.connects, pu.connection.requests), (2, 2))
+
+    def test_retried_once(self):
+        self.assertRaises(RemoteDisconnected, self.send,
+                          {'response': [RemoteDisconnected("closed"), RemoteDisconnected("closed")]})
+
+    def test_new_connection_is_not_retried(self):
+        self.assertRaises(RemoteDisconnected, self.send,
+                          {'response': [RemoteDisconnected("closed")]}, reused=False)
+
+    def test_body_errors_are_not_retried(self):
+        self.assertRaises(connection.ConnectionError, self.send, {'body': [socket_error(errno.EPIPE)]})
+
+    def test_other_errors_are_not_retried(self):
+        self.assertRaises(socket.timeout, self.send, {'response': [socket.timeout()]})
+        self.assertRaises(OSError, self.send, {'headers': [socket_error(errno.EHOSTUNREACH)]})
+
+
+if __name__ == '__main__':
+    unittest.main()
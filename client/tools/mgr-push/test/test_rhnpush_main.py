@@ -0,0 +1,162 @@
+#
+# Copyright (c) 2024 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from rhnpush import rhnpush_main
+
+
+class FakeUploadClass(rhnpush_main.UploadClass):
+    """ Pushes to a stubbed server: checksums are made up from the file
+        names, the server has the packages of server_packages
+    """
+
+    def __init__(self, files, server_packages=(), fail_upload=None, fail_checksum=None):
+        options = mock.Mock(tolerant=None, force=None, source=None, nullorg=None, verbose=0)
+        rhnpush_main.UploadClass.__init__(self, options, files)
+        self.url_v2 = "http://localhost/PACKAGE-PUSH"
+        self.orgId = 1
+        self.channels = ['base-channel']
+        self.server_packages = server_packages
+        self.fail_upload = fail_upload
+        self.fail_checksum = fail_checksum
+        self.checked = []
+        self.uploaded = []
+        self.subscribed = None
+        self._stub_lock = threading.Lock()
+
+    def _package_info(self, pkg):
+        name = os.path.basename(pkg)
+        if name == self.fail_checksum:
+            self.die(-1, "ERROR: %s: This file doesn't appear to be a package" % pkg)
+        return {'name': name, 'version': '1.0', 'release': '1', 'epoch': '',
+                'arch': 'noarch', 'checksum_type': 'sha256', 'checksum': 'sum-' + name}
+
+    def _server_checksums(self, pkg_hash):
+        self.checked.append(sorted(pkg_hash))
+        ret = {}
+        for pkg_key in pkg_hash:
+            if pkg_key in self.server_packages:
+                ret[pkg_key] = ['sha256', 'sum-' + pkg_key]
+            else:
+                ret[pkg_key] = []
+        return ret
+
+    def _upload_retrying(self, pkg, checksum_type, checksum):
+        name = os.path.basename(pkg)
+        if name == self.fail_upload:
+            self.die(1, "Error pushing %s: Internal Server Error (500)" % pkg)
+        with self._stub_lock:
+            self.uploaded.append(name)
+        return self._package_info(pkg)
+
+    def subscribe_packages(self, channel_packages):
+        self.subscribed = sorted(info['name'] for info in channel_packages)
+        return 0
+
+
+class ParallelPackagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        for patcher in (mock.patch.object(rhnpush_main.rhnpush_cache.utils, 'get_home_dir',
+                                          lambda: self.tmpdir),
+                        mock.patch.object(rhnpush_main.uploadLib, 'ReportError', mock.Mock()),
+                        mock.patch.object(rhnpush_main, 'PACKAGES_PER_CHECK', 2)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # the packages are given as found in the current directory
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        self.addCleanup(os.chdir, cwd)
+        self.files = ['a.rpm', 'b.rpm', 'patch-cluster-1.rpm', 'c.rpm', 'd.rpm', 'e.rpm']
+        for name in self.files:
+            with open(name, 'w') as f:
+                f.write(name)
+
+    def manifest(self):
+        return [name for name in os.listdir(self.tmpdir) if name.startswith('.rhnpush-manifest-')]
+
+    def test_packages_are_checked_in_batches(self):
+        push = FakeUploadClass(self.files, server_packages=['b.rpm', 'd.rpm'])
+        self.assertEqual(push.parallel_packages(3), 0)
+
+        # the patch clusters come last
+        self.assertEqual(push.checked, [['a.rpm', 'b.rpm'], ['c.rpm', 'd.rpm'], ['e.rpm'],
+                                        ['patch-cluster-1.rpm']])
+        self.assertEqual(sorted(push.uploaded), ['a.rpm', 'c.rpm', 'e.rpm', 'patch-cluster-1.rpm'])
+        self.assertEqual(push.subscribed, ['a.rpm', 'b.rpm', 'c.rpm', 'd.rpm', 'e.rpm',
+                                           'patch-cluster-1.rpm'])
+        self.assertEqual(self.manifest(), [])
+
+    def test_interrupted_push_is_resumed(self):
+        push = FakeUploadClass(self.files, server_packages=['b.rpm'], fail_upload='d.rpm')
+        with self.assertRaises(SystemExit) as cm:
+            push.parallel_packages(1)
+        self.assertEqual(cm.exception.code, 1)
+        self.assertEqual(push.subscribed, None)
+        self.assertEqual(len(self.manifest()), 1)
+        done = set(['a.rpm', 'b.rpm', 'c.rpm'])
+        self.assertTrue(done.issubset(set(push.uploaded) | set(['b.rpm'])))
+
+        push = FakeUploadClass(self.files, server_packages=['b.rpm'])
+        self.assertEqual(push.parallel_packages(1), 0)
+
+        # the packages pushed before are neither checked nor uploaded again
+        checked = set(name for batch in push.checked for name in batch)
+        self.assertTrue('d.rpm' in checked)
+        self.assertEqual(checked & done, set())
+        self.assertEqual(set(push.uploaded) & done, set())
+        self.assertEqual(push.subscribed, ['a.rpm', 'b.rpm', 'c.rpm', 'd.rpm', 'e.rpm',
+                                           'patch-cluster-1.rpm'])
+        self.assertEqual(self.manifest(), [])
+
+    def test_changed_package_is_pushed_again(self):
+        push = FakeUploadClass(self.files, fail_upload='patch-cluster-1.rpm')
+        self.assertRaises(SystemExit, push.parallel_packages, 2)
+        with open(self.files[0], 'a') as f:
+            f.write("rebuilt")
+
+        push = FakeUploadClass(self.files)
+        push.parallel_packages(2)
+        self.assertEqual(sorted(push.uploaded), ['a.rpm', 'patch-cluster-1.rpm'])
+
+    def test_die_in_a_checksum_worker_ends_the_push(self):
+        push = FakeUploadClass(self.files, fail_checksum='c.rpm')
+        with self.assertRaises(SystemExit) as cm:
+            push.parallel_packages(2)
+        self.assertEqual(cm.exception.code, -1)
+        self.assertEqual(push.subscribed, None)
+        self.assertTrue('c.rpm' not in push.uploaded)
+
+
+class InWorkerTest(unittest.TestCase):
+
+    def test_system_exit_becomes_worker_exit(self):
+        def die():
+            raise SystemExit(3)
+        with self.assertRaises(rhnpush_main.WorkerExit) as cm:
+            rhnpush_main._in_worker(die)
+        self.assertEqual(cm.exception.args, (3,))
+
+    def test_result_and_other_errors(self):
+        self.assertEqual(rhnpush_main._in_worker(lambda a, b: a + b, 1, 2), 3)
+        self.assertRaises(KeyError, rhnpush_main._in_worker, {}.__getitem__, 'a')
+
+
+if __name__ == '__main__':
+    unittest.main()
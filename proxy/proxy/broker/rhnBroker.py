@@ -632,8 +632,16 @@ class BrokerHandler(SharedHandler):
             params = ()
         try:
             ret = f(*params)
-        except rhnRepository.NotLocalError:
+        except rhnRepository.NotLocalError as e:
             # The package is not local
+            if funct == 'getPackage' and e.args and CFG.CACHE_STREAMED_PACKAGES:
+                # keep a copy while it is streamed from the parent, the next
+                # request for it is served locally; only packages whose
+                # checksum is known can be verified before they are kept
+                checksum = rhnRepository.packagePathChecksum(e.args[0])
+                if checksum is not None:
+                    self.cachePath = os.path.join(CFG.PKG_DIR, e.args[0])
+                    self.cacheChecksum = checksum
             return None
 
         return ret
@@ -0,0 +1,271 @@
+# rhnCacheStore.py                          - Versioned cache files of the broker.
+#-------------------------------------------------------------------------------
+# Copyright (c) 2022 SUSE LLC
+#
+# This software is licensed to you under the GNU General Public License,
+# version 2 (GPLv2). There is NO WARRANTY for this software, express or
+# implied, including the implied warranties of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. You should have received a copy of GPLv2
+# along with this software; if not, see
+# http://www.gnu.org/licenses/old-licenses/gpl-2.0.txt.
+#
+#-------------------------------------------------------------------------------
+#
+# Objects are stored as <name>-<version> files in a directory; names end
+# with a colon (e.g. package_mapping:<channel>:). Only the newest version of
+# every name is kept: older versions are removed by a background thread, out
+# of the request path, and a periodic scan of the directory catches the ones
+# written by other processes.
+#
+
+## language imports
+import errno
+import os
+import tempfile
+import threading
+import time
+from collections import deque
+
+## common imports
+from spacewalk.common.rhnLog import log_debug, log_error
+
+# Seconds between two scans of the cache directory
+EXPIRY_INTERVAL = 300
+# Temporary files left behind by dead processes are removed after this many
+# seconds
+STALE_TEMP_AGE = 3600
+TEMP_PREFIX = ".tmp-"
+
+# O_TMPFILE is Linux only, and not every file system supports it
+_O_TMPFILE = getattr(os, 'O_TMPFILE', None)
+
+
+def version_key(version):
+    """ Sort key of a version: numerically when it is a number (channel
+        versions are timestamps), as a string otherwise.
+    """
+    if version.isdigit():
+        return (1, int(version), version)
+    return (0, 0, version)
+
+
+def split_file_name(fileName):
+    """ Returns the (name, version) a cache file was stored as, or
+        (None, None) if fileName is not a cache file.
+    """
+    name, sep, version = fileName.rpartition(':-')
+    if not sep or not version or '-' in version:
+        return None, None
+    return name + ':', version
+
+
+class CacheStore:
+
+    """ Versioned cache files in one directory. """
+
+    def __init__(self, directory, expiry_interval=EXPIRY_INTERVAL):
+        self.directory = directory
+        self.expiry_interval = expiry_interval
+        self._lock = threading.Lock()
+        # name -> {version: (size, mtime)}
+        self._index = {}
+        # paths of older versions waiting to be removed
+        self._expired = deque()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+        self._tmpfile_supported = _O_TMPFILE is not None
+
+    def path(self, name, version):
+        return "%s/%s-%s" % (self.directory, name, version)
+
+    def read(self, name, version):
+        """ Returns the data stored for name and version, or None. """
+        try:
+            with open(self.path(name, version), "rb") as f:
+                return f.read()
+        except IOError:
+            return None
+
+    def write(self, name, version, data):
+        """ Atomically publish data as version of name, and schedule the
+            removal of the older versions.
+        """
+        if not os.access(self.directory, os.R_OK | os.W_OK | os.X_OK):
+            os.makedirs(self.directory)
+        filePath = self.path(name, version)
+        if self._tmpfile_supported:
+            try:
+                self._write_tmpfile(filePath, data)
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.EISDIR, errno.EINVAL,
+                                   errno.ENOENT, errno.EXDEV):
+                    raise
+                log_debug(3, "O_TMPFILE not usable in %s: %s" % (self.directory, e))
+                self._tmpfile_supported = False
+                self._write_named(filePath, data)
+        else:
+            self._write_named(filePath, data)
+        self._published(name, version, len(data))
+
+    def _write_tmpfile(self, filePath, data):
+        # The file has no name until it is complete, so readers and crashes
+        # never leave a partial file behind
+        fd = os.open(self.directory, _O_TMPFILE | os.O_WRONLY, 0o644)
+        dirFd = None
+        try:
+            self._write_all(fd, data)
+            tempPath = self._temp_path()
+            # os.link only uses linkat(), which can follow the /proc link,
+            # when given a directory descriptor
+            dirFd = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            os.link("/proc/self/fd/%d" % fd, os.path.basename(tempPath), dst_dir_fd=dirFd)
+        finally:
+            os.close(fd)
+            if dirFd is not None:
+                os.close(dirFd)
+        os.rename(tempPath, filePath)
+
+    def _write_named(self, filePath, data):
+        fd, tempPath = tempfile.mkstemp(prefix=TEMP_PREFIX, dir=self.directory)
+        try:
+            os.fchmod(fd, 0o644)
+            self._write_all(fd, data)
+        except:  # pylint: disable=bare-except
+            os.close(fd)
+            os.unlink(tempPath)
+            raise
+        os.close(fd)
+        os.rename(tempPath, filePath)
+
+    @staticmethod
+    def _write_all(fd, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(fd, view)
+            view = view[written:]
+
+    def _temp_path(self):
+        return "%s/%s%d-%.6f" % (self.directory, TEMP_PREFIX, os.getpid(), time.time())
+
+    def _published(self, name, version, size):
+        now = time.time()
+        with self._lock:
+            versions = self._index.setdefault(name, {})
+            versions[version] = (size, now)
+            self._expire_older(name, versions)
+        self._start()
+        if self._expired:
+            self._wakeup.set()
+
+    def _expire_older(self, name, versions):
+        # Called with the lock held
+        newest = max(versions, key=version_key)
+        for version in list(versions):
+            if version != newest:
+                del versions[version]
+                self._expired.append(self.path(name, version))
+
+    def _start(self):
+        """ Start the expiry thread of this process, if needed. """
+        if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._thread is not None and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._expiry_loop,
+                                            name="rhnCacheStore-expiry")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _expiry_loop(self):
+        lastScan = 0
+        while True:
+            # set again by writes happening while this pass runs
+            self._wakeup.clear()
+            try:
+                if time.time() - lastScan >= self.expiry_interval:
+                    self.scan()
+                    lastScan = time.time()
+                self.remove_expired()
+            except Exception as e:  # pylint: disable=broad-except
+                log_error("Error expiring the cache in %s: %s" % (self.directory, e))
+            self._wakeup.wait(self.expiry_interval)
+
+    def remove_expired(self):
+        """ Remove the older versions scheduled so far. """
+        while self._expired:
+            filePath = self._expired.popleft()
+            try:
+                os.unlink(filePath)
+                log_debug(4, "Removed expired cache file", filePath)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def scan(self):
+        """ Rebuild the index from the directory, scheduling the removal of
+            older versions and of stale temporary files.
+        """
+        index = {}
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as it:
+                entries = list(it)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return
+            raise
+        for entry in entries:
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            name, version = split_file_name(entry.name)
+            if name is None:
+                # temporary files, also the ones of older proxy versions
+                if now - st.st_mtime > STALE_TEMP_AGE:
+                    self._expired.append(entry.path)
+                continue
+            index.setdefault(name, {})[version] = (st.st_size, st.st_mtime)
+        with self._lock:
+            for name, versions in index.items():
+                self._expire_older(name, versions)
+            self._index = index
+        stats = self.stats()
+        log_debug(3, "Cache %s: %d files, %d bytes, oldest %d seconds" % (
+            self.directory, stats['files'], stats['bytes'], stats['oldest_age']))
+
+    def stats(self):
+        """ Size and age metrics of the cache, as of the last scan plus the
+            writes of this process.
+        """
+        now = time.time()
+        files = size = 0
+        oldest = now
+        with self._lock:
+            for versions in self._index.values():
+                for fileSize, mtime in versions.values():
+                    files += 1
+                    size += fileSize
+                    oldest = min(oldest, mtime)
+            pending = len(self._expired)
+        return {
+            'files': files,
+            'bytes': size,
+            'oldest_age': int(now - oldest),
+            'pending_removal': pending,
+        }
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_cache_store(directory):
+    """ Returns the CacheStore of directory, shared by the whole process. """
+    with _stores_lock:
+        if directory not in _stores:
+            _stores[directory] = CacheStore(directory)
+        return _stores[directory]
@@ -20,7 +20,8 @@
 ## language imports
 import os
 import time
-import glob
+import threading
+from collections import OrderedDict
 try:
     # python 3
     import pickle as cPickle
@@ -46,12 +47,94 @@ from spacewalk.common import rhnRepository
 from spacewalk.common.rhnTranslate import _
 from uyuni.common.rhnLib import parseRPMName
 from uyuni.common.usix import raise_with_tb
+from . import rhnCacheStore
 
 
 
 PKG_LIST_DIR = os.path.join(CFG.PKG_DIR, 'list')
 PREFIX = "rhn"
 
+# Package mappings kept in memory by every process, the least recently used
+# ones are dropped first
+MAX_CACHED_MAPPINGS = 8
+# Seconds a package file found readable is not checked again
+STAT_CACHE_TTL = 10
+MAX_CACHED_STATS = 10000
+
+
+class _MappingCache:
+
+    """ Channel package mappings of this process, keyed by channel name
+        and version: a new channel version is a different key, the mappings
+        of older versions age out.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self._lock = threading.Lock()
+        self._mappings = OrderedDict()
+
+    def get(self, channelName, channelVersion):
+        key = (channelName, channelVersion)
+        with self._lock:
+            mapping = self._mappings.get(key)
+            if mapping is not None:
+                self._mappings.move_to_end(key)
+            return mapping
+
+    def set(self, channelName, channelVersion, mapping):
+        with self._lock:
+            self._mappings[(channelName, channelVersion)] = mapping
+            while len(self._mappings) > self.size:
+                self._mappings.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._mappings.clear()
+
+
+class _StatCache:
+
+    """ Remember for a few seconds which package files are readable.
+        Missing files are always checked again, they may be fetched any
+        moment.
+    """
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        self._lock = threading.Lock()
+        # path -> time the file was found readable
+        self._readable = {}
+
+    def readable(self, path):
+        now = time.time()
+        checked = self._readable.get(path)
+        if checked is not None and now - checked < self.ttl:
+            return True
+        if not os.access(path, os.R_OK):
+            with self._lock:
+                self._readable.pop(path, None)
+            return False
+        with self._lock:
+            if len(self._readable) >= self.size:
+                self._readable = dict((p, t) for p, t in self._readable.items()
+                                      if now - t < self.ttl)
+            self._readable[path] = now
+        return True
+
+    def forget(self, path):
+        with self._lock:
+            self._readable.pop(path, None)
+
+    def clear(self):
+        with self._lock:
+            self._readable = {}
+
+
+_mapping_cache = _MappingCache(MAX_CACHED_MAPPINGS)
+_stat_cache = _StatCache(STAT_CACHE_TTL, MAX_CACHED_STATS)
+
 
 class NotLocalError(Exception):
     pass
@@ -86,9 +169,7 @@ class Repository(rhnRepository.Repository):
         """
 
         log_debug(3, pkgFilename)
-        mappingName = "package_mapping:%s:" % self.channelName
-        mapping = self._cacheObj(mappingName, self.channelVersion,
-                                 self.__channelPackageMapping, ())
+        mapping = self._packageMapping()
 
         # If the file name has parameters, it's a different kind of package.
         # Determine the architecture requested so we can construct an
@@ -115,7 +196,7 @@ class Repository(rhnRepository.Repository):
         for filePath in filePaths:
             filePath = "%s/%s" % (CFG.PKG_DIR, filePath)
             log_debug(4, "File path", filePath)
-            if os.access(filePath, os.R_OK):
+            if _stat_cache.readable(filePath):
                 return filePath
         log_debug(4, "Package not found locally: %s" % pkgFilename)
         raise NotLocalError(filePaths[0], pkgFilename)
@@ -164,11 +245,36 @@ class Repository(rhnRepository.Repository):
         for filePath in filePaths:
             filePath = "%s/%s" % (CFG.PKG_DIR, filePath)
             log_debug(4, "File path", filePath)
-            if os.access(filePath, os.R_OK):
+            if _stat_cache.readable(filePath):
                 return filePath
         log_debug(4, "Source package not found locally: %s" % pkgFilename)
         raise NotLocalError(filePaths[0], pkgFilename)
 
+    def _getFile(self, filePath):
+        """ OVERLOADS _getFile in common/rhnRepository.
+            A package found readable a few seconds ago may be gone by now,
+            it is then fetched from the parent.
+        """
+        try:
+            return rhnRepository.Repository._getFile(self, filePath)
+        except (IOError, OSError) as e:
+            _stat_cache.forget(filePath)
+            log_debug(4, "Package not readable anymore: %s: %s" % (filePath, e))
+            raise_with_tb(NotLocalError(os.path.relpath(filePath, CFG.PKG_DIR),
+                                        os.path.basename(filePath)), sys.exc_info()[2])
+
+    def _packageMapping(self):
+        """ Returns the package mapping of the channel, from memory if this
+            process already loaded the current channel version.
+        """
+        mapping = _mapping_cache.get(self.channelName, self.channelVersion)
+        if mapping is None:
+            mappingName = "package_mapping:%s:" % self.channelName
+            mapping = self._cacheObj(mappingName, self.channelVersion,
+                                     self.__channelPackageMapping, ())
+            _mapping_cache.set(self.channelName, self.channelVersion, mapping)
+        return mapping
+
     def _cacheObj(self, fileName, version, dataProducer, params=None):
         """ The real workhorse for all flavors of listall
             It tries to pull data out of a file; if it doesn't work,
@@ -461,43 +567,28 @@ def computePackagePaths(nvrea, source=0, prepend="", checksum=None):
     return paths
 
 
+# Checksum types by the length of their hex digest
+_CHECKSUM_TYPES = {32: 'md5', 40: 'sha1', 64: 'sha256', 96: 'sha384', 128: 'sha512'}
+
+
+def packagePathChecksum(filePath):
+    """ Returns the (checksum type, checksum) of a package path computed by
+        computePackagePaths with a checksum, None for other paths.
+    """
+    parts = filePath.split('/')
+    if len(parts) < 6:
+        return None
+    checksum = parts[-2]
+    checksumType = _CHECKSUM_TYPES.get(len(checksum))
+    if checksumType is None or parts[-6] != checksum[:3]:
+        return None
+    try:
+        int(checksum, 16)
+    except ValueError:
+        return None
+    return checksumType, checksum
+
+
 def cache(stringObject, directory, filename, version):
     """ Caches stringObject into a file and removes older files """
-
-    # The directory should be readable, writable, seekable
-    if not os.access(directory, os.R_OK | os.W_OK | os.X_OK):
-        os.makedirs(directory)
-    filePath = "%s/%s-%s" % (directory, filename, version)
-    # Create a temp file based on the filename, version and stuff
-    tempfile = "%s-%.20f" % (filePath, time.time())
-    # Try to create the temp file
-    tries = 10
-    while tries > 0:
-        # Try to create this new file
-        try:
-            fd = os.open(tempfile, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
-        except OSError as e:
-            if e.errno == 17:
-                # File exists; give it another try
-                tries = tries - 1
-                tempfile = tempfile + "%.20f" % time.time()
-                continue
-            # Another error
-            raise
-        else:
-            # We've got the file; everything's nice and dandy
-            break
-    else:
-        # Could not create the file
-        raise Exception("Could not create the file")
-    # Write the object into the cache
-    os.write(fd, stringObject)
-    os.close(fd)
-    # Now rename the temp file
-    os.rename(tempfile, filePath)
-    # Expire the cached copies
-    _list = glob.glob("%s/%s-*" % (directory, filename))
-    for _file in _list:
-        if _file < filePath:
-            # Older than this
-            os.unlink(_file)
+    rhnCacheStore.get_cache_store(directory).write(filename, version, stringObject)
@@ -0,0 +1,110 @@
+#!/usr/bin/python3
+"""
+Tests for the versioned cache files of the broker.
+"""
+
+import errno
+import os
+import time
+from unittest.mock import patch
+
+import pytest
+
+from proxy.broker import rhnCacheStore
+from proxy.broker.rhnCacheStore import CacheStore, split_file_name, version_key
+
+NAME = "package_mapping:channel:"
+
+
+@pytest.fixture
+def store(tmp_path):
+    cacheStore = CacheStore(str(tmp_path))
+    # expire in the tests, not in the background
+    with patch.object(cacheStore, "_start"):
+        yield cacheStore
+
+
+def test_split_file_name():
+    assert split_file_name("package_mapping:channel:-20220301") == ("package_mapping:channel:", "20220301")
+    assert split_file_name("list:-abc") == ("list:", "abc")
+    assert split_file_name(".tmp-123-1646000000.000000") == (None, None)
+    assert split_file_name("package_mapping:channel:-") == (None, None)
+    assert split_file_name("name:-1-2") == (None, None)
+
+
+def test_version_key():
+    assert sorted(["20220301", "9", "abc", "100"], key=version_key) == ["abc", "9", "100", "20220301"]
+
+
+def test_write_publishes_the_newest_version(store):
+    store.write(NAME, "9", b"old")
+    store.write(NAME, "10", b"new")
+
+    assert store.read(NAME, "10") == b"new"
+    # removed by the expiry thread
+    assert store.read(NAME, "9") == b"old"
+    store.remove_expired()
+    assert store.read(NAME, "9") is None
+    assert os.listdir(store.directory) == ["%s-10" % NAME]
+    assert store.stats()["files"] == 1
+
+
+def test_write_falls_back_to_named_temporary_files(store):
+    with patch.object(store, "_write_tmpfile",
+                      side_effect=OSError(errno.EOPNOTSUPP, "Operation not supported")) as writeTmpfile:
+        store.write(NAME, "1", b"data")
+        store.write(NAME, "2", b"more data")
+
+    writeTmpfile.assert_called_once()
+    assert not store._tmpfile_supported
+    assert store.read(NAME, "2") == b"more data"
+    store.remove_expired()
+    assert os.listdir(store.directory) == ["%s-2" % NAME]
+
+
+def test_write_raises_other_errors(store):
+    with patch.object(store, "_write_tmpfile", side_effect=OSError(errno.ENOSPC, "No space left on device")):
+        with pytest.raises(OSError):
+            store.write(NAME, "1", b"data")
+
+    assert store._tmpfile_supported
+
+
+def test_named_temporary_file_is_removed_on_error(store):
+    with patch.object(store, "_write_all", side_effect=OSError(errno.ENOSPC, "No space left on device")):
+        with pytest.raises(OSError):
+            store._write_named(store.path(NAME, "1"), b"data")
+
+    assert os.listdir(store.directory) == []
+
+
+def test_scan_expires_the_files_of_other_processes(store):
+    for version in ("1", "3", "2"):
+        with open(store.path(NAME, version), "wb") as f:
+            f.write(b"data")
+    with open(store.path("other:", "1"), "wb") as f:
+        f.write(b"data")
+    staleTemp = os.path.join(store.directory, rhnCacheStore.TEMP_PREFIX + "1")
+    freshTemp = os.path.join(store.directory, rhnCacheStore.TEMP_PREFIX + "2")
+    for tempPath in (staleTemp, freshTemp):
+        with open(tempPath, "wb") as f:
+            f.write(b"partial")
+    old = time.time() - rhnCacheStore.STALE_TEMP_AGE - 1
+    os.utime(staleTemp, (old, old))
+
+    store.scan()
+    store.remove_expired()
+
+    assert sorted(os.listdir(store.directory)) == sorted([
+        os.path.basename(freshTemp), "%s-3" % NAME, "other:-1"])
+    assert store.stats()["files"] == 2
+
+
+def test_remove_expired_ignores_files_already_gone(store):
+    store.write(NAME, "1", b"data")
+    store.write(NAME, "2", b"data")
+    os.unlink(store.path(NAME, "1"))
+
+    store.remove_expired()
+
+    assert store.stats()["pending_removal"] == 0
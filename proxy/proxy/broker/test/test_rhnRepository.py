@@ -0,0 +1,111 @@
+#!/usr/bin/python3
+"""
+Tests for the package paths of the broker repository.
+"""
+
+import os
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+from spacewalk.common.rhnConfig import initCFG
+
+initCFG("proxy.broker")
+
+# pylint: disable=wrong-import-position
+from proxy.broker import rhnRepository
+
+SHA256 = "a" * 61 + "0f9"
+
+
+def test_checksum_is_read_back_from_the_package_path():
+    paths = rhnRepository.computePackagePaths(("vim", "9.0", "1", "", "x86_64"),
+                                              prepend=rhnRepository.PREFIX, checksum=SHA256)
+
+    assert rhnRepository.packagePathChecksum(paths[0]) == ("sha256", SHA256)
+
+
+def test_paths_without_checksum_have_none():
+    paths = rhnRepository.computePackagePaths(("vim", "9.0", "1", "", "x86_64"),
+                                              prepend=rhnRepository.PREFIX)
+
+    assert len(paths) == 1
+    assert rhnRepository.packagePathChecksum(paths[0]) is None
+    assert rhnRepository.packagePathChecksum("rhn/ggg/vim/9.0-1/x86_64/%s/vim.rpm" % ("g" * 64)) is None
+    assert rhnRepository.packagePathChecksum("vim.rpm") is None
+
+
+def test_mapping_cache_drops_the_least_recently_used():
+    cache = rhnRepository._MappingCache(2)
+    cache.set("a", 1, {"a": 1})
+    cache.set("b", 1, {"b": 1})
+    assert cache.get("a", 1) == {"a": 1}
+    cache.set("c", 1, {"c": 1})
+
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == {"a": 1}
+    assert cache.get("c", 1) == {"c": 1}
+    assert cache.get("c", 2) is None
+
+
+def test_package_mapping_is_loaded_once_per_channel_version():
+    def repository(version):
+        repo = rhnRepository.Repository.__new__(rhnRepository.Repository)
+        repo.channelName = "test-channel"
+        repo.channelVersion = version
+        return repo
+
+    with patch.object(rhnRepository, "_mapping_cache", rhnRepository._MappingCache(2)), \
+            patch.object(rhnRepository.Repository, "_cacheObj",
+                         side_effect=lambda name, version, *args: {"version": version}) as cacheObj:
+        assert repository("1")._packageMapping() == {"version": "1"}
+        assert repository("1")._packageMapping() == {"version": "1"}
+        assert repository("2")._packageMapping() == {"version": "2"}
+
+    assert cacheObj.call_count == 2
+
+
+def test_stat_cache_expires(tmp_path):
+    path = str(tmp_path / "pkg.rpm")
+    open(path, "w").close()
+    cache = rhnRepository._StatCache(10, 100)
+
+    assert cache.readable(path)
+    os.unlink(path)
+    # not checked again within the ttl
+    assert cache.readable(path)
+    with patch.object(rhnRepository.time, "time", return_value=time.time() + 11):
+        assert not cache.readable(path)
+    assert not cache.readable(path)
+
+
+def test_stat_cache_is_bounded(tmp_path):
+    cache = rhnRepository._StatCache(10, 2)
+    paths = [str(tmp_path / ("pkg-%d.rpm" % i)) for i in range(3)]
+    for path in paths:
+        open(path, "w").close()
+
+    cache.readable(paths[0])
+    cache.readable(paths[1])
+    with patch.object(rhnRepository.time, "time", return_value=time.time() + 11):
+        cache.readable(paths[2])
+
+    assert list(cache._readable) == [paths[2]]
+
+
+def test_deleted_package_is_fetched_from_the_parent(tmp_path):
+    relPath = "rhn/vim/9.0-1/x86_64/vim-9.0-1.x86_64.rpm"
+    path = str(tmp_path / relPath)
+    os.makedirs(os.path.dirname(path))
+    open(path, "w").close()
+    repo = rhnRepository.Repository.__new__(rhnRepository.Repository)
+
+    with patch.object(rhnRepository, "_stat_cache", rhnRepository._StatCache(10, 100)), \
+            patch.object(rhnRepository, "CFG", Mock(PKG_DIR=str(tmp_path))):
+        assert rhnRepository._stat_cache.readable(path)
+        os.unlink(path)
+        with pytest.raises(rhnRepository.NotLocalError) as e:
+            repo._getFile(path)
+        assert e.value.args == (relPath, "vim-9.0-1.x86_64.rpm")
+        assert path not in rhnRepository._stat_cache._readable
@@ -62,6 +62,17 @@ class ResponseContext:
         """ Set the current connection object. """
         self._getCurrentContext()[CXT_CONNECTION] = connection
 
+    def detach(self):
+        """ Take the response body and the connection out of the current
+            context, so they stay open when the context is closed. The caller
+            has to close them.
+        """
+        context = self._getCurrentContext()
+        bodyFd, connection = context[CXT_RESP_BODYFD], context[CXT_CONNECTION]
+        context[CXT_RESP_BODYFD] = None
+        context[CXT_CONNECTION] = None
+        return bodyFd, connection
+
     def add(self):
         """ Add a new context to the stack. The new context becomes the current
             one.
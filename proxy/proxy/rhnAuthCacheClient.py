@@ -19,8 +19,10 @@
 #-------------------------------------------------------------------------------
 
 ## language imports
+import os
 import socket
 import sys
+import threading
 try:
     #  python 2
     from xmlrpclib import Fault
@@ -41,6 +43,14 @@ from .rhnAuthProtocol import CommunicationError, send, recv
 # 1. Send the size of the data as a long (4 bytes), in network order
 # 2. Send the data
 #
+# Daemons answering more than one request per connection get their
+# connections reused, and several requests sent before the answers are read;
+# they come back in order. When the daemon closes a connection after one
+# answer, a new connection is opened for every request again.
+#
+
+# Idle connections kept per auth cache server in every process
+MAX_IDLE_CONNECTIONS = 4
 
 # Shamelessly stolen from xmlrpclib.xmlrpc
 
@@ -70,6 +80,91 @@ class _Method:
     __repr__ = __str__
 
 
+class _Connection:
+
+    """ A connection to the authentication cache daemon. """
+
+    def __init__(self, server_addr):
+        self.pid = os.getpid()
+        # requests answered on this connection
+        self.answered = 0
+        self.sock = socket.create_connection(server_addr)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.rfile = self.sock.makefile("rb")
+        self.wfile = self.sock.makefile("wb")
+
+    def send(self, calls):
+        for methodname, params in calls:
+            send(self.wfile, *params, methodname=methodname)
+        self.wfile.flush()
+
+    def recv(self):
+        """ Read the next answer; a Fault is returned, not raised. """
+        try:
+            params, _methodname = recv(self.rfile)
+        except Fault as e:
+            result = e
+        else:
+            result = params[0]
+        self.answered += 1
+        return result
+
+    def close(self):
+        for f in (self.rfile, self.wfile, self.sock):
+            try:
+                f.close()
+            except (IOError, socket.error):
+                pass
+
+
+class _ConnectionPool:
+
+    """ The idle connections of this process, per auth cache server. """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._idle = {}
+        # server -> whether it answers several requests per connection,
+        # None until it is known
+        self._persistent = {}
+
+    def persistent(self, server_addr):
+        return self._persistent.get(server_addr)
+
+    def set_persistent(self, server_addr, persistent):
+        with self._lock:
+            self._persistent[server_addr] = persistent
+            idle = []
+            if not persistent:
+                idle = self._idle.pop(server_addr, [])
+        for conn in idle:
+            conn.close()
+
+    def get(self, server_addr):
+        """ Return an idle connection to server_addr, or None. """
+        with self._lock:
+            idle = self._idle.get(server_addr, [])
+            while idle:
+                conn = idle.pop()
+                # connections inherited from the parent process are shared
+                # with it, leave them alone
+                if conn.pid == os.getpid():
+                    return conn
+        return None
+
+    def put(self, server_addr, conn):
+        with self._lock:
+            if self._persistent.get(server_addr) is not False:
+                idle = self._idle.setdefault(server_addr, [])
+                if len(idle) < MAX_IDLE_CONNECTIONS:
+                    idle.append(conn)
+                    return
+        conn.close()
+
+
+_pool = _ConnectionPool()
+
+
 class Shelf:
 
     """ Client authenication temp. db.
@@ -83,19 +178,12 @@ class Shelf:
         log_debug(6, server_addr)
         self.serverAddr = server_addr
 
-    def __request(self, methodname, params):
-        # pylint: disable=R0915
-        log_debug(6, methodname, params)
-        # Init the socket
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-
+    def __connect(self):
         try:
-            sock.connect(self.serverAddr)
+            return _Connection(self.serverAddr)
         except socket.error as e:
-            sock.close()
-            methodname = None
             log_error("Error connecting to the auth cache: %s" % str(e))
-            Traceback("Shelf.__request", extra="""
+            Traceback("Shelf.__connect", extra="""
               Error connecting to the the authentication cache daemon.
               Make sure it is started on %s""" % str(self.serverAddr))
             # FIXME: PROBLEM: this rhnFault will never reach the client
@@ -103,51 +191,89 @@ class Shelf:
                 rhnFault(1000, _("Spacewalk Proxy error (issues connecting to auth cache). "
                                  "Please contact your system administrator")), sys.exc_info()[2])
 
-        wfile = sock.makefile("w")
-
-        try:
-            send(wfile, methodname, None, *params)
-        except CommunicationError:
-            wfile.close()
-            sock.close()
-            Traceback("Shelf.__request",
-                      extra="Encountered a CommunicationError")
-            raise
-        except socket.error:
-            wfile.close()
-            sock.close()
-            log_error("Error communicating to the auth cache: %s" % str(e))
-            Traceback("Shelf.__request", extra="""\
-                     Error sending to the authentication cache daemon.
-                     Make sure the authentication cache daemon is started""")
-            # FIXME: PROBLEM: this rhnFault will never reach the client
-            raise_with_tb(
-                rhnFault(1000, _("Spacewalk Proxy error (issues connecting to auth cache). "
-                                 "Please contact your system administrator")), sys.exc_info()[2])
+    def pipeline(self, calls):
+        """ Run a list of (methodname, params) calls and return their
+            results; a Fault is returned in place of the result of a failed
+            call. The calls are sent at once to daemons keeping connections
+            open, one by one to the others.
+        """
+        log_debug(6, calls)
+        results = []
+        conn = _pool.get(self.serverAddr)
+        while len(results) < len(calls):
+            if conn is None:
+                conn = self.__connect()
+            persistent = _pool.persistent(self.serverAddr)
+            if persistent:
+                pending = calls[len(results):]
+            else:
+                pending = calls[len(results):len(results) + 1]
+            try:
+                conn.send(pending)
+                for _call in pending:
+                    results.append(conn.recv())
+            except (CommunicationError, socket.error) as e:
+                conn.close()
+                if not conn.answered:
+                    self.__failed(e)
+                if persistent is None and conn.answered == 1:
+                    log_debug(4, "The auth cache answers one request per connection")
+                    _pool.set_persistent(self.serverAddr, False)
+                else:
+                    # closed while idle or after some answers
+                    log_debug(4, "Reconnecting to the auth cache")
+                conn = None
+                continue
+            if persistent is None and conn.answered > 1:
+                _pool.set_persistent(self.serverAddr, True)
+        if conn is not None:
+            _pool.put(self.serverAddr, conn)
+        return results
 
-        wfile.close()
-
-        rfile = sock.makefile("r")
-        try:
-            params, methodname = recv(rfile)
-        except CommunicationError as e:
-            log_error(e.faultString)
-            rfile.close()
-            sock.close()
-            log_error("Error communicating to the auth cache: %s" % str(e))
-            Traceback("Shelf.__request", extra="""\
+    @staticmethod
+    def __failed(e):
+        if isinstance(e, CommunicationError):
+            log_error("Error communicating to the auth cache: %s" % str(e.faultString))
+            Traceback("Shelf.pipeline", extra="""\
                       Error receiving from the authentication cache daemon.
                       Make sure the authentication cache daemon is started""")
             # FIXME: PROBLEM: this rhnFault will never reach the client
             raise_with_tb(
                 rhnFault(1000, _("Spacewalk Proxy error (issues communicating to auth cache). "
                                  "Please contact your system administrator")), sys.exc_info()[2])
-        except Fault as e:
-            rfile.close()
-            sock.close()
-            raise
+        log_error("Error communicating to the auth cache: %s" % str(e))
+        Traceback("Shelf.pipeline", extra="""\
+                 Error sending to the authentication cache daemon.
+                 Make sure the authentication cache daemon is started""")
+        # FIXME: PROBLEM: this rhnFault will never reach the client
+        raise_with_tb(
+            rhnFault(1000, _("Spacewalk Proxy error (issues connecting to auth cache). "
+                             "Please contact your system administrator")), sys.exc_info()[2])
+
+    def __request(self, methodname, params):
+        result = self.pipeline([(methodname, params)])[0]
+        if isinstance(result, Fault):
+            raise result
+        return result
+
+    def get(self, key, default=None):
+        """ Look up key, sending both calls at once when possible. """
+        found, value = self.pipeline([('has_key', (key,)), ('__getitem__', (key,))])
+        if not found or isinstance(value, Fault):
+            return default
+        return value
+
+    def has_key(self, key):
+        return self.__request('has_key', (key,))
+
+    def __getitem__(self, key):
+        return self.__request('__getitem__', (key,))
+
+    def __setitem__(self, key, value):
+        return self.__request('__setitem__', (key, value))
 
-        return params[0]
+    def __delitem__(self, key):
+        return self.__request('__delitem__', (key,))
 
     def __getattr__(self, name):
         log_debug(6, name)
@@ -19,6 +19,7 @@
 import os
 import time
 import socket
+import threading
 try:
     #  python 2
     import xmlrpclib
@@ -149,10 +150,7 @@ class ProxyAuth:
         # Try to connect to the token-cache.
         shelf = get_auth_shelf()
         # Fetch the token
-        key = self.__cache_proxy_key()
-        if shelf.has_key(key):
-            return shelf[key]
-        return None
+        return shelf.get(self.__cache_proxy_key())
 
     def set_cached_token(self, token):
         """ Caches current token in the auth cache.
@@ -344,9 +342,7 @@ problems, isn't running, or the token is somehow corrupt.
     @staticmethod
     def get_client_token(clientid):
         shelf = get_auth_shelf()
-        if shelf.has_key(clientid):
-            return shelf[clientid]
-        return None
+        return shelf.get(clientid)
 
     @staticmethod
     def set_client_token(clientid, token):
@@ -424,12 +420,88 @@ problems, isn't running, or the token is somehow corrupt.
         return self.__serverid
 
 
+# (use_local_auth, auth_cache_server, auth_cache_ttl) -> CachedAuthShelf
+_cached_shelves = {}
+
+
 def get_auth_shelf():
     if CFG.USE_LOCAL_AUTH:
-        return AuthLocalBackend()
-    server, port = CFG.AUTH_CACHE_SERVER.split(':')
-    port = int(port)
-    return rhnAuthCacheClient.Shelf((server, port))
+        shelf = AuthLocalBackend()
+    else:
+        server, port = CFG.AUTH_CACHE_SERVER.split(':')
+        port = int(port)
+        shelf = rhnAuthCacheClient.Shelf((server, port))
+    ttl = int(CFG.AUTH_CACHE_TTL or 0)
+    if ttl <= 0:
+        return shelf
+    key = (CFG.USE_LOCAL_AUTH, CFG.AUTH_CACHE_SERVER, ttl)
+    if key not in _cached_shelves:
+        _cached_shelves[key] = CachedAuthShelf(shelf, ttl)
+    return _cached_shelves[key]
+
+
+class CachedAuthShelf:
+
+    """ Keep the tokens read from an auth shelf in memory for ttl seconds.
+
+        Tokens are looked up on every request of a client; this saves the
+        round trip to the auth cache for the following requests. Tokens
+        set or deleted through this process are dropped from memory right
+        away, the ones changed by other processes are seen after at most ttl
+        seconds.
+    """
+    # Beyond this, expired entries are dropped
+    max_entries = 10000
+
+    def __init__(self, shelf, ttl):
+        self.shelf = shelf
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # key -> (expiration time, token)
+        self._tokens = {}
+
+    def get(self, key, default=None):
+        now = time.time()
+        entry = self._tokens.get(key)
+        if entry is not None and entry[0] > now:
+            val = entry[1]
+        else:
+            val = self.shelf.get(key)
+            # a missing token may be set by another process any moment
+            if val is not None:
+                self._remember(key, val, now)
+        if val is None:
+            return default
+        return val
+
+    def has_key(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        val = self.get(key)
+        if val is None:
+            raise KeyError(key)
+        return val
+
+    def __setitem__(self, key, val):
+        self._forget(key)
+        self.shelf[key] = val
+
+    def __delitem__(self, key):
+        self._forget(key)
+        del self.shelf[key]
+
+    def _forget(self, key):
+        with self._lock:
+            self._tokens.pop(key, None)
+
+    def _remember(self, key, val, now):
+        with self._lock:
+            if len(self._tokens) >= self.max_entries:
+                self._tokens = dict((k, entry) for k, entry in self._tokens.items() if entry[0] > now)
+                if len(self._tokens) >= self.max_entries:
+                    self._tokens = {}
+            self._tokens[key] = (now + self.ttl, val)
 
 
 class AuthLocalBackend:
@@ -449,6 +521,13 @@ class AuthLocalBackend:
         val = rhnCache.get(rkey, missing_is_null=0)
         return val
 
+    def get(self, key, default=None):
+        rkey = self._compute_key(key)
+        val = rhnCache.get(rkey)
+        if val is None:
+            return default
+        return val
+
     def __setitem__(self, key, val):
         rkey = self._compute_key(key)
         return rhnCache.set(rkey, val)
@@ -21,8 +21,10 @@ try:
 except ImportError:
     # python 2
     import urllib
+import os
 import socket
 import sys
+import time
 
 # global imports
 from rhn import connections
@@ -38,6 +40,7 @@ from spacewalk.common.rhnLog import log_debug, log_error
 from spacewalk.common import rhnFlags, apache
 from spacewalk.common.rhnTranslate import _
 from uyuni.common import rhnLib
+from uyuni.common.checksum import getHashlibInstance
 from uyuni.common.usix import raise_with_tb, ListType, TupleType
 
 # local imports
@@ -69,6 +72,10 @@ class SharedHandler:
 
         self.responseContext = ResponseContext()
         self.uri = None   # ''
+        # Where to keep a copy of the response body and the (checksum type,
+        # checksum) it must match, see _forwardHTTPBody
+        self.cachePath = None
+        self.cacheChecksum = None
 
         # Common settings for both the proxy and the redirect
         # broker and redirect immediately alter these for their own purposes
@@ -465,7 +472,19 @@ class SharedHandler:
         # Now fill in the bytes if need be.
 
         # read content if there is some or the size is unknown
-        if (size > 0 or size == -1) and (toRequest.method != 'HEAD'):
+        if (size > 0 or size == -1) and (toRequest.method != 'HEAD') and CFG.STREAM_RESPONSES:
+            # The body is sent to the client while it is read from the
+            # server: the WSGI server asks for the next chunk only after the
+            # previous one was written, so a slow client slows down the
+            # download instead of filling up memory or /tmp.
+            # The generator outlives the handler, so it takes over the
+            # connection from the response context and closes it at the end.
+            _bodyFd, connection = self.responseContext.detach()
+            cachePath = checksum = None
+            if self.cachePath and self.cacheChecksum and size > 0 and fromResponse.status == apache.HTTP_OK:
+                cachePath, checksum = self.cachePath, self.cacheChecksum
+            toRequest.output = self._streamHTTPBody(fromResponse, connection, size, cachePath, checksum)
+        elif (size > 0 or size == -1) and (toRequest.method != 'HEAD'):
             tfile = SmartIO(max_mem_size=CFG.MAX_MEM_FILE_SIZE)
             buf = fromResponse.read(CFG.BUFFER_SIZE)
             while buf:
@@ -479,3 +498,69 @@ class SharedHandler:
                 toRequest.output = toRequest.headers_in['wsgi.file_wrapper'](tfile, CFG.BUFFER_SIZE)
             else:
                 toRequest.output = iter(lambda: tfile.read(CFG.BUFFER_SIZE), '')
+
+    @staticmethod
+    def _streamHTTPBody(fromResponse, connection, size, cachePath=None, checksum=None):
+        """ Yield the body of an HTTP response in chunks of CFG.BUFFER_SIZE.
+            With a cachePath and the (checksum type, checksum) of the body, a
+            copy of the body is written to that file if all of the size bytes
+            were received and they match the checksum.
+        """
+        cacheFile = tempPath = digest = None
+        if cachePath and checksum:
+            digest = getHashlibInstance(checksum[0], False)
+            tempPath = "%s.%d.%.6f" % (cachePath, os.getpid(), time.time())
+            try:
+                if not os.path.isdir(os.path.dirname(cachePath)):
+                    os.makedirs(os.path.dirname(cachePath))
+                cacheFile = open(tempPath, 'wb')
+            except (IOError, OSError) as e:
+                log_error("Can not cache the response", cachePath, e)
+                cacheFile = None
+
+        received = 0
+        try:
+            while size == -1 or received < size:
+                try:
+                    buf = fromResponse.read(CFG.BUFFER_SIZE)
+                except IOError as e:
+                    log_error("Error reading the response from the server", e)
+                    break
+                if not buf:
+                    break
+                received += len(buf)
+                if cacheFile is not None:
+                    digest.update(buf)
+                    try:
+                        cacheFile.write(buf)
+                    except (IOError, OSError) as e:
+                        log_error("Can not cache the response", cachePath, e)
+                        cacheFile.close()
+                        os.unlink(tempPath)
+                        cacheFile = None
+                yield buf
+
+            if size != -1 and received != size:
+                # the client sees the connection closed before Content-Length
+                # bytes were sent, which tells it the transfer failed
+                log_error("Response body truncated: got %d of %d bytes" % (received, size))
+            elif cacheFile is not None:
+                cacheFile.close()
+                cacheFile = None
+                if digest.hexdigest() != checksum[1]:
+                    log_error("Not caching the response, checksum mismatch", cachePath)
+                    os.unlink(tempPath)
+                else:
+                    try:
+                        os.rename(tempPath, cachePath)
+                        log_debug(3, "Cached response body in", cachePath)
+                    except OSError as e:
+                        log_error("Can not cache the response", cachePath, e)
+                        os.unlink(tempPath)
+        finally:
+            if cacheFile is not None:
+                cacheFile.close()
+                os.unlink(tempPath)
+            fromResponse.close()
+            if connection is not None:
+                connection.close()
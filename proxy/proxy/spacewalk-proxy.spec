@@ -397,6 +397,7 @@ fi
 %{destdir}/broker/__init__.py*
 %{destdir}/broker/rhnBroker.py*
 %{destdir}/broker/rhnRepository.py*
+%{destdir}/broker/rhnCacheStore.py*
 %attr(750,%{apache_user},%{apache_group}) %dir %{_var}/spool/rhn-proxy
 %attr(750,%{apache_user},%{apache_group}) %dir %{_var}/spool/rhn-proxy/list
 %if 0%{?rhel}
@@ -0,0 +1,138 @@
+#!/usr/bin/python3
+"""
+Round trip tests of the auth cache client with in-process daemons.
+"""
+
+import socketserver
+import threading
+from unittest.mock import patch
+from xmlrpc.client import Fault
+
+import pytest
+
+from spacewalk.common.rhnException import rhnFault
+from proxy import rhnAuthCacheClient
+from proxy.rhnAuthProtocol import CommunicationError, recv, send
+
+
+class Tokens(dict):
+
+    def has_key(self, key):
+        return key in self
+
+
+class DaemonHandler(socketserver.StreamRequestHandler):
+
+    """ Answers the requests of a connection until the client closes it, or
+        after server.max_requests of them.
+    """
+
+    def handle(self):
+        self.server.connections += 1
+        for _i in range(self.server.max_requests):
+            try:
+                params, methodname = recv(self.rfile)
+            except CommunicationError:
+                return
+            self.server.requests.append(methodname)
+            try:
+                result = getattr(self.server.tokens, methodname)(*params)
+            except KeyError as e:
+                send(self.wfile, fault=Fault(1, "KeyError: %s" % e))
+            else:
+                send(self.wfile, 1 if result is None else result)
+            self.wfile.flush()
+
+
+class Daemon(socketserver.ThreadingTCPServer):
+
+    daemon_threads = True
+
+    def __init__(self, max_requests):
+        socketserver.ThreadingTCPServer.__init__(self, ("127.0.0.1", 0), DaemonHandler)
+        self.max_requests = max_requests
+        self.tokens = Tokens()
+        self.connections = 0
+        self.requests = []
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+@pytest.fixture(autouse=True)
+def pool():
+    with patch.object(rhnAuthCacheClient, "_pool", rhnAuthCacheClient._ConnectionPool()):
+        yield rhnAuthCacheClient._pool
+
+
+def daemon(max_requests):
+    server = Daemon(max_requests)
+    return server, rhnAuthCacheClient.Shelf(server.server_address)
+
+
+def test_connection_is_reused_and_lookups_are_pipelined(pool):
+    server, shelf = daemon(1000)
+    try:
+        shelf["client-1"] = "token"
+        assert pool.persistent(server.server_address) is None
+        assert shelf.has_key("client-1")
+        assert pool.persistent(server.server_address) is True
+
+        assert shelf.get("client-1") == "token"
+        assert shelf.get("client-2") is None
+        del shelf["client-1"]
+        assert shelf.get("client-1", "missing") == "missing"
+    finally:
+        server.shutdown()
+
+    assert server.connections == 1
+    assert server.requests == ["__setitem__", "has_key"] + ["has_key", "__getitem__"] * 2 + \
+        ["__delitem__", "has_key", "__getitem__"]
+
+
+def test_daemon_answering_one_request_per_connection(pool):
+    server, shelf = daemon(1)
+    try:
+        shelf["client-1"] = "token"
+        assert shelf.get("client-1") == "token"
+        assert pool.persistent(server.server_address) is False
+        assert shelf["client-1"] == "token"
+        assert shelf.get("client-2") is None
+    finally:
+        server.shutdown()
+
+    assert server.requests == ["__setitem__", "has_key", "__getitem__", "__getitem__", "has_key", "__getitem__"]
+    assert server.connections == len(server.requests)
+
+
+def test_connection_closed_by_the_daemon_is_reopened(pool):
+    server, shelf = daemon(2)
+    try:
+        shelf["client-1"] = "token"
+        assert shelf["client-1"] == "token"
+        assert pool.persistent(server.server_address) is True
+        # the daemon closed the idle connection
+        assert shelf["client-1"] == "token"
+        assert shelf.get("client-1") == "token"
+    finally:
+        server.shutdown()
+
+    assert server.connections == 3
+
+
+def test_missing_key_raises_the_fault():
+    server, shelf = daemon(1000)
+    try:
+        with pytest.raises(Fault):
+            shelf["client-1"]
+    finally:
+        server.shutdown()
+
+
+def test_daemon_not_running():
+    server = Daemon(1)
+    server.shutdown()
+    server.server_close()
+    shelf = rhnAuthCacheClient.Shelf(server.server_address)
+
+    with patch.object(rhnAuthCacheClient, "Traceback"):
+        with pytest.raises(rhnFault):
+            shelf.has_key("client-1")
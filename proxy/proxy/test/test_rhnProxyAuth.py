@@ -0,0 +1,64 @@
+#!/usr/bin/python3
+"""
+Tests for the in-memory token cache of the broker.
+"""
+
+import time
+from unittest.mock import patch
+
+from proxy import rhnProxyAuth
+
+
+class Shelf(dict):
+
+    """ The shared auth cache, counting the lookups reaching it. """
+
+    lookups = 0
+
+    def get(self, key, default=None):
+        self.lookups += 1
+        return dict.get(self, key, default)
+
+
+def test_tokens_are_served_from_memory():
+    shelf = Shelf({"client-1": "token"})
+    cached = rhnProxyAuth.CachedAuthShelf(shelf, 5)
+
+    assert cached.get("client-1") == "token"
+    assert cached["client-1"] == "token"
+    assert cached.has_key("client-1")
+    assert shelf.lookups == 1
+
+
+def test_missing_tokens_are_not_remembered():
+    shelf = Shelf()
+    cached = rhnProxyAuth.CachedAuthShelf(shelf, 5)
+
+    assert cached.get("client-1") is None
+    shelf["client-1"] = "token"
+    assert cached.get("client-1") == "token"
+
+
+def test_tokens_expire():
+    shelf = Shelf({"client-1": "token"})
+    cached = rhnProxyAuth.CachedAuthShelf(shelf, 5)
+    assert cached.get("client-1") == "token"
+    shelf["client-1"] = "new token"
+
+    assert cached.get("client-1") == "token"
+    with patch.object(rhnProxyAuth.time, "time", return_value=time.time() + 6):
+        assert cached.get("client-1") == "new token"
+    assert shelf.lookups == 2
+
+
+def test_set_and_delete_drop_the_token_from_memory():
+    shelf = Shelf({"client-1": "token"})
+    cached = rhnProxyAuth.CachedAuthShelf(shelf, 5)
+    assert cached.get("client-1") == "token"
+
+    cached["client-1"] = "new token"
+    assert cached.get("client-1") == "new token"
+    del cached["client-1"]
+    assert cached.get("client-1") is None
+    assert "client-1" not in shelf
+    assert shelf.lookups == 3
@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""
+Tests for streaming responses of the parent server and caching packages.
+"""
+
+import hashlib
+import io
+import os
+from unittest.mock import Mock, patch
+
+import pytest
+
+from proxy import rhnShared
+
+BODY = b"0123456789" * 10
+
+
+class Response(io.BytesIO):
+
+    """ An HTTP response whose body is read in chunks. """
+
+    def close(self):
+        self.closed_by_handler = True
+        io.BytesIO.close(self)
+
+
+@pytest.fixture(autouse=True)
+def cfg():
+    with patch.object(rhnShared, "CFG", Mock(BUFFER_SIZE=16)):
+        yield
+
+
+def stream(body, size, cachePath=None, checksum=None):
+    response = Response(body)
+    connection = Mock()
+    chunks = list(rhnShared.SharedHandler._streamHTTPBody(response, connection, size,
+                                                          cachePath, checksum))
+    assert response.closed_by_handler
+    connection.close.assert_called_once_with()
+    return b"".join(chunks)
+
+
+def test_body_is_streamed_in_chunks():
+    response = Response(BODY)
+    chunks = list(rhnShared.SharedHandler._streamHTTPBody(response, None, len(BODY)))
+
+    assert b"".join(chunks) == BODY
+    assert max(len(chunk) for chunk in chunks) == 16
+
+
+def test_body_of_unknown_size_is_streamed_to_the_end():
+    assert stream(BODY, -1) == BODY
+
+
+def test_package_is_cached_when_the_checksum_matches(tmp_path):
+    cachePath = str(tmp_path / "rhn" / "pkg.rpm")
+
+    assert stream(BODY, len(BODY), cachePath, ("sha256", hashlib.sha256(BODY).hexdigest())) == BODY
+
+    with open(cachePath, "rb") as f:
+        assert f.read() == BODY
+    assert os.listdir(os.path.dirname(cachePath)) == ["pkg.rpm"]
+
+
+def test_corrupted_package_is_not_cached(tmp_path):
+    cachePath = str(tmp_path / "pkg.rpm")
+    corrupted = BODY[:-1] + b"X"
+
+    assert stream(corrupted, len(BODY), cachePath, ("md5", hashlib.md5(BODY).hexdigest())) == corrupted
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_truncated_package_is_not_cached(tmp_path):
+    cachePath = str(tmp_path / "pkg.rpm")
+
+    assert stream(BODY[:50], len(BODY), cachePath, ("sha256", hashlib.sha256(BODY).hexdigest())) == BODY[:50]
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_package_without_checksum_is_not_cached(tmp_path):
+    cachePath = str(tmp_path / "pkg.rpm")
+
+    assert stream(BODY, len(BODY), cachePath) == BODY
+
+    assert os.listdir(str(tmp_path)) == []
+
+
+def test_temporary_file_is_removed_when_the_client_goes_away(tmp_path):
+    cachePath = str(tmp_path / "pkg.rpm")
+    response = Response(BODY)
+    body = rhnShared.SharedHandler._streamHTTPBody(response, None, len(BODY), cachePath,
+                                                   ("sha256", hashlib.sha256(BODY).hexdigest()))
+    next(body)
+    body.close()
+
+    assert response.closed_by_handler
+    assert os.listdir(str(tmp_path)) == []
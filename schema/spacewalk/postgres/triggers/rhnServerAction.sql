@@ -32,3 +32,31 @@ before insert or update on rhnServerAction
 for each row
 execute procedure rhn_server_action_mod_trig_fun();
 
+
+-- Tell the osa-dispatcher which push clients have actions to pick up: the new
+-- ones, and the ones whose actions completed (unblocking the next ones of
+-- a chain and freeing slots of the notify threshold)
+create or replace function rhn_server_action_notify_trig_fun() returns trigger as
+$$
+begin
+        -- only the osad clients are notified through the dispatcher
+        if exists (select 1 from rhnPushClient where server_id = new.server_id) then
+                perform pg_notify('rhn_server_action', new.server_id::text);
+        end if;
+        return null;
+end;
+$$ language plpgsql;
+
+create trigger
+rhn_server_action_notify_ins_trig
+after insert on rhnServerAction
+for each row
+when (new.status <> 1)
+execute procedure rhn_server_action_notify_trig_fun();
+
+create trigger
+rhn_server_action_notify_upd_trig
+after update of status on rhnServerAction
+for each row
+when (new.status is distinct from old.status and new.status <> 1)
+execute procedure rhn_server_action_notify_trig_fun();
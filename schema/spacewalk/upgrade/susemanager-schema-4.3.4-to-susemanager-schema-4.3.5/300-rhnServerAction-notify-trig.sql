@@ -0,0 +1,28 @@
+create or replace function rhn_server_action_notify_trig_fun() returns trigger as
+$$
+begin
+        -- only the osad clients are notified through the dispatcher
+        if exists (select 1 from rhnPushClient where server_id = new.server_id) then
+                perform pg_notify('rhn_server_action', new.server_id::text);
+        end if;
+        return null;
+end;
+$$ language plpgsql;
+
+drop trigger if exists rhn_server_action_notify_ins_trig on rhnServerAction;
+
+create trigger
+rhn_server_action_notify_ins_trig
+after insert on rhnServerAction
+for each row
+when (new.status <> 1)
+execute procedure rhn_server_action_notify_trig_fun();
+
+drop trigger if exists rhn_server_action_notify_upd_trig on rhnServerAction;
+
+create trigger
+rhn_server_action_notify_upd_trig
+after update of status on rhnServerAction
+for each row
+when (new.status is distinct from old.status and new.status <> 1)
+execute procedure rhn_server_action_notify_trig_fun();